@@ -16,6 +16,16 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 # Extensions (Cache & Rate Limit) - PAS DE LOGIN_MANAGER
 from extensions import limiter, cache, mail
 from flask_migrate import Migrate
+from services.export_job_service import exports_cli
+from services.import_service import imports_cli
+from services.backup_service import backups_cli
+from services.image_service import images_cli, image_src
+from services.upload_service import uploads_cli, cache_immuable
+from services.storage_service import stockage_cli
+from services import parametre_service
+from services.sql_profiler_service import installer as installer_profiler_sql
+import services.limiter_service  # Enregistre le schéma sqlite:// du limiter
+from services.asset_service import assets_cli, construire as construire_assets, servir_asset, asset_url
 
 # Imports locaux
 from db import db, Parametre, Armoire, Categorie, Salle, init_app as init_db_app
@@ -92,8 +102,70 @@ def create_app():
         'pool_recycle': 300,
     }
     app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024 
-    app.config['CACHE_TYPE'] = 'SimpleCache'
+    # Cache partagé entre workers gunicorn : Redis si configuré, sinon disque local (instance/cache)
     app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+    if os.environ.get('CACHE_REDIS_URL'):
+        app.config['CACHE_TYPE'] = 'RedisCache'
+        app.config['CACHE_REDIS_URL'] = os.environ['CACHE_REDIS_URL']
+        app.config['CACHE_KEY_PREFIX'] = 'scientral:'
+    else:
+        app.config['CACHE_TYPE'] = 'FileSystemCache'
+        app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR') or os.path.join(app.instance_path, 'cache')
+        app.config['CACHE_THRESHOLD'] = int(os.environ.get('CACHE_THRESHOLD', 5000))
+
+    # Exports en arrière-plan (file d'attente en base, pool de processus local)
+    app.config['EXPORT_WORKERS'] = int(os.environ.get('EXPORT_WORKERS', 2))
+    app.config['EXPORT_JOBS_TTL_HOURS'] = int(os.environ.get('EXPORT_JOBS_TTL_HOURS', 24))
+    app.config['EXPORT_JOBS_DIR'] = os.environ.get('EXPORT_JOBS_DIR')  # Défaut : instance/exports
+
+    # Rendu PDF (ReportLab) dans un pool de processus partagé
+    app.config['PDF_WORKERS'] = int(os.environ.get('PDF_WORKERS', 2))
+    app.config['PDF_RENDER_TIMEOUT'] = int(os.environ.get('PDF_RENDER_TIMEOUT', 60))
+
+    # Cache disque des exports (clé : filtres + versions des données), éviction LRU par taille
+    app.config['EXPORT_CACHE_ENABLED'] = os.environ.get('EXPORT_CACHE_ENABLED', '1') != '0'
+    app.config['EXPORT_CACHE_DIR'] = os.environ.get('EXPORT_CACHE_DIR')  # Défaut : instance/export_cache
+    app.config['EXPORT_CACHE_MAX_BYTES'] = int(os.environ.get('EXPORT_CACHE_MAX_MB', 200)) * 1024 * 1024
+
+    # Imports Excel en deux phases (analyse puis validation, via la file des exports)
+    app.config['IMPORT_UPLOADS_DIR'] = os.environ.get('IMPORT_UPLOADS_DIR')  # Défaut : instance/imports
+    app.config['IMPORT_SESSIONS_TTL_HOURS'] = int(os.environ.get('IMPORT_SESSIONS_TTL_HOURS', 72))
+
+    # Restauration de sauvegarde : fichier lu en flux, seule route autorisée au-delà de MAX_CONTENT_LENGTH
+    app.config['BACKUP_MAX_UPLOAD_BYTES'] = int(os.environ.get('BACKUP_MAX_UPLOAD_MB', 100)) * 1024 * 1024
+    app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR')  # Sauvegardes nocturnes, défaut : instance/backups
+
+    # Images uploadées : variantes (miniature, moyenne, originale plafonnée) générées par un pool de processus
+    app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+
+    # Uploads stockés par empreinte (static/uploads/cas) : délai avant qu'un blob non référencé soit supprimé
+    app.config['UPLOAD_GC_GRACE_MINUTES'] = int(os.environ.get('UPLOAD_GC_GRACE_MINUTES', 60))
+
+    # Documents et archives : disque local (instance/storage), copie Cloudinary envoyée en arrière-plan
+    app.config['STORAGE_BACKEND'] = os.environ.get(
+        'STORAGE_BACKEND', 'cloudinary' if os.environ.get('CLOUDINARY_CLOUD_NAME') else 'local')
+    app.config['STORAGE_DIR'] = os.environ.get('STORAGE_DIR')  # Défaut : instance/storage
+    app.config['STORAGE_WORKERS'] = int(os.environ.get('STORAGE_WORKERS', 4))
+    # Téléchargements délégués au serveur frontal : X-Sendfile (Apache) ou X-Accel-Redirect (nginx)
+    app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+    app.config['STORAGE_X_ACCEL_PREFIX'] = os.environ.get('STORAGE_X_ACCEL_PREFIX')
+
+    # Limiter : compteurs partagés entre workers (SQLite local, ou Redis via RATELIMIT_STORAGE_URI),
+    # fenêtre glissante pondérée (pas de rafale à la frontière de deux fenêtres)
+    app.config['RATELIMIT_STORAGE_URI'] = os.environ.get(
+        'RATELIMIT_STORAGE_URI', f"sqlite:///{os.path.join(app.instance_path, 'limiter.db')}")
+    app.config['RATELIMIT_STRATEGY'] = 'sliding-window-counter'
+
+    # CSS/JS empreintés + .gz/.br servis depuis /assets (désactivé en debug : fichiers modifiés à chaud)
+    app.config['ASSETS_FINGERPRINT'] = os.environ.get('ASSETS_FINGERPRINT', '0' if app.debug else '1') == '1'
+    app.config['ASSETS_DIR'] = os.environ.get('ASSETS_DIR')  # Défaut : instance/assets
+
+    # Instrumentation SQL par requête : X-DB-Queries / Server-Timing en dev, journal des requêtes coûteuses
+    app.config['SQL_PROFILER_HEADERS'] = os.environ.get('SQL_PROFILER_HEADERS', '1' if app.debug else '0') == '1'
+    app.config['SQL_SLOW_QUERY_MS'] = int(os.environ.get('SQL_SLOW_QUERY_MS', 200))
+    app.config['SQL_SLOW_REQUEST_QUERIES'] = int(os.environ.get('SQL_SLOW_REQUEST_QUERIES', 50))
+    app.config['SQL_SLOW_REQUEST_MS'] = int(os.environ.get('SQL_SLOW_REQUEST_MS', 500))
+    app.config['SQL_N_PLUS_1_SEUIL'] = int(os.environ.get('SQL_N_PLUS_1_SEUIL', 10))
 
     if is_production:
         app.config['SESSION_COOKIE_HTTPONLY'] = True
@@ -104,6 +176,14 @@ def create_app():
         app.config['TESTING'] = True
         app.config['WTF_CSRF_ENABLED'] = False
         app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        app.config['EXPORT_JOBS_INLINE'] = True  # Base mémoire non partageable avec un pool
+        app.config['PDF_RENDER_INLINE'] = True
+        app.config['IMAGE_PROCESS_INLINE'] = True
+        app.config['STORAGE_BACKEND'] = 'local'
+        app.config['STORAGE_UPLOAD_INLINE'] = True
+        app.config['RATELIMIT_STORAGE_URI'] = 'memory://'
+        app.config['CACHE_TYPE'] = 'SimpleCache'  # Base mémoire : un cache disque survivrait à la base
+        app.config['EXPORT_CACHE_ENABLED'] = False  # Idem pour les fichiers d'export en cache
         logging.warning("⚠️  MODE TESTING ACTIVÉ : Base de données en mémoire.")
 
     # ============================================================
@@ -113,6 +193,17 @@ def create_app():
     migrate = Migrate(app, db)
     with app.app_context():
         db.create_all()
+
+    @app.before_request
+    def _limite_upload_sauvegarde():
+        # Avant CSRFProtect, qui lit le formulaire (et donc applique la limite de taille)
+        if request.endpoint == 'admin.importer_db':
+            request.max_content_length = app.config['BACKUP_MAX_UPLOAD_BYTES']
+
+    # Uploads nommés par empreinte : cache navigateur/CDN permanent
+    app.after_request(cache_immuable)
+    installer_profiler_sql(app)
+
     CSRFProtect(app)
     limiter.init_app(app)
     cache.init_app(app)
@@ -169,6 +260,22 @@ def create_app():
     app.register_blueprint(api_bp)
     app.register_blueprint(securite_bp)
     app.register_blueprint(admin_documents_bp)
+    app.cli.add_command(exports_cli)
+    app.cli.add_command(imports_cli)
+    app.cli.add_command(backups_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(uploads_cli)
+    app.cli.add_command(stockage_cli)
+    app.cli.add_command(assets_cli)
+
+    app.add_url_rule('/assets/<path:filename>', 'assets', limiter.exempt(servir_asset))
+    if app.config['ASSETS_FINGERPRINT']:
+        try:
+            with app.app_context():
+                construire_assets()
+        except Exception as e:
+            # Les templates retombent sur /static/ (fichiers non empreintés)
+            app.logger.error(f"Construction des assets impossible : {e}", exc_info=True)
 
     # ============================================================
     # 5. GESTION ERREURS
@@ -215,6 +322,8 @@ def create_app():
         return value.strftime(format_fr)
 
     app.jinja_env.filters['annee_scolaire'] = annee_scolaire_format
+    app.jinja_env.globals['image_src'] = image_src
+    app.jinja_env.globals['asset_url'] = asset_url
 
     # ============================================================
     # 7. CONTEXT PROCESSORS (GLOBAL DATA)
@@ -246,7 +355,7 @@ def create_app():
             alert_info = get_alerte_info()
             context['alertes_total'] = alert_info.get('alertes_total', 0)
             
-            params_dict = get_etablissement_params(etablissement_id)
+            params_dict = parametre_service.tous(etablissement_id)
             
             if params_dict.get('licence_statut') == 'PRO':
                 context['licence']['statut'] = 'PRO'
@@ -0,0 +1,228 @@
+"""
+Benchmarks répétables des chemins critiques sur le jeu synthétique de bench/donnees.py.
+
+Chaque cas est exécuté `--repetitions` fois après un tour de chauffe ; durée (min, médiane,
+p95, max) et nombre d'instructions SQL (services/sql_profiler_service) sont relevés.
+Les cas qui écrivent (checkout) sont nettoyés hors chronomètre : la base reste identique
+d'une répétition et d'une exécution à l'autre.
+
+Usage :
+    python bench/bench_chemins_critiques.py --echelle petite --json avant.json
+    python bench/bench_chemins_critiques.py --echelle petite --json apres.json --comparer avant.json
+    python bench/bench_chemins_critiques.py --base postgresql://localhost/scientral_bench --echelle grande \\
+        --seulement disponibilites verify_stock_atomic
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, time as dtime, timedelta
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import donnees
+
+REPETITIONS_DEFAUT = 5
+OBJETS_PAR_CHECKOUT = 4
+OCCURRENCES_RECURRENCE = 8
+
+
+class Cas:
+    """Un benchmark : `executer` est chronométré, `preparer`/`nettoyer` ne le sont pas."""
+
+    def __init__(self, nom: str, executer: Callable[[], object],
+                 preparer: Optional[Callable[[], None]] = None, nettoyer: Optional[Callable[[object], None]] = None):
+        self.nom = nom
+        self.executer = executer
+        self.preparer = preparer
+        self.nettoyer = nettoyer
+
+
+def percentile(valeurs: List[float], p: float) -> float:
+    """Rang le plus proche (pas d'interpolation : valeur réellement observée)."""
+    ordonnees = sorted(valeurs)
+    rang = max(0, min(len(ordonnees) - 1, int(round(p / 100 * len(ordonnees) + 0.5)) - 1))
+    return ordonnees[rang]
+
+
+def mesurer(cas: Cas, repetitions: int) -> Dict[str, object]:
+    from services.sql_profiler_service import mesurer as mesurer_sql
+
+    durees, requetes = [], []
+    for tour in range(repetitions + 1):
+        if cas.preparer:
+            cas.preparer()
+        with mesurer_sql() as sql:
+            debut = time.perf_counter()
+            resultat = cas.executer()
+            duree = time.perf_counter() - debut
+        if cas.nettoyer:
+            cas.nettoyer(resultat)
+        if tour:    # Tour 0 : chauffe (caches SQLAlchemy, pages de la base)
+            durees.append(duree * 1000)
+            requetes.append(sql.requetes)
+    return {
+        'cas': cas.nom, 'repetitions': repetitions,
+        'min_ms': round(min(durees), 2), 'mediane_ms': round(statistics.median(durees), 2),
+        'p95_ms': round(percentile(durees, 95), 2), 'max_ms': round(max(durees), 2),
+        'requetes_sql': int(statistics.median(requetes)),
+    }
+
+
+# ============================================================
+# CAS MESURÉS
+# ============================================================
+
+def construire_cas(app, jeu: donnees.Jeu) -> List[Cas]:
+    from flask import session
+    from sqlalchemy import delete, select
+
+    from db import db, PanierItem, Reservation, ReservationRecurrence, AuditLog
+    from services.inventory_service import InventoryService
+    from services.panier_service import PanierService
+    from services.stock_service import StockService
+    from utils import get_alerte_info
+
+    etab = jeu.etablissement_id
+    # Créneau chargé (jour de référence) pour les lectures, créneau plus calme pour le checkout
+    debut = datetime.combine(jeu.reference, dtime(10, 0))
+    fin = debut + timedelta(hours=2)
+    jour_checkout = jeu.reference + timedelta(days=3)
+    objets = jeu.objet_ids[:OBJETS_PAR_CHECKOUT]
+    items = [{'type': 'objet', 'id': oid, 'quantite': 1} for oid in objets]
+    if jeu.kit_ids:
+        items.append({'type': 'kit', 'id': jeu.kit_ids[0], 'quantite': 1})
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s.update(user_id=jeu.admin_id, etablissement_id=etab, user_role='admin',
+                 nom_etablissement=jeu.nom_etablissement)
+
+    def http(url: str) -> Callable[[], int]:
+        def _get():
+            reponse = client.get(url)
+            taille = len(reponse.get_data())     # Consomme les réponses en flux
+            reponse.close()
+            if reponse.status_code != 200:
+                raise RuntimeError(f"{url} : HTTP {reponse.status_code}")
+            return taille
+        return _get
+
+    def alertes():
+        with app.test_request_context():
+            session['etablissement_id'] = etab
+            return get_alerte_info()
+
+    def verifier_stock():
+        return StockService(etab).verify_stock_atomic(items, debut, fin, jeu.admin_id)
+
+    def remplir_panier():
+        service = PanierService(etab)
+        service.vider_panier(jeu.admin_id)      # Reste d'un checkout refusé
+        panier = service._get_active_panier(jeu.admin_id, create_if_missing=True)
+        recurrence = json.dumps({'type': 'hebdo', 'nb_occurrences': OCCURRENCES_RECURRENCE})
+        for item in items:
+            db.session.add(PanierItem(id_panier=panier.id, type=item['type'], id_item=item['id'], quantite=1,
+                                      date_reservation=jour_checkout, heure_debut='14:00', heure_fin='16:00',
+                                      recurrence_data=recurrence))
+        db.session.commit()
+
+    def annuler_checkout(resultat):
+        groupes = resultat['groupes']
+        recurrences = db.session.execute(
+            select(Reservation.recurrence_id).where(Reservation.groupe_id.in_(groupes)).distinct()
+        ).scalars().all()
+        db.session.execute(delete(Reservation).where(Reservation.groupe_id.in_(groupes)))
+        db.session.execute(delete(ReservationRecurrence).where(ReservationRecurrence.id.in_([r for r in recurrences if r])))
+        db.session.execute(delete(AuditLog).where(AuditLog.etablissement_id == etab, AuditLog.action == 'CHECKOUT'))
+        db.session.commit()
+
+    inventaire = InventoryService(etab)
+    date_debut = (jeu.reference - timedelta(days=90)).isoformat()
+    date_fin = (jeu.reference - timedelta(days=1)).isoformat()
+
+    return [
+        Cas('get_alerte_info', alertes),
+        Cas('disponibilites', lambda: StockService(etab).get_disponibilites(debut, fin)),
+        Cas('verify_stock_atomic', verifier_stock, nettoyer=lambda _: db.session.rollback()),
+        Cas('valider_panier_recurrence', lambda: PanierService(etab).valider_panier(jeu.admin_id),
+            preparer=remplir_panier, nettoyer=annuler_checkout),
+        Cas('inventaire_page', lambda: inventaire.get_paginated_inventory(10, 'armoire', 'asc', {})),
+        Cas('inventaire_recherche', lambda: inventaire.get_paginated_inventory(1, 'nom', 'desc', {'q': 'pipette', 'etat': 'stock'})),
+        Cas('vue_jour', http(f"/jour/{jeu.reference.isoformat()}")),
+        Cas('export_inventaire_excel', http('/admin/exporter_inventaire?format=excel')),
+        Cas('export_inventaire_pdf', http('/admin/exporter_inventaire?format=pdf')),
+        Cas('export_rapports_csv', http(f'/admin/exporter_rapports?format=csv&date_debut={date_debut}&date_fin={date_fin}')),
+        Cas('export_rapports_excel', http(f'/admin/exporter_rapports?format=excel&date_debut={date_debut}&date_fin={date_fin}')),
+    ]
+
+
+# ============================================================
+# SORTIE
+# ============================================================
+
+def afficher(resultat: Dict[str, object], precedent: Optional[Dict[str, object]] = None) -> None:
+    ligne = (f"{resultat['cas']:<27} médiane {resultat['mediane_ms']:>9.2f} ms | p95 {resultat['p95_ms']:>9.2f} ms | "
+             f"min {resultat['min_ms']:>9.2f} ms | {resultat['requetes_sql']:>6} SQL")
+    if precedent and 'mediane_ms' in precedent:
+        ratio = resultat['mediane_ms'] / precedent['mediane_ms'] if precedent['mediane_ms'] else 0
+        ligne += f" | x{ratio:.2f} vs précédent ({precedent['requetes_sql']} SQL)"
+    print(ligne)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    donnees.ajouter_arguments(parser)
+    parser.add_argument('--repetitions', type=int, default=REPETITIONS_DEFAUT)
+    parser.add_argument('--seulement', nargs='+', metavar='CAS', help="Sous-ensemble des cas à mesurer")
+    parser.add_argument('--json', help="Fichier de sortie JSON (comparaison entre exécutions)")
+    parser.add_argument('--comparer', help="JSON d'une exécution précédente : affiche le rapport des médianes")
+    args = parser.parse_args()
+
+    app, jeu = donnees.preparer(args)
+    precedents = {}
+    if args.comparer:
+        with open(args.comparer, 'r', encoding='utf-8') as f:
+            precedents = {r['cas']: r for r in json.load(f)['resultats']}
+
+    cas = construire_cas(app, jeu)
+    if args.seulement:
+        inconnus = set(args.seulement) - {c.nom for c in cas}
+        if inconnus:
+            parser.error(f"Cas inconnus : {', '.join(sorted(inconnus))}")
+        cas = [c for c in cas if c.nom in args.seulement]
+
+    from db import db
+    resultats = []
+    for c in cas:
+        try:
+            resultat = mesurer(c, args.repetitions)
+        except Exception as e:
+            # Un chemin qui échoue à cette échelle est un résultat en soi : on le consigne et on continue
+            db.session.rollback()
+            resultats.append({'cas': c.nom, 'erreur': f"{type(e).__name__}: {e}"})
+            print(f"{c.nom:<27} ÉCHEC : {type(e).__name__}: {e}")
+            continue
+        resultats.append(resultat)
+        afficher(resultat, precedents.get(c.nom))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'benchmark': 'chemins_critiques',
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'base': db.engine.dialect.name,
+                'echelle': args.echelle, 'volumes': jeu.volumes, 'graine': args.graine,
+                'reference': jeu.reference.isoformat(),
+                'python': platform.python_version(),
+                'resultats': resultats,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark mémoire / latence des exports Excel d'inventaire.
+
+Compare le backend write_only (generer_inventaire_excel) à une construction
+classique Workbook() + styles par cellule + BytesIO, à 1k, 10k et 50k lignes.
+
+Usage :
+    python bench/bench_excel_export.py
+    python bench/bench_excel_export.py --rows 1000 10000 --json resultats.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Application minimale (SQLite mémoire) : seul le contexte de requête est utilisé
+os.environ.setdefault('FLASK_ENV', 'testing')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('GMLCL_PRO_KEY', 'bench')
+
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+
+from app import create_app
+from views.admin import generer_inventaire_excel
+
+DEFAULT_ROWS = [1000, 10000, 50000]
+
+
+def generer_lignes(n):
+    """Lignes synthétiques déterministes (générateur : aucun préchargement)."""
+    for i in range(n):
+        yield {
+            'categorie': f"Catégorie {i % 40}",
+            'nom': f"Objet de laboratoire n°{i}",
+            'quantite': i % 17,
+            'seuil': 3,
+            'armoire': f"Armoire {i % 25}",
+            'peremption': f"{1 + i % 28:02d}/{1 + i % 12:02d}/2027" if i % 3 == 0 else "-"
+        }
+
+
+def export_classique(data, metadata):
+    """Référence : ancien schéma (classeur complet en RAM + copie BytesIO)."""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Inventaire"
+    fill_header = PatternFill(start_color="1F3B73", end_color="1F3B73", fill_type="solid")
+    font_header = Font(name='Segoe UI', size=11, bold=True, color="FFFFFF")
+    align_center = Alignment(horizontal="center", vertical="center")
+    border_thin = Border(left=Side(style='thin', color='D9D9D9'), right=Side(style='thin', color='D9D9D9'), bottom=Side(style='thin', color='D9D9D9'))
+    font_alert = Font(color="DC3545", bold=True)
+
+    ws['A1'] = f"ÉTAT DE L'INVENTAIRE - {metadata['etablissement']}"
+    ws.append([])
+    ws.append(["Catégorie", "Désignation", "Quantité", "Seuil", "Emplacement", "Péremption"])
+    for col in range(1, 7):
+        cell = ws.cell(row=3, column=col)
+        cell.fill = fill_header
+        cell.font = font_header
+        cell.alignment = align_center
+
+    for row in data:
+        ws.append([row['categorie'], row['nom'], row['quantite'], row['seuil'], row['armoire'], row['peremption']])
+        current_row = ws.max_row
+        for col in range(1, 7):
+            cell = ws.cell(row=current_row, column=col)
+            cell.border = border_thin
+            cell.alignment = align_center if col in [3, 4, 6] else Alignment(vertical="center")
+        if row['quantite'] <= row['seuil']:
+            ws.cell(row=current_row, column=3).font = font_alert
+
+    buffer = BytesIO()
+    wb.save(buffer)
+    return len(buffer.getvalue())
+
+
+def export_streaming(data, metadata):
+    """Backend write_only : la réponse est consommée comme le ferait le serveur WSGI."""
+    response = generer_inventaire_excel(data, metadata)
+    response.direct_passthrough = False
+    taille = sum(len(chunk) for chunk in response.response)
+    response.close()
+    return taille
+
+
+def mesurer(fonction, n, metadata):
+    tracemalloc.start()
+    debut = time.perf_counter()
+    taille = fonction(generer_lignes(n), metadata)
+    duree = time.perf_counter() - debut
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'duree_s': round(duree, 3), 'pic_memoire_mo': round(pic / 1024 / 1024, 2), 'taille_ko': round(taille / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--json', help="Fichier de sortie JSON (comparaison entre exécutions)")
+    args = parser.parse_args()
+
+    app = create_app()
+    metadata = {'etablissement': 'Benchmark', 'date_generation': '01/01/2026 à 08:00', 'total': 0}
+    resultats = []
+
+    with app.test_request_context():
+        for n in args.rows:
+            metadata['total'] = n
+            for nom, fonction in (('classique', export_classique), ('write_only', export_streaming)):
+                mesure = mesurer(fonction, n, metadata)
+                mesure.update({'backend': nom, 'lignes': n})
+                resultats.append(mesure)
+                print(f"{nom:<11} {n:>7} lignes : {mesure['duree_s']:>7.3f} s | "
+                      f"pic {mesure['pic_memoire_mo']:>8.2f} Mo | {mesure['taille_ko']:>9.1f} Ko")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'excel_export', 'resultats': resultats}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
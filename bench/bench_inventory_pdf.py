@@ -0,0 +1,106 @@
+"""
+Benchmark du rendu PDF d'inventaire (DocumentService).
+
+Compare la Table ReportLab unique d'origine (une Paragraph par cellule) au rendu
+par tableaux de `chunk_rows` lignes avec cellules texte brut, de 500 à 20k lignes.
+Le rendu s'exécute dans le processus courant (sans pool) pour isoler le coût ReportLab.
+
+Usage :
+    python bench/bench_inventory_pdf.py
+    python bench/bench_inventory_pdf.py --rows 2000 10000 --sans-reference --json resultats.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from html import escape
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+
+from services.document_service import DocumentService
+
+DEFAULT_ROWS = [500, 2000, 5000, 10000, 20000]
+REFERENCE_MAX_ROWS = 10000   # Au-delà, la référence prend plusieurs minutes
+
+
+def generer_lignes(n):
+    """Lignes synthétiques déterministes (un nom long sur sept pour forcer les retours à la ligne)."""
+    return [{
+        'nom': f"Objet de laboratoire n°{i}" + (" avec une désignation longue qui déborde de la colonne" if i % 7 == 0 else ""),
+        'categorie': f"Catégorie {i % 40}",
+        'armoire': f"Armoire {i % 25}",
+        'quantite': i % 17,
+        'is_cmr': i % 11 == 0,
+    } for i in range(n)]
+
+
+def rendu_reference(service, rows, output):
+    """Ancien schéma : une seule Table, une Paragraph par cellule."""
+    doc = SimpleDocTemplate(output, pagesize=landscape(A4))
+    data = [[Paragraph(h, service.style_header) for h in ('Désignation', 'Catégorie', 'Emplacement', 'Qté', 'CMR')]]
+    for row in rows:
+        data.append([
+            Paragraph(escape(row['nom']), service.style_cell),
+            Paragraph(escape(row['categorie']), service.style_cell),
+            Paragraph(escape(row['armoire']), service.style_cell),
+            Paragraph(str(row['quantite']), service.style_cell_center),
+            Paragraph("OUI", service.style_cell_danger) if row['is_cmr'] else Paragraph("-", service.style_cell_center),
+        ])
+    t = Table(data, colWidths=service.config['col_widths'], repeatRows=1)
+    t.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), service.config['color_primary']),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, service.config['color_secondary']]),
+        ('GRID', (0, 0), (-1, -1), 0.5, service.config['color_border']),
+    ]))
+    doc.build([t])
+
+
+def rendu_par_blocs(service, rows, output):
+    service._build_inventory(output, "Benchmark", rows, "INVENTAIRE RÉGLEMENTAIRE", "Inventaire")
+
+
+def mesurer(fonction, service, rows):
+    output = BytesIO()
+    debut = time.perf_counter()
+    fonction(service, rows, output)
+    duree = time.perf_counter() - debut
+    return {'duree_s': round(duree, 3), 'ms_par_ligne': round(duree * 1000 / len(rows), 3),
+            'taille_ko': round(len(output.getvalue()) / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--sans-reference', action='store_true', help="Ne mesurer que le rendu par blocs")
+    parser.add_argument('--json', help="Fichier de sortie JSON (comparaison entre exécutions)")
+    args = parser.parse_args()
+
+    service = DocumentService(tempfile.gettempdir())
+    resultats = []
+
+    for n in args.rows:
+        rows = generer_lignes(n)
+        variantes = [('par_blocs', rendu_par_blocs)]
+        if not args.sans_reference and n <= REFERENCE_MAX_ROWS:
+            variantes.insert(0, ('table_unique', rendu_reference))
+        for nom, fonction in variantes:
+            mesure = mesurer(fonction, service, rows)
+            mesure.update({'rendu': nom, 'lignes': n})
+            resultats.append(mesure)
+            print(f"{nom:<12} {n:>7} lignes : {mesure['duree_s']:>8.3f} s | "
+                  f"{mesure['ms_par_ligne']:>6.3f} ms/ligne | {mesure['taille_ko']:>9.1f} Ko")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'inventory_pdf', 'resultats': resultats}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""
+Test de charge du checkout concurrent (PanierService.valider_panier).
+
+M utilisateurs remplissent un panier sur un même créneau, avec des objets « chauds » en
+stock réduit et des kits qui les contiennent, puis valident tous en même temps (barrière),
+depuis des threads ou des processus. Le rapport donne le débit, les latences p50/p95/p99,
+la répartition des issues (succès, conflit NOWAIT, stock insuffisant, erreur technique) et
+le résultat d'un contrôle d'invariant après exécution : pour chaque objet et chaque
+occurrence du créneau, unités réservées (directes + via kits) <= quantite_physique.
+
+Le créneau (07:00, jamais utilisé par bench/donnees.py) et les stocks modifiés sont
+remis en état à la fin, sauf --conserver.
+
+Usage :
+    python bench/charge_checkout.py --utilisateurs 40 --concurrence 16
+    python bench/charge_checkout.py --base postgresql://localhost/scientral_bench --mode processus \\
+        --concurrence 8 --recurrence 4 --json charge.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, time as dtime, timedelta
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import donnees
+from bench_chemins_critiques import percentile
+
+HEURE_DEBUT, HEURE_FIN = '07:00', '08:00'
+DECALAGE_JOURS = 30                     # Créneau = référence + 30 j (futur, hors fenêtre la plus dense)
+PREFIXE_UTILISATEURS = 'charge_'
+
+# Issues d'un checkout, d'après le message de PanierServiceError
+CONFLIT, STOCK, LIMITE, ERREUR, SUCCES = 'conflit_nowait', 'stock_insuffisant', 'limite_items', 'erreur', 'succes'
+_MOTIFS = (("modifié par une autre personne", CONFLIT), ("Stock insuffisant", STOCK),
+           ("Trop d'items", LIMITE))
+
+
+def classer(message: str) -> str:
+    for motif, issue in _MOTIFS:
+        if motif in message:
+            return issue
+    return ERREUR
+
+
+# ============================================================
+# PRÉPARATION
+# ============================================================
+
+def creneaux(jeu: donnees.Jeu, recurrence: int) -> List[Tuple[datetime, datetime]]:
+    jour = jeu.reference + timedelta(days=DECALAGE_JOURS)
+    h_deb, h_fin = (dtime.fromisoformat(h) for h in (HEURE_DEBUT, HEURE_FIN))
+    return [(datetime.combine(jour + timedelta(weeks=k), h_deb), datetime.combine(jour + timedelta(weeks=k), h_fin))
+            for k in range(max(1, recurrence))]
+
+
+def preparer_paniers(jeu: donnees.Jeu, args) -> Tuple[List[int], Dict[int, int], List[int]]:
+    """Utilisateurs, stocks d'origine des objets chauds (pour remise en état), kits chauds."""
+    from db import db, Objet, KitObjet, Utilisateur, PanierItem
+    from services.panier_service import PanierService
+
+    etab = jeu.etablissement_id
+    rng = random.Random(args.graine)
+    chauds = jeu.objet_ids[:args.objets_chauds]
+    kits = db.session.execute(
+        db.select(KitObjet.kit_id).where(KitObjet.objet_id.in_(chauds)).distinct().order_by(KitObjet.kit_id)
+        .limit(args.kits_chauds)
+    ).scalars().all()
+
+    stocks = dict(db.session.execute(db.select(Objet.id, Objet.quantite_physique).where(Objet.id.in_(chauds))).all())
+    db.session.execute(db.update(Objet).where(Objet.id.in_(chauds)).values(quantite_physique=args.stock))
+
+    existants = dict(db.session.execute(
+        db.select(Utilisateur.nom_utilisateur, Utilisateur.id)
+        .filter_by(etablissement_id=etab).where(Utilisateur.nom_utilisateur.like(f"{PREFIXE_UTILISATEURS}%"))
+    ).all())
+    utilisateurs = []
+    for k in range(args.utilisateurs):
+        nom = f"{PREFIXE_UTILISATEURS}{etab}_{k}"
+        if nom not in existants:
+            u = Utilisateur(nom_utilisateur=nom, mot_de_passe='bench', role='utilisateur', etablissement_id=etab)
+            db.session.add(u)
+            db.session.flush()
+            existants[nom] = u.id
+        utilisateurs.append(existants[nom])
+    db.session.commit()
+
+    jour = creneaux(jeu, 1)[0][0].date()
+    recurrence = json.dumps({'type': 'hebdo', 'nb_occurrences': args.recurrence}) if args.recurrence > 1 else None
+    candidats = [('objet', o) for o in chauds] + [('kit', k) for k in kits]
+    for uid in utilisateurs:
+        service = PanierService(etab)
+        service.vider_panier(uid)
+        panier = service._get_active_panier(uid, create_if_missing=True)
+        for type_item, id_item in rng.sample(candidats, min(len(candidats), rng.randint(1, 3))):
+            db.session.add(PanierItem(id_panier=panier.id, type=type_item, id_item=id_item,
+                                      quantite=1 if type_item == 'kit' else rng.randint(1, 2),
+                                      date_reservation=jour, heure_debut=HEURE_DEBUT, heure_fin=HEURE_FIN,
+                                      recurrence_data=recurrence))
+    db.session.commit()
+    return utilisateurs, stocks, kits
+
+
+# ============================================================
+# EXÉCUTION CONCURRENTE
+# ============================================================
+
+def _checkouts(etab: int, utilisateurs: List[int], barriere, sortie: list) -> None:
+    """Un worker (contexte d'application et session SQLAlchemy propres) : attend les autres, puis valide ses paniers."""
+    from services.panier_service import PanierService, PanierServiceError
+
+    barriere.wait()
+    for uid in utilisateurs:
+        debut = time.perf_counter()
+        try:
+            PanierService(etab).valider_panier(uid)
+            issue = SUCCES
+        except PanierServiceError as e:
+            issue = classer(str(e))
+        sortie.append({'utilisateur': uid, 'issue': issue,
+                       'latence_ms': (time.perf_counter() - debut) * 1000, 'fin': time.time()})
+
+
+def _thread(app, etab, utilisateurs, barriere, sortie):
+    with app.app_context():
+        _checkouts(etab, utilisateurs, barriere, sortie)
+
+
+def _processus(base, etab, utilisateurs, barriere, file):
+    app = donnees.creer_app(base)
+    sortie = []
+    with app.app_context():
+        _checkouts(etab, utilisateurs, barriere, sortie)
+    file.put(sortie)
+
+
+def lancer(app, base: str, etab: int, utilisateurs: List[int], mode: str, concurrence: int) -> Tuple[list, float]:
+    lots = [utilisateurs[i::concurrence] for i in range(concurrence)]
+    lots = [lot for lot in lots if lot]
+    if mode == 'threads':
+        barriere, sortie = threading.Barrier(len(lots) + 1), []
+        workers = [threading.Thread(target=_thread, args=(app, etab, lot, barriere, sortie)) for lot in lots]
+        for w in workers:
+            w.start()
+        barriere.wait()
+        debut = time.time()
+        for w in workers:
+            w.join()
+        return sortie, debut
+
+    # Processus : chacun crée son application (pas de connexion héritée d'un fork)
+    ctx = multiprocessing.get_context('spawn')
+    barriere, file = ctx.Barrier(len(lots) + 1), ctx.Queue()
+    workers = [ctx.Process(target=_processus, args=(base, etab, lot, barriere, file)) for lot in lots]
+    for w in workers:
+        w.start()
+    barriere.wait()
+    debut = time.time()
+    sortie = [r for _ in workers for r in file.get()]
+    for w in workers:
+        w.join()
+    return sortie, debut
+
+
+# ============================================================
+# INVARIANT & REMISE EN ÉTAT
+# ============================================================
+
+def surreservations(jeu: donnees.Jeu, recurrence: int) -> List[Dict[str, object]]:
+    """Objets dont les unités réservées sur une occurrence du créneau dépassent le stock physique."""
+    from db import db, Objet, KitObjet, Reservation
+
+    etab = jeu.etablissement_id
+    anomalies = []
+    for debut, fin in creneaux(jeu, recurrence):
+        actives = (Reservation.etablissement_id == etab, Reservation.statut == 'confirmée',
+                   Reservation.debut_reservation < fin, Reservation.fin_reservation > debut)
+        directes = db.select(Reservation.objet_id.label('objet_id'), Reservation.quantite_reservee.label('unites')) \
+            .where(Reservation.objet_id.isnot(None), *actives)
+        via_kits = db.select(KitObjet.objet_id.label('objet_id'), (Reservation.quantite_reservee * KitObjet.quantite).label('unites')) \
+            .join(KitObjet, KitObjet.kit_id == Reservation.kit_id).where(*actives)
+        union = directes.union_all(via_kits).subquery()
+        lignes = db.session.execute(
+            db.select(Objet.id, Objet.quantite_physique, db.func.sum(union.c.unites))
+            .join(union, union.c.objet_id == Objet.id)
+            .group_by(Objet.id, Objet.quantite_physique)
+            .having(db.func.sum(union.c.unites) > Objet.quantite_physique)
+        ).all()
+        anomalies += [{'objet_id': oid, 'creneau': debut.isoformat(), 'stock': stock, 'reserve': int(reserve)}
+                      for oid, stock, reserve in lignes]
+    return anomalies
+
+
+def remettre_en_etat(jeu: donnees.Jeu, args, utilisateurs: List[int], stocks: Dict[int, int]) -> None:
+    from db import db, Objet, Reservation, ReservationRecurrence, AuditLog, PanierItem, Panier
+
+    etab = jeu.etablissement_id
+    occurrences = creneaux(jeu, args.recurrence)
+    for debut, _ in occurrences:
+        db.session.execute(db.delete(Reservation).where(Reservation.etablissement_id == etab,
+                                                        Reservation.debut_reservation == debut))
+    db.session.execute(db.delete(ReservationRecurrence).where(ReservationRecurrence.etablissement_id == etab,
+                                                              ReservationRecurrence.utilisateur_id.in_(utilisateurs)))
+    db.session.execute(db.delete(AuditLog).where(AuditLog.etablissement_id == etab,
+                                                 AuditLog.id_utilisateur.in_(utilisateurs)))
+    paniers = db.select(Panier.id).where(Panier.id_utilisateur.in_(utilisateurs))
+    db.session.execute(db.delete(PanierItem).where(PanierItem.id_panier.in_(paniers)))
+    for oid, stock in stocks.items():
+        db.session.execute(db.update(Objet).where(Objet.id == oid).values(quantite_physique=stock))
+    db.session.commit()
+
+
+# ============================================================
+# RAPPORT
+# ============================================================
+
+def rapport(sortie: list, debut: float, args, anomalies: list) -> Dict[str, object]:
+    duree = max(r['fin'] for r in sortie) - debut if sortie else 0.0
+    issues = Counter(r['issue'] for r in sortie)
+    latences = [r['latence_ms'] for r in sortie]
+    latences_ok = [r['latence_ms'] for r in sortie if r['issue'] == SUCCES]
+
+    def _stats(valeurs):
+        if not valeurs:
+            return None
+        return {p: round(percentile(valeurs, n), 2) for p, n in (('p50', 50), ('p95', 95), ('p99', 99))}
+
+    return {
+        'checkouts': len(sortie), 'duree_s': round(duree, 3),
+        'debit_succes_par_s': round(issues[SUCCES] / duree, 2) if duree else 0.0,
+        'debit_tentatives_par_s': round(len(sortie) / duree, 2) if duree else 0.0,
+        'issues': dict(issues),
+        'taux_conflit_nowait': round(issues[CONFLIT] / len(sortie), 4) if sortie else 0.0,
+        'latence_ms': _stats(latences), 'latence_succes_ms': _stats(latences_ok),
+        'surreservations': anomalies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    donnees.ajouter_arguments(parser)
+    parser.add_argument('--utilisateurs', type=int, default=40, help="M paniers validés simultanément")
+    parser.add_argument('--concurrence', type=int, default=8, help="Threads ou processus")
+    parser.add_argument('--mode', choices=('threads', 'processus'), default='threads')
+    parser.add_argument('--objets-chauds', type=int, default=5, help="Objets visés par tous les paniers")
+    parser.add_argument('--kits-chauds', type=int, default=3, help="Kits contenant des objets chauds")
+    parser.add_argument('--stock', type=int, default=8, help="quantite_physique imposée aux objets chauds")
+    parser.add_argument('--recurrence', type=int, default=1, help="Occurrences hebdomadaires par panier")
+    parser.add_argument('--conserver', action='store_true', help="Ne pas supprimer les réservations créées")
+    parser.add_argument('--json', help="Fichier de sortie JSON (comparaison entre exécutions)")
+    args = parser.parse_args()
+
+    app, jeu = donnees.preparer(args)
+    from db import db
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.text('PRAGMA journal_mode=WAL'))     # Persistant : vaut pour tous les workers
+        db.session.commit()
+
+    utilisateurs, stocks, kits = preparer_paniers(jeu, args)
+    print(f"{len(utilisateurs)} paniers sur {len(stocks)} objets chauds (stock {args.stock}) et {len(kits)} kits, "
+          f"{args.concurrence} {args.mode}, base {db.engine.dialect.name}")
+
+    sortie, debut = lancer(app, args.base, jeu.etablissement_id, utilisateurs, args.mode, args.concurrence)
+    db.session.expire_all()
+    anomalies = surreservations(jeu, args.recurrence)
+    resultat = rapport(sortie, debut, args, anomalies)
+    if not args.conserver:
+        remettre_en_etat(jeu, args, utilisateurs, stocks)
+
+    lat = resultat['latence_ms'] or {}
+    print(f"{resultat['checkouts']} checkouts en {resultat['duree_s']:.2f} s : "
+          f"{resultat['debit_succes_par_s']:.1f} succès/s, {resultat['debit_tentatives_par_s']:.1f} tentatives/s")
+    print(f"Latence p50 {lat.get('p50', 0):.1f} ms | p95 {lat.get('p95', 0):.1f} ms | p99 {lat.get('p99', 0):.1f} ms")
+    print("Issues : " + ", ".join(f"{k}={v}" for k, v in sorted(resultat['issues'].items())) +
+          f" | conflits NOWAIT {resultat['taux_conflit_nowait']:.1%}")
+    if anomalies:
+        print(f"INVARIANT VIOLÉ : {len(anomalies)} surréservation(s)")
+        for a in anomalies[:10]:
+            print(f"  objet {a['objet_id']} le {a['creneau']} : {a['reserve']} réservé(s) pour {a['stock']} en stock")
+    else:
+        print("Invariant respecté : aucune surréservation.")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'benchmark': 'charge_checkout',
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'base': db.engine.dialect.name, 'mode': args.mode, 'concurrence': args.concurrence,
+                'utilisateurs': args.utilisateurs, 'objets_chauds': args.objets_chauds, 'stock': args.stock,
+                'recurrence': args.recurrence, 'echelle': args.echelle, 'graine': args.graine,
+                'python': platform.python_version(),
+                'resultat': resultat,
+            }, f, indent=2, ensure_ascii=False)
+    sys.exit(1 if anomalies else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Jeu de données synthétique et déterministe pour les benchmarks.
+
+N établissements, chacun avec ses armoires, catégories, utilisateurs, objets, kits,
+réservations et historique. Même graine + même échelle + même date de référence
+=> mêmes lignes, sous SQLite comme sous PostgreSQL. Les lignes sont insérées par lots
+(insert Core, identifiants explicites) : 500k réservations en une à deux minutes.
+
+Le jeu est marqué d'une signature (paramètre 'bench_signature' du premier établissement) :
+une base déjà remplie avec la même signature est réutilisée telle quelle.
+
+Usage :
+    python bench/donnees.py --echelle petite
+    python bench/donnees.py --base postgresql://localhost/scientral_bench --echelle grande --reinitialiser
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Pas de FLASK_ENV=testing : il imposerait une base SQLite en mémoire
+os.environ.setdefault('GMLCL_PRO_KEY', 'bench')
+os.environ.setdefault('ASSETS_FINGERPRINT', '0')
+os.environ.setdefault('RATELIMIT_STORAGE_URI', 'memory://')
+
+BASE_DEFAUT = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'scientral_bench.db')
+GRAINE_DEFAUT = 42
+TAILLE_LOT = 5000
+
+# Volumes PAR établissement (le premier est celui que mesurent les benchmarks)
+ECHELLES = {
+    'mini':    dict(etablissements=1, objets=200,    kits=10,  reservations=1_000,   historique=2_000),
+    'petite':  dict(etablissements=2, objets=1_000,  kits=40,  reservations=10_000,  historique=20_000),
+    'moyenne': dict(etablissements=3, objets=3_000,  kits=150, reservations=100_000, historique=200_000),
+    'grande':  dict(etablissements=3, objets=10_000, kits=500, reservations=500_000, historique=1_000_000),
+}
+ARMOIRES = 25
+CATEGORIES = 40
+UTILISATEURS = 30
+FENETRE_JOURS = 90          # Réservations réparties sur [référence - 90 j, référence + 90 j]
+HISTORIQUE_JOURS = 180
+ACTIONS = ('Création', 'Modification', 'Déplacement', 'Mouvement Stock', 'Réservation', 'Suppression')
+
+
+@dataclass
+class Jeu:
+    """Identifiants utiles aux benchmarks (établissement mesuré)."""
+    etablissement_id: int
+    admin_id: int
+    nom_etablissement: str
+    utilisateur_ids: List[int]
+    objet_ids: List[int]
+    kit_ids: List[int]
+    reference: date
+    volumes: Dict[str, int]
+
+
+def prochain_lundi(jour: Optional[date] = None) -> date:
+    jour = jour or date.today()
+    return jour + timedelta(days=7 - jour.weekday())
+
+
+def creer_app(base: str):
+    """Application pointant sur `base`, limiter et cache d'exports désactivés."""
+    os.environ['DATABASE_URL'] = base
+    from app import create_app
+    from extensions import limiter
+
+    app = create_app()
+    app.config['EXPORT_CACHE_ENABLED'] = False      # Mesurer la génération, pas le cache
+    app.config['PDF_RENDER_INLINE'] = True          # Rendu dans le processus mesuré
+    limiter.enabled = False
+    logging.getLogger('services.sql_profiler_service').setLevel(logging.ERROR)
+    return app
+
+
+# ============================================================
+# GÉNÉRATION
+# ============================================================
+
+class _Generateur:
+    def __init__(self, volumes: Dict[str, int], graine: int, reference: date):
+        self.v = volumes
+        self.rng = random.Random(graine)
+        self.reference = reference
+        self.prochains: Dict[str, int] = {}
+
+    def _ids(self, table, n: int) -> range:
+        from db import db
+        if table.name not in self.prochains:
+            self.prochains[table.name] = (db.session.execute(db.select(db.func.max(table.c.id))).scalar() or 0) + 1
+        debut = self.prochains[table.name]
+        self.prochains[table.name] += n
+        return range(debut, debut + n)
+
+    @staticmethod
+    def _inserer(table, lignes) -> int:
+        from db import db
+        lot, total = [], 0
+        for ligne in lignes:
+            lot.append(ligne)
+            if len(lot) >= TAILLE_LOT:
+                db.session.execute(table.insert(), lot)
+                total += len(lot)
+                lot = []
+        if lot:
+            db.session.execute(table.insert(), lot)
+            total += len(lot)
+        return total
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def etablissement(self, numero: int) -> Jeu:
+        from db import (Etablissement, Utilisateur, Armoire, Categorie, Objet, Kit, KitObjet,
+                        Reservation, Historique, Parametre)
+        rng, v = self.rng, self.v
+        t = lambda m: m.__table__
+
+        etab_id = self._ids(t(Etablissement), 1)[0]
+        nom = f"Bench {numero:04d}"
+        self._inserer(t(Etablissement), [{'id': etab_id, 'nom': nom, 'code_invitation': f"BENCH{etab_id:06d}"}])
+        self._inserer(t(Parametre), [
+            {'id': i, 'etablissement_id': etab_id, 'cle': cle, 'valeur': valeur}
+            for i, (cle, valeur) in zip(self._ids(t(Parametre), 3),
+                                        (('licence_statut', 'PRO'), ('planning_debut', '08:00'), ('planning_fin', '18:00')))
+        ])
+
+        users = list(self._ids(t(Utilisateur), UTILISATEURS))
+        self._inserer(t(Utilisateur), ({
+            'id': uid, 'nom_utilisateur': f"bench{etab_id}_{k}", 'email': f"bench{etab_id}_{k}@exemple.fr",
+            'mot_de_passe': 'bench', 'role': 'admin' if k == 0 else 'utilisateur', 'etablissement_id': etab_id,
+        } for k, uid in enumerate(users)))
+
+        armoires = list(self._ids(t(Armoire), ARMOIRES))
+        self._inserer(t(Armoire), ({'id': a, 'nom': f"Armoire {k}", 'etablissement_id': etab_id}
+                                   for k, a in enumerate(armoires)))
+        categories = list(self._ids(t(Categorie), CATEGORIES))
+        self._inserer(t(Categorie), ({'id': c, 'nom': f"Catégorie {k}", 'etablissement_id': etab_id}
+                                     for k, c in enumerate(categories)))
+
+        objets = list(self._ids(t(Objet), v['objets']))
+
+        def _objets():
+            for k, oid in enumerate(objets):
+                peremption = rng.random() < 0.1
+                yield {
+                    'id': oid, 'nom': f"Objet {k:05d} {rng.choice(('bécher', 'pipette', 'erlenmeyer', 'burette', 'éprouvette'))}",
+                    'type_objet': 'materiel', 'quantite_physique': rng.randint(5, 60), 'seuil': rng.randint(0, 5),
+                    'date_peremption': self.reference + timedelta(days=rng.randint(-60, 365)) if peremption else None,
+                    'is_cmr': rng.random() < 0.02, 'en_commande': rng.random() < 0.03, 'traite': False,
+                    'armoire_id': rng.choice(armoires), 'categorie_id': rng.choice(categories),
+                    'etablissement_id': etab_id,
+                }
+        self._inserer(t(Objet), _objets())
+
+        kits = list(self._ids(t(Kit), v['kits']))
+        self._inserer(t(Kit), ({'id': kid, 'nom': f"Kit {k:04d}", 'etablissement_id': etab_id}
+                               for k, kid in enumerate(kits)))
+        compositions = [(kid, oid, rng.randint(1, 3)) for kid in kits for oid in rng.sample(objets, rng.randint(2, 6))]
+        self._inserer(t(KitObjet), ({'id': i, 'kit_id': kid, 'objet_id': oid, 'quantite': q, 'etablissement_id': etab_id}
+                                    for i, (kid, oid, q) in zip(self._ids(t(KitObjet), len(compositions)), compositions)))
+
+        debut_fenetre = datetime.combine(self.reference - timedelta(days=FENETRE_JOURS), dtime(0, 0))
+
+        def _reservations():
+            for rid in self._ids(t(Reservation), v['reservations']):
+                jour = debut_fenetre + timedelta(days=rng.randrange(2 * FENETRE_JOURS))
+                debut = jour + timedelta(hours=rng.randint(8, 16))
+                kit = kits and rng.random() < 0.2
+                yield {
+                    'id': rid, 'utilisateur_id': rng.choice(users), 'etablissement_id': etab_id,
+                    'objet_id': None if kit else rng.choice(objets), 'kit_id': rng.choice(kits) if kit else None,
+                    'quantite_reservee': rng.randint(1, 2), 'debut_reservation': debut,
+                    'fin_reservation': debut + timedelta(hours=rng.randint(1, 2)), 'groupe_id': self._uuid(),
+                    'statut': 'confirmée' if rng.random() < 0.95 else 'annulée',
+                }
+        self._inserer(t(Reservation), _reservations())
+
+        fin_historique = datetime.combine(self.reference, dtime(0, 0))
+
+        def _historique():
+            for hid in self._ids(t(Historique), v['historique']):
+                yield {
+                    'id': hid, 'objet_id': rng.choice(objets), 'utilisateur_id': rng.choice(users),
+                    'action': rng.choice(ACTIONS), 'details': f"Opération {hid}",
+                    'timestamp': fin_historique - timedelta(seconds=rng.randrange(HISTORIQUE_JOURS * 86400)),
+                    'etablissement_id': etab_id,
+                }
+        self._inserer(t(Historique), _historique())
+
+        return Jeu(etab_id, users[0], nom, users, objets, kits, self.reference, dict(v))
+
+
+def _realigner_sequences() -> None:
+    """Identifiants explicites : les séquences PostgreSQL doivent repartir après le max."""
+    from db import db
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in db.metadata.sorted_tables:
+        if 'id' in table.c and table.c.id.autoincrement and isinstance(table.c.id.type, db.Integer):
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+            ))
+
+
+def _signature(volumes: Dict[str, int], graine: int, reference: date) -> str:
+    return json.dumps({'volumes': volumes, 'graine': graine, 'reference': reference.isoformat()}, sort_keys=True)
+
+
+def _charger(signature: str) -> Optional[Jeu]:
+    from db import db, Etablissement, Parametre, Utilisateur, Objet, Kit
+    etab_id = db.session.execute(
+        db.select(Parametre.etablissement_id).filter_by(cle='bench_signature', valeur=signature)
+    ).scalar()
+    if etab_id is None:
+        return None
+    meta = json.loads(signature)
+    ids = lambda m: list(db.session.execute(db.select(m.id).filter_by(etablissement_id=etab_id).order_by(m.id)).scalars())
+    users = ids(Utilisateur)
+    return Jeu(etab_id, users[0], db.session.get(Etablissement, etab_id).nom, users, ids(Objet), ids(Kit),
+               date.fromisoformat(meta['reference']), meta['volumes'])
+
+
+def generer(volumes: Dict[str, int], graine: int = GRAINE_DEFAUT, reference: Optional[date] = None,
+            reinitialiser: bool = False) -> Jeu:
+    """Remplit la base de l'application courante (ou réutilise un jeu de même signature)."""
+    from db import db, Etablissement, Parametre
+    reference = reference or prochain_lundi()
+    signature = _signature(volumes, graine, reference)
+
+    if reinitialiser:
+        db.drop_all()
+        db.create_all()
+    else:
+        jeu = _charger(signature)
+        if jeu:
+            return jeu
+        if db.session.execute(db.select(Etablissement.id).limit(1)).first():
+            raise SystemExit("Base non vide et signature différente : relancer avec --reinitialiser.")
+
+    generateur = _Generateur(volumes, graine, reference)
+    debut = time.perf_counter()
+    jeux = [generateur.etablissement(n) for n in range(volumes['etablissements'])]
+    db.session.add(Parametre(etablissement_id=jeux[0].etablissement_id, cle='bench_signature', valeur=signature))
+    _realigner_sequences()
+    db.session.commit()
+    print(f"Jeu généré en {time.perf_counter() - debut:.1f} s : {volumes}")
+    return jeux[0]
+
+
+def ajouter_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options communes aux scripts du dossier bench/."""
+    parser.add_argument('--base', default=os.environ.get('BENCH_DATABASE_URL', BASE_DEFAUT),
+                        help="URL SQLAlchemy (défaut : SQLite dans le dossier temporaire)")
+    parser.add_argument('--echelle', choices=sorted(ECHELLES), default='petite')
+    parser.add_argument('--graine', type=int, default=GRAINE_DEFAUT)
+    parser.add_argument('--reference', type=date.fromisoformat,
+                        help="Date centrale des réservations, future (défaut : lundi prochain)")
+    parser.add_argument('--reinitialiser', action='store_true', help="Vide la base avant génération")
+
+
+def preparer(args) -> tuple:
+    """(app, jeu) à partir des options communes ; le contexte d'application reste ouvert."""
+    app = creer_app(args.base)
+    app.app_context().push()
+    jeu = generer(ECHELLES[args.echelle], args.graine, args.reference, args.reinitialiser)
+    return app, jeu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ajouter_arguments(parser)
+    args = parser.parse_args()
+    _, jeu = preparer(args)
+    print(f"Établissement mesuré : {jeu.etablissement_id} ({len(jeu.objet_ids)} objets, "
+          f"{len(jeu.kit_ids)} kits, référence {jeu.reference.isoformat()})")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import uuid
-from datetime import datetime, date
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert
 from sqlalchemy.sql import func
 from flask_login import UserMixin
 
@@ -10,6 +11,28 @@ def init_app(app):
     db.init_app(app)
     # La création des tables se fait via reset_db.py
 
+
+def inserer_lot(cible, lignes):
+    """
+    INSERT en lot (modèle ou table) renvoyant les ids dans l'ordre des lignes.
+    PostgreSQL : INSERT multi-lignes ... RETURNING. SQLite exécute un RETURNING ordonné ligne
+    par ligne : simple executemany, puis ids déduits du plus grand id (attribués consécutivement,
+    la transaction d'écriture tenant le verrou unique de la base).
+    render_nulls : l'ORM omet sinon les valeurs None et découpe le lot en autant d'instructions
+    que de combinaisons de colonnes renseignées.
+    """
+    if not lignes:
+        return []
+    table = getattr(cible, '__table__', cible)
+    stmt = insert(cible).execution_options(render_nulls=True)
+    if db.session.get_bind().dialect.name != 'sqlite':
+        return db.session.execute(stmt.returning(table.c.id, sort_by_parameter_order=True),
+                                  lignes).scalars().all()
+    db.session.execute(stmt, lignes)
+    dernier = db.session.execute(db.select(func.max(table.c.id))).scalar()
+    return list(range(dernier - len(lignes) + 1, dernier + 1))
+
+
 # ============================================================
 # 1. MODÈLES DE BASE (Etablissement & Utilisateur)
 # ============================================================
@@ -61,6 +84,10 @@ class Armoire(db.Model):
     etablissement_id = db.Column(db.Integer, db.ForeignKey('etablissements.id'), nullable=False)
     objets = db.relationship('Objet', back_populates='armoire')
 
+    __table_args__ = (
+        db.Index('idx_armoires_photo_url', 'photo_url'),   # Compteur de références des uploads
+    )
+
 class Categorie(db.Model):
     __tablename__ = 'categories'
     id = db.Column(db.Integer, primary_key=True)
@@ -111,6 +138,8 @@ class Objet(db.Model):
 
     __table_args__ = (
         db.Index('idx_objets_etablissement_categorie', 'etablissement_id', 'categorie_id'),
+        db.Index('idx_objets_image_url', 'image_url'),     # Compteur de références des uploads
+        db.Index('idx_objets_fds_url', 'fds_url'),
     )
     
     # Propriété calculée pour le pourcentage restant
@@ -294,6 +323,10 @@ class Historique(db.Model):
 
 class Parametre(db.Model):
     __tablename__ = 'parametres'
+    __table_args__ = (
+        db.UniqueConstraint('etablissement_id', 'cle', name='uq_parametres_etablissement_cle'),
+        db.Index('idx_parametres_cle', 'cle'),              # Références au logo (cle = 'logo_url')
+    )
     id = db.Column(db.Integer, primary_key=True)
     cle = db.Column(db.String(50), nullable=False)
     valeur = db.Column(db.Text, nullable=False)
@@ -424,7 +457,8 @@ class DocumentReglementaire(db.Model):
     nom = db.Column(db.String(150), nullable=False)
     type_doc = db.Column(db.String(50))
     fichier_url = db.Column(db.String(255), nullable=False)
-    fichier_pdf = db.Column(db.LargeBinary, nullable=True)
+    # Ancien stockage en base : jamais chargé avec la ligne, lu par morceaux au téléchargement
+    fichier_pdf = db.deferred(db.Column(db.LargeBinary, nullable=True))
     date_upload = db.Column(db.DateTime, default=datetime.now)
 
 class InventaireArchive(db.Model):
@@ -437,7 +471,7 @@ class InventaireArchive(db.Model):
     titre = db.Column(db.String(150))
     date_archive = db.Column(db.DateTime, default=datetime.now)
     fichier_url = db.Column(db.String(255), nullable=False)
-    fichier_pdf = db.Column(db.LargeBinary, nullable=True)
+    fichier_pdf = db.deferred(db.Column(db.LargeBinary, nullable=True))
     nb_objets = db.Column(db.Integer)
 
 # ============================================================
@@ -493,4 +527,121 @@ class ReservationRecurrence(db.Model):
     date_creation = db.Column(db.DateTime(timezone=True), server_default=func.current_timestamp())
 
     reservations = db.relationship('Reservation', backref='recurrence', lazy=True,
-                                   foreign_keys='Reservation.recurrence_id')
\ No newline at end of file
+                                   foreign_keys='Reservation.recurrence_id')
+# ============================================================
+# 11. EXPORTS EN ARRIÈRE-PLAN
+# ============================================================
+class ExportJob(db.Model):
+    """File d'attente des exports lourds (PDF/Excel), traités hors requête par un pool de workers."""
+    __tablename__ = 'export_jobs'
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    etablissement_id = db.Column(db.Integer, db.ForeignKey('etablissements.id'), nullable=False)
+    utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'), nullable=True)
+
+    type_export = db.Column(db.String(30), nullable=False)  # 'inventaire', 'rapport', 'inventaire_annuel'
+    format = db.Column(db.String(10), nullable=False)       # 'pdf', 'excel', 'csv'
+    parametres = db.Column(db.JSON, nullable=False, default=dict)
+
+    # Cycle de vie : 'en_attente' -> 'en_cours' -> 'termine' | 'erreur'
+    statut = db.Column(db.String(20), nullable=False, default='en_attente')
+    progression = db.Column(db.Integer, nullable=False, default=0)  # 0-100
+    total = db.Column(db.Integer, nullable=True)                    # Lignes attendues (si connu)
+    message = db.Column(db.String(255), nullable=True)
+    worker_pid = db.Column(db.Integer, nullable=True)
+
+    # Résultat (fichier local dans EXPORT_JOBS_DIR)
+    fichier = db.Column(db.String(255), nullable=True)
+    nom_fichier = db.Column(db.String(255), nullable=True)
+    mimetype = db.Column(db.String(100), nullable=True)
+
+    date_creation = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    date_debut = db.Column(db.DateTime, nullable=True)
+    date_fin = db.Column(db.DateTime, nullable=True)
+    date_expiration = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('idx_export_jobs_statut', 'statut', 'date_creation'),
+        db.Index('idx_export_jobs_etablissement', 'etablissement_id'),
+        db.Index('idx_export_jobs_expiration', 'date_expiration'),
+    )
+
+# ============================================================
+# 12. VERSIONS DE DONNÉES (invalidation des caches)
+# ============================================================
+class VersionDonnees(db.Model):
+    """Version (horodatage ns, jamais réutilisée) changée à chaque écriture d'un domaine (inventaire, thème...) par établissement."""
+    __tablename__ = 'versions_donnees'
+    id = db.Column(db.Integer, primary_key=True)
+    etablissement_id = db.Column(db.Integer, db.ForeignKey('etablissements.id'), nullable=False)
+    domaine = db.Column(db.String(30), nullable=False)  # 'inventaire', 'theme'
+    version = db.Column(db.BigInteger, nullable=False)
+    date_maj = db.Column(db.DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('etablissement_id', 'domaine', name='uq_versions_donnees_etab_domaine'),
+    )
+
+# ============================================================
+# 13. IMPORTS EN DEUX PHASES (analyse puis validation)
+# ============================================================
+class ImportSession(db.Model):
+    """Import Excel : fichier analysé en arrière-plan, lignes en zone de transit jusqu'à confirmation."""
+    __tablename__ = 'import_sessions'
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    etablissement_id = db.Column(db.Integer, db.ForeignKey('etablissements.id'), nullable=False)
+    utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateurs.id'), nullable=True)
+    nom_fichier = db.Column(db.String(255), nullable=True)
+
+    # Cycle de vie : 'analyse' -> 'pret' -> 'en_cours' -> 'termine' ('erreur' si le fichier est illisible)
+    statut = db.Column(db.String(20), nullable=False, default='analyse')
+    job_id = db.Column(db.String(36), nullable=True)  # Dernier job (analyse ou validation)
+    message = db.Column(db.String(255), nullable=True)
+
+    nb_lignes = db.Column(db.Integer, nullable=False, default=0)
+    nb_valides = db.Column(db.Integer, nullable=False, default=0)
+    nb_erreurs = db.Column(db.Integer, nullable=False, default=0)
+    nb_ignores = db.Column(db.Integer, nullable=False, default=0)
+    nb_importes = db.Column(db.Integer, nullable=False, default=0)
+
+    date_creation = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    date_fin = db.Column(db.DateTime, nullable=True)
+
+    lignes = db.relationship('ImportLigne', backref='session', lazy='dynamic', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('idx_import_sessions_etablissement', 'etablissement_id', 'date_creation'),
+    )
+
+
+class ImportLigne(db.Model):
+    """Ligne normalisée d'un import : 'valide' -> 'importe', ou 'erreur' / 'ignore' (doublon)."""
+    __tablename__ = 'import_lignes'
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(36), db.ForeignKey('import_sessions.id', ondelete='CASCADE'), nullable=False)
+    ligne = db.Column(db.Integer, nullable=False)          # Numéro de ligne Excel
+    statut = db.Column(db.String(10), nullable=False)
+    donnees = db.Column(db.JSON, nullable=False)           # Paramètres d'insertion, ou valeurs brutes si erreur
+    erreur = db.Column(db.String(255), nullable=True)
+    objet_id = db.Column(db.Integer, nullable=True)        # Renseigné une fois importée
+
+    __table_args__ = (
+        db.Index('idx_import_lignes_session_statut', 'session_id', 'statut', 'id'),
+    )
+
+# ============================================================
+# 14. JOURNAL DES MODIFICATIONS (sauvegardes différentielles)
+# ============================================================
+class JournalModification(db.Model):
+    """Une entrée par écriture sur une table sauvegardée ; l'id sert de séquence de changement monotone."""
+    __tablename__ = 'journal_modifications'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    etablissement_id = db.Column(db.Integer, db.ForeignKey('etablissements.id'), nullable=False)
+    table_nom = db.Column(db.String(50), nullable=False)
+    ligne_id = db.Column(db.Integer, nullable=True)          # NULL : toute la table (écriture en masse)
+    operation = db.Column(db.String(10), nullable=False)     # 'upsert', 'delete' (tombstone), 'complet', 'rupture'
+    date = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('idx_journal_etab_table_seq', 'etablissement_id', 'table_nom', 'id'),
+        db.Index('idx_journal_date', 'date'),
+    )
@@ -9,9 +9,8 @@ db = SQLAlchemy()
 cache = Cache()
 mail = Mail()
 
+# Stockage et stratégie lus dans la config (RATELIMIT_STORAGE_URI, RATELIMIT_STRATEGY) : voir app.py
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["2000 per day", "500 per hour"],
-    storage_uri="memory://",
-    strategy="fixed-window"
 )
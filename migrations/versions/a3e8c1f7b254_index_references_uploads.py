@@ -0,0 +1,35 @@
+"""Index des colonnes qui référencent les uploads (compteur de références, GC)
+
+Revision ID: a3e8c1f7b254
+Revises: f4d9a2c7e816
+Create Date: 2026-10-19 21:05:44.512837
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e8c1f7b254'
+down_revision = 'f4d9a2c7e816'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('objets', schema=None) as batch_op:
+        batch_op.create_index('idx_objets_image_url', ['image_url'], unique=False)
+        batch_op.create_index('idx_objets_fds_url', ['fds_url'], unique=False)
+    with op.batch_alter_table('armoires', schema=None) as batch_op:
+        batch_op.create_index('idx_armoires_photo_url', ['photo_url'], unique=False)
+    with op.batch_alter_table('parametres', schema=None) as batch_op:
+        batch_op.create_index('idx_parametres_cle', ['cle'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('parametres', schema=None) as batch_op:
+        batch_op.drop_index('idx_parametres_cle')
+    with op.batch_alter_table('armoires', schema=None) as batch_op:
+        batch_op.drop_index('idx_armoires_photo_url')
+    with op.batch_alter_table('objets', schema=None) as batch_op:
+        batch_op.drop_index('idx_objets_fds_url')
+        batch_op.drop_index('idx_objets_image_url')
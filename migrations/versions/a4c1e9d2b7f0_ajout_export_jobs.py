@@ -0,0 +1,55 @@
+"""ajout export_jobs (file d'attente des exports)
+
+Revision ID: a4c1e9d2b7f0
+Revises: 7b2f1a937c95
+Create Date: 2026-10-19 09:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c1e9d2b7f0'
+down_revision = '7b2f1a937c95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('export_jobs',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('etablissement_id', sa.Integer(), nullable=False),
+        sa.Column('utilisateur_id', sa.Integer(), nullable=True),
+        sa.Column('type_export', sa.String(length=30), nullable=False),
+        sa.Column('format', sa.String(length=10), nullable=False),
+        sa.Column('parametres', sa.JSON(), nullable=False),
+        sa.Column('statut', sa.String(length=20), nullable=False),
+        sa.Column('progression', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=True),
+        sa.Column('message', sa.String(length=255), nullable=True),
+        sa.Column('worker_pid', sa.Integer(), nullable=True),
+        sa.Column('fichier', sa.String(length=255), nullable=True),
+        sa.Column('nom_fichier', sa.String(length=255), nullable=True),
+        sa.Column('mimetype', sa.String(length=100), nullable=True),
+        sa.Column('date_creation', sa.DateTime(), nullable=False),
+        sa.Column('date_debut', sa.DateTime(), nullable=True),
+        sa.Column('date_fin', sa.DateTime(), nullable=True),
+        sa.Column('date_expiration', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['etablissement_id'], ['etablissements.id'], ),
+        sa.ForeignKeyConstraint(['utilisateur_id'], ['utilisateurs.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('export_jobs', schema=None) as batch_op:
+        batch_op.create_index('idx_export_jobs_statut', ['statut', 'date_creation'], unique=False)
+        batch_op.create_index('idx_export_jobs_etablissement', ['etablissement_id'], unique=False)
+        batch_op.create_index('idx_export_jobs_expiration', ['date_expiration'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('export_jobs', schema=None) as batch_op:
+        batch_op.drop_index('idx_export_jobs_expiration')
+        batch_op.drop_index('idx_export_jobs_etablissement')
+        batch_op.drop_index('idx_export_jobs_statut')
+
+    op.drop_table('export_jobs')
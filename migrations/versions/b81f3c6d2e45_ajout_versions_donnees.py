@@ -0,0 +1,33 @@
+"""ajout versions_donnees (compteurs d'invalidation des caches)
+
+Revision ID: b81f3c6d2e45
+Revises: a4c1e9d2b7f0
+Create Date: 2026-10-19 10:02:17.530918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81f3c6d2e45'
+down_revision = 'a4c1e9d2b7f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('versions_donnees',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('etablissement_id', sa.Integer(), nullable=False),
+        sa.Column('domaine', sa.String(length=30), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('date_maj', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['etablissement_id'], ['etablissements.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('etablissement_id', 'domaine', name='uq_versions_donnees_etab_domaine')
+    )
+
+
+def downgrade():
+    op.drop_table('versions_donnees')
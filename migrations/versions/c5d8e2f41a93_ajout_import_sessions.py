@@ -0,0 +1,64 @@
+"""ajout import_sessions / import_lignes (imports Excel en deux phases)
+
+Revision ID: c5d8e2f41a93
+Revises: b81f3c6d2e45
+Create Date: 2026-10-19 11:24:05.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d8e2f41a93'
+down_revision = 'b81f3c6d2e45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_sessions',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('etablissement_id', sa.Integer(), nullable=False),
+        sa.Column('utilisateur_id', sa.Integer(), nullable=True),
+        sa.Column('nom_fichier', sa.String(length=255), nullable=True),
+        sa.Column('statut', sa.String(length=20), nullable=False),
+        sa.Column('job_id', sa.String(length=36), nullable=True),
+        sa.Column('message', sa.String(length=255), nullable=True),
+        sa.Column('nb_lignes', sa.Integer(), nullable=False),
+        sa.Column('nb_valides', sa.Integer(), nullable=False),
+        sa.Column('nb_erreurs', sa.Integer(), nullable=False),
+        sa.Column('nb_ignores', sa.Integer(), nullable=False),
+        sa.Column('nb_importes', sa.Integer(), nullable=False),
+        sa.Column('date_creation', sa.DateTime(), nullable=False),
+        sa.Column('date_fin', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['etablissement_id'], ['etablissements.id'], ),
+        sa.ForeignKeyConstraint(['utilisateur_id'], ['utilisateurs.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('import_sessions', schema=None) as batch_op:
+        batch_op.create_index('idx_import_sessions_etablissement', ['etablissement_id', 'date_creation'], unique=False)
+
+    op.create_table('import_lignes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('session_id', sa.String(length=36), nullable=False),
+        sa.Column('ligne', sa.Integer(), nullable=False),
+        sa.Column('statut', sa.String(length=10), nullable=False),
+        sa.Column('donnees', sa.JSON(), nullable=False),
+        sa.Column('erreur', sa.String(length=255), nullable=True),
+        sa.Column('objet_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['session_id'], ['import_sessions.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('import_lignes', schema=None) as batch_op:
+        batch_op.create_index('idx_import_lignes_session_statut', ['session_id', 'statut', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('import_lignes', schema=None) as batch_op:
+        batch_op.drop_index('idx_import_lignes_session_statut')
+    op.drop_table('import_lignes')
+
+    with op.batch_alter_table('import_sessions', schema=None) as batch_op:
+        batch_op.drop_index('idx_import_sessions_etablissement')
+    op.drop_table('import_sessions')
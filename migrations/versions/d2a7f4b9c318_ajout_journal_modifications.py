@@ -0,0 +1,40 @@
+"""ajout journal_modifications (sauvegardes différentielles)
+
+Revision ID: d2a7f4b9c318
+Revises: c5d8e2f41a93
+Create Date: 2026-10-19 14:12:40.226814
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7f4b9c318'
+down_revision = 'c5d8e2f41a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('journal_modifications',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('etablissement_id', sa.Integer(), nullable=False),
+        sa.Column('table_nom', sa.String(length=50), nullable=False),
+        sa.Column('ligne_id', sa.Integer(), nullable=True),
+        sa.Column('operation', sa.String(length=10), nullable=False),
+        sa.Column('date', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['etablissement_id'], ['etablissements.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('journal_modifications', schema=None) as batch_op:
+        batch_op.create_index('idx_journal_etab_table_seq', ['etablissement_id', 'table_nom', 'id'], unique=False)
+        batch_op.create_index('idx_journal_date', ['date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('journal_modifications', schema=None) as batch_op:
+        batch_op.drop_index('idx_journal_date')
+        batch_op.drop_index('idx_journal_etab_table_seq')
+
+    op.drop_table('journal_modifications')
@@ -0,0 +1,31 @@
+"""unicité (etablissement_id, cle) des parametres
+
+Revision ID: e7b3c9a1d552
+Revises: d2a7f4b9c318
+Create Date: 2026-10-19 16:05:12.481937
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3c9a1d552'
+down_revision = 'd2a7f4b9c318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Doublons hérités des anciens upserts non atomiques : la ligne la plus récente l'emporte
+    op.execute(sa.text(
+        "DELETE FROM parametres WHERE id NOT IN ("
+        "SELECT id FROM (SELECT MAX(id) AS id FROM parametres GROUP BY etablissement_id, cle) AS derniers)"
+    ))
+    with op.batch_alter_table('parametres', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_parametres_etablissement_cle', ['etablissement_id', 'cle'])
+
+
+def downgrade():
+    with op.batch_alter_table('parametres', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_parametres_etablissement_cle', type_='unique')
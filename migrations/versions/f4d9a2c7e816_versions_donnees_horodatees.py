@@ -0,0 +1,33 @@
+"""versions_donnees.version en BigInteger (horodatage ns, jamais réutilisé)
+
+Revision ID: f4d9a2c7e816
+Revises: e7b3c9a1d552
+Create Date: 2026-10-19 18:42:07.118304
+
+"""
+import time
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4d9a2c7e816'
+down_revision = 'e7b3c9a1d552'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('versions_donnees', schema=None) as batch_op:
+        batch_op.alter_column('version', existing_type=sa.Integer(), type_=sa.BigInteger(),
+                              existing_nullable=False)
+    # Les anciens compteurs (1, 2, ...) pourraient coïncider avec ceux d'une base recréée
+    op.execute(sa.text("UPDATE versions_donnees SET version = :v").bindparams(v=time.time_ns()))
+
+
+def downgrade():
+    op.execute(sa.text("UPDATE versions_donnees SET version = 1"))
+    with op.batch_alter_table('versions_donnees', schema=None) as batch_op:
+        batch_op.alter_column('version', existing_type=sa.BigInteger(), type_=sa.Integer(),
+                              existing_nullable=False)
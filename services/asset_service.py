@@ -0,0 +1,231 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+import uuid
+from typing import Dict, Optional, Set
+
+import click
+from flask import abort, current_app, request, send_file, url_for
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:     # Optionnel : sans lui seuls les .gz sont produits
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION (surchargée par app.config) ---
+DOSSIERS = ('css', 'js')                # Sous-dossiers de static/ pris en charge
+EXTENSIONS = ('.css', '.js')
+LONGUEUR_EMPREINTE = 12
+TAILLE_MIN_COMPRESSION = 512            # En dessous, l'en-tête Content-Encoding coûte plus qu'il ne gagne
+CACHE_IMMUABLE = 365 * 24 * 3600        # L'URL contient l'empreinte : son contenu ne change jamais
+MANIFESTE = 'manifest.json'
+
+# Références relatives réécrites vers les noms empreintés (sinon le navigateur chargerait
+# l'ancienne version, ou une URL relative à /assets/ qui n'existe pas)
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")\s]+)\1\s*\)''')
+_CSS_IMPORT = re.compile(r'''@import\s+(['"])([^'"]+)\1''')
+_JS_IMPORT = re.compile(r'''(\bfrom\s*|\bimport\s*\(?\s*)(['"])(\.{1,2}/[^'"]+)\2''')
+
+_manifestes: Dict[str, Dict[str, str]] = {}
+_lock = threading.Lock()
+
+
+def _dossier_sortie() -> str:
+    path = current_app.config.get('ASSETS_DIR') or os.path.join(current_app.instance_path, 'assets')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _ecrire_atomique(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# ============================================================
+# CONSTRUCTION DU MANIFESTE
+# ============================================================
+
+class _Construction:
+    """Empreinte de chaque fichier ; une feuille CSS ou un module JS est empreinté après ses dépendances."""
+
+    def __init__(self, racine: str, sortie: str, prefixe_static: str):
+        self.racine = racine
+        self.sortie = sortie
+        self.prefixe = prefixe_static.rstrip('/')
+        self.sources: Dict[str, str] = {}
+        self.manifeste: Dict[str, str] = {}
+        self._en_cours: Set[str] = set()
+        for dossier in DOSSIERS:
+            for parent, _, noms in os.walk(os.path.join(racine, dossier)):
+                for nom in noms:
+                    if nom.endswith(EXTENSIONS):
+                        chemin = os.path.join(parent, nom)
+                        self.sources[os.path.relpath(chemin, racine).replace(os.sep, '/')] = chemin
+
+    def construire(self) -> Dict[str, str]:
+        for rel in sorted(self.sources):
+            self.empreinter(rel)
+        return self.manifeste
+
+    def _reference(self, source: str, ref: str) -> str:
+        if ref.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return ref
+        m = re.match(r'([^?#]*)(.*)', ref)
+        chemin, suffixe = m.group(1), m.group(2)
+        dossier = posixpath.dirname(source)
+        cible = posixpath.normpath(posixpath.join(dossier, chemin))
+        if cible.startswith('..'):
+            return ref
+        empreinte = self.empreinter(cible) if cible in self.sources else None
+        if empreinte:
+            relatif = posixpath.relpath(empreinte, dossier)
+            return (relatif if relatif.startswith('../') else f"./{relatif}") + suffixe
+        # Fichier hors manifeste (image, police) : URL absolue, valable depuis /assets/ comme depuis /static/
+        return f"{self.prefixe}/{cible}{suffixe}"
+
+    def _reecrire(self, rel: str, texte: str) -> str:
+        if rel.endswith('.css'):
+            texte = _CSS_IMPORT.sub(lambda m: f"@import {m.group(1)}{self._reference(rel, m.group(2))}{m.group(1)}", texte)
+            return _CSS_URL.sub(lambda m: f"url({m.group(1)}{self._reference(rel, m.group(2))}{m.group(1)})", texte)
+        return _JS_IMPORT.sub(lambda m: f"{m.group(1)}{m.group(2)}{self._reference(rel, m.group(3))}{m.group(2)}", texte)
+
+    def empreinter(self, rel: str) -> Optional[str]:
+        if rel in self.manifeste:
+            return self.manifeste[rel]
+        if rel in self._en_cours:
+            return None     # Import circulaire : la référence reste vers /static/
+        self._en_cours.add(rel)
+        with open(self.sources[rel], 'rb') as f:
+            data = f.read()
+        data = self._reecrire(rel, data.decode('utf-8', 'surrogateescape')).encode('utf-8', 'surrogateescape')
+        base, extension = posixpath.splitext(rel)
+        cible = f"{base}.{hashlib.sha256(data).hexdigest()[:LONGUEUR_EMPREINTE]}{extension}"
+        _produire(os.path.join(self.sortie, cible), data)
+        self._en_cours.discard(rel)
+        self.manifeste[rel] = cible
+        return cible
+
+
+def _produire(path: str, data: bytes) -> None:
+    """Fichier empreinté + .gz/.br précompressés. Nom = contenu : un fichier déjà présent est complet."""
+    if not os.path.exists(path):
+        _ecrire_atomique(path, data)
+    if len(data) < TAILLE_MIN_COMPRESSION:
+        return
+    variantes = [('.gz', lambda d: gzip.compress(d, 9, mtime=0))]
+    if brotli is not None:
+        variantes.append(('.br', lambda d: brotli.compress(d, quality=11)))
+    for suffixe, compresser in variantes:
+        if os.path.exists(path + suffixe):
+            continue
+        compresse = compresser(data)
+        if len(compresse) < len(data):
+            _ecrire_atomique(path + suffixe, compresse)
+
+
+def construire() -> Dict[str, str]:
+    """
+    Empreinte les CSS/JS de static/, écrit les fichiers (et leurs .gz/.br) dans ASSETS_DIR
+    puis le manifeste {chemin static: chemin empreinté}. Sans effet sur ce qui est déjà produit :
+    plusieurs workers peuvent le lancer en même temps au démarrage.
+    """
+    sortie = _dossier_sortie()
+    manifeste = _Construction(current_app.static_folder, sortie, current_app.static_url_path).construire()
+    _ecrire_atomique(os.path.join(sortie, MANIFESTE), json.dumps(manifeste, indent=1, sort_keys=True).encode('utf-8'))
+    with _lock:
+        _manifestes[sortie] = manifeste
+    logger.info(f"Manifeste des assets : {len(manifeste)} fichier(s)")
+    return manifeste
+
+
+def manifeste() -> Dict[str, str]:
+    sortie = _dossier_sortie()
+    with _lock:
+        if sortie not in _manifestes:
+            try:
+                with open(os.path.join(sortie, MANIFESTE), 'r', encoding='utf-8') as f:
+                    _manifestes[sortie] = json.load(f)
+            except (OSError, ValueError):
+                _manifestes[sortie] = {}
+        return _manifestes[sortie]
+
+
+def nettoyer() -> int:
+    """Supprime les fichiers empreintés qui ne figurent plus dans le manifeste courant."""
+    sortie = _dossier_sortie()
+    vivants = {os.path.join(sortie, c) for c in manifeste().values()}
+    supprimes = 0
+    for parent, _, noms in os.walk(sortie):
+        for nom in noms:
+            chemin = os.path.join(parent, nom)
+            base = chemin[:-3] if nom.endswith(('.gz', '.br')) else chemin
+            if nom == MANIFESTE or base in vivants:
+                continue
+            os.remove(chemin)
+            supprimes += 1
+    return supprimes
+
+
+# ============================================================
+# TEMPLATES ET SERVICE HTTP
+# ============================================================
+
+def asset_url(filename: str) -> str:
+    """Global de template `asset_url('css/style.css')` : URL empreintée si elle existe, /static/ sinon."""
+    if current_app.config.get('ASSETS_FINGERPRINT'):
+        empreinte = manifeste().get(filename)
+        if empreinte:
+            return url_for('assets', filename=empreinte)
+    return url_for('static', filename=filename)
+
+
+def servir_asset(filename: str):
+    """/assets/<fichier empreinté> : variante .br ou .gz selon Accept-Encoding, cache immuable."""
+    chemin = safe_join(_dossier_sortie(), filename)
+    if chemin is None or filename == MANIFESTE or not os.path.isfile(chemin):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encodage = None
+    for enc, suffixe in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[enc] and os.path.isfile(chemin + suffixe):
+            chemin, encodage = chemin + suffixe, enc
+            break
+    response = send_file(chemin, mimetype=mimetype, conditional=True, max_age=CACHE_IMMUABLE)
+    if encodage:
+        response.headers['Content-Encoding'] = encodage
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# ============================================================
+# CLI : flask assets ...
+# ============================================================
+assets_cli = AppGroup('assets', help="CSS/JS empreintés et précompressés.")
+
+
+@assets_cli.command('build')
+@click.option('--nettoyer', 'avec_nettoyage', is_flag=True, help="Supprime aussi les anciennes versions.")
+def build_command(avec_nettoyage):
+    """Reconstruit le manifeste (à lancer au déploiement ; le démarrage le fait aussi)."""
+    produits = construire()
+    message = f"{len(produits)} fichier(s) empreinté(s)"
+    if brotli is None:
+        message += " (module brotli absent : .gz uniquement)"
+    if avec_nettoyage:
+        message += f", {nettoyer()} ancien(s) fichier(s) supprimé(s)"
+    click.echo(message + ".")
@@ -0,0 +1,801 @@
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import zlib
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from db import (db, inserer_lot, Etablissement, Utilisateur, Armoire, Categorie, Fournisseur, Salle, Objet,
+                Kit, KitObjet, ReservationRecurrence, Reservation, Suggestion, Historique, Budget, Depense, Echeance,
+                Parametre, EquipementSecurite, MaintenancePlan, MaintenanceLog, DocumentReglementaire,
+                InventaireArchive, Notification, Panier, PanierItem)
+from services import journal_service as journal
+from services import storage_service as stockage
+from services.export_service import iter_rows
+from services.version_service import bump_version, DOMAINE_INVENTAIRE, DOMAINE_THEME, DOMAINE_PARAMETRES
+
+logger = logging.getLogger(__name__)
+
+FORMAT_SAUVEGARDE = 'scientral-backup'
+VERSION_SAUVEGARDE = 3             # v3 : mode complet/différentiel, séquence du journal, tombstones
+BACKUP_BATCH_SIZE = 1000
+RESTORE_BATCH_SIZE = 1000
+BACKUP_FLUSH_SIZE = 64 * 1024      # Octets NDJSON accumulés avant compression
+GZIP_LEVEL = 6
+GZIP_WBITS = 31                    # 16 + 15 : en-tête et CRC gzip, lisible par gunzip
+IDS_PAR_REQUETE = 500              # Différentielle : relecture des lignes modifiées par paquets d'ids
+# Les transactions concurrentes peuvent valider leurs entrées de journal dans le désordre :
+# une différentielle reprend aussi les entrées de cette fenêtre avant son point de départ (rejeu idempotent)
+RECOUVREMENT = timedelta(minutes=10)
+
+MODE_COMPLET = 'complet'
+MODE_DIFFERENTIEL = 'differentiel'
+
+# Paramètres propres à l'instance / la licence : jamais exportés ni restaurés
+PARAMETRES_PROTEGES = ('licence_cle', 'licence_statut', 'instance_id')
+
+
+class BackupServiceError(Exception):
+    """Sauvegarde impossible à produire ou fichier de restauration invalide."""
+    pass
+
+
+# ============================================================
+# REGISTRE DES TABLES SAUVEGARDÉES
+# ============================================================
+
+@dataclass(frozen=True)
+class TableSauvegarde:
+    nom: str
+    model: Any
+    filtre: Callable[[int], Any]           # etablissement_id -> clause WHERE
+    exclues: Tuple[str, ...] = ()          # Colonnes jamais exportées
+
+    @property
+    def colonnes(self):
+        return [c for c in self.model.__table__.columns if c.name not in self.exclues]
+
+
+def _par_etablissement(model):
+    return lambda etab_id: model.etablissement_id == etab_id
+
+
+def _par_equipement(model):
+    """Tables de maintenance : rattachées à l'établissement via l'équipement."""
+    return lambda etab_id: model.equipement_id.in_(
+        select(EquipementSecurite.id).where(EquipementSecurite.etablissement_id == etab_id)
+    )
+
+
+def _table(nom, model, filtre=None, exclues=()):
+    return TableSauvegarde(nom, model, filtre or _par_etablissement(model), tuple(exclues))
+
+
+# Ordre des dépendances : une table n'est référencée que par des tables listées après elle.
+# Paniers, journal d'audit et tables techniques (jobs, versions, imports) sont volontairement absents.
+BACKUP_TABLES = (
+    _table('utilisateurs', Utilisateur, exclues=('mot_de_passe',)),
+    _table('armoires', Armoire),
+    _table('categories', Categorie),
+    _table('fournisseurs', Fournisseur),
+    _table('salles', Salle),
+    _table('objets', Objet),
+    _table('kits', Kit),
+    _table('kit_composants', KitObjet),
+    _table('reservation_recurrences', ReservationRecurrence),
+    _table('reservations', Reservation),
+    _table('suggestions', Suggestion),
+    _table('historique', Historique),
+    _table('budgets', Budget),
+    _table('depenses', Depense),
+    _table('echeances', Echeance),
+    _table('parametres', Parametre,
+           filtre=lambda etab_id: (Parametre.etablissement_id == etab_id) & Parametre.cle.notin_(PARAMETRES_PROTEGES)),
+    _table('equipements_securite', EquipementSecurite),
+    _table('maintenance_plans', MaintenancePlan, filtre=_par_equipement(MaintenancePlan)),
+    _table('maintenance_logs', MaintenanceLog, filtre=_par_equipement(MaintenanceLog)),
+    _table('documents_reglementaires', DocumentReglementaire),
+    _table('inventaires_archives', InventaireArchive),
+    _table('notifications', Notification),
+)
+
+TABLES_PAR_NOM = {t.nom: t for t in BACKUP_TABLES}
+
+journal.suivre((t.nom, t.model) for t in BACKUP_TABLES)
+
+
+# ============================================================
+# SÉRIALISATION
+# ============================================================
+
+def _serial(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return {'$b64': base64.b64encode(bytes(obj)).decode('ascii')}
+    raise TypeError(f"Type {type(obj)} non sérialisable")
+
+
+def _ligne(enregistrement: Dict[str, Any]) -> bytes:
+    """Un enregistrement NDJSON compact (une ligne, UTF-8)."""
+    return (json.dumps(enregistrement, default=_serial, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _snapshot():
+    """
+    PostgreSQL : toutes les tables sont lues dans la même transaction REPEATABLE READ
+    (instantané cohérent même si l'établissement est modifié pendant le téléchargement).
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    db.session.rollback()
+    db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+
+
+# ============================================================
+# GÉNÉRATION EN FLUX
+# ============================================================
+
+def verifier_differentielle(etablissement_id: int, depuis: int) -> datetime:
+    """
+    Une différentielle depuis la séquence `depuis` est-elle possible ? Renvoie le début de la
+    fenêtre de recouvrement ; BackupServiceError si la chaîne est rompue (restauration, journal purgé).
+    """
+    if depuis < 0 or depuis > journal.sequence_courante():
+        raise BackupServiceError("Séquence de départ inconnue : sauvegarde complète nécessaire.")
+    if journal.rupture_depuis(etablissement_id, depuis):
+        raise BackupServiceError("Données restaurées depuis cette sauvegarde : sauvegarde complète nécessaire.")
+    if depuis == 0:
+        return datetime.min
+    date_depart = journal.date_sequence(depuis)
+    if date_depart is None:
+        raise BackupServiceError("Journal purgé depuis cette sauvegarde : sauvegarde complète nécessaire.")
+    return date_depart - RECOUVREMENT
+
+
+def _lignes_table(table: TableSauvegarde, etablissement_id: int, batch_size: int):
+    stmt = select(*table.colonnes).where(table.filtre(etablissement_id)).order_by(table.model.__table__.c.id)
+    return iter_rows(stmt, batch_size)
+
+
+def _lignes_par_ids(table: TableSauvegarde, etablissement_id: int, ids):
+    """État courant des lignes modifiées (les ids absents ont été supprimés depuis)."""
+    t = table.model.__table__
+    ids = sorted(ids)
+    for i in range(0, len(ids), IDS_PAR_REQUETE):
+        yield from db.session.execute(
+            select(*table.colonnes)
+            .where(table.filtre(etablissement_id), t.c.id.in_(ids[i:i + IDS_PAR_REQUETE]))
+            .order_by(t.c.id)
+        )
+
+
+def iter_ndjson(etablissement_id: int, nom_etablissement: Optional[str] = None, depuis: Optional[int] = None,
+                sequence: Optional[int] = None, batch_size: int = BACKUP_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Produit la sauvegarde NDJSON ligne par ligne :
+      - un en-tête (format, version, mode, séquence du journal, établissement, liste des tables) ;
+      - pour chaque table : {"type": "table", colonnes}, une ligne {"t", "r"} par enregistrement
+        (valeurs dans l'ordre des colonnes), une ligne {"t", "d"} par suppression (différentielle),
+        puis {"type": "fin_table", lignes, sha256} ;
+      - un manifeste final (lignes et sha256 de chaque table).
+    Le sha256 porte sur les octets exacts des lignes de données de la table.
+    Complète : chaque table est lue par lots (yield_per), la mémoire ne dépend pas du volume.
+    Différentielle (`depuis`) : seules les lignes touchées depuis cette séquence du journal.
+    `sequence` (lue par l'appelant avant l'instantané, pour nommer le fichier) peut être en retard :
+    la différentielle suivante reprendra alors quelques changements déjà inclus, sans effet au rejeu.
+    """
+    _snapshot()
+    if sequence is None:
+        sequence = journal.sequence_courante()
+    recouvrement = verifier_differentielle(etablissement_id, depuis) if depuis is not None else None
+
+    yield _ligne({
+        'type': 'entete', 'format': FORMAT_SAUVEGARDE, 'version': VERSION_SAUVEGARDE,
+        'mode': MODE_COMPLET if depuis is None else MODE_DIFFERENTIEL,
+        'depuis': depuis, 'sequence': sequence,
+        'etablissement_id': etablissement_id, 'etablissement': nom_etablissement,
+        'date': datetime.now().isoformat(), 'tables': [t.nom for t in BACKUP_TABLES],
+    })
+
+    manifeste = {}
+    for table in BACKUP_TABLES:
+        colonnes = table.colonnes
+        yield _ligne({'type': 'table', 'table': table.nom, 'colonnes': [c.name for c in colonnes]})
+
+        supprimes = set()
+        if depuis is None:
+            rows = _lignes_table(table, etablissement_id, batch_size)
+        else:
+            ecrits, supprimes, complet = journal.ids_modifies(etablissement_id, table.nom, depuis, sequence, recouvrement)
+            rows = (_lignes_table(table, etablissement_id, batch_size) if complet
+                    else _lignes_par_ids(table, etablissement_id, ecrits | supprimes))
+
+        empreinte = hashlib.sha256()
+        nb = 0
+        for row in rows:
+            supprimes.discard(row.id)
+            ligne = _ligne({'t': table.nom, 'r': list(row)})
+            empreinte.update(ligne)
+            nb += 1
+            yield ligne
+        # Restent les ids supprimés qui n'existent plus : tombstones
+        for id_ in sorted(supprimes):
+            ligne = _ligne({'t': table.nom, 'd': id_})
+            empreinte.update(ligne)
+            nb += 1
+            yield ligne
+
+        manifeste[table.nom] = {'lignes': nb, 'sha256': empreinte.hexdigest()}
+        yield _ligne({'type': 'fin_table', 'table': table.nom, **manifeste[table.nom]})
+
+    yield _ligne({
+        'type': 'manifeste', 'sequence': sequence, 'tables': manifeste,
+        'total_lignes': sum(m['lignes'] for m in manifeste.values()),
+    })
+    logger.info(f"Sauvegarde {'complète' if depuis is None else f'différentielle depuis {depuis}'} "
+                f"etab {etablissement_id} : {sum(m['lignes'] for m in manifeste.values())} lignes, "
+                f"séquence {sequence}")
+
+
+def gzip_stream(chunks, level: int = GZIP_LEVEL, flush_size: int = BACKUP_FLUSH_SIZE) -> Iterator[bytes]:
+    """Compression gzip à la volée : tampon de `flush_size` octets, jamais le fichier entier."""
+    compresseur = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    tampon = []
+    taille = 0
+    for chunk in chunks:
+        tampon.append(chunk)
+        taille += len(chunk)
+        if taille >= flush_size:
+            sortie = compresseur.compress(b''.join(tampon))
+            tampon, taille = [], 0
+            if sortie:
+                yield sortie
+    if tampon:
+        sortie = compresseur.compress(b''.join(tampon))
+        if sortie:
+            yield sortie
+    yield compresseur.flush()
+
+
+def generer_sauvegarde(etablissement_id: int, nom_etablissement: Optional[str] = None, compresser: bool = True,
+                       depuis: Optional[int] = None, sequence: Optional[int] = None) -> Iterator[bytes]:
+    """Sauvegarde de l'établissement en flux (gzip par défaut) : complète, ou différentielle si `depuis`."""
+    try:
+        flux = iter_ndjson(etablissement_id, nom_etablissement, depuis=depuis, sequence=sequence)
+        yield from (gzip_stream(flux) if compresser else flux)
+    except Exception as e:
+        # L'en-tête HTTP est déjà parti : on journalise, le fichier tronqué n'aura pas de manifeste
+        logger.error(f"Erreur sauvegarde etab {etablissement_id}: {e}", exc_info=True)
+        raise BackupServiceError(str(e)) from e
+
+
+# ============================================================
+# LECTURE EN FLUX (NDJSON v2 ET JSON v1 HÉRITÉ)
+# ============================================================
+
+GZIP_MAGIC = b'\x1f\x8b'
+LEGACY_MAX_SIZE = 5 * 1024 * 1024   # Le format v1 (un seul document JSON) est chargé en mémoire
+
+# Enregistrements produits par iter_sauvegarde
+ENTETE, LIGNE, SUPPRESSION = 'entete', 'ligne', 'suppression'
+
+# Format v1 (ancien telecharger_db) : clé du document -> (table, renommage des colonnes)
+_LEGACY_TABLES = (
+    ('armoires', 'armoires', {}),
+    ('categories', 'categories', {}),
+    ('fournisseurs', 'fournisseurs', {}),
+    ('objets', 'objets', {'quantite': 'quantite_physique'}),
+    ('budget', 'budgets', {'montant': 'montant_initial'}),
+    ('depenses', 'depenses', {'date': 'date_depense'}),
+    ('echeances', 'echeances', {'date': 'date_echeance'}),
+)
+# Tables remplacées par une restauration v1 (celles que purgeait l'ancien importer_db)
+LEGACY_PURGE = frozenset({'armoires', 'categories', 'fournisseurs', 'objets', 'kits', 'kit_composants',
+                          'reservations', 'suggestions', 'historique', 'budgets', 'depenses', 'echeances'})
+
+
+def ouvrir_sauvegarde(fichier):
+    """Flux binaire, décompressé à la volée si le fichier est un gzip (détection par signature)."""
+    if not fichier.seekable():
+        fichier = io.BufferedReader(fichier)
+        signature = fichier.peek(2)[:2]
+    else:
+        signature = fichier.read(2)
+        fichier.seek(0)
+    if signature == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=fichier, mode='rb')
+    return fichier
+
+
+def _iter_legacy(flux) -> Iterator[Tuple[str, Optional[str], Dict[str, Any]]]:
+    contenu = flux.read(LEGACY_MAX_SIZE + 1)
+    if len(contenu) > LEGACY_MAX_SIZE:
+        raise BackupServiceError("Sauvegarde JSON v1 trop volumineuse (Max 5Mo).")
+    try:
+        data = json.loads(contenu)
+    except ValueError as e:
+        raise BackupServiceError("Fichier de sauvegarde illisible.") from e
+    if not isinstance(data, dict):
+        raise BackupServiceError("Fichier de sauvegarde illisible.")
+    yield ENTETE, None, {'mode': MODE_COMPLET, 'version': 1}
+    for cle, table, renommage in _LEGACY_TABLES:
+        for row in data.get(cle) or []:
+            yield LIGNE, table, {renommage.get(k, k): v for k, v in row.items()}
+
+
+def _lire_entete(flux) -> Tuple[Optional[Dict[str, Any]], bytes]:
+    premier = flux.readline()
+    try:
+        entete = json.loads(premier)
+    except ValueError:
+        entete = None
+    if not isinstance(entete, dict) or entete.get('type') != 'entete':
+        return None, premier
+    if entete.get('format') != FORMAT_SAUVEGARDE or entete.get('version', 0) > VERSION_SAUVEGARDE:
+        raise BackupServiceError("Format de sauvegarde non pris en charge.")
+    entete.setdefault('mode', MODE_COMPLET)    # Fichiers v2 : toujours complets
+    return entete, premier
+
+
+def lire_entete(fichier) -> Dict[str, Any]:
+    """En-tête d'un fichier de sauvegarde (v1 : complet implicite) ; le fichier est rembobiné."""
+    entete, _ = _lire_entete(ouvrir_sauvegarde(fichier))
+    fichier.seek(0)
+    return entete or {'mode': MODE_COMPLET, 'version': 1}
+
+
+def iter_sauvegarde(fichier) -> Iterator[Tuple[str, Optional[str], Any]]:
+    """
+    Itère (ENTETE, None, en-tête), puis (LIGNE, table, ligne) et (SUPPRESSION, table, id) sans
+    charger le fichier : NDJSON (gzip ou non) lu ligne par ligne, empreinte sha256 de chaque
+    table vérifiée à sa ligne de fin, manifeste final obligatoire.
+    Les anciens fichiers JSON v1 sont acceptés (chargés en mémoire, taille bornée).
+    """
+    flux = ouvrir_sauvegarde(fichier)
+    entete, premier = _lire_entete(flux)
+    if entete is None:
+        # Document JSON v1 : on relit depuis le début
+        yield from _iter_legacy(io.BytesIO(premier + flux.read(LEGACY_MAX_SIZE + 1)))
+        return
+    yield ENTETE, None, entete
+
+    colonnes: List[str] = []
+    empreinte = hashlib.sha256()
+    nb = 0
+    for ligne in flux:
+        if not ligne.strip():
+            continue
+        try:
+            rec = json.loads(ligne)
+        except ValueError as e:
+            raise BackupServiceError("Fichier de sauvegarde corrompu.") from e
+
+        if 't' in rec:
+            empreinte.update(ligne)
+            nb += 1
+            if 'd' in rec:
+                yield SUPPRESSION, rec['t'], rec['d']
+            else:
+                yield LIGNE, rec['t'], dict(zip(colonnes, rec['r']))
+        elif rec.get('type') == 'table':
+            colonnes, empreinte, nb = rec['colonnes'], hashlib.sha256(), 0
+        elif rec.get('type') == 'fin_table':
+            if rec.get('lignes') != nb or rec.get('sha256') != empreinte.hexdigest():
+                raise BackupServiceError(f"Somme de contrôle invalide pour la table {rec.get('table')}.")
+        elif rec.get('type') == 'manifeste':
+            return
+
+    raise BackupServiceError("Sauvegarde tronquée (manifeste absent).")
+
+
+# ============================================================
+# RESTAURATION ENSEMBLISTE
+# ============================================================
+
+# Écritures de la restauration : une seule entrée « rupture » au journal, pas une par ligne
+SANS_JOURNAL = {'journaliser': False}
+
+# Références sans clé étrangère déclarée, remappées comme les autres
+_REFERENCES_LIBRES = {('historique', 'objet_id'): 'objets'}
+
+# Tables dont fichier_url désigne un fichier du stockage : clé de l'établissement restaurant exigée
+_TABLES_FICHIERS = ('documents_reglementaires', 'inventaires_archives')
+
+# Types JSON -> Python (inverse de _serial)
+_CONVERTISSEURS = {
+    datetime: datetime.fromisoformat,
+    date: lambda v: datetime.fromisoformat(v).date(),
+    bytes: lambda v: base64.b64decode(v['$b64']),
+}
+
+
+class _Restauration:
+    """
+    Reconstruit l'établissement table par table : INSERT par lots (executemany ; ids des
+    tables référencées via db.inserer_lot), clés étrangères réécrites via des
+    tables de correspondance en mémoire {ancien id: nouvel id}.
+    Les différentielles rejouées ensuite mettent à jour les lignes déjà connues
+    (UPDATE par lots), insèrent les nouvelles et appliquent les tombstones.
+    """
+
+    def __init__(self, etablissement_id: int, utilisateur_id: int, batch_size: int, chaine: bool = False):
+        self.etablissement_id = etablissement_id
+        self.utilisateur_id = utilisateur_id
+        self.batch_size = batch_size
+        self.maps: Dict[str, Dict[Any, int]] = {t.nom: {} for t in BACKUP_TABLES}
+        self.stats: Dict[str, int] = {}
+        self.ignorees = 0
+        self.sequence: Optional[int] = None
+        self.fichiers = 0
+        if chaine:
+            # Des différentielles suivent : toute ligne peut être mise à jour ou supprimée plus tard
+            self.referencees = set(TABLES_PAR_NOM)
+        else:
+            # Tables dont les nouveaux ids sont nécessaires aux tables suivantes
+            self.referencees = {fk.column.table.name for t in BACKUP_TABLES
+                                for c in t.model.__table__.columns for fk in c.foreign_keys}
+            self.referencees.update(_REFERENCES_LIBRES.values())
+        # Comptes non recréés (pas de mot de passe dans la sauvegarde) : rattachement par identifiant
+        self.comptes = {nom: id_ for id_, nom in db.session.execute(
+            select(Utilisateur.id, Utilisateur.nom_utilisateur).where(Utilisateur.etablissement_id == etablissement_id)
+        )}
+
+    def _preparer(self, table: TableSauvegarde):
+        """
+        Plan de la table, calculé une fois : colonnes recopiées telles quelles,
+        colonnes à convertir (dates, binaires) et références à réécrire.
+        """
+        directes, conversions, references = [], [], []
+        for col in table.colonnes:
+            if col.name in ('id', 'etablissement_id'):
+                continue
+            cible = next((fk.column.table.name for fk in col.foreign_keys), None) \
+                or _REFERENCES_LIBRES.get((table.nom, col.name))
+            try:
+                python_type = col.type.python_type
+            except NotImplementedError:
+                python_type = None
+            if cible:
+                references.append((col.name, self.maps.setdefault(cible, {}), col.nullable,
+                                   self.utilisateur_id if cible == 'utilisateurs' and not col.nullable else None))
+            elif python_type in _CONVERTISSEURS:
+                conversions.append((col.name, _CONVERTISSEURS[python_type], col.nullable))
+            else:
+                directes.append(col.name)
+        avec_etab = 'etablissement_id' in table.model.__table__.c
+        return directes, conversions, references, avec_etab
+
+    def _parametres(self, plan, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        directes, conversions, references, avec_etab = plan
+        params = {nom: row[nom] for nom in directes if nom in row}
+        if avec_etab:
+            params['etablissement_id'] = self.etablissement_id
+
+        for nom, correspondance, nullable, defaut in references:
+            if nom not in row:
+                continue
+            valeur = row[nom]
+            if valeur is not None:
+                valeur = correspondance.get(valeur, defaut)
+                if valeur is None and not nullable:
+                    return None  # Parent absent de la sauvegarde : ligne orpheline
+            params[nom] = valeur
+
+        for nom, convertir, nullable in conversions:
+            valeur = row.get(nom)
+            if valeur is None:
+                if nom in row:
+                    params[nom] = None
+                continue
+            try:
+                params[nom] = convertir(valeur)
+            except (ValueError, TypeError, KeyError):
+                if not nullable:
+                    return None
+                params[nom] = None
+        return params
+
+    def _fichier_autorise(self, params: Dict[str, Any]) -> bool:
+        """Fichier porté par la ligne (ancien blob en base) ou clé de l'établissement (storage_service.appartient)."""
+        url = params.get('fichier_url')
+        return not url or params.get('fichier_pdf') is not None or stockage.appartient(self.etablissement_id, url)
+
+    def _compter(self, table: str, n: int) -> None:
+        self.stats[table] = self.stats.get(table, 0) + n
+
+    def _ecrire(self, table: TableSauvegarde, anciens_ids, lignes) -> None:
+        if not lignes:
+            return
+        t = table.model.__table__
+        correspondance = self.maps[table.nom]
+        nouvelles, anciens_nouvelles, maj = [], [], []
+        for ancien, params in zip(anciens_ids, lignes):
+            existant = correspondance.get(ancien) if ancien is not None else None
+            if existant is None:
+                nouvelles.append(params)
+                anciens_nouvelles.append(ancien)
+            else:
+                maj.append({**params, 'b_id': existant})
+
+        if maj:
+            db.session.execute(update(t).where(t.c.id == bindparam('b_id')), maj, execution_options=SANS_JOURNAL)
+        if nouvelles and table.nom == 'parametres':
+            # Clé unique par établissement : la dernière valeur lue (complète puis différentielles) l'emporte
+            dernieres = {p['cle']: (a, p) for a, p in zip(anciens_nouvelles, nouvelles)}
+            anciens_nouvelles = [a for a, _ in dernieres.values()]
+            nouvelles = [p for _, p in dernieres.values()]
+            db.session.execute(delete(t).where(t.c.etablissement_id == self.etablissement_id,
+                                               t.c.cle.in_([p['cle'] for p in nouvelles])),
+                               execution_options=SANS_JOURNAL)
+        if nouvelles:
+            if table.nom in self.referencees:
+                ids = inserer_lot(t, nouvelles)
+                correspondance.update((a, n) for a, n in zip(anciens_nouvelles, ids) if a is not None)
+            else:
+                db.session.execute(insert(t), nouvelles)
+        self._compter(table.nom, len(lignes))
+
+    def _supprimer(self, suppressions: Dict[str, List[Any]]) -> None:
+        """Tombstones d'une différentielle, enfants avant parents."""
+        for table in reversed(BACKUP_TABLES):
+            anciens = suppressions.get(table.nom)
+            if not anciens or table.nom == 'utilisateurs':
+                continue
+            correspondance = self.maps[table.nom]
+            ids = [correspondance.pop(a) for a in anciens if a in correspondance]
+            t = table.model.__table__
+            for i in range(0, len(ids), IDS_PAR_REQUETE):
+                db.session.execute(delete(t).where(table.filtre(self.etablissement_id),
+                                                   t.c.id.in_(ids[i:i + IDS_PAR_REQUETE])),
+                                   execution_options=SANS_JOURNAL)
+            self._compter(table.nom, len(ids))
+
+    def _entete(self, entete: Dict[str, Any]) -> None:
+        """Chaîne valide : une complète, puis des différentielles sans trou de séquence."""
+        mode = entete.get('mode')
+        if not self.fichiers:
+            if mode != MODE_COMPLET:
+                raise BackupServiceError("La restauration doit commencer par une sauvegarde complète.")
+            self.sequence = entete.get('sequence')
+        elif mode != MODE_DIFFERENTIEL:
+            raise BackupServiceError("Une seule sauvegarde complète par restauration.")
+        elif self.sequence is None or entete.get('depuis') is None or entete['depuis'] > self.sequence:
+            # depuis > séquence atteinte : des changements manquent (depuis < : recouvrement, rejeu sans effet)
+            raise BackupServiceError("Sauvegarde différentielle hors séquence (fichier manquant ou mal ordonné).")
+        else:
+            self.sequence = max(self.sequence, entete.get('sequence') or 0)
+        self.fichiers += 1
+
+    def _utilisateur(self, row: Dict[str, Any]) -> None:
+        id_ = self.comptes.get(row.get('nom_utilisateur'))
+        if id_:
+            self.maps['utilisateurs'][row.get('id')] = id_
+
+    def executer(self, enregistrements: Iterable[Tuple[str, Optional[str], Any]]) -> None:
+        """Applique un fichier (complet ou différentiel)."""
+        courante, plan, anciens, lot = None, None, [], []
+        suppressions: Dict[str, List[Any]] = {}
+        for op, nom, data in enregistrements:
+            if op == ENTETE:
+                self._entete(data)
+                continue
+            if op == SUPPRESSION:
+                suppressions.setdefault(nom, []).append(data)
+                continue
+
+            if nom != (courante.nom if courante else None):
+                if courante:
+                    self._ecrire(courante, anciens, lot)
+                anciens, lot = [], []
+                courante = TABLES_PAR_NOM.get(nom)
+                if courante is None:
+                    logger.warning(f"Restauration : table inconnue '{nom}' ignorée")
+                    continue
+                plan = self._preparer(courante)
+            if courante is None:
+                continue
+            if courante.nom == 'utilisateurs':
+                self._utilisateur(data)
+                continue
+            if courante.nom == 'parametres' and data.get('cle') in PARAMETRES_PROTEGES:
+                continue
+
+            params = self._parametres(plan, data)
+            if params is not None and courante.nom in _TABLES_FICHIERS and not self._fichier_autorise(params):
+                logger.warning(f"Restauration etab {self.etablissement_id} : {courante.nom} #{data.get('id')} "
+                               f"ignoré, fichier hors établissement ({params.get('fichier_url')})")
+                params = None
+            if params is None:
+                self.ignorees += 1
+                continue
+            anciens.append(data.get('id'))
+            lot.append(params)
+            if len(lot) >= self.batch_size:
+                self._ecrire(courante, anciens, lot)
+                anciens, lot = [], []
+
+        if courante:
+            self._ecrire(courante, anciens, lot)
+        self._supprimer(suppressions)
+
+
+def purger_donnees(etablissement_id: int, tables=None) -> None:
+    """
+    Supprime les données sauvegardables de l'établissement (ordre inverse des dépendances) :
+    toutes les tables sauf les comptes, ou seulement `tables` (noms). Les paniers, qui pointent
+    vers des objets recréés sous d'autres ids, sont toujours vidés.
+    """
+    paniers = select(Panier.id).where(Panier.etablissement_id == etablissement_id)
+    db.session.execute(delete(PanierItem).where(PanierItem.id_panier.in_(paniers)))
+    db.session.execute(delete(Panier).where(Panier.etablissement_id == etablissement_id))
+    for table in reversed(BACKUP_TABLES):
+        if table.nom == 'utilisateurs' or (tables is not None and table.nom not in tables):
+            continue
+        db.session.execute(delete(table.model.__table__).where(table.filtre(etablissement_id)),
+                           execution_options=SANS_JOURNAL)
+
+
+def restaurer_sauvegarde(fichiers, etablissement_id: int, utilisateur_id: int,
+                         batch_size: int = RESTORE_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Remplace les données de l'établissement par le contenu de la sauvegarde (un fichier, ou une
+    complète suivie de ses différentielles, dans l'ordre), en une transaction : purge ensembliste,
+    puis lecture en flux et écritures par lots. Toute erreur (fichier corrompu, somme de contrôle,
+    chaîne incomplète, contrainte) annule l'ensemble. Les comptes utilisateurs ne sont pas recréés :
+    les références sont rattachées au compte de même identifiant, sinon à l'administrateur restaurant.
+    """
+    if not isinstance(fichiers, (list, tuple)):
+        fichiers = [fichiers]
+    try:
+        # Un fichier v1 ne couvre que l'inventaire et le budget : salles, thème, sécurité... sont conservés
+        v1 = lire_entete(fichiers[0]).get('version') == 1
+        purger_donnees(etablissement_id, LEGACY_PURGE if v1 else None)
+        restauration = _Restauration(etablissement_id, utilisateur_id, batch_size, chaine=len(fichiers) > 1)
+        for fichier in fichiers:
+            restauration.executer(iter_sauvegarde(fichier))
+        # Tous les ids ont changé : les différentielles suivantes repartiront d'une complète
+        journal.rupture(etablissement_id)
+        bump_version(etablissement_id, DOMAINE_INVENTAIRE)
+        bump_version(etablissement_id, DOMAINE_THEME)
+        bump_version(etablissement_id, DOMAINE_PARAMETRES)
+        db.session.commit()
+    except BackupServiceError:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erreur restauration etab {etablissement_id}: {e}", exc_info=True)
+        raise BackupServiceError("Erreur critique lors de l'importation.") from e
+
+    stats = restauration.stats
+    total = sum(stats.values())
+    logger.info(f"Restauration etab {etablissement_id} ({len(fichiers)} fichier(s)) : "
+                f"{total} lignes, {restauration.ignorees} ignorées")
+    return {'tables': stats, 'total': total, 'ignorees': restauration.ignorees, 'fichiers': len(fichiers)}
+
+
+# ============================================================
+# SAUVEGARDES AUTOMATIQUES (NUIT)
+# ============================================================
+
+DEFAULT_FULL_EVERY_DAYS = 7
+DEFAULT_KEEP_CHAINS = 2
+DEFAULT_JOURNAL_RETENTION_DAYS = 35
+
+
+def _backups_dir(etablissement_id: int) -> str:
+    base = current_app.config.get('BACKUP_DIR') or os.path.join(current_app.instance_path, 'backups')
+    path = os.path.join(base, str(etablissement_id))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _etat_chaine(dossier: str) -> Optional[Dict[str, Any]]:
+    """Dernier fichier de la chaîne courante : {'sequence', 'date_complete'} (nom des fichiers)."""
+    fichiers = sorted(f for f in os.listdir(dossier) if f.endswith('.ndjson.gz'))
+    if not fichiers:
+        return None
+    completes = [f for f in fichiers if '_complet_' in f]
+    if not completes:
+        return None
+    dernier = fichiers[-1]
+    return {
+        'sequence': int(dernier.rsplit('_', 1)[1].split('.', 1)[0]),
+        'date_complete': datetime.strptime(completes[-1][:15], '%Y%m%d-%H%M%S'),
+    }
+
+
+def _rotation(dossier: str, garder: int) -> None:
+    """Conserve les `garder` dernières chaînes (une complète et ses différentielles)."""
+    fichiers = sorted(f for f in os.listdir(dossier) if f.endswith('.ndjson.gz'))
+    completes = [f for f in fichiers if '_complet_' in f]
+    if len(completes) <= garder:
+        return
+    limite = completes[-garder]
+    for f in fichiers:
+        if f < limite:
+            os.remove(os.path.join(dossier, f))
+
+
+def sauvegarde_nocturne(etablissement_id: int, full_every_days: int = DEFAULT_FULL_EVERY_DAYS,
+                        garder: int = DEFAULT_KEEP_CHAINS) -> Tuple[str, str]:
+    """
+    Sauvegarde automatique d'un établissement : différentielle depuis le dernier fichier de la
+    chaîne, ou complète (première fois, chaîne trop ancienne, chaîne rompue).
+    Fichiers : AAAAMMJJ-HHMMSS_complet_<séquence> / AAAAMMJJ-HHMMSS_diff_<depuis>_<séquence>.
+    """
+    dossier = _backups_dir(etablissement_id)
+    etat = _etat_chaine(dossier)
+    depuis = None
+    if etat and datetime.now() - etat['date_complete'] < timedelta(days=full_every_days):
+        try:
+            verifier_differentielle(etablissement_id, etat['sequence'])
+            depuis = etat['sequence']
+        except BackupServiceError as e:
+            logger.info(f"Sauvegarde etab {etablissement_id} : complète ({e})")
+
+    horodatage = datetime.now().strftime('%Y%m%d-%H%M%S')
+    sequence = journal.sequence_courante()
+    mode = MODE_COMPLET if depuis is None else MODE_DIFFERENTIEL
+    nom = (f"{horodatage}_complet_{sequence}.ndjson.gz" if depuis is None
+           else f"{horodatage}_diff_{depuis}_{sequence}.ndjson.gz")
+
+    # Écriture sous un nom provisoire (hors chaîne), renommé une fois le manifeste écrit
+    provisoire = os.path.join(dossier, f"{horodatage}_en_cours")
+    try:
+        with open(provisoire, 'wb') as f:
+            for chunk in generer_sauvegarde(etablissement_id, depuis=depuis, sequence=sequence):
+                f.write(chunk)
+        os.replace(provisoire, os.path.join(dossier, nom))
+    finally:
+        if os.path.exists(provisoire):
+            os.remove(provisoire)
+        db.session.rollback()  # Fin de l'instantané de lecture
+
+    if depuis is None:
+        _rotation(dossier, garder)
+    return mode, nom
+
+
+backups_cli = AppGroup('sauvegardes', help="Sauvegardes complètes et différentielles des établissements.")
+
+
+@backups_cli.command('nuit')
+@click.option('--complete-tous-les', 'full_every_days', default=DEFAULT_FULL_EVERY_DAYS, show_default=True,
+              help="Jours entre deux sauvegardes complètes (différentielles entre les deux).")
+@click.option('--garder', default=DEFAULT_KEEP_CHAINS, show_default=True, help="Chaînes conservées par établissement.")
+def nightly_command(full_every_days, garder):
+    """Sauvegarde tous les établissements (à lancer chaque nuit)."""
+    ids = db.session.execute(select(Etablissement.id).order_by(Etablissement.id)).scalars().all()
+    erreurs = 0
+    for etablissement_id in ids:
+        try:
+            mode, nom = sauvegarde_nocturne(etablissement_id, full_every_days, garder)
+            click.echo(f"Etablissement {etablissement_id} : {mode} -> {nom}")
+        except BackupServiceError as e:
+            erreurs += 1
+            db.session.rollback()
+            click.echo(f"Etablissement {etablissement_id} : ERREUR {e}", err=True)
+    click.echo(f"{len(ids) - erreurs}/{len(ids)} établissement(s) sauvegardé(s).")
+
+
+@backups_cli.command('purge-journal')
+@click.option('--jours', default=DEFAULT_JOURNAL_RETENTION_DAYS, show_default=True,
+              help="Ancienneté minimale des entrées supprimées (doit dépasser l'intervalle entre complètes).")
+def purge_journal_command(jours):
+    """Supprime les entrées anciennes du journal des modifications."""
+    click.echo(f"{journal.purger_journal(datetime.now() - timedelta(days=jours))} entrée(s) supprimée(s).")
@@ -3,7 +3,7 @@ import logging
 import uuid
 import re
 from datetime import date, datetime
-from typing import List, Dict, Any, TypedDict, TYPE_CHECKING
+from typing import List, Dict, Any, TypedDict
 from werkzeug.utils import secure_filename
 
 # ReportLab Imports
@@ -13,10 +13,10 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Flowable
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from html import escape
 
-if TYPE_CHECKING:
-    from db import Objet
+from services.pdf_render_service import render_pdf_to_file, PdfRenderError
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +27,7 @@ class DocumentConfig(TypedDict, total=False):
     color_alert: colors.Color
     color_border: colors.Color
     max_items: int
+    chunk_rows: int
     margins: float
     col_widths: List[float] # Point 4
 
@@ -35,11 +36,17 @@ DEFAULT_CONFIG: DocumentConfig = {
     'color_secondary': colors.HexColor('#F4F6F9'),
     'color_alert': colors.red,
     'color_border': colors.HexColor('#E0E0E0'),
-    'max_items': 2000,
+    'max_items': 50000,
+    'chunk_rows': 250,
     'margins': 1.0 * cm,
     'col_widths': [9.0*cm, 6.0*cm, 6.0*cm, 3.0*cm, 3.0*cm] # Externalisé
 }
 
+# Cellules texte brut (sans Paragraph) : mêmes métriques que style_cell
+CELL_FONT = 'Helvetica'
+CELL_FONT_SIZE = 9
+CELL_PADDING = 6
+
 class DocumentServiceError(Exception):
     """Erreur métier générique."""
     pass
@@ -92,6 +99,10 @@ class DocumentService:
         self.style_cell_center = ParagraphStyle('CellCenter', parent=self.style_cell, alignment=TA_CENTER)
         self.style_cell_danger = ParagraphStyle('CellDanger', parent=self.style_cell_center, textColor=self.config['color_alert'], fontName='Helvetica-Bold')
         self.style_stats = ParagraphStyle('Stats', parent=styles['Normal'], fontSize=10, alignment=TA_RIGHT, textColor=c_prim)
+        self.inventory_headers = [
+            Paragraph(label, self.style_header)
+            for label in ('Désignation', 'Catégorie', 'Emplacement', 'Qté', 'CMR')
+        ]
 
     def _generate_filename(self, etablissement_id: int, name: str, prefix: str = "Inventaire") -> str:
         safe_name = re.sub(r'[^\w\s-]', '', str(name)).strip().replace(' ', '_')
@@ -100,9 +111,28 @@ class DocumentService:
         unique_id = uuid.uuid4().hex[:8]
         return f"{prefix}_{etablissement_id}_{safe_name}_{timestamp}_{unique_id}.pdf"
 
-    def generate_inventory_pdf(self, etablissement_name: str, etablissement_id: int, objets: List['Objet'], 
+    @staticmethod
+    def _serialize_objet(o: Any) -> Dict[str, Any]:
+        """ORM ou dict -> dict simple (picklable, détaché de la session)."""
+        if isinstance(o, dict):
+            return o
+        cat = getattr(o, 'categorie', None)
+        arm = getattr(o, 'armoire', None)
+        return {
+            'nom': getattr(o, 'nom', 'Inconnu'),
+            'categorie': cat.nom if cat else "-",
+            'armoire': arm.nom if arm else "-",
+            'quantite': getattr(o, 'quantite_physique', 0),
+            'is_cmr': bool(getattr(o, 'is_cmr', False)),
+        }
+
+    def generate_inventory_pdf(self, etablissement_name: str, etablissement_id: int, objets: List[Any], 
                              doc_title: str = "INVENTAIRE RÉGLEMENTAIRE", 
                              filename_prefix: str = "Inventaire") -> Dict[str, Any]:
+        """
+        `objets` : entités Objet (catégorie/armoire chargées) ou dict déjà sérialisés.
+        Le rendu ReportLab s'exécute dans le pool de rendu, hors du processus web.
+        """
         
         # Point 6 : Validation ID
         if not isinstance(etablissement_id, int) or etablissement_id <= 0:
@@ -114,6 +144,8 @@ class DocumentService:
         if len(objets) > self.config['max_items']:
             raise DocumentServiceError(f"Trop d'objets ({len(objets)}). Limite : {self.config['max_items']}.")
 
+        rows = [self._serialize_objet(o) for o in objets]
+
         try:
             # Point 7 : TOCTOU mitigation
             os.makedirs(self.archive_folder, exist_ok=True)
@@ -122,85 +154,12 @@ class DocumentService:
             filename = self._generate_filename(etablissement_id, etablissement_name, prefix=filename_prefix)
             full_path = os.path.join(self.archive_folder, filename)
 
-            # Configuration Doc
-            margin = self.config['margins']
-            doc = SimpleDocTemplate(
-                full_path,
-                pagesize=landscape(A4),
-                rightMargin=margin, leftMargin=margin,
-                topMargin=margin, bottomMargin=margin,
-                title=f"{filename_prefix} - {etablissement_name}",
-                author="LabFlow",
-                creator="LabFlow System"
-            )
-
-            elements = []
-
-            # En-tête
-            logo = LogoGraphique(width=40, height=40, primary_color=self.config['color_primary'])
-            titre_bloc = [
-                Paragraph(doc_title, self.style_titre), # Titre personnalisé
-                Paragraph(f"Arrêté au {date.today().strftime('%d/%m/%Y')} - {escape(etablissement_name)}", self.style_sous_titre)
-            ]
-            header_table = Table([[logo, titre_bloc]], colWidths=[1.5*cm, 20*cm])
-            header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
-            elements.append(header_table)
-            elements.append(Spacer(1, 0.8*cm))
-
-            # Données
-            headers = [
-                Paragraph('Désignation', self.style_header),
-                Paragraph('Catégorie', self.style_header),
-                Paragraph('Emplacement', self.style_header),
-                Paragraph('Qté', self.style_header),
-                Paragraph('CMR', self.style_header)
-            ]
-            
-            table_data = [headers]
-            total_cmr = 0
-
-            for o in objets:
-                is_cmr = getattr(o, 'is_cmr', False)
-                nom = getattr(o, 'nom', 'Inconnu')
-                qte = getattr(o, 'quantite_physique', 0)
-                cat = getattr(o, 'categorie', None)
-                arm = getattr(o, 'armoire', None)
-
-                if is_cmr:
-                    total_cmr += 1
-                    cmr_display = Paragraph("OUI", self.style_cell_danger)
-                else:
-                    cmr_display = Paragraph("-", self.style_cell_center)
-
-                table_data.append([
-                    Paragraph(escape(nom), self.style_cell),
-                    Paragraph(escape(cat.nom if cat else "-"), self.style_cell),
-                    Paragraph(escape(arm.nom if arm else "-"), self.style_cell),
-                    Paragraph(str(qte), self.style_cell_center),
-                    cmr_display
-                ])
-
-            # Tableau
-            t = Table(table_data, colWidths=self.config['col_widths'], repeatRows=1)
-            t.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), self.config['color_primary']),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('TOPPADDING', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, self.config['color_secondary']]),
-                ('GRID', (0, 0), (-1, -1), 0.5, self.config['color_border']),
-                ('LINEBELOW', (0, 0), (-1, 0), 2, self.config['color_primary']),
-            ]))
-            elements.append(t)
-
-            # Pied de page
-            elements.append(Spacer(1, 1*cm))
-            stats_text = f"<b>Total références :</b> {len(objets)}  |  <b>Dont produits CMR :</b> {total_cmr}"
-            elements.append(Paragraph(stats_text, self.style_stats))
-
-            # Écriture Disque
+            # Écriture Disque (processus de rendu)
             try:
-                doc.build(elements)
+                render_pdf_to_file(_render_inventory, full_path, self.upload_root, self.config,
+                                   etablissement_name, rows, doc_title, filename_prefix)
+            except PdfRenderError as e:
+                raise DocumentServiceError(str(e)) from e
             except Exception as e:
                 raise DocumentServiceError(f"Erreur ReportLab lors de la génération: {e}") from e
             
@@ -211,13 +170,108 @@ class DocumentService:
             return {
                 "filename": filename,
                 "relative_path": relative_path,
-                "nb_objets": len(objets),
+                "nb_objets": len(rows),
                 "titre": f"{filename_prefix} {date.today().year} (v.{datetime.now().strftime('%H%M')})"
             }
 
+        except DocumentServiceError:
+            raise
         except (OSError, IOError) as e:
             logger.error(f"Erreur I/O PDF: {e}", exc_info=True)
             raise FileSystemError(f"Erreur d'écriture disque: {e.strerror}") from e
         except Exception as e:
             logger.error(f"Erreur inattendue PDF: {e}", exc_info=True)
-            raise DocumentServiceError(f"Erreur technique inattendue: {type(e).__name__}") from e
\ No newline at end of file
+            raise DocumentServiceError(f"Erreur technique inattendue: {type(e).__name__}") from e
+
+    def _build_inventory(self, output, etablissement_name: str, rows: List[Dict[str, Any]],
+                         doc_title: str, filename_prefix: str) -> None:
+        """Construction ReportLab (CPU) à partir de lignes sérialisées."""
+        # Configuration Doc
+        margin = self.config['margins']
+        doc = SimpleDocTemplate(
+            output,
+            pagesize=landscape(A4),
+            rightMargin=margin, leftMargin=margin,
+            topMargin=margin, bottomMargin=margin,
+            title=f"{filename_prefix} - {etablissement_name}",
+            author="LabFlow",
+            creator="LabFlow System"
+        )
+
+        elements = []
+
+        # En-tête
+        logo = LogoGraphique(width=40, height=40, primary_color=self.config['color_primary'])
+        titre_bloc = [
+            Paragraph(doc_title, self.style_titre), # Titre personnalisé
+            Paragraph(f"Arrêté au {date.today().strftime('%d/%m/%Y')} - {escape(etablissement_name)}", self.style_sous_titre)
+        ]
+        header_table = Table([[logo, titre_bloc]], colWidths=[1.5*cm, 20*cm])
+        header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
+        elements.append(header_table)
+        elements.append(Spacer(1, 0.8*cm))
+
+        # Données : tableaux de `chunk_rows` lignes (le coût de mise en page d'une Table
+        # ReportLab croît plus vite que linéairement avec son nombre de lignes)
+        total_cmr = 0
+        chunk_size = self.config['chunk_rows']
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            total_cmr += sum(1 for row in chunk if row['is_cmr'])
+            elements.append(self._build_inventory_chunk(chunk))
+
+        # Pied de page
+        elements.append(Spacer(1, 1*cm))
+        stats_text = f"<b>Total références :</b> {len(rows)}  |  <b>Dont produits CMR :</b> {total_cmr}"
+        elements.append(Paragraph(stats_text, self.style_stats))
+
+        doc.build(elements)
+
+    def _cell(self, text: str, width: float):
+        """Chaîne brute si le texte tient sur une ligne, Paragraph (retour à la ligne) sinon."""
+        text = str(text)
+        if stringWidth(text, CELL_FONT, CELL_FONT_SIZE) <= width - 2 * CELL_PADDING:
+            return text
+        return Paragraph(escape(text), self.style_cell)
+
+    def _build_inventory_chunk(self, chunk: List[Dict[str, Any]]) -> Table:
+        """Une Table autonome (en-tête répété) ; les styles de cellule passent par TableStyle."""
+        widths = self.config['col_widths']
+        table_data = [self.inventory_headers]
+        cmr_rows = []
+
+        for i, row in enumerate(chunk, start=1):
+            if row['is_cmr']:
+                cmr_rows.append(i)
+            table_data.append([
+                self._cell(row['nom'], widths[0]),
+                self._cell(row['categorie'], widths[1]),
+                self._cell(row['armoire'], widths[2]),
+                str(row['quantite']),
+                "OUI" if row['is_cmr'] else "-"
+            ])
+
+        commands = [
+            ('BACKGROUND', (0, 0), (-1, 0), self.config['color_primary']),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('TOPPADDING', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+            ('FONT', (0, 1), (-1, -1), CELL_FONT, CELL_FONT_SIZE),
+            ('ALIGN', (3, 1), (4, -1), 'CENTER'),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, self.config['color_secondary']]),
+            ('GRID', (0, 0), (-1, -1), 0.5, self.config['color_border']),
+            ('LINEBELOW', (0, 0), (-1, 0), 2, self.config['color_primary']),
+        ]
+        for i in cmr_rows:
+            commands.append(('TEXTCOLOR', (4, i), (4, i), self.config['color_alert']))
+            commands.append(('FONT', (4, i), (4, i), 'Helvetica-Bold', CELL_FONT_SIZE))
+
+        t = Table(table_data, colWidths=widths, repeatRows=1)
+        t.setStyle(TableStyle(commands))
+        return t
+
+
+def _render_inventory(upload_root: str, config: DocumentConfig, etablissement_name: str,
+                      rows: List[Dict[str, Any]], doc_title: str, filename_prefix: str, output) -> None:
+    """Point d'entrée du pool de rendu (fonction de module, arguments picklables)."""
+    DocumentService(upload_root, config)._build_inventory(output, etablissement_name, rows, doc_title, filename_prefix)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import date
+from typing import Any, Callable, Dict, Optional
+
+from flask import current_app
+
+from services.version_service import get_versions, DOMAINE_INVENTAIRE, DOMAINE_THEME
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION (surchargée par app.config) ---
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024   # Taille totale du cache disque (EXPORT_CACHE_MAX_BYTES)
+
+# Domaines de version dont dépend le contenu de chaque type d'export
+_DOMAINES = {
+    'inventaire': (DOMAINE_INVENTAIRE, DOMAINE_THEME),
+}
+
+_evict_lock = threading.Lock()
+
+
+class ExportCacheError(Exception):
+    """Écriture impossible dans le cache des exports."""
+    pass
+
+
+def _cache_dir() -> str:
+    path = current_app.config.get('EXPORT_CACHE_DIR') or os.path.join(current_app.instance_path, 'export_cache')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def is_enabled() -> bool:
+    return current_app.config.get('EXPORT_CACHE_ENABLED', True)
+
+
+def cache_key(etablissement_id: int, type_export: str, format_type: str, filtres: Dict[str, Any],
+              titre: str) -> str:
+    """
+    Clé déterministe : établissement, type, format, filtres et versions des données.
+    Toute écriture sur les domaines concernés change la clé : pas d'invalidation à gérer,
+    les anciennes entrées vieillissent et sortent par l'éviction LRU. Le titre (nom de
+    l'établissement, qu'aucune version ne suit) et le jour de génération, imprimés dans
+    l'en-tête, en font partie. Les versions sont des horodatages jamais réutilisés : une
+    base recréée ne peut pas retomber sur un fichier resté sur le disque.
+    """
+    versions = get_versions(etablissement_id)
+    domaines = _DOMAINES.get(type_export, (DOMAINE_INVENTAIRE,))
+    payload = [etablissement_id, type_export, format_type, titre, date.today().isoformat(),
+               sorted((k, v) for k, v in filtres.items() if v is not None),
+               [versions.get(d, 0) for d in domaines]]
+    return hashlib.sha256(json.dumps(payload, default=str).encode('utf-8')).hexdigest()
+
+
+def _path(key: str, ext: str) -> str:
+    return os.path.join(_cache_dir(), f"{key}.{ext}")
+
+
+def get(key: str, ext: str) -> Optional[str]:
+    """Chemin du fichier en cache, ou None. Un accès rafraîchit son rang LRU (mtime)."""
+    path = _path(key, ext)
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    return path
+
+
+def store(key: str, ext: str, writer: Callable[[str], Any]) -> str:
+    """
+    `writer(chemin)` écrit l'export directement dans un fichier temporaire du cache,
+    publié par renommage atomique (un lecteur concurrent ne voit jamais de fichier partiel).
+    """
+    path = _path(key, ext)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        writer(tmp)
+        os.replace(tmp, path)
+    except OSError as e:
+        raise ExportCacheError(f"Mise en cache impossible : {e}")
+    finally:
+        _remove(tmp)
+    evict()
+    return path
+
+
+def put_file(key: str, ext: str, src_path: str) -> str:
+    """Copie un export déjà généré (worker d'arrière-plan) dans le cache."""
+    return store(key, ext, lambda tmp: shutil.copyfile(src_path, tmp))
+
+
+def put_bytes(key: str, ext: str, data: bytes) -> str:
+    def _write(tmp):
+        with open(tmp, 'wb') as f:
+            f.write(data)
+    return store(key, ext, _write)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def evict(max_bytes: Optional[int] = None) -> int:
+    """Supprime les fichiers les moins récemment servis jusqu'à repasser sous la limite."""
+    if max_bytes is None:
+        max_bytes = current_app.config.get('EXPORT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+    with _evict_lock:
+        entries = []
+        total = 0
+        with os.scandir(_cache_dir()) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            _remove(path)
+            total -= size
+            removed += 1
+
+    if removed:
+        logger.info(f"Cache exports : {removed} fichier(s) évincé(s)")
+    return removed
@@ -0,0 +1,418 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from db import db, ExportJob
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION (surchargée par app.config) ---
+DEFAULT_WORKERS = 2                   # Processus de rendu simultanés (par process web)
+DEFAULT_TTL_HOURS = 24                # Durée de conservation des fichiers générés
+DEFAULT_STALE_MINUTES = 30            # Job 'en_cours' sans fin au-delà : worker considéré mort
+PROGRESS_INTERVAL = 1.0               # Secondes minimum entre deux écritures de progression
+CLAIM_CANDIDATES = 5                  # Jobs examinés par tentative de réservation
+STATUTS_MEMORISES = 1000              # Derniers statuts lus, servis si la base est verrouillée
+
+STATUT_EN_ATTENTE = 'en_attente'
+STATUT_EN_COURS = 'en_cours'
+STATUT_TERMINE = 'termine'
+STATUT_ERREUR = 'erreur'
+
+
+class ExportJobError(Exception):
+    """Erreur métier lors du traitement d'un export en arrière-plan."""
+    pass
+
+
+# ============================================================
+# REGISTRE DES GÉNÉRATEURS
+# ============================================================
+_HANDLERS: Dict[str, Callable[['JobContext'], Dict[str, str]]] = {}
+
+
+def export_job_handler(type_export: str):
+    """
+    Déclare la fonction de rendu d'un type d'export.
+    Le handler reçoit un JobContext, écrit le fichier dans `ctx.output_path`
+    et renvoie {'nom_fichier': ..., 'mimetype': ...}.
+    """
+    def decorator(func):
+        _HANDLERS[type_export] = func
+        return func
+    return decorator
+
+
+class JobContext:
+    """Données sérialisables d'un job + suivi de progression (exécuté dans le worker)."""
+
+    def __init__(self, job: ExportJob, output_path: str, persist_progress: bool = True):
+        self.job_id = job.id
+        self.etablissement_id = job.etablissement_id
+        self.utilisateur_id = job.utilisateur_id
+        self.format = job.format
+        self.parametres = dict(job.parametres or {})
+        self.total = job.total
+        self.output_path = output_path
+        self._persist = persist_progress
+        self._last_write = 0.0
+        self._last_value = -1
+
+    def progress(self, done: int, total: Optional[int] = None) -> None:
+        """Publie l'avancement (plafonné à 99 : 100 est réservé à la fin du rendu)."""
+        total = total or self.total
+        if not total:
+            return
+        value = min(99, int(done * 100 / total))
+        now = time.monotonic()
+        if value == self._last_value or now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write, self._last_value = now, value
+        if self._persist:
+            # Connexion dédiée : un commit sur la session fermerait le curseur serveur en cours de lecture
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(update(ExportJob).where(ExportJob.id == self.job_id).values(progression=value))
+            except SQLAlchemyError as e:
+                # SQLite verrouille la base pendant la lecture : la progression est facultative
+                logger.debug(f"Progression non enregistrée pour {self.job_id} : {e}")
+                self._persist = False
+
+    def track(self, rows: Iterable[Any]) -> Iterator[Any]:
+        """Itère `rows` en publiant la progression au fil de l'eau."""
+        done = 0
+        for row in rows:
+            yield row
+            done += 1
+            self.progress(done)
+
+
+# ============================================================
+# FILE D'ATTENTE (TABLE export_jobs)
+# ============================================================
+def _exports_dir() -> str:
+    path = current_app.config.get('EXPORT_JOBS_DIR') or os.path.join(current_app.instance_path, 'exports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _ttl() -> timedelta:
+    return timedelta(hours=current_app.config.get('EXPORT_JOBS_TTL_HOURS', DEFAULT_TTL_HOURS))
+
+
+def enqueue(type_export: str, format_type: str, etablissement_id: int, utilisateur_id: Optional[int],
+            parametres: Dict[str, Any], total: Optional[int] = None) -> ExportJob:
+    """Enregistre un job (paramètres JSON uniquement) et réveille un worker."""
+    if type_export not in _HANDLERS:
+        raise ExportJobError(f"Type d'export inconnu : {type_export}")
+
+    job = ExportJob(
+        etablissement_id=etablissement_id,
+        utilisateur_id=utilisateur_id,
+        type_export=type_export,
+        format=format_type,
+        parametres=parametres,
+        total=total,
+        statut=STATUT_EN_ATTENTE
+    )
+    db.session.add(job)
+    db.session.commit()
+    _memoriser(job)
+
+    _dispatch()
+    return job
+
+
+def get_job(job_id: str, etablissement_id: int) -> Optional[ExportJob]:
+    """Lecture cloisonnée par établissement (pas d'accès inter-tenant par id)."""
+    job = db.session.get(ExportJob, job_id)
+    if not job or job.etablissement_id != etablissement_id:
+        return None
+    return job
+
+
+def job_file_path(job: ExportJob) -> Optional[str]:
+    if not job.fichier:
+        return None
+    return os.path.join(_exports_dir(), job.fichier)
+
+
+def is_downloadable(job: ExportJob) -> bool:
+    if job.statut != STATUT_TERMINE or not job.fichier:
+        return False
+    if job.date_expiration and job.date_expiration < datetime.now():
+        return False
+    path = job_file_path(job)
+    return bool(path) and os.path.exists(path)
+
+
+def jobs_non_aboutis(etablissement_id: int, type_export: str, limite: int = 5) -> List[ExportJob]:
+    """Jobs d'un type en attente, en cours ou en échec (non expirés), les plus récents d'abord."""
+    return db.session.execute(
+        select(ExportJob)
+        .where(ExportJob.etablissement_id == etablissement_id, ExportJob.type_export == type_export,
+               ExportJob.statut != STATUT_TERMINE,
+               (ExportJob.date_expiration.is_(None)) | (ExportJob.date_expiration > datetime.now()))
+        .order_by(ExportJob.date_creation.desc())
+        .limit(limite)
+    ).scalars().all()
+
+
+def job_to_dict(job: ExportJob) -> Dict[str, Any]:
+    return {
+        'id': job.id,
+        'type': job.type_export,
+        'format': job.format,
+        'statut': job.statut,
+        'progression': job.progression,
+        'total': job.total,
+        'message': job.message,
+        'nom_fichier': job.nom_fichier,
+        'date_creation': job.date_creation.isoformat() if job.date_creation else None,
+        'date_expiration': job.date_expiration.isoformat() if job.date_expiration else None,
+    }
+
+
+# Dernier statut lu par ce processus : {job_id: (etablissement_id, job_to_dict)}
+_statuts: 'OrderedDict[str, Tuple[int, Dict[str, Any]]]' = OrderedDict()
+_statuts_lock = threading.Lock()
+
+
+def _memoriser(job: ExportJob) -> Dict[str, Any]:
+    data = job_to_dict(job)
+    data['telechargeable'] = is_downloadable(job)
+    with _statuts_lock:
+        _statuts[job.id] = (job.etablissement_id, data)
+        _statuts.move_to_end(job.id)
+        while len(_statuts) > STATUTS_MEMORISES:
+            _statuts.popitem(last=False)
+    return dict(data)
+
+
+def lire_statut(job_id: str, etablissement_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Statut d'un job pour le suivi (job_to_dict + 'telechargeable'), None si introuvable.
+    SQLite verrouille la base pendant qu'un worker écrit : le dernier statut lu par ce processus
+    est alors renvoyé (marqué 'perime') ; OperationalError s'il n'en a jamais lu.
+    """
+    try:
+        job = get_job(job_id, etablissement_id)
+    except OperationalError:
+        db.session.rollback()
+        with _statuts_lock:
+            connu = _statuts.get(job_id)
+        if connu is None or connu[0] != etablissement_id:
+            raise
+        return dict(connu[1], perime=True)
+    if not job:
+        return None
+    return _memoriser(job)
+
+
+def _claim_next() -> Optional[str]:
+    """
+    Réserve le plus ancien job en attente (compare-and-swap sur le statut).
+    Portable SQLite/PostgreSQL : seul l'UPDATE qui voit encore 'en_attente' gagne.
+    """
+    candidats = db.session.execute(
+        select(ExportJob.id)
+        .where(ExportJob.statut == STATUT_EN_ATTENTE)
+        .order_by(ExportJob.date_creation)
+        .limit(CLAIM_CANDIDATES)
+    ).scalars().all()
+
+    for job_id in candidats:
+        result = db.session.execute(
+            update(ExportJob)
+            .where(ExportJob.id == job_id, ExportJob.statut == STATUT_EN_ATTENTE)
+            .values(statut=STATUT_EN_COURS, date_debut=datetime.now(), worker_pid=os.getpid())
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return job_id
+    return None
+
+
+def run_job(job_id: str, persist_progress: bool = True) -> None:
+    """Exécute un job réservé et enregistre son résultat (fichier ou erreur)."""
+    job = db.session.get(ExportJob, job_id)
+    if not job:
+        return
+
+    ext = {'excel': 'xlsx', 'pdf': 'pdf', 'csv': 'csv', 'json': 'json'}.get(job.format, 'bin')
+    fichier = f"{job.id}.{ext}"
+    output_path = os.path.join(_exports_dir(), fichier)
+    ctx = JobContext(job, output_path, persist_progress=persist_progress)
+
+    try:
+        result = _HANDLERS[job.type_export](ctx)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Export {job_id} ({job.type_export}/{job.format}) en échec : {e}", exc_info=True)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        job = db.session.get(ExportJob, job_id)
+        job.statut = STATUT_ERREUR
+        job.message = str(e)[:255] if isinstance(e, ExportJobError) else "Erreur technique lors de la génération."
+        job.date_fin = datetime.now()
+        job.date_expiration = job.date_fin + _ttl()
+        db.session.commit()
+        return
+
+    job = db.session.get(ExportJob, job_id)
+    job.statut = STATUT_TERMINE
+    job.progression = 100
+    job.fichier = fichier
+    job.nom_fichier = result.get('nom_fichier') or fichier
+    job.mimetype = result.get('mimetype')
+    job.message = result.get('message')
+    job.date_fin = datetime.now()
+    job.date_expiration = job.date_fin + _ttl()
+    db.session.commit()
+    logger.info(f"Export {job_id} terminé en {(job.date_fin - job.date_debut).total_seconds():.1f}s")
+
+
+def process_next(persist_progress: bool = True) -> bool:
+    """Réserve et traite un job. Renvoie False si la file est vide."""
+    job_id = _claim_next()
+    if not job_id:
+        return False
+    try:
+        run_job(job_id, persist_progress=persist_progress)
+    finally:
+        db.session.remove()
+    return True
+
+
+def purge_expired() -> int:
+    """Supprime les jobs expirés (et leurs fichiers) ; clôt les jobs orphelins d'un worker mort."""
+    now = datetime.now()
+    stale = now - timedelta(minutes=current_app.config.get('EXPORT_JOBS_STALE_MINUTES', DEFAULT_STALE_MINUTES))
+
+    db.session.execute(
+        update(ExportJob)
+        .where(ExportJob.statut == STATUT_EN_COURS, ExportJob.date_debut < stale)
+        .values(statut=STATUT_ERREUR, message="Génération interrompue.", date_fin=now, date_expiration=now + _ttl())
+    )
+
+    expired = db.session.execute(
+        select(ExportJob).where(ExportJob.date_expiration < now)
+    ).scalars().all()
+
+    for job in expired:
+        path = job_file_path(job)
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Suppression impossible de {path} : {e}")
+                continue
+        db.session.delete(job)
+
+    db.session.commit()
+    if expired:
+        logger.info(f"{len(expired)} export(s) expiré(s) purgé(s)")
+    return len(expired)
+
+
+# ============================================================
+# POOL DE WORKERS (SANS BROKER EXTERNE)
+# ============================================================
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_worker_app = None
+
+
+def _init_worker() -> None:
+    """Initialisation d'un processus du pool : application et contexte propres."""
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app()
+    # Déjà hors du processus web : le rendu PDF se fait sur place, sans second pool
+    _worker_app.config['PDF_RENDER_INLINE'] = True
+    _worker_app.app_context().push()
+
+
+def _worker_drain() -> int:
+    """Tâche soumise au pool : vide la file (jobs restés en attente inclus)."""
+    traites = 0
+    while process_next():
+        traites += 1
+    try:
+        purge_expired()
+    except Exception as e:
+        logger.warning(f"Purge des exports impossible : {e}")
+        db.session.rollback()
+    return traites
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Pool réutilisé, recréé si le processus web a été forké (gunicorn)."""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config.get('EXPORT_WORKERS', DEFAULT_WORKERS),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _dispatch() -> None:
+    if current_app.config.get('EXPORT_JOBS_INLINE'):
+        # Tests / debug : traitement synchrone dans la requête
+        job_id = _claim_next()
+        if job_id:
+            run_job(job_id, persist_progress=False)
+        return
+    try:
+        _get_executor().submit(_worker_drain)
+    except Exception as e:
+        # Le job reste en attente : il sera repris au prochain dispatch ou par `flask exports worker`
+        logger.error(f"Pool d'export indisponible : {e}")
+
+
+@atexit.register
+def _shutdown_executor() -> None:
+    if _executor is not None and _executor_pid == os.getpid():
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ============================================================
+# CLI : flask exports worker | flask exports purge
+# ============================================================
+exports_cli = AppGroup('exports', help="File d'attente des exports en arrière-plan.")
+
+
+@exports_cli.command('worker')
+@click.option('--interval', default=2.0, show_default=True, help="Secondes entre deux scrutations de la file.")
+def worker_command(interval):
+    """Worker autonome (process dédié, ex. ligne `worker:` du Procfile)."""
+    click.echo(f"Worker d'export démarré (pid {os.getpid()})")
+    last_purge = 0.0
+    while True:
+        if not process_next():
+            time.sleep(interval)
+        if time.monotonic() - last_purge > 300:
+            purge_expired()
+            last_purge = time.monotonic()
+
+
+@exports_cli.command('purge')
+def purge_command():
+    """Supprime les exports expirés."""
+    click.echo(f"{purge_expired()} export(s) supprimé(s).")
@@ -0,0 +1,164 @@
+import csv
+import io
+import logging
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from flask import Response, send_file, stream_with_context
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from sqlalchemy import func, select
+
+from db import db
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+EXPORT_BATCH_SIZE = 1000               # Lignes remontées par aller-retour curseur
+CSV_FLUSH_SIZE = 64 * 1024             # Taille d'un chunk HTTP (CSV)
+SPOOL_MAX_SIZE = 8 * 1024 * 1024       # Au-delà, le fichier temporaire bascule sur disque
+CSV_DELIMITER = ';'                    # Excel FR attend le point-virgule
+
+COLOR_PRIMARY = "1F3B73"
+COLOR_ALERT = "DC3545"
+COLOR_BORDER = "D9D9D9"
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+
+
+def count_rows(stmt) -> int:
+    """Compte les lignes d'un SELECT sans les charger (tri retiré)."""
+    sub = stmt.order_by(None).subquery()
+    return db.session.execute(select(func.count()).select_from(sub)).scalar() or 0
+
+
+def iter_rows(stmt, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Any]:
+    """
+    Itère un SELECT par lots via curseur serveur (yield_per).
+    La mémoire reste bornée à `batch_size` lignes quel que soit le volume.
+    """
+    result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+
+def stream_csv(headers: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[bytes]:
+    """Sérialise les lignes en CSV par chunks (BOM UTF-8 pour Excel)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=CSV_DELIMITER)
+
+    yield '﻿'.encode('utf-8')
+    writer.writerow(headers)
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_FLUSH_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def csv_response(headers: Sequence[str], rows: Iterable[Sequence[Any]], filename: str) -> Response:
+    """Réponse HTTP chunked : le CSV est produit pendant l'envoi."""
+    return Response(
+        stream_with_context(stream_csv(headers, rows)),
+        mimetype=CSV_MIMETYPE,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+def workbook_response(wb, filename: str) -> Response:
+    """
+    Sauvegarde un classeur (write_only de préférence) dans un fichier temporaire
+    et l'envoie par blocs via send_file, sans copie intégrale en RAM.
+    """
+    tmp = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        wb.save(tmp)
+        tmp.seek(0)
+    except Exception:
+        tmp.close()
+        raise
+    return send_file(tmp, as_attachment=True, download_name=filename, mimetype=XLSX_MIMETYPE)
+
+
+
+def _build_named_styles() -> List[NamedStyle]:
+    """Palette commune des exports Excel (une instance par classeur)."""
+    side = Side(style='thin', color=COLOR_BORDER)
+    border_thin = Border(left=side, right=side, bottom=side)
+    font_data = Font(name='Segoe UI', size=10)
+    center = Alignment(horizontal="center", vertical="center")
+
+    return [
+        NamedStyle('lf_titre', font=Font(name='Segoe UI', size=16, bold=True, color=COLOR_PRIMARY),
+                   alignment=Alignment(horizontal="left", vertical="center")),
+        NamedStyle('lf_meta', font=Font(name='Segoe UI', size=10, italic=True, color="666666"),
+                   alignment=Alignment(horizontal="left", vertical="center", wrap_text=True)),
+        NamedStyle('lf_header', font=Font(name='Segoe UI', size=11, bold=True, color="FFFFFF"),
+                   fill=PatternFill(start_color=COLOR_PRIMARY, end_color=COLOR_PRIMARY, fill_type="solid"),
+                   alignment=center, border=border_thin),
+        NamedStyle('lf_cell', font=font_data, border=border_thin,
+                   alignment=Alignment(vertical="center")),
+        NamedStyle('lf_cell_wrap', font=font_data, border=border_thin,
+                   alignment=Alignment(vertical="top", wrap_text=True)),
+        NamedStyle('lf_cell_center', font=font_data, border=border_thin, alignment=center),
+        NamedStyle('lf_cell_alert', font=Font(name='Segoe UI', size=10, bold=True, color=COLOR_ALERT),
+                   border=border_thin, alignment=center),
+        NamedStyle('lf_money', font=font_data, border=border_thin, number_format='#,##0.00 €',
+                   alignment=Alignment(horizontal="right", vertical="center")),
+        NamedStyle('lf_total_label', font=Font(name='Segoe UI', size=10, bold=True),
+                   alignment=Alignment(horizontal="right", vertical="center")),
+        NamedStyle('lf_total_money', font=Font(name='Segoe UI', size=12, bold=True, color=COLOR_PRIMARY),
+                   number_format='#,##0.00 €'),
+    ]
+
+
+class StreamingWorkbook:
+    """
+    Backend Excel à mémoire constante (openpyxl write_only).
+    Les styles nommés sont enregistrés une fois par classeur : chaque cellule
+    ne porte qu'une référence de style, sans objet Font/Border dupliqué.
+    Contrainte write_only : largeurs, hauteurs, fusions et volets figés
+    doivent être déclarés avant la première ligne.
+    """
+
+    def __init__(self, title: str):
+        self.wb = Workbook(write_only=True)
+        for style in _build_named_styles():
+            self.wb.add_named_style(style)
+        self.ws = self.wb.create_sheet(title)
+        self.rows_written = 0
+
+    def cell(self, value: Any, style: Optional[str] = None) -> WriteOnlyCell:
+        c = WriteOnlyCell(self.ws, value=value)
+        if style:
+            c.style = style
+        return c
+
+    def append(self, values: Sequence[Any], styles: Optional[Sequence[Optional[str]]] = None) -> None:
+        """Écrit une ligne ; `styles` donne le style nommé de chaque colonne."""
+        if styles is None:
+            self.ws.append(list(values))
+        else:
+            self.ws.append([self.cell(v, st) for v, st in zip(values, styles)])
+        self.rows_written += 1
+
+    def set_widths(self, widths: Dict[str, float]) -> None:
+        for col, width in widths.items():
+            self.ws.column_dimensions[col].width = width
+
+    def save(self, output) -> None:
+        """Écrit le classeur dans un chemin ou un fichier (exports en arrière-plan)."""
+        self.wb.save(output)
+
+    def response(self, filename: str) -> Response:
+        return workbook_response(self.wb, filename)
@@ -0,0 +1,371 @@
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Iterable, List, Optional, Tuple
+
+import click
+import pillow_heif
+from flask import current_app, url_for
+from flask.cli import AppGroup
+from PIL import Image, ImageCms, ImageOps, UnidentifiedImageError
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from services.upload_service import chemin_blob, est_blob, hacher, liberer, toucher
+
+pillow_heif.register_heif_opener()
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION (surchargée par app.config) ---
+DEFAULT_WORKERS = 2                     # Processus de traitement d'images (IMAGE_WORKERS)
+FORMATS_ACCEPTES = {'JPEG', 'PNG', 'WEBP', 'HEIF', 'HEIC', 'GIF'}
+MAX_SOURCE_PIXELS = 50_000_000          # Au-delà : refus (bombe de décompression)
+QUALITE_JPEG = 80
+QUALITE_WEBP = 78
+
+# Variantes générées (plus grand côté, en pixels), de la plus grande à la plus petite.
+# 'original' est l'image plafonnée : son JPEG est le chemin enregistré en base.
+VARIANTES: Tuple[Tuple[str, int], ...] = (('original', 1920), ('medium', 512), ('thumb', 96))
+TAILLES = tuple(nom for nom, _ in VARIANTES)
+FORMATS = ('webp', 'jpg')
+
+
+class ImageServiceError(Exception):
+    """Fichier image refusé (format, taille, contenu illisible)."""
+    pass
+
+
+# ============================================================
+# NOMMAGE DES VARIANTES
+# ============================================================
+
+def chemin_variante(chemin: str, taille: str = 'original', fmt: str = 'jpg') -> str:
+    """'uploads/cas/ab/cd/<sha>.jpg' -> 'uploads/cas/ab/cd/<sha>_thumb.webp' (même dossier, même racine)."""
+    racine = chemin.rsplit('.', 1)[0]
+    suffixe = '' if taille == 'original' else f'_{taille}'
+    return f"{racine}{suffixe}.{fmt}"
+
+
+def variantes(chemin: str) -> List[str]:
+    """Toutes les variantes possibles d'une image, hors le chemin lui-même."""
+    return [v for v in (chemin_variante(chemin, t, f) for t in TAILLES for f in FORMATS) if v != chemin]
+
+
+def _static_path(relative_path: str) -> str:
+    return os.path.join(current_app.root_path, 'static', relative_path)
+
+
+# ============================================================
+# TRAITEMENT (EXÉCUTÉ DANS LE PROCESSUS DE TRAITEMENT)
+# ============================================================
+# Fonctions de module sans application ni base : chemins absolus en entrée.
+
+def _vers_srgb(img: Image.Image) -> Image.Image:
+    """Applique le profil ICC (photos P3 des téléphones) avant de le supprimer avec les métadonnées."""
+    icc = img.info.get('icc_profile')
+    if not icc:
+        return img
+    try:
+        source = ImageCms.ImageCmsProfile(BytesIO(icc))
+        mode = 'RGBA' if 'A' in img.getbands() else 'RGB'
+        return ImageCms.profileToProfile(img, source, ImageCms.createProfile('sRGB'), outputMode=mode)
+    except (ImageCms.PyCMSError, OSError, ValueError):
+        return img
+
+
+def _rgb(img: Image.Image) -> Image.Image:
+    """RGB sans transparence (fond blanc) : un seul mode pour JPEG et WebP."""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        fond = Image.new('RGB', img.size, (255, 255, 255))
+        fond.paste(img, mask=img.getchannel('A'))
+        return fond
+    return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+def _ecrire(img: Image.Image, destination: str, fmt: str) -> None:
+    """Écriture atomique : le fichier n'apparaît qu'une fois complet."""
+    tmp = f"{destination}.{uuid.uuid4().hex}.tmp"
+    if fmt == 'webp':
+        img.save(tmp, 'WEBP', quality=QUALITE_WEBP, method=4)
+    else:
+        img.save(tmp, 'JPEG', quality=QUALITE_JPEG, optimize=True, progressive=True)
+    os.replace(tmp, destination)
+
+
+def _decoder(source) -> Image.Image:
+    """
+    Décode `source` (chemin ou flux, HEIC compris) une seule fois, redresse selon l'EXIF,
+    convertit en sRGB et plafonne à la taille de l'original, sans aucune métadonnée (EXIF, GPS, ICC).
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    cote = VARIANTES[0][1]
+    with Image.open(source) as img:
+        img.draft('RGB', (cote, cote))   # JPEG : décodage directement réduit
+        img = ImageOps.exif_transpose(img)
+        courante = _rgb(_vers_srgb(img))
+    # Dictionnaire info vidé : ni EXIF ni profil ICC ne sont recopiés dans les fichiers produits
+    courante.info = {}
+    if courante.width > cote or courante.height > cote:
+        courante.thumbnail((cote, cote), Image.Resampling.LANCZOS)
+    return courante
+
+
+def traiter_image(source: str, destination: str, avec_original: bool = True) -> int:
+    """
+    Écrit chaque variante de `source` en WebP et JPEG, chacune réduite depuis la précédente.
+    `destination` est le chemin absolu de l'original JPEG ; avec_original=False : il existe déjà
+    (écrit par la requête, ou ancien upload) et n'est pas réécrit. Renvoie le nombre de fichiers écrits.
+    """
+    courante = _decoder(source)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    ecrits = 0
+    for taille, cote in VARIANTES:
+        if courante.width > cote or courante.height > cote:
+            courante.thumbnail((cote, cote), Image.Resampling.LANCZOS)
+        for fmt in FORMATS:
+            if taille == 'original' and fmt == 'jpg' and not avec_original:
+                continue
+            _ecrire(courante, chemin_variante(destination, taille, fmt), fmt)
+            ecrits += 1
+    return ecrits
+
+
+def _generer_variantes(original: str) -> int:
+    """
+    Variantes d'un original déjà publié. Deux envois simultanés du même fichier lancent deux
+    traitements du même original : écritures atomiques, le second remplace à l'identique.
+    """
+    try:
+        return traiter_image(original, original, avec_original=False)
+    except FileNotFoundError:
+        # Blob libéré (ligne supprimée, GC) avant le traitement : plus rien à générer
+        logger.info(f"Image {os.path.basename(original)} supprimée avant génération des variantes")
+        return 0
+
+
+# ============================================================
+# POOL DE TRAITEMENT (UN PAR PROCESSUS WEB)
+# ============================================================
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Pool réutilisé entre requêtes ; recréé après un fork."""
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            workers = current_app.config.get('IMAGE_WORKERS', DEFAULT_WORKERS)
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _fin_traitement(original: str):
+    def callback(future):
+        erreur = future.exception()
+        if erreur:
+            # L'original reste servi ; `flask images variantes` génère les variantes manquantes
+            logger.error(f"Traitement image en échec ({os.path.basename(original)}) : {erreur}")
+    return callback
+
+
+def _soumettre(original: str) -> None:
+    if current_app.config.get('IMAGE_PROCESS_INLINE'):
+        _generer_variantes(original)
+        return
+    try:
+        future = _get_executor().submit(_generer_variantes, original)
+    except RuntimeError as e:
+        logger.error(f"Pool d'images indisponible, variantes différées : {e}")
+        return
+    future.add_done_callback(_fin_traitement(original))
+
+
+# ============================================================
+# ENREGISTREMENT (REQUÊTE WEB)
+# ============================================================
+# L'original JPEG est écrit avant de rendre son chemin : l'URL enregistrée en base est servie
+# dès la réponse. Seules les variantes attendent le commit de la session ; une transaction
+# annulée laisse un blob non référencé, supprimé par le GC des uploads après son délai de grâce.
+
+_EN_ATTENTE = 'images_en_attente'
+
+
+def enregistrer_image(file_obj) -> str:
+    """
+    Valide l'image envoyée et renvoie son chemin par empreinte ('uploads/cas/ab/cd/<sha256>.jpg')
+    à enregistrer en base. Image déjà connue : rien à refaire. Sinon l'original (plafonné, sans
+    métadonnées) est écrit tout de suite et les autres variantes sont générées en arrière-plan
+    après le commit de la session. ImageServiceError si refusée.
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+    try:
+        file_obj.seek(0)
+        with Image.open(file_obj) as img:
+            fmt = (img.format or '').upper()
+            largeur, hauteur = img.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        raise ImageServiceError("Fichier image invalide ou corrompu.")
+    if fmt not in FORMATS_ACCEPTES:
+        raise ImageServiceError("Format non supporté. Utilisez JPG, PNG, WebP ou HEIC (iPhone).")
+    if largeur * hauteur > MAX_SOURCE_PIXELS:
+        raise ImageServiceError("Image trop grande.")
+
+    # Empreinte de la source envoyée : le même fichier donne le même chemin (et les mêmes variantes)
+    chemin = chemin_blob(hacher(file_obj), 'jpg')
+    if toucher(chemin):
+        return chemin
+
+    try:
+        file_obj.seek(0)
+        original = _decoder(file_obj)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        raise ImageServiceError("Fichier image invalide ou corrompu.")
+    destination = _static_path(chemin)
+    try:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        _ecrire(original, destination, 'jpg')
+    except OSError as e:
+        logger.error(f"Écriture image impossible ({chemin}) : {e}", exc_info=True)
+        raise ImageServiceError("Erreur technique lors de l'enregistrement de l'image.") from e
+
+    from db import db
+    db.session.info.setdefault(_EN_ATTENTE, []).append(destination)
+    return chemin
+
+
+@event.listens_for(Session, 'after_commit')
+def _lancer_apres_commit(session):
+    for original in session.info.pop(_EN_ATTENTE, []):
+        try:
+            _soumettre(original)
+        except Exception as e:
+            logger.error(f"Traitement image impossible ({os.path.basename(original)}) : {e}", exc_info=True)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _abandonner_sans_commit(session, transaction):
+    # Après un commit la liste est déjà vide ; sinon (rollback, fermeture) aucune variante n'est générée
+    if transaction.nested or transaction.parent is not None:
+        return
+    session.info.pop(_EN_ATTENTE, None)
+
+
+# ============================================================
+# SUPPRESSION
+# ============================================================
+
+def supprimer_upload(relative_path: Optional[str]) -> bool:
+    """Supprime un fichier de static/uploads ; ignore les URL externes et tout chemin hors du dossier."""
+    if not relative_path or not relative_path.startswith('uploads/'):
+        return False
+    root_uploads = os.path.abspath(os.path.join(current_app.root_path, 'static', 'uploads'))
+    full_path = os.path.abspath(_static_path(os.path.normpath(relative_path)))
+    if not full_path.startswith(root_uploads + os.sep):
+        logger.warning(f"SECURITY: Tentative de suppression hors uploads : {relative_path}")
+        return False
+    _variantes_connues.discard(relative_path)
+    try:
+        os.remove(full_path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.warning(f"Echec suppression fichier {relative_path}: {e}")
+        return False
+
+
+def supprimer_image(relative_path: Optional[str]) -> bool:
+    """Supprime une image uploadée et toutes ses variantes. True si l'image elle-même existait."""
+    return supprimer_images([relative_path]) > 0
+
+
+def supprimer_images(chemins: Iterable[Optional[str]]) -> int:
+    """
+    Après commit. Blobs par empreinte : supprimés seulement s'ils ne sont plus référencés
+    (partagés entre lignes). Anciens uploads : supprimés avec leurs variantes.
+    """
+    chemins = [c for c in chemins if c and c.startswith('uploads/')]
+    supprimes = liberer([c for c in chemins if est_blob(c)])
+    for chemin in chemins:
+        if est_blob(chemin):
+            continue
+        for variante in variantes(chemin):
+            supprimer_upload(variante)
+        supprimes += supprimer_upload(chemin)
+    return supprimes
+
+
+# ============================================================
+# HELPER DE TEMPLATE
+# ============================================================
+_variantes_connues = set()      # Variantes déjà vues sur disque (noms uniques : jamais réécrites)
+_MAX_CONNUES = 20000
+
+
+def _existe(relative_path: str) -> bool:
+    if relative_path in _variantes_connues:
+        return True
+    if not os.path.exists(_static_path(relative_path)):
+        return False
+    if len(_variantes_connues) >= _MAX_CONNUES:
+        _variantes_connues.clear()
+    _variantes_connues.add(relative_path)
+    return True
+
+
+def image_src(url: Optional[str], taille: str = 'thumb', fmt: str = 'jpg') -> Optional[str]:
+    """
+    URL de la variante demandée d'une image stockée en base. URL externe : inchangée.
+    Variante pas encore générée (traitement en cours, ancien upload) : image d'origine en JPEG,
+    et None en WebP (le <source> est alors omis).
+    """
+    if not url:
+        return None
+    if url.startswith(('http://', 'https://')):
+        return url if fmt == 'jpg' else None
+    variante = chemin_variante(url, taille, fmt)
+    if _existe(variante):
+        return url_for('static', filename=variante)
+    return url_for('static', filename=url) if fmt == 'jpg' else None
+
+
+# ============================================================
+# CLI : flask images ...
+# ============================================================
+images_cli = AppGroup('images', help="Traitement des images uploadées.")
+
+
+@images_cli.command('variantes')
+@click.option('--forcer', is_flag=True, help="Régénère aussi les variantes déjà présentes.")
+def variantes_command(forcer):
+    """Génère les miniatures des images uploadées avant la mise en place du traitement."""
+    from db import db, Objet, Armoire
+
+    chemins = set()
+    for colonne in (Objet.image_url, Armoire.photo_url):
+        chemins.update(c for c in db.session.execute(select(colonne).distinct()).scalars()
+                       if c and c.startswith('uploads/'))
+
+    generees = 0
+    for chemin in sorted(chemins):
+        source = _static_path(chemin)
+        if not os.path.exists(source):
+            continue
+        if not forcer and os.path.exists(_static_path(chemin_variante(chemin, 'thumb', 'jpg'))):
+            continue
+        try:
+            # L'original n'est pas réécrit : son nom (et donc l'URL en base) ne change pas
+            traiter_image(source, source, avec_original=False)
+            generees += 1
+        except Exception as e:
+            click.echo(f"{chemin} : {e}")
+    click.echo(f"Variantes générées pour {generees} image(s).")
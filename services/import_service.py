@@ -0,0 +1,501 @@
+import logging
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from openpyxl import load_workbook
+from sqlalchemy import delete, insert, select, update, func
+
+from db import db, inserer_lot, Objet, Armoire, Categorie, Historique, ExportJob, ImportSession, ImportLigne
+from services.export_job_service import (enqueue, export_job_handler, ExportJobError,
+                                         STATUT_EN_ATTENTE as JOB_EN_ATTENTE, STATUT_EN_COURS as JOB_EN_COURS)
+from services.version_service import bump_version, DOMAINE_INVENTAIRE
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+IMPORT_CHUNK_SIZE = 1000         # Lignes écrites par lot (zone de transit comme objets définitifs)
+MAX_IMPORT_ROWS = 50000          # Lecture en flux : la limite ne protège plus que la durée de l'analyse
+DEFAULT_TTL_HOURS = 72           # Conservation des sessions d'import (IMPORT_SESSIONS_TTL_HOURS)
+
+REQUIRED_COLUMNS = ('Nom', 'Quantité', 'Seuil', 'Armoire', 'Catégorie')
+OPTIONAL_COLUMNS = ('Date Péremption', 'Image (URL)')
+
+NOM_MAX_LENGTH = Objet.__table__.c.nom.type.length
+URL_MAX_LENGTH = Objet.__table__.c.image_url.type.length
+
+# Session
+STATUT_ANALYSE = 'analyse'
+STATUT_PRET = 'pret'
+STATUT_EN_COURS = 'en_cours'
+STATUT_TERMINE = 'termine'
+STATUT_ERREUR = 'erreur'
+
+# Ligne
+LIGNE_VALIDE = 'valide'
+LIGNE_ERREUR = 'erreur'
+LIGNE_IGNORE = 'ignore'
+LIGNE_IMPORTE = 'importe'
+
+
+class ImportServiceError(Exception):
+    """Fichier illisible, structure invalide ou session dans un état incompatible."""
+    pass
+
+
+# ============================================================
+# LECTURE ET VALIDATION (une seule passe, en flux)
+# ============================================================
+
+def iter_excel_rows(fichier) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    (numéro de ligne Excel, {colonne: valeur}) en mode read_only : les lignes sont
+    décodées au fil de la lecture, le classeur n'est jamais chargé entièrement.
+    """
+    try:
+        wb = load_workbook(fichier, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportServiceError(f"Fichier Excel illisible : {e}")
+
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        columns = {str(v).strip(): idx for idx, v in enumerate(header) if v is not None}
+        missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+        if missing:
+            raise ImportServiceError(f"Colonnes manquantes. Requis : {', '.join(REQUIRED_COLUMNS)}")
+
+        wanted = [(c, columns[c]) for c in REQUIRED_COLUMNS + OPTIONAL_COLUMNS if c in columns]
+        for ligne, row in enumerate(rows, 2):
+            if not row or all(v is None for v in row):
+                continue
+            yield ligne, {c: (row[idx] if idx < len(row) else None) for c, idx in wanted}
+    finally:
+        wb.close()
+
+
+def estimer_lignes(fichier) -> Optional[int]:
+    """Nombre de lignes de données d'après la dimension de la feuille (lue sans parcourir le fichier)."""
+    try:
+        wb = load_workbook(fichier, read_only=True)
+    except Exception:
+        return None
+    try:
+        max_row = wb.active.max_row
+        return max_row - 1 if max_row and max_row > 1 else None
+    finally:
+        wb.close()
+
+
+def _parse_int(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        number = float(str(value).replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else None
+
+
+def _parse_date(value: Any) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value.split(' ')[0], '%Y-%m-%d').date()
+        except ValueError:
+            return None
+    return None
+
+
+def _brut(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Valeurs de cellule sérialisables en JSON (rapport d'erreurs)."""
+    out = {}
+    for col, val in values.items():
+        if isinstance(val, datetime):
+            val = val.date().isoformat()
+        elif isinstance(val, date):
+            val = val.isoformat()
+        elif val is not None and not isinstance(val, (int, float, str)):
+            val = str(val)
+        out[col] = val
+    return out
+
+
+@dataclass
+class ReferencesImport:
+    armoires: Dict[str, int]
+    categories: Dict[str, int]
+    existants: set
+
+
+class ImportService:
+    def __init__(self, etablissement_id: int, utilisateur_id: Optional[int] = None):
+        self.etablissement_id = etablissement_id
+        self.utilisateur_id = utilisateur_id
+        self.refs: Optional[ReferencesImport] = None
+
+    def charger_references(self) -> ReferencesImport:
+        """Trois requêtes de colonnes : noms d'objets existants, armoires, catégories."""
+        etab = self.etablissement_id
+        self.refs = ReferencesImport(
+            armoires={nom.lower().strip(): id_ for id_, nom in db.session.execute(
+                select(Armoire.id, Armoire.nom).where(Armoire.etablissement_id == etab))},
+            categories={nom.lower().strip(): id_ for id_, nom in db.session.execute(
+                select(Categorie.id, Categorie.nom).where(Categorie.etablissement_id == etab))},
+            existants=set(db.session.execute(
+                select(func.lower(Objet.nom)).where(Objet.etablissement_id == etab)).scalars())
+        )
+        return self.refs
+
+    def valider_ligne(self, values: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Ligne brute -> (paramètres d'insertion, None), (None, erreur) ou (None, None) pour un doublon.
+        Les doublons sont mémorisés : une répétition dans le fichier est aussi ignorée.
+        """
+        refs = self.refs
+        nom = str(values['Nom']).strip() if values.get('Nom') is not None else ''
+        qte, seuil = values.get('Quantité'), values.get('Seuil')
+        if not nom or qte is None or seuil is None:
+            return None, "Données obligatoires manquantes"
+        if len(nom) > NOM_MAX_LENGTH:
+            return None, f"Nom trop long ({NOM_MAX_LENGTH} caractères max)"
+
+        quantite, seuil_int = _parse_int(qte), _parse_int(seuil)
+        if quantite is None or seuil_int is None or quantite < 0 or seuil_int < 0:
+            return None, "Quantité et seuil doivent être des entiers positifs"
+
+        if nom.lower() in refs.existants:
+            return None, None
+
+        arm_nom, cat_nom = values.get('Armoire'), values.get('Catégorie')
+        arm_id = refs.armoires.get(str(arm_nom).lower().strip()) if arm_nom else None
+        cat_id = refs.categories.get(str(cat_nom).lower().strip()) if cat_nom else None
+        if not arm_id or not cat_id:
+            return None, "Armoire ou Catégorie inconnue"
+
+        image = values.get('Image (URL)')
+        image = str(image).strip() if image else None
+        if image and len(image) > URL_MAX_LENGTH:
+            return None, f"URL d'image trop longue ({URL_MAX_LENGTH} caractères max)"
+
+        refs.existants.add(nom.lower())
+        return {
+            'nom': nom,
+            'quantite_physique': quantite,
+            'seuil': seuil_int,
+            'armoire_id': arm_id,
+            'categorie_id': cat_id,
+            'date_peremption': _parse_date(values.get('Date Péremption')),
+            'image_url': image,
+            'etablissement_id': self.etablissement_id,
+        }, None
+
+    def inserer_lot(self, lot: List[Dict[str, Any]]) -> List[int]:
+        """Un INSERT en lot pour les objets (ids dans l'ordre, voir db.inserer_lot), un pour l'historique."""
+        ids = inserer_lot(Objet, lot)
+        now = datetime.now()
+        db.session.execute(insert(Historique), [{
+            'objet_id': objet_id,
+            'utilisateur_id': self.utilisateur_id,
+            'action': "Création",
+            'details': f"Import Excel (Qté: {params['quantite_physique']})",
+            'timestamp': now,
+            'etablissement_id': self.etablissement_id,
+        } for objet_id, params in zip(ids, lot)])
+        return ids
+
+
+# ============================================================
+# SESSIONS D'IMPORT
+# ============================================================
+
+def _uploads_dir() -> str:
+    path = current_app.config.get('IMPORT_UPLOADS_DIR') or os.path.join(current_app.instance_path, 'imports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _upload_path(session_id: str) -> str:
+    return os.path.join(_uploads_dir(), f"{session_id}.xlsx")
+
+
+def get_session(session_id: str, etablissement_id: int) -> Optional[ImportSession]:
+    """Lecture cloisonnée par établissement."""
+    import_session = db.session.get(ImportSession, session_id)
+    if not import_session or import_session.etablissement_id != etablissement_id:
+        return None
+    return import_session
+
+
+def job_actif(import_session: ImportSession) -> Optional[ExportJob]:
+    if not import_session.job_id:
+        return None
+    job = db.session.get(ExportJob, import_session.job_id)
+    return job if job and job.statut in (JOB_EN_ATTENTE, JOB_EN_COURS) else None
+
+
+def peut_reprendre(import_session: ImportSession) -> bool:
+    """Validation interrompue (erreur, worker tué) : les lignes restantes peuvent être reprises."""
+    return (import_session.statut == STATUT_EN_COURS and import_session.job_id is not None
+            and job_actif(import_session) is None)
+
+
+def creer_session(etablissement_id: int, utilisateur_id: Optional[int], fichier, nom_fichier: str) -> ImportSession:
+    """Phase 1 : enregistre le fichier et met son analyse en file. Aucune ligne n'est encore lue."""
+    purge_sessions(etablissement_id)
+
+    import_session = ImportSession(etablissement_id=etablissement_id, utilisateur_id=utilisateur_id,
+                                   nom_fichier=nom_fichier[:255], statut=STATUT_ANALYSE)
+    db.session.add(import_session)
+    db.session.flush()
+    fichier.save(_upload_path(import_session.id))
+    db.session.commit()
+
+    try:
+        enqueue('import_analyse', 'import', etablissement_id, utilisateur_id,
+                {'session_id': import_session.id})
+    except ExportJobError as e:
+        raise ImportServiceError(str(e))
+    db.session.refresh(import_session)
+    return import_session
+
+
+def lancer_validation(import_session: ImportSession) -> None:
+    """
+    Phase 2 : met en file l'import des lignes valides (première fois ou reprise).
+    Compare-and-swap sur la session : deux clics simultanés ne lancent qu'un job.
+    """
+    if import_session.statut == STATUT_PRET:
+        condition = ImportSession.statut == STATUT_PRET
+    elif peut_reprendre(import_session):
+        condition = (ImportSession.statut == STATUT_EN_COURS) & (ImportSession.job_id == import_session.job_id)
+    else:
+        raise ImportServiceError("Cet import n'est pas prêt à être validé.")
+
+    result = db.session.execute(
+        update(ImportSession).where(ImportSession.id == import_session.id, condition)
+        .values(statut=STATUT_EN_COURS, job_id=None, message=None)
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        raise ImportServiceError("Import déjà en cours de validation.")
+
+    restantes = import_session.nb_valides - import_session.nb_importes
+    enqueue('import_validation', 'import', import_session.etablissement_id, import_session.utilisateur_id,
+            {'session_id': import_session.id}, total=restantes)
+
+
+def annuler_session(import_session: ImportSession) -> None:
+    """Abandon (lignes déjà importées conservées) ; impossible pendant un traitement."""
+    if import_session.statut in (STATUT_ANALYSE, STATUT_EN_COURS) and not peut_reprendre(import_session):
+        raise ImportServiceError("Import en cours de traitement.")
+    _supprimer_sessions([import_session.id])
+    db.session.commit()
+
+
+def iter_rapport(session_id: str) -> Iterator[List[Any]]:
+    """Lignes du rapport CSV (erreurs et doublons, avec les valeurs d'origine à corriger)."""
+    stmt = (
+        select(ImportLigne.ligne, ImportLigne.statut, ImportLigne.erreur, ImportLigne.donnees)
+        .where(ImportLigne.session_id == session_id, ImportLigne.statut.in_((LIGNE_ERREUR, LIGNE_IGNORE)))
+        .order_by(ImportLigne.ligne)
+        .execution_options(yield_per=IMPORT_CHUNK_SIZE)
+    )
+    for ligne, statut, erreur, donnees in db.session.execute(stmt):
+        message = erreur if statut == LIGNE_ERREUR else (erreur or "Doublon : objet déjà présent")
+        yield [ligne, message] + [donnees.get(c, donnees.get(_PARAMS_COLONNES.get(c)))
+                                  for c in REQUIRED_COLUMNS + OPTIONAL_COLUMNS]
+
+
+RAPPORT_HEADERS = ['Ligne', 'Erreur'] + list(REQUIRED_COLUMNS + OPTIONAL_COLUMNS)
+
+# Lignes rejetées à la validation : `donnees` contient les paramètres normalisés, pas les cellules
+_PARAMS_COLONNES = {'Nom': 'nom', 'Quantité': 'quantite_physique', 'Seuil': 'seuil',
+                    'Date Péremption': 'date_peremption', 'Image (URL)': 'image_url'}
+
+
+# ============================================================
+# HANDLERS (exécutés par le pool des exports en arrière-plan)
+# ============================================================
+
+def _claim(session_id: str, job_id: str) -> ImportSession:
+    """Le job s'inscrit sur la session ; un second job concurrent est écarté."""
+    result = db.session.execute(
+        update(ImportSession)
+        .where(ImportSession.id == session_id,
+               (ImportSession.job_id.is_(None)) | (ImportSession.job_id == job_id))
+        .values(job_id=job_id)
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        raise ExportJobError("Session d'import déjà prise en charge par un autre traitement.")
+    return db.session.get(ImportSession, session_id)
+
+
+# Lignes avec et sans erreur dans le même lot : une seule instruction (voir db.inserer_lot)
+_INSERT_LIGNES = insert(ImportLigne).execution_options(render_nulls=True)
+
+
+@export_job_handler('import_analyse')
+def _job_analyse(ctx):
+    import_session = _claim(ctx.parametres['session_id'], ctx.job_id)
+    path = _upload_path(import_session.id)
+    service = ImportService(import_session.etablissement_id, import_session.utilisateur_id)
+    service.charger_references()
+
+    counts = {LIGNE_VALIDE: 0, LIGNE_ERREUR: 0, LIGNE_IGNORE: 0}
+    lot: List[Dict[str, Any]] = []
+    try:
+        db.session.execute(delete(ImportLigne).where(ImportLigne.session_id == import_session.id))
+        total = estimer_lignes(path)
+        for ligne, values in iter_excel_rows(path):
+            if ligne - 1 > MAX_IMPORT_ROWS:
+                raise ImportServiceError(f"Limite de {MAX_IMPORT_ROWS} lignes dépassée.")
+
+            params, erreur = service.valider_ligne(values)
+            if erreur:
+                statut, donnees = LIGNE_ERREUR, _brut(values)
+            elif params is None:
+                statut, donnees = LIGNE_IGNORE, _brut(values)
+            else:
+                statut = LIGNE_VALIDE
+                donnees = {**params, 'date_peremption': params['date_peremption'].isoformat()
+                           if params['date_peremption'] else None}
+            counts[statut] += 1
+            lot.append({'session_id': import_session.id, 'ligne': ligne, 'statut': statut,
+                        'donnees': donnees, 'erreur': erreur})
+            if len(lot) >= IMPORT_CHUNK_SIZE:
+                db.session.execute(_INSERT_LIGNES, lot)
+                lot.clear()
+                ctx.progress(ligne - 1, total)
+        if lot:
+            db.session.execute(_INSERT_LIGNES, lot)
+
+        import_session.statut = STATUT_PRET
+        import_session.nb_valides = counts[LIGNE_VALIDE]
+        import_session.nb_erreurs = counts[LIGNE_ERREUR]
+        import_session.nb_ignores = counts[LIGNE_IGNORE]
+        import_session.nb_lignes = sum(counts.values())
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if isinstance(e, ImportServiceError):
+            message = str(e)
+        else:
+            logger.error(f"Analyse d'import {ctx.parametres['session_id']} en échec : {e}", exc_info=True)
+            message = "Erreur technique lors de l'analyse du fichier."
+        import_session = db.session.get(ImportSession, ctx.parametres['session_id'])
+        import_session.statut = STATUT_ERREUR
+        import_session.message = message[:255]
+        import_session.date_fin = datetime.now()
+        db.session.commit()
+    finally:
+        # Le fichier n'est plus relu : la zone de transit fait foi
+        if os.path.exists(path):
+            os.remove(path)
+
+    return {'message': f"{counts[LIGNE_VALIDE]} ligne(s) valide(s), {counts[LIGNE_ERREUR]} erreur(s)"}
+
+
+@export_job_handler('import_validation')
+def _job_validation(ctx):
+    """
+    Importe les lignes 'valide' par lots ; chaque lot (objets, historique, statut des lignes)
+    est une transaction. Après un arrêt, une reprise repart des lignes encore 'valide'.
+    """
+    import_session = _claim(ctx.parametres['session_id'], ctx.job_id)
+    session_id = import_session.id
+    service = ImportService(import_session.etablissement_id, import_session.utilisateur_id)
+    refs = service.charger_references()
+    armoires, categories = set(refs.armoires.values()), set(refs.categories.values())
+    done = 0
+
+    while True:
+        lignes = db.session.execute(
+            select(ImportLigne)
+            .where(ImportLigne.session_id == session_id, ImportLigne.statut == LIGNE_VALIDE)
+            .order_by(ImportLigne.id)
+            .limit(IMPORT_CHUNK_SIZE)
+        ).scalars().all()
+        if not lignes:
+            break
+
+        # Revalidation de ce qui a pu changer depuis l'analyse
+        a_inserer, params = [], []
+        nb_erreurs = nb_ignores = 0
+        for ligne in lignes:
+            p = dict(ligne.donnees)
+            if p['nom'].lower() in refs.existants:
+                ligne.statut, ligne.erreur = LIGNE_IGNORE, "Doublon : objet créé depuis l'analyse"
+                nb_ignores += 1
+            elif p['armoire_id'] not in armoires or p['categorie_id'] not in categories:
+                ligne.statut, ligne.erreur = LIGNE_ERREUR, "Armoire ou Catégorie supprimée depuis l'analyse"
+                nb_erreurs += 1
+            else:
+                p['date_peremption'] = date.fromisoformat(p['date_peremption']) if p['date_peremption'] else None
+                refs.existants.add(p['nom'].lower())
+                a_inserer.append(ligne)
+                params.append(p)
+
+        if params:
+            for ligne, objet_id in zip(a_inserer, service.inserer_lot(params)):
+                ligne.statut, ligne.objet_id = LIGNE_IMPORTE, objet_id
+            bump_version(import_session.etablissement_id, DOMAINE_INVENTAIRE)
+
+        import_session.nb_importes += len(params)
+        import_session.nb_erreurs += nb_erreurs
+        import_session.nb_ignores += nb_ignores
+        db.session.commit()
+
+        done += len(lignes)
+        ctx.progress(done)
+
+    import_session.statut = STATUT_TERMINE
+    import_session.date_fin = datetime.now()
+    db.session.commit()
+    return {'message': f"{import_session.nb_importes} objet(s) importé(s)"}
+
+
+# ============================================================
+# PURGE
+# ============================================================
+
+def _supprimer_sessions(session_ids: List[str]) -> None:
+    if not session_ids:
+        return
+    db.session.execute(delete(ImportLigne).where(ImportLigne.session_id.in_(session_ids)))
+    db.session.execute(delete(ImportSession).where(ImportSession.id.in_(session_ids)))
+    for session_id in session_ids:
+        path = _upload_path(session_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def purge_sessions(etablissement_id: Optional[int] = None) -> int:
+    """Supprime les sessions plus anciennes que IMPORT_SESSIONS_TTL_HOURS (et leurs lignes)."""
+    limite = datetime.now() - timedelta(hours=current_app.config.get('IMPORT_SESSIONS_TTL_HOURS', DEFAULT_TTL_HOURS))
+    stmt = select(ImportSession.id).where(ImportSession.date_creation < limite)
+    if etablissement_id:
+        stmt = stmt.where(ImportSession.etablissement_id == etablissement_id)
+    session_ids = db.session.execute(stmt).scalars().all()
+    _supprimer_sessions(session_ids)
+    db.session.commit()
+    return len(session_ids)
+
+
+imports_cli = AppGroup('imports', help="Sessions d'import Excel en deux phases.")
+
+
+@imports_cli.command('purge')
+def purge_command():
+    """Supprime les sessions d'import expirées."""
+    click.echo(f"{purge_sessions()} session(s) d'import supprimée(s).")
@@ -0,0 +1,204 @@
+import logging
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session
+
+from db import db, JournalModification, EquipementSecurite
+
+logger = logging.getLogger(__name__)
+
+OP_UPSERT = 'upsert'        # Ligne créée ou modifiée : l'état courant est relu au moment de la sauvegarde
+OP_DELETE = 'delete'        # Tombstone
+OP_COMPLET = 'complet'      # Écriture en masse sans ids connus : toute la table est reprise
+OP_RUPTURE = 'rupture'      # Ids réattribués (restauration, purge) : sauvegarde complète obligatoire
+
+TABLE_TOUTES = '*'
+
+# Tables suivies : nom -> modèle (déclarées par le registre des sauvegardes)
+_TABLES: Dict[str, type] = {}
+
+
+def suivre(tables: Iterable[Tuple[str, type]]) -> None:
+    """Active le journal pour ces tables (écritures ORM, UPDATE/DELETE/INSERT en masse via la session)."""
+    for nom, model in tables:
+        _TABLES[nom] = model
+
+
+def _etablissements(connection, equipements: Set[int]) -> Dict[int, int]:
+    """{equipement_id: etablissement_id} pour les tables rattachées via l'équipement."""
+    equipements = {e for e in equipements if e}
+    if not equipements:
+        return {}
+    return dict(connection.execute(
+        select(EquipementSecurite.id, EquipementSecurite.etablissement_id)
+        .where(EquipementSecurite.id.in_(equipements))
+    ).all())
+
+
+def _ecrire(connection, entrees: Iterable[Tuple[int, str, Optional[int], str]]) -> None:
+    now = datetime.now()
+    lignes = [{'etablissement_id': etab, 'table_nom': table, 'ligne_id': ligne_id, 'operation': op, 'date': now}
+              for etab, table, ligne_id, op in entrees if etab]
+    if lignes:
+        connection.execute(insert(JournalModification.__table__), lignes)
+
+
+def journaliser(etablissement_id: int, table: str, operation: str, ids: Iterable[Optional[int]] = (None,)) -> None:
+    """
+    Entrées explicites pour les écritures hors session ORM (Core sur Table, SQL brut).
+    S'exécute dans la transaction courante : l'appelant commit.
+    """
+    _ecrire(db.session.connection(), ((etablissement_id, table, i, operation) for i in ids))
+
+
+def rupture(etablissement_id: int) -> None:
+    """Les ids de l'établissement ont changé : la chaîne différentielle repart d'une sauvegarde complète."""
+    journaliser(etablissement_id, TABLE_TOUTES, OP_RUPTURE)
+
+
+def sequence_courante() -> int:
+    """
+    Position courante du journal (séquence globale, monotone : donc aussi par table).
+    Une sauvegarde note cette position ; la différentielle suivante part de là.
+    """
+    return db.session.execute(select(func.max(JournalModification.id))).scalar() or 0
+
+
+# ============================================================
+# CAPTURE (ÉVÉNEMENTS DE SESSION)
+# ============================================================
+
+def _etab_objet(obj) -> Optional[int]:
+    # Lecture sans chargement paresseux (interdit pendant un flush)
+    etab = obj.__dict__.get('etablissement_id')
+    if etab is None and 'equipement' in obj.__dict__ and obj.__dict__['equipement'] is not None:
+        etab = obj.__dict__['equipement'].__dict__.get('etablissement_id')
+    return etab
+
+
+@event.listens_for(Session, 'after_flush')
+def _journal_on_flush(session, flush_context):
+    """Une entrée par ligne suivie créée, modifiée ou supprimée, dans la transaction de l'écriture."""
+    if not _TABLES:
+        return
+    entrees: List[Tuple[int, str, Optional[int], str]] = []
+    via_equipement: List[Tuple[object, str, str]] = []
+    for obj in chain(session.new, session.dirty, session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table not in _TABLES:
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        op = OP_DELETE if obj in session.deleted else OP_UPSERT
+        etab = _etab_objet(obj)
+        if etab is None and 'equipement_id' in obj.__dict__:
+            via_equipement.append((obj, table, op))
+            continue
+        entrees.append((etab, table, obj.__dict__.get('id'), op))
+
+    connection = session.connection()
+    if via_equipement:
+        etabs = _etablissements(connection, {o.__dict__.get('equipement_id') for o, _, _ in via_equipement})
+        entrees.extend((etabs.get(o.__dict__.get('equipement_id')), t, o.__dict__.get('id'), op)
+                       for o, t, op in via_equipement)
+    if entrees:
+        _ecrire(connection, entrees)
+
+
+def _cibles(connection, table, whereclause) -> List[Tuple[int, int]]:
+    """(id, etablissement_id) des lignes visées par un UPDATE/DELETE en masse, avant exécution."""
+    model = _TABLES[table.name]
+    if 'etablissement_id' in table.c:
+        stmt = select(table.c.id, table.c.etablissement_id)
+    else:
+        stmt = select(table.c.id, EquipementSecurite.etablissement_id).join(
+            EquipementSecurite, EquipementSecurite.id == model.equipement_id)
+    if whereclause is not None:
+        stmt = stmt.where(whereclause)
+    return connection.execute(stmt).all()
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _journal_bulk(state):
+    """
+    Écritures en masse ORM passées par la session (db.update / db.delete / insert(Model)) :
+    UPDATE et DELETE journalisent les lignes visées, INSERT multi-lignes marque la table à reprendre.
+    Option d'exécution `journaliser=False` : l'appelant journalise lui-même (restauration → rupture).
+    """
+    if not _TABLES or not state.is_orm_statement or not (state.is_update or state.is_delete or state.is_insert):
+        return None
+    if not state.execution_options.get('journaliser', True):
+        return None
+    table = getattr(state.statement, 'table', None)
+    if table is None or table.name not in _TABLES:
+        return None
+    connection = state.session.connection()
+
+    if state.is_insert:
+        params = state.parameters
+        lignes = params if isinstance(params, list) else [params or {}]
+        etabs = {p.get('etablissement_id') for p in lignes}
+        _ecrire(connection, ((etab, table.name, None, OP_COMPLET) for etab in etabs if etab))
+        return None
+
+    cibles = _cibles(connection, table, state.statement.whereclause)
+    result = state.invoke_statement()
+    op = OP_DELETE if state.is_delete else OP_UPSERT
+    _ecrire(connection, ((etab, table.name, id_, op) for id_, etab in cibles))
+    return result
+
+
+# ============================================================
+# LECTURE (SAUVEGARDES DIFFÉRENTIELLES)
+# ============================================================
+
+def ids_modifies(etablissement_id: int, table: str, depuis: int, jusqua: int,
+                 recouvrement: datetime) -> Tuple[Set[int], Set[int], bool]:
+    """
+    Entrées de (depuis, jusqua] ou postérieures à `recouvrement` : ids écrits, ids supprimés,
+    et indicateur « toute la table » si une écriture en masse sans ids a eu lieu.
+    """
+    stmt = select(JournalModification.ligne_id, JournalModification.operation).where(
+        JournalModification.etablissement_id == etablissement_id,
+        JournalModification.table_nom == table,
+        JournalModification.id <= jusqua,
+        (JournalModification.id > depuis) | (JournalModification.date >= recouvrement),
+    ).distinct()
+    ecrits, supprimes, complet = set(), set(), False
+    for ligne_id, op in db.session.execute(stmt):
+        if op == OP_COMPLET:
+            complet = True
+        elif ligne_id is None:
+            continue
+        elif op == OP_DELETE:
+            supprimes.add(ligne_id)
+        else:
+            ecrits.add(ligne_id)
+    return ecrits, supprimes, complet
+
+
+def rupture_depuis(etablissement_id: int, depuis: int) -> bool:
+    return db.session.execute(
+        select(JournalModification.id).where(
+            JournalModification.etablissement_id == etablissement_id,
+            JournalModification.operation == OP_RUPTURE,
+            JournalModification.id > depuis,
+        ).limit(1)
+    ).first() is not None
+
+
+def date_sequence(sequence: int) -> Optional[datetime]:
+    return db.session.execute(
+        select(JournalModification.date).where(JournalModification.id == sequence)
+    ).scalar()
+
+
+def purger_journal(avant: datetime) -> int:
+    """Supprime les entrées antérieures à `avant` (les différentielles plus anciennes deviennent impossibles)."""
+    table = JournalModification.__table__
+    result = db.session.execute(table.delete().where(table.c.date < avant))
+    db.session.commit()
+    return result.rowcount or 0
@@ -0,0 +1,170 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from math import floor
+from typing import Optional, Tuple
+
+from limits import parse
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport, TimestampedSlidingWindow
+
+from extensions import limiter
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+PURGE_TOUS_LES = 1000                   # Lignes expirées supprimées toutes les N écritures (coût amorti O(1))
+LIMITE_LICENCE = parse("5 per 15 minutes")
+BUSY_TIMEOUT_MS = 5000
+
+
+# ============================================================
+# STOCKAGE SQLITE PARTAGÉ (sqlite:///chemin/limiter.db)
+# ============================================================
+# Un fichier SQLite en WAL partagé par tous les workers de la machine. Fenêtre glissante
+# pondérée : deux compteurs par clé (fenêtre précédente et courante), lus et incrémentés
+# dans une même transaction IMMEDIATE, donc sans course entre processus.
+
+class SqliteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        # sqlite:////chemin/absolu.db ou sqlite:///relatif.db (comme SQLAlchemy)
+        self.chemin = uri.split('://', 1)[1][1:] if uri else 'limiter.db'
+        dossier = os.path.dirname(os.path.abspath(self.chemin))
+        os.makedirs(dossier, exist_ok=True)
+        self._local = threading.local()
+        self._ecritures = 0
+        with self._transaction() as cur:
+            cur.execute("CREATE TABLE IF NOT EXISTS compteurs ("
+                        "cle TEXT PRIMARY KEY, valeur INTEGER NOT NULL, expire REAL NOT NULL)")
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connexion(self) -> sqlite3.Connection:
+        # Une connexion par thread et par processus (jamais partagée à travers un fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.chemin, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    class _Transaction:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def __enter__(self):
+            self.conn.execute('BEGIN IMMEDIATE')
+            return self.conn.cursor()
+
+        def __exit__(self, exc_type, exc, tb):
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+            return False
+
+    def _transaction(self):
+        return self._Transaction(self._connexion())
+
+    @staticmethod
+    def _lire(cur, cle: str, now: float) -> Tuple[int, float]:
+        ligne = cur.execute("SELECT valeur, expire FROM compteurs WHERE cle = ?", (cle,)).fetchone()
+        if ligne is None or ligne[1] <= now:
+            return 0, now
+        return ligne[0], ligne[1]
+
+    def _incr(self, cur, cle: str, expiry: float, amount: int, now: float) -> int:
+        cur.execute(
+            "INSERT INTO compteurs (cle, valeur, expire) VALUES (?, ?, ?) "
+            "ON CONFLICT(cle) DO UPDATE SET "
+            "valeur = CASE WHEN expire <= ? THEN excluded.valeur ELSE valeur + excluded.valeur END, "
+            "expire = CASE WHEN expire <= ? THEN excluded.expire ELSE expire END",
+            (cle, amount, now + expiry, now, now))
+        self._ecritures += 1
+        if self._ecritures % PURGE_TOUS_LES == 0:
+            cur.execute("DELETE FROM compteurs WHERE expire <= ?", (now,))
+        return self._lire(cur, cle, now)[0]
+
+    # --- Storage ---
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        now = time.time()
+        with self._transaction() as cur:
+            return self._incr(cur, key, expiry, amount, now)
+
+    def get(self, key: str) -> int:
+        return self._lire(self._connexion().cursor(), key, time.time())[0]
+
+    def get_expiry(self, key: str) -> float:
+        return self._lire(self._connexion().cursor(), key, time.time())[1]
+
+    def check(self) -> bool:
+        try:
+            self._connexion().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        with self._transaction() as cur:
+            return cur.execute("DELETE FROM compteurs").rowcount
+
+    def clear(self, key: str) -> None:
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM compteurs WHERE cle = ?", (key,))
+
+    # --- Fenêtre glissante pondérée ---
+    def _fenetre(self, cur, key: str, expiry: int, now: float) -> Tuple[int, float, int, float]:
+        precedente, courante = self.sliding_window_keys(key, expiry, now)
+        n_prec = self._lire(cur, precedente, now)[0]
+        n_cour = self._lire(cur, courante, now)[0]
+        ttl_prec = (1 - (((now - expiry) / expiry) % 1)) * expiry if n_prec else 0.0
+        ttl_cour = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return n_prec, ttl_prec, n_cour, ttl_cour
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        now = time.time()
+        with self._transaction() as cur:
+            n_prec, ttl_prec, n_cour, _ = self._fenetre(cur, key, expiry, now)
+            if floor(n_prec * ttl_prec / expiry + n_cour) + amount > limit:
+                return False
+            # Compteur courant gardé deux fenêtres : il sert ensuite de « fenêtre précédente »
+            self._incr(cur, self.sliding_window_keys(key, expiry, now)[1], 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key: str, expiry: int) -> Tuple[int, float, int, float]:
+        return self._fenetre(self._connexion().cursor(), key, expiry, time.time())
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        precedente, courante = self.sliding_window_keys(key, expiry, time.time())
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM compteurs WHERE cle IN (?, ?)", (precedente, courante))
+
+
+# ============================================================
+# LIMITES APPLICATIVES (HORS DÉCORATEUR FLASK-LIMITER)
+# ============================================================
+
+def tenter(limite, *identifiants) -> bool:
+    """Consomme une tentative dans le stockage partagé du limiter ; False si la limite est atteinte."""
+    if not limiter.enabled:
+        return True
+    try:
+        return limiter.limiter.hit(limite, 'app', *identifiants)
+    except Exception as e:
+        # Stockage indisponible : on laisse passer plutôt que de bloquer l'application
+        logger.warning(f"Limiter indisponible : {e}")
+        return True
+
+
+def reinitialiser(limite, *identifiants) -> None:
+    try:
+        limiter.limiter.clear(limite, 'app', *identifiants)
+    except Exception as e:
+        logger.warning(f"Réinitialisation limiter impossible : {e}")
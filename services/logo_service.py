@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from flask import current_app
+from PIL import Image, UnidentifiedImageError
+from werkzeug.security import safe_join
+
+from services import parametre_service as parametres
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+LOGO_MAX_PX = 300                 # Logo pré-réduit (affiché en 40-55 pt dans les PDF, 50 px en Excel)
+LOGO_REVALIDATE_SECONDS = 86400   # Revalidation conditionnelle (ETag / Last-Modified) une fois par jour
+LOGO_FETCH_TIMEOUT = 5
+MEMORY_MAX_ENTRIES = 256          # Établissements gardés en RAM par processus
+
+
+class LogoServiceError(Exception):
+    """Logo illisible ou téléchargement impossible."""
+    pass
+
+
+# Mémoire : etablissement_id -> (logo_url, mtime du .json disque, octets PNG)
+_memory: "OrderedDict[int, Tuple[str, float, bytes]]" = OrderedDict()
+_lock = threading.Lock()
+# Établissements dont la revalidation tourne en arrière-plan (une seule à la fois par logo)
+_en_revalidation: set = set()
+
+
+def _cache_dir() -> str:
+    path = current_app.config.get('LOGO_CACHE_DIR') or os.path.join(current_app.instance_path, 'logo_cache')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _paths(etablissement_id: int) -> Tuple[str, str]:
+    base = os.path.join(_cache_dir(), f"logo_{int(etablissement_id)}")
+    return base + '.png', base + '.json'
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _read_meta(meta_path: str) -> Dict[str, Any]:
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _normalize(raw: bytes) -> bytes:
+    """Décode et pré-réduit le logo en PNG (format accepté par ReportLab et openpyxl)."""
+    try:
+        img = Image.open(BytesIO(raw))
+        img.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise LogoServiceError(f"Logo illisible : {e}")
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    img.thumbnail((LOGO_MAX_PX, LOGO_MAX_PX))
+    out = BytesIO()
+    img.save(out, format='PNG', optimize=True)
+    return out.getvalue()
+
+
+def _fetch(logo_url: str, meta: Dict[str, Any]) -> Tuple[Optional[bytes], Dict[str, Any]]:
+    """
+    Récupère la source du logo. Renvoie (None, meta) si la copie locale est toujours valide (304).
+    Les logos locaux (static/) sont validés par mtime/taille, sans réseau.
+    """
+    if logo_url.startswith('http'):
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        r = requests.get(logo_url, headers=headers, timeout=LOGO_FETCH_TIMEOUT)
+        if r.status_code == 304:
+            return None, meta
+        if r.status_code != 200:
+            raise LogoServiceError(f"HTTP {r.status_code} pour {logo_url}")
+        return r.content, {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+
+    path = safe_join(os.path.join(current_app.root_path, 'static'), logo_url)
+    if path is None:
+        raise LogoServiceError(f"Chemin de logo invalide : {logo_url}")
+    try:
+        st = os.stat(path)
+    except OSError:
+        raise LogoServiceError(f"Logo local introuvable : {logo_url}")
+    etag = f"{int(st.st_mtime)}-{st.st_size}"
+    if meta.get('etag') == etag:
+        return None, meta
+    with open(path, 'rb') as f:
+        return f.read(), {'etag': etag, 'last_modified': None}
+
+
+def _remember(etablissement_id: int, logo_url: str, mtime: float, data: bytes) -> None:
+    with _lock:
+        _memory[etablissement_id] = (logo_url, mtime, data)
+        _memory.move_to_end(etablissement_id)
+        while len(_memory) > MEMORY_MAX_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def _revalider(etablissement_id: int, logo_url: str, meta: Dict[str, Any], same_source: bool) -> bytes:
+    """Téléchargement ou revalidation conditionnelle, puis mise à jour du cache disque et mémoire."""
+    png_path, meta_path = _paths(etablissement_id)
+    raw, validators = _fetch(logo_url, meta if same_source else {})
+    if raw is None:
+        with open(png_path, 'rb') as f:
+            data = f.read()
+    else:
+        data = _normalize(raw)
+        _write_atomic(png_path, data)
+    new_meta = {'url': logo_url, 'etag': validators.get('etag'),
+                'last_modified': validators.get('last_modified'), 'validated_at': time.time()}
+    _write_atomic(meta_path, json.dumps(new_meta).encode('utf-8'))
+    _remember(etablissement_id, logo_url, os.stat(meta_path).st_mtime, data)
+    return data
+
+
+def _revalider_en_arriere_plan(app, etablissement_id: int, logo_url: str, meta: Dict[str, Any]) -> None:
+    try:
+        with app.app_context():
+            _revalider(etablissement_id, logo_url, meta, True)
+    except (LogoServiceError, requests.RequestException, OSError) as e:
+        # La copie périmée reste servie ; nouvelle tentative à la prochaine demande
+        logger.warning(f"Revalidation du logo etab {etablissement_id} impossible : {e}")
+    except Exception as e:
+        logger.error(f"Revalidation du logo etab {etablissement_id} en échec : {e}", exc_info=True)
+    finally:
+        with _lock:
+            _en_revalidation.discard(etablissement_id)
+
+
+def _planifier_revalidation(etablissement_id: int, logo_url: str, meta: Dict[str, Any]) -> None:
+    """Lance la revalidation hors de la requête, sans doublon par établissement."""
+    with _lock:
+        if etablissement_id in _en_revalidation:
+            return
+        _en_revalidation.add(etablissement_id)
+    app = current_app._get_current_object()
+    threading.Thread(target=_revalider_en_arriere_plan, args=(app, etablissement_id, logo_url, meta),
+                     name=f"logo-revalidation-{etablissement_id}", daemon=True).start()
+
+
+def get_logo_bytes(etablissement_id: Optional[int]) -> Optional[bytes]:
+    """
+    PNG pré-réduit du logo de l'établissement, ou None (pas de logo / logo illisible).
+    Chemin chaud : `logo_url` lu dans le magasin de paramètres + un stat disque, aucune I/O réseau.
+    Une copie périmée est servie telle quelle pendant sa revalidation en arrière-plan.
+    """
+    if not etablissement_id:
+        return None
+
+    try:
+        logo_url = parametres.texte(etablissement_id, 'logo_url')
+    except Exception as e:
+        logger.warning(f"Lecture logo_url impossible (etab {etablissement_id}) : {e}")
+        return None
+    if not logo_url:
+        return None
+
+    png_path, meta_path = _paths(etablissement_id)
+    try:
+        meta_mtime = os.stat(meta_path).st_mtime
+    except OSError:
+        meta_mtime = None
+
+    # 1. Mémoire (invalidée si le .json disque a changé : autre processus, invalidation)
+    entry = _memory.get(etablissement_id)
+    if entry and meta_mtime is not None and entry[0] == logo_url and entry[1] == meta_mtime \
+            and time.time() - meta_mtime < LOGO_REVALIDATE_SECONDS:
+        return entry[2]
+
+    # 2. Disque : copie pour la même URL, revalidée hors requête si elle a plus d'un jour
+    meta = _read_meta(meta_path) if meta_mtime is not None else {}
+    if meta.get('url') == logo_url:
+        try:
+            with open(png_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = None
+        if data is not None:
+            if time.time() - meta_mtime < LOGO_REVALIDATE_SECONDS:
+                _remember(etablissement_id, logo_url, meta_mtime, data)
+            else:
+                _planifier_revalidation(etablissement_id, logo_url, meta)
+            return data
+
+    # 3. Aucune copie pour cette URL (nouveau logo) : premier téléchargement, une seule fois
+    try:
+        return _revalider(etablissement_id, logo_url, {}, False)
+    except (LogoServiceError, requests.RequestException, OSError) as e:
+        logger.warning(f"Logo etab {etablissement_id} indisponible : {e}")
+        return None
+
+
+def invalidate_logo(etablissement_id: int) -> None:
+    """À appeler après tout changement de logo (upload, suppression)."""
+    with _lock:
+        _memory.pop(etablissement_id, None)
+    for path in _paths(etablissement_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Invalidation logo impossible ({path}) : {e}")
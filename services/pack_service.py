@@ -0,0 +1,146 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+from db import db, inserer_lot, Objet, Armoire, Categorie
+from services.version_service import bump_version, DOMAINE_INVENTAIRE
+from static.data.packs_onboarding import PACKS_ONBOARDING
+
+logger = logging.getLogger(__name__)
+
+
+class PackServiceError(Exception):
+    """Pack inconnu ou import impossible."""
+    pass
+
+
+# ============================================================
+# PACKS PRÉCOMPILÉS (UNE FOIS, AU CHARGEMENT DU MODULE)
+# ============================================================
+
+@dataclass(frozen=True)
+class PackCompile:
+    id: str
+    nom: str
+    armoires: Tuple[Tuple[str, Optional[str]], ...]     # (nom, description), dans l'ordre du pack
+    categories: Tuple[str, ...]
+    objets: Tuple[Tuple[str, str, Dict[str, Any]], ...]  # (armoire, catégorie, colonnes de l'objet)
+
+
+def _normaliser_objet(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Colonnes d'insertion complètes et homogènes (un seul executemany pour tout le pack)."""
+    produit = obj["type_objet"] == "produit"
+    return {
+        'nom': obj["nom"],
+        'type_objet': obj["type_objet"],
+        'quantite_physique': obj["quantite_physique"],
+        'seuil': obj["seuil"],
+        'unite': obj.get("unite", "unité"),
+        'is_cmr': obj.get("is_cmr", False),
+        'image_url': obj.get("image_url"),
+        'fds_url': obj.get("fds_url"),
+        'en_commande': False,
+        'traite': False,
+        # Champs spécifiques aux produits chimiques (défauts des colonnes sinon)
+        'capacite_initiale': obj.get("capacite_initiale") if produit else 0.0,
+        'niveau_actuel': obj.get("niveau_actuel") if produit else 0.0,
+        'seuil_pourcentage': obj.get("seuil_pourcentage", 50) if produit else 10,
+    }
+
+
+def _compiler(pack: Dict[str, Any]) -> PackCompile:
+    vus = set()
+    objets = []
+    for obj in pack["objets"]:
+        if obj["nom"] in vus:
+            continue
+        vus.add(obj["nom"])
+        objets.append((obj["armoire"], obj["categorie"], _normaliser_objet(obj)))
+    return PackCompile(
+        id=pack["id"],
+        nom=pack["nom"],
+        armoires=tuple((a["nom"], a.get("description")) for a in pack["armoires"]),
+        categories=tuple(dict.fromkeys(pack["categories"])),
+        objets=tuple(objets),
+    )
+
+
+PACKS = {pack["id"]: _compiler(pack) for pack in PACKS_ONBOARDING}
+
+
+def get_pack(pack_id: str) -> Optional[PackCompile]:
+    return PACKS.get(pack_id)
+
+
+# ============================================================
+# IMPORT ENSEMBLISTE
+# ============================================================
+
+def _existants(model, noms, etablissement_id: int) -> Dict[str, int]:
+    """Une requête par table : {nom: id} des éléments du pack déjà présents."""
+    if not noms:
+        return {}
+    return {nom: id_ for id_, nom in db.session.execute(
+        select(model.id, model.nom).where(model.etablissement_id == etablissement_id, model.nom.in_(noms))
+    )}
+
+
+def _inserer(model, lignes) -> Dict[str, int]:
+    """INSERT en lot (db.inserer_lot) : correspondance nom -> id sans flush."""
+    ids = inserer_lot(model, lignes)
+    return {ligne['nom']: id_ for ligne, id_ in zip(lignes, ids)}
+
+
+def importer_pack(pack_id: str, etablissement_id: int) -> Dict[str, int]:
+    """
+    Crée armoires, catégories et objets manquants du pack (comparaison exacte des noms).
+    Trois lectures, trois insertions, un commit ; renvoie les compteurs de l'import.
+    """
+    pack = get_pack(pack_id)
+    if not pack:
+        raise PackServiceError("Pack introuvable")
+
+    stats = {"armoires": 0, "categories": 0, "objets": 0, "ignores": 0}
+    try:
+        # 1. Armoires
+        armoires = _existants(Armoire, [nom for nom, _ in pack.armoires], etablissement_id)
+        nouvelles = _inserer(Armoire, [
+            {'nom': nom, 'description': description, 'etablissement_id': etablissement_id}
+            for nom, description in pack.armoires if nom not in armoires
+        ])
+        armoires.update(nouvelles)
+        stats["armoires"] = len(nouvelles)
+
+        # 2. Catégories
+        categories = _existants(Categorie, list(pack.categories), etablissement_id)
+        nouvelles = _inserer(Categorie, [
+            {'nom': nom, 'etablissement_id': etablissement_id}
+            for nom in pack.categories if nom not in categories
+        ])
+        categories.update(nouvelles)
+        stats["categories"] = len(nouvelles)
+
+        # 3. Objets
+        deja_la = _existants(Objet, [colonnes['nom'] for _, _, colonnes in pack.objets], etablissement_id)
+        lignes = [
+            {**colonnes, 'etablissement_id': etablissement_id,
+             'armoire_id': armoires.get(armoire), 'categorie_id': categories.get(categorie)}
+            for armoire, categorie, colonnes in pack.objets if colonnes['nom'] not in deja_la
+        ]
+        if lignes:
+            # render_nulls : image, FDS ou armoire absentes sur certains objets sans découper le lot
+            db.session.execute(insert(Objet).execution_options(render_nulls=True), lignes)
+        stats["objets"] = len(lignes)
+        stats["ignores"] = len(pack.objets) - len(lignes)
+
+        if any(stats[k] for k in ("armoires", "categories", "objets")):
+            bump_version(etablissement_id, DOMAINE_INVENTAIRE)
+        db.session.commit()
+        return stats
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erreur import pack {pack_id} (etab {etablissement_id}): {e}", exc_info=True)
+        raise PackServiceError(str(e)) from e
@@ -47,8 +47,11 @@ class PanierService:
 
         panier = db.session.execute(stmt).scalar_one_or_none()
 
-        # Rotation si expiré
-        if panier and panier.date_expiration < now:
+        # Rotation si expiré (SQLite rend des dates naïves, stockées en UTC)
+        expiration = panier.date_expiration if panier else None
+        if expiration is not None and expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        if panier and expiration < now:
             panier.statut = 'expiré'
             panier = None
 
@@ -0,0 +1,202 @@
+import logging
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from db import db, Parametre
+from extensions import cache
+from services.version_service import DOMAINE_PARAMETRES, get_version
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+MAX_ETABLISSEMENTS = 512                # Entrées gardées en mémoire par processus (LRU)
+TIMEOUT_CACHE_PARTAGE = 3600            # La clé partagée contient la version : jamais périmée, seulement évincée
+VRAI = ('1', 'true', 'oui', 'on', 'yes')
+
+_VERIFIES = '_parametres_verifies'      # flask.g : établissements dont la version a été lue dans la requête
+_MODIFIES = 'parametres_modifies'       # session.info : établissements écrits dans la transaction en cours
+
+# etablissement_id -> (version, paramètres en lecture seule)
+_memoire: 'OrderedDict[int, Tuple[int, Mapping[str, str]]]' = OrderedDict()
+_lock = threading.Lock()
+
+
+class ParametreServiceError(Exception):
+    pass
+
+
+# ============================================================
+# LECTURE (CACHE MÉMOIRE VERSIONNÉ)
+# ============================================================
+# Toute écriture d'un Parametre change la version du domaine 'parametres' dans la même
+# transaction (version_service). Une requête lit cette version une seule fois par établissement
+# puis sert les valeurs depuis la mémoire du processus ; un autre worker voit donc une écriture
+# dès sa requête suivante, sans TTL ni invalidation explicite.
+
+def _verifies() -> set:
+    if not has_app_context():
+        return set()
+    if _VERIFIES not in g:
+        setattr(g, _VERIFIES, set())
+    return getattr(g, _VERIFIES)
+
+
+def _charger(etablissement_id: int) -> Dict[str, str]:
+    lignes = db.session.execute(
+        db.select(Parametre.cle, Parametre.valeur).filter_by(etablissement_id=etablissement_id)
+    ).all()
+    return {cle: valeur for cle, valeur in lignes}
+
+
+def _charger_partage(etablissement_id: int, version: int) -> Dict[str, str]:
+    """Second niveau : un worker qui démarre ou vient d'être évincé évite la requête si un autre a déjà chargé cette version."""
+    cle = f"parametres:{int(etablissement_id)}:v{version}"
+    try:
+        valeurs = cache.get(cle)
+    except Exception as e:
+        # Cache partagé indisponible (Redis arrêté, disque plein) : lecture directe
+        logger.warning(f"Cache partagé indisponible (paramètres) : {e}")
+        return _charger(etablissement_id)
+    if valeurs is None:
+        valeurs = _charger(etablissement_id)
+        try:
+            cache.set(cle, valeurs, timeout=TIMEOUT_CACHE_PARTAGE)
+        except Exception as e:
+            logger.warning(f"Écriture cache impossible (paramètres) : {e}")
+    return valeurs
+
+
+def tous(etablissement_id: Optional[int]) -> Mapping[str, str]:
+    """Paramètres de l'établissement (lecture seule). Une requête SQL de version au plus par requête HTTP."""
+    if not etablissement_id:
+        return MappingProxyType({})
+    # Écriture non encore validée dans cette transaction : lue telle quelle, ni mémorisée ni partagée
+    if etablissement_id in db.session.info.get(_MODIFIES, ()):
+        return MappingProxyType(_charger(etablissement_id))
+    verifies = _verifies()
+    with _lock:
+        entree = _memoire.get(etablissement_id)
+    if entree is not None and etablissement_id in verifies:
+        return entree[1]
+
+    try:
+        version = get_version(etablissement_id, DOMAINE_PARAMETRES)
+        if entree is None or entree[0] != version:
+            entree = (version, MappingProxyType(_charger_partage(etablissement_id, version)))
+    except SQLAlchemyError as e:
+        logger.error(f"Lecture des paramètres etab {etablissement_id} impossible : {e}")
+        return entree[1] if entree else MappingProxyType({})
+
+    with _lock:
+        _memoire[etablissement_id] = entree
+        _memoire.move_to_end(etablissement_id)
+        while len(_memoire) > MAX_ETABLISSEMENTS:
+            _memoire.popitem(last=False)
+    verifies.add(etablissement_id)
+    return entree[1]
+
+
+# ============================================================
+# ACCESSEURS TYPÉS
+# ============================================================
+
+def texte(etablissement_id: Optional[int], cle: str, defaut: Optional[str] = None) -> Optional[str]:
+    valeur = tous(etablissement_id).get(cle)
+    return defaut if valeur in (None, '') else valeur
+
+
+def entier(etablissement_id: Optional[int], cle: str, defaut: int = 0) -> int:
+    try:
+        return int(tous(etablissement_id).get(cle))
+    except (TypeError, ValueError):
+        return defaut
+
+
+def booleen(etablissement_id: Optional[int], cle: str, defaut: bool = False) -> bool:
+    valeur = tous(etablissement_id).get(cle)
+    if valeur in (None, ''):
+        return defaut
+    return valeur.strip().lower() in VRAI
+
+
+def est_pro(etablissement_id: Optional[int]) -> bool:
+    return tous(etablissement_id).get('licence_statut') == 'PRO'
+
+
+# ============================================================
+# ÉCRITURE (DANS LA TRANSACTION DE L'APPELANT)
+# ============================================================
+# Passe par l'ORM : journal des différentielles et version du domaine suivent automatiquement.
+# L'index unique (etablissement_id, cle) tranche entre deux créations concurrentes.
+
+def definir(etablissement_id: int, cle: str, valeur) -> None:
+    """Crée ou met à jour un paramètre ; l'appelant commit."""
+    if not etablissement_id or not cle:
+        raise ParametreServiceError("Établissement et clé obligatoires.")
+    valeur = '' if valeur is None else str(valeur)
+    param = db.session.execute(
+        db.select(Parametre).filter_by(etablissement_id=etablissement_id, cle=cle)
+    ).scalar_one_or_none()
+    if param is not None:
+        param.valeur = valeur
+        db.session.flush()
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Parametre(etablissement_id=etablissement_id, cle=cle, valeur=valeur))
+    except IntegrityError:
+        # Créé entre-temps par une autre requête : mise à jour
+        param = db.session.execute(
+            db.select(Parametre).filter_by(etablissement_id=etablissement_id, cle=cle)
+        ).scalar_one()
+        param.valeur = valeur
+        db.session.flush()
+
+
+def supprimer(etablissement_id: int, cle: str) -> bool:
+    param = db.session.execute(
+        db.select(Parametre).filter_by(etablissement_id=etablissement_id, cle=cle)
+    ).scalar_one_or_none()
+    if param is None:
+        return False
+    db.session.delete(param)
+    db.session.flush()
+    return True
+
+
+def oublier(etablissement_id: Optional[int] = None) -> None:
+    """Vide la mémoire du processus (écritures SQL brutes suivies d'un bump_version, restauration)."""
+    with _lock:
+        if etablissement_id is None:
+            _memoire.clear()
+        else:
+            _memoire.pop(etablissement_id, None)
+    if etablissement_id is None:
+        _verifies().clear()
+    else:
+        _verifies().discard(etablissement_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _noter_ecritures(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Parametre):
+            etablissement_id = obj.__dict__.get('etablissement_id')
+            if etablissement_id:
+                session.info.setdefault(_MODIFIES, set()).add(etablissement_id)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _fin_transaction(session, transaction):
+    # Validée ou annulée : ce worker relit la version à sa prochaine lecture, même dans la requête en cours
+    if transaction.parent is not None:
+        return
+    for etablissement_id in session.info.pop(_MODIFIES, ()):
+        oublier(etablissement_id)
@@ -0,0 +1,183 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from io import BytesIO
+from typing import Any, Callable, Optional
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION (surchargée par app.config) ---
+DEFAULT_WORKERS = 2          # Rendus ReportLab simultanés (PDF_WORKERS)
+DEFAULT_TIMEOUT = 60         # Échéance unique de l'appelant, file comprise (PDF_RENDER_TIMEOUT)
+QUEUE_FACTOR = 2             # Rendus en file au-delà des workers avant refus
+
+
+class PdfRenderError(Exception):
+    """Rendu PDF impossible (timeout, pool saturé ou cassé)."""
+    pass
+
+
+# ============================================================
+# EXÉCUTION DANS LE PROCESSUS DE RENDU
+# ============================================================
+# Les renderers sont des fonctions de module `renderer(*args, output)` qui ne
+# touchent ni à la base ni à l'application : elles reçoivent des dict/list/str.
+
+def _render_to_bytes(renderer: Callable, args: tuple) -> bytes:
+    buffer = BytesIO()
+    renderer(*args, buffer)
+    return buffer.getvalue()
+
+
+def _render_to_path(renderer: Callable, args: tuple, path: str) -> Any:
+    return renderer(*args, path)
+
+
+def _boucle_worker(conn) -> None:
+    """Processus de rendu persistant : une tâche à la fois, reçue et renvoyée par `conn`."""
+    while True:
+        try:
+            func, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send(('ok', func(*args)))
+        except Exception as e:
+            try:
+                conn.send(('erreur', e))        # Relevée telle quelle chez l'appelant
+            except Exception:
+                conn.send(('erreur', PdfRenderError(f"{type(e).__name__}: {e}")))
+
+
+# ============================================================
+# POOL PARTAGÉ (UN PAR PROCESSUS WEB)
+# ============================================================
+# Chaque worker est un processus dédié avec son propre canal : un rendu bloqué est
+# arrêté seul, sans toucher aux rendus des autres requêtes.
+
+class _Worker:
+    def __init__(self):
+        self.process = None
+        self.conn = None
+
+    def demarrer(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            return
+        self.arreter()
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, conn_enfant = ctx.Pipe()
+        self.process = ctx.Process(target=_boucle_worker, args=(conn_enfant,), daemon=True)
+        self.process.start()
+        conn_enfant.close()
+
+    def arreter(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=5)
+        if self.conn is not None:
+            self.conn.close()
+        self.process = self.conn = None
+
+
+_libres: Optional[queue.Queue] = None
+_pool_pid: Optional[int] = None
+_slots: Optional[threading.BoundedSemaphore] = None
+_lock = threading.Lock()
+
+
+def _config(key: str, default: Any) -> Any:
+    return current_app.config.get(key, default) if has_app_context() else default
+
+
+def _get_pool():
+    """Workers réutilisés entre requêtes (démarrés à la demande) ; recréés après un fork."""
+    global _libres, _pool_pid, _slots
+    with _lock:
+        if _libres is None or _pool_pid != os.getpid():
+            workers = _config('PDF_WORKERS', DEFAULT_WORKERS)
+            _libres = queue.Queue()
+            for _ in range(workers):
+                _libres.put(_Worker())
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(workers * QUEUE_FACTOR)
+        return _libres, _slots
+
+
+def _nom(args: tuple) -> str:
+    return getattr(args[0], '__name__', str(args[0])) if args else '?'
+
+
+def _recuperer(worker: _Worker, limite: float, libres: queue.Queue, nom: str) -> None:
+    """
+    L'appelant a abandonné le rendu : on laisse le worker finir (résultat ignoré) ou on
+    l'arrête à `limite` (ReportLab ne peut pas être interrompu autrement), puis il retourne au pool.
+    """
+    try:
+        if worker.conn.poll(max(0.0, limite - time.monotonic())):
+            worker.conn.recv()
+        else:
+            logger.error(f"Rendu PDF arrêté après dépassement du délai d'exécution ({nom})")
+            worker.arreter()
+    except (EOFError, OSError):
+        worker.arreter()
+    finally:
+        libres.put(worker)
+
+
+def _submit(func: Callable, *args) -> Any:
+    if _config('PDF_RENDER_INLINE', False):
+        return func(*args)
+
+    timeout = _config('PDF_RENDER_TIMEOUT', DEFAULT_TIMEOUT)
+    echeance = time.monotonic() + timeout      # Échéance unique de l'appelant, file d'attente comprise
+    libres, slots = _get_pool()
+    occupe = PdfRenderError("Trop de documents en cours de génération, réessayez dans un instant.")
+
+    # Concurrence bornée : au-delà de la file, on refuse plutôt que d'empiler les requêtes
+    if not slots.acquire(timeout=timeout):
+        raise occupe
+    try:
+        try:
+            worker = libres.get(timeout=max(0.0, echeance - time.monotonic()))
+        except queue.Empty:
+            raise occupe        # Jamais démarré : rien à interrompre
+        confie = False
+        try:
+            worker.demarrer()
+            debut = time.monotonic()        # Le délai d'exécution du rendu part d'ici
+            worker.conn.send((func, args))
+            if not worker.conn.poll(max(0.0, echeance - debut)):
+                # Échéance de l'appelant atteinte : le worker garde son propre délai, compté depuis
+                # le début du rendu (pas depuis la file), et n'est arrêté seul qu'au-delà
+                threading.Thread(target=_recuperer, args=(worker, debut + timeout, libres, _nom(args)),
+                                 daemon=True).start()
+                confie = True
+                raise PdfRenderError("La génération du PDF a dépassé le délai autorisé.")
+            statut, valeur = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.arreter()
+            raise PdfRenderError("Le moteur de rendu PDF a été redémarré, réessayez.")
+        finally:
+            if not confie:
+                libres.put(worker)
+    finally:
+        slots.release()
+
+    if statut == 'erreur':
+        raise valeur
+    return valeur
+
+
+def render_pdf(renderer: Callable, *args) -> bytes:
+    """Rend `renderer(*args, output)` hors du processus web et renvoie les octets du PDF."""
+    return _submit(_render_to_bytes, renderer, args)
+
+
+def render_pdf_to_file(renderer: Callable, path: str, *args) -> Any:
+    """Rend directement dans `path` (disque partagé) et renvoie la valeur du renderer."""
+    return _submit(_render_to_path, renderer, args, path)
@@ -0,0 +1,222 @@
+import json
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+
+from db import (db, Objet, Armoire, Categorie, Kit, KitObjet, Reservation, ReservationRecurrence, Suggestion,
+                Salle, Fournisseur, Budget, Depense, Panier, PanierItem, ExportJob)
+from services import journal_service as journal
+from services.image_service import supprimer_images
+from services.export_job_service import (enqueue, export_job_handler, ExportJobError,
+                                         STATUT_EN_ATTENTE as JOB_EN_ATTENTE, STATUT_EN_COURS as JOB_EN_COURS)
+from services.version_service import bump_version, DOMAINE_INVENTAIRE
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 1000     # Lignes par transaction : verrous courts, WAL lissé
+SANS_JOURNAL = {'journaliser': False}   # Une rupture unique remplace les tombstones ligne à ligne
+TYPE_JOB = 'reset_etablissement'
+
+
+class PurgeServiceError(Exception):
+    """Sélection invalide ou purge interrompue."""
+    pass
+
+
+# ============================================================
+# PLAN DE PURGE (ORDRE DES DÉPENDANCES)
+# ============================================================
+
+@dataclass(frozen=True)
+class Etape:
+    element: str                                # Case cochée qui déclenche l'étape
+    model: type
+    filtre: Callable[[int], object]             # Lignes visées pour l'établissement
+    detacher: Optional[str] = None              # Colonne mise à NULL au lieu de supprimer la ligne
+    fichiers: Tuple[str, ...] = ()              # Colonnes de chemins 'uploads/...' à nettoyer (et variantes)
+    principale: bool = False                    # Compteur affiché pour l'élément
+
+
+def _items_panier(etab: int):
+    return PanierItem.id_panier.in_(select(Panier.id).where(Panier.etablissement_id == etab))
+
+
+# Enfants avant parents ; les « détachements » ne visent que les références encore présentes,
+# ils ne coûtent qu'un COUNT quand les lignes enfants ont déjà été supprimées plus haut.
+ETAPES: Tuple[Etape, ...] = (
+    # Réservations
+    Etape('reservations', Reservation, lambda e: Reservation.etablissement_id == e, principale=True),
+    Etape('reservations', ReservationRecurrence, lambda e: ReservationRecurrence.etablissement_id == e),
+
+    # Kits
+    Etape('kits', Reservation, lambda e: (Reservation.etablissement_id == e) & Reservation.kit_id.isnot(None)),
+    Etape('kits', PanierItem, lambda e: _items_panier(e) & (PanierItem.type == 'kit')),
+    Etape('kits', KitObjet, lambda e: KitObjet.etablissement_id == e),
+    Etape('kits', Kit, lambda e: Kit.etablissement_id == e, principale=True),
+
+    # Inventaire
+    Etape('inventaire', Reservation, lambda e: (Reservation.etablissement_id == e) & Reservation.objet_id.isnot(None)),
+    Etape('inventaire', PanierItem, lambda e: _items_panier(e) & (PanierItem.type == 'objet')),
+    Etape('inventaire', KitObjet, lambda e: KitObjet.etablissement_id == e),
+    Etape('inventaire', Suggestion, lambda e: Suggestion.etablissement_id == e),
+    Etape('inventaire', Objet, lambda e: Objet.etablissement_id == e,
+          fichiers=('image_url', 'fds_url'), principale=True),
+
+    # Budget (avant les fournisseurs : les dépenses supprimées n'ont plus à être détachées)
+    Etape('budget', Depense, lambda e: Depense.etablissement_id == e),
+    Etape('budget', Budget, lambda e: Budget.etablissement_id == e, principale=True),
+
+    # Armoires et catégories : l'inventaire conservé perd seulement son rattachement
+    Etape('armoires', Objet, lambda e: (Objet.etablissement_id == e) & Objet.armoire_id.isnot(None),
+          detacher='armoire_id'),
+    Etape('armoires', Armoire, lambda e: Armoire.etablissement_id == e, fichiers=('photo_url',), principale=True),
+    Etape('categories', Objet, lambda e: (Objet.etablissement_id == e) & Objet.categorie_id.isnot(None),
+          detacher='categorie_id'),
+    Etape('categories', Categorie, lambda e: Categorie.etablissement_id == e, principale=True),
+
+    # Salles
+    Etape('salles', Reservation, lambda e: (Reservation.etablissement_id == e) & Reservation.salle_id.isnot(None),
+          detacher='salle_id'),
+    Etape('salles', ReservationRecurrence,
+          lambda e: (ReservationRecurrence.etablissement_id == e) & ReservationRecurrence.salle_id.isnot(None),
+          detacher='salle_id'),
+    Etape('salles', PanierItem, lambda e: _items_panier(e) & PanierItem.salle_id.isnot(None), detacher='salle_id'),
+    Etape('salles', Salle, lambda e: Salle.etablissement_id == e, principale=True),
+
+    # Fournisseurs (logos non supprimés : le dossier contient aussi les logos fournis avec l'application)
+    Etape('fournisseurs', Depense, lambda e: (Depense.etablissement_id == e) & Depense.fournisseur_id.isnot(None),
+          detacher='fournisseur_id'),
+    Etape('fournisseurs', Fournisseur, lambda e: Fournisseur.etablissement_id == e, principale=True),
+)
+
+ELEMENTS = tuple(dict.fromkeys(etape.element for etape in ETAPES))
+_DOMAINE_INVENTAIRE = {Objet, Armoire, Categorie}
+
+
+def plan_purge(elements: Iterable[str]) -> List[Etape]:
+    """Étapes à exécuter pour la sélection, dans l'ordre global des dépendances."""
+    elements = set(elements)
+    inconnus = elements - set(ELEMENTS)
+    if inconnus or not elements:
+        raise PurgeServiceError(f"Sélection invalide : {', '.join(sorted(inconnus)) or 'vide'}")
+    return [etape for etape in ETAPES if etape.element in elements]
+
+
+# ============================================================
+# EXÉCUTION PAR LOTS
+# ============================================================
+
+def _compter(etape: Etape, etablissement_id: int) -> int:
+    return db.session.execute(
+        select(func.count()).select_from(etape.model).where(etape.filtre(etablissement_id))
+    ).scalar() or 0
+
+
+def _lot(etape: Etape, etablissement_id: int, taille: int) -> Tuple[int, List[str]]:
+    """Un lot : ids (et chemins de fichiers) lus par clé primaire, puis une seule écriture IN (...)."""
+    model = etape.model
+    table = model.__table__
+    lignes = db.session.execute(
+        select(model.id, *(getattr(model, c) for c in etape.fichiers))
+        .where(etape.filtre(etablissement_id))
+        .order_by(model.id)
+        .limit(taille)
+    ).all()
+    if not lignes:
+        return 0, []
+
+    ids = [ligne[0] for ligne in lignes]
+    if etape.detacher:
+        stmt = update(table).where(table.c.id.in_(ids)).values({etape.detacher: None})
+    else:
+        stmt = delete(table).where(table.c.id.in_(ids))
+    db.session.execute(stmt, execution_options=SANS_JOURNAL)
+    return len(ids), [chemin for ligne in lignes for chemin in ligne[1:] if chemin]
+
+
+def purger_etablissement(etablissement_id: int, elements: Iterable[str],
+                         progression: Callable[[int, int], None] = lambda fait, total: None,
+                         batch_size: int = PURGE_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Supprime les éléments sélectionnés de l'établissement, enfants avant parents, par lots de
+    `batch_size` lignes (une transaction par lot). Les fichiers uploadés des lignes supprimées
+    sont effacés après le commit de leur lot. Une purge interrompue se termine en la relançant.
+    Renvoie {élément: lignes supprimées} + 'fichiers'.
+    """
+    etapes = plan_purge(elements)
+    stats = {etape.element: 0 for etape in etapes}
+    stats['fichiers'] = 0
+
+    try:
+        # Rupture validée avant la première suppression : aucune différentielle ne peut manquer de tombstones
+        journal.rupture(etablissement_id)
+        db.session.commit()
+
+        comptes = [_compter(etape, etablissement_id) for etape in etapes]
+        total, fait = sum(comptes), 0
+        progression(0, total)
+
+        for etape, attendu in zip(etapes, comptes):
+            if not attendu:
+                continue
+            while True:
+                n, fichiers = _lot(etape, etablissement_id, batch_size)
+                if not n:
+                    break
+                if etape.model in _DOMAINE_INVENTAIRE:
+                    bump_version(etablissement_id, DOMAINE_INVENTAIRE)
+                db.session.commit()
+
+                fait += n
+                if etape.principale:
+                    stats[etape.element] += n
+                stats['fichiers'] += supprimer_images(fichiers)
+                progression(min(fait, total), total)
+                if n < batch_size:
+                    break
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erreur purge etab {etablissement_id} ({sorted(stats)}): {e}", exc_info=True)
+        raise PurgeServiceError("Erreur technique lors de la purge.") from e
+
+    logger.info(f"Purge etab {etablissement_id} : {stats}")
+    return stats
+
+
+# ============================================================
+# EXÉCUTION EN ARRIÈRE-PLAN
+# ============================================================
+
+def purge_en_cours(etablissement_id: int) -> Optional[ExportJob]:
+    return db.session.execute(
+        select(ExportJob).where(ExportJob.etablissement_id == etablissement_id,
+                                ExportJob.type_export == TYPE_JOB,
+                                ExportJob.statut.in_((JOB_EN_ATTENTE, JOB_EN_COURS)))
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def lancer_purge(etablissement_id: int, utilisateur_id: Optional[int], elements: Iterable[str]) -> ExportJob:
+    """Met la purge en file (une seule à la fois par établissement) ; le bilan est le fichier du job."""
+    elements = [etape.element for etape in ETAPES if etape.element in set(elements)]
+    plan_purge(elements)
+    if purge_en_cours(etablissement_id):
+        raise PurgeServiceError("Un reset est déjà en cours pour cet établissement.")
+    return enqueue(TYPE_JOB, 'json', etablissement_id, utilisateur_id,
+                   {'elements': list(dict.fromkeys(elements))})
+
+
+@export_job_handler(TYPE_JOB)
+def _job_purge(ctx):
+    try:
+        stats = purger_etablissement(ctx.etablissement_id, ctx.parametres.get('elements', []),
+                                     progression=ctx.progress)
+    except PurgeServiceError as e:
+        raise ExportJobError(str(e)) from e
+    with open(ctx.output_path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f)
+    supprimes = sum(v for k, v in stats.items() if k != 'fichiers')
+    return {'nom_fichier': f"reset_{ctx.job_id}.json", 'mimetype': 'application/json',
+            'message': f"{supprimes} élément(s) supprimé(s), {stats['fichiers']} fichier(s) nettoyé(s)"}
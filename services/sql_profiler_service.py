@@ -0,0 +1,207 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION (surchargée par app.config, voir installer) ---
+SEUIL_REQUETE_LENTE_MS = 200            # Une instruction SQL au-delà est journalisée
+SEUIL_REQUETES = 50                     # Requête HTTP journalisée au-delà de N instructions...
+SEUIL_DUREE_MS = 500                    # ... ou de N ms passées en base
+SEUIL_N_PLUS_1 = 10                     # Même forme d'instruction répétée N fois : N+1 probable
+LONGUEUR_LOG = 300                      # Instructions tronquées dans les logs
+
+_config = {
+    'SQL_SLOW_QUERY_MS': SEUIL_REQUETE_LENTE_MS,
+    'SQL_SLOW_REQUEST_QUERIES': SEUIL_REQUETES,
+    'SQL_SLOW_REQUEST_MS': SEUIL_DUREE_MS,
+    'SQL_N_PLUS_1_SEUIL': SEUIL_N_PLUS_1,
+}
+
+# Listes de paramètres dépliées (IN (?, ?, ?)) et littéraux : une seule forme quel que soit le nombre
+_LISTE_PARAMS = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*\)')
+_NOMBRE = re.compile(r'\b\d+\b')
+_ESPACES = re.compile(r'\s+')
+
+_mesure_courante: ContextVar[Optional['Mesure']] = ContextVar('mesure_sql', default=None)
+
+
+class BudgetSqlDepasse(AssertionError):
+    """Levée par `budget()` : AssertionError pour être rapportée comme un échec de test."""
+
+
+def forme(statement: str) -> str:
+    """Forme normalisée d'une instruction : deux appels ne différant que par leurs paramètres sont identiques."""
+    texte = _LISTE_PARAMS.sub('(?)', statement)
+    texte = _NOMBRE.sub('N', texte)
+    return _ESPACES.sub(' ', texte).strip()
+
+
+# ============================================================
+# MESURE (UNE PAR REQUÊTE HTTP OU PAR BLOC `mesurer()`)
+# ============================================================
+
+class Mesure:
+    __slots__ = ('requetes', 'duree', 'formes', 'parent')
+
+    def __init__(self, parent: Optional['Mesure'] = None):
+        self.requetes = 0
+        self.duree = 0.0            # Secondes passées dans le driver
+        self.formes: Counter = Counter()
+        self.parent = parent        # Mesure englobante (budget() autour d'un client.get())
+
+    def ajouter(self, texte: str, duree: float) -> None:
+        mesure = self
+        while mesure is not None:
+            mesure.requetes += 1
+            mesure.duree += duree
+            mesure.formes[texte] += 1
+            mesure = mesure.parent
+
+    @property
+    def duree_ms(self) -> float:
+        return self.duree * 1000
+
+    def repetitions(self, seuil: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Formes exécutées au moins `seuil` fois, les plus fréquentes d'abord."""
+        seuil = seuil or _config['SQL_N_PLUS_1_SEUIL']
+        return [(f, n) for f, n in self.formes.most_common() if n >= seuil]
+
+    def resume(self) -> Dict[str, object]:
+        return {'requetes': self.requetes, 'duree_ms': round(self.duree_ms, 2),
+                'repetitions': self.repetitions()}
+
+
+@contextmanager
+def mesurer() -> Iterator[Mesure]:
+    """Compte les instructions SQL exécutées dans le bloc (thread/contexte courant uniquement)."""
+    mesure = Mesure(_mesure_courante.get())
+    jeton = _mesure_courante.set(mesure)
+    try:
+        yield mesure
+    finally:
+        _mesure_courante.reset(jeton)
+
+
+# ============================================================
+# HOOKS SQLALCHEMY (TOUS LES ENGINES)
+# ============================================================
+# Coût hors mesure : une lecture de ContextVar et deux appels perf_counter par instruction.
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _avant(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_debuts_sql', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _apres(conn, cursor, statement, parameters, context, executemany):
+    debuts = conn.info.get('_debuts_sql')
+    if not debuts:
+        return
+    duree = time.perf_counter() - debuts.pop()
+    mesure = _mesure_courante.get()
+    if mesure is not None:
+        mesure.ajouter(forme(statement), duree)
+    if duree * 1000 >= _config['SQL_SLOW_QUERY_MS']:
+        logger.warning(f"SQL lente ({duree * 1000:.0f} ms) [{_endpoint()}] : "
+                       f"{_ESPACES.sub(' ', statement)[:LONGUEUR_LOG]}")
+
+
+@event.listens_for(Engine, 'handle_error')
+def _erreur(exception_context):
+    # Instruction en échec : after_cursor_execute n'est pas appelé, on dépile quand même
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('_debuts_sql'):
+        conn.info['_debuts_sql'].pop()
+
+
+def _endpoint() -> str:
+    try:
+        return request.endpoint or request.path
+    except RuntimeError:
+        return 'hors requête'
+
+
+# ============================================================
+# INTÉGRATION FLASK
+# ============================================================
+
+def installer(app) -> None:
+    """
+    Mesure chaque requête HTTP : journalise les requêtes trop coûteuses ou répétitives
+    et, si SQL_PROFILER_HEADERS, ajoute X-DB-Queries et Server-Timing à la réponse.
+    Les réponses en flux ne comptent que les instructions exécutées avant leur envoi.
+    """
+    for cle in _config:
+        if cle in app.config:
+            _config[cle] = app.config[cle]
+
+    @app.before_request
+    def _debut_mesure_sql():
+        mesure = Mesure(_mesure_courante.get())
+        request.environ['sql_profiler.mesure'] = mesure
+        request.environ['sql_profiler.jeton'] = _mesure_courante.set(mesure)
+
+    @app.after_request
+    def _fin_mesure_sql(response):
+        mesure = request.environ.get('sql_profiler.mesure')
+        if mesure is None:
+            return response
+        if app.config.get('SQL_PROFILER_HEADERS'):
+            response.headers['X-DB-Queries'] = str(mesure.requetes)
+            response.headers.add('Server-Timing', f'db;dur={mesure.duree_ms:.1f};desc="{mesure.requetes} SQL"')
+        _journaliser(mesure)
+        return response
+
+    @app.teardown_request
+    def _liberer_mesure_sql(exc):
+        jeton = request.environ.pop('sql_profiler.jeton', None)
+        if jeton is not None:
+            try:
+                _mesure_courante.reset(jeton)
+            except ValueError:
+                _mesure_courante.set(None)     # Jeton d'un autre contexte (copy_current_request_context)
+
+
+def _journaliser(mesure: Mesure) -> None:
+    repetees = mesure.repetitions()
+    trop = (mesure.requetes > _config['SQL_SLOW_REQUEST_QUERIES']
+            or mesure.duree_ms > _config['SQL_SLOW_REQUEST_MS'])
+    if not trop and not repetees:
+        return
+    message = f"{request.method} {request.path} [{_endpoint()}] : {mesure.requetes} SQL, {mesure.duree_ms:.0f} ms"
+    for texte, n in repetees[:3]:
+        message += f"\n  N+1 probable ({n}x) : {texte[:LONGUEUR_LOG]}"
+    logger.warning(message)
+
+
+# ============================================================
+# BUDGET DE REQUÊTES (TESTS)
+# ============================================================
+
+@contextmanager
+def budget(maximum: int, repetitions_max: Optional[int] = None) -> Iterator[Mesure]:
+    """
+    Échoue (BudgetSqlDepasse) si le bloc exécute plus de `maximum` instructions, ou une même
+    forme plus de `repetitions_max` fois. Le client de test Flask exécute la requête dans le
+    même thread : `with budget(8): client.get('/inventaire/')` couvre toute la vue.
+    """
+    with mesurer() as mesure:
+        yield mesure
+    erreurs = []
+    if mesure.requetes > maximum:
+        erreurs.append(f"{mesure.requetes} instructions SQL pour un budget de {maximum}")
+    if repetitions_max is not None:
+        for texte, n in mesure.repetitions(repetitions_max + 1):
+            erreurs.append(f"{n}x la même forme (max {repetitions_max}) : {texte[:LONGUEUR_LOG]}")
+    if erreurs:
+        detail = '\n'.join(f"  {n}x {f[:LONGUEUR_LOG]}" for f, n in mesure.formes.most_common(5))
+        raise BudgetSqlDepasse('\n'.join(erreurs) + f"\nFormes les plus fréquentes :\n{detail}")
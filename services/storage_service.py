@@ -0,0 +1,515 @@
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import click
+from flask import Response, current_app, redirect, request, send_file, stream_with_context
+from flask.cli import AppGroup
+from sqlalchemy import event, func, select, update
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import NotFound
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import secure_filename
+
+from db import db, DocumentReglementaire, InventaireArchive
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION (surchargée par app.config) ---
+DEFAULT_WORKERS = 4                     # Envois vers le stockage distant en parallèle (STORAGE_WORKERS)
+DOSSIER_CLOUDINARY = 'scientral'        # Préfixe des public_id : scientral/<etab>/docs/...
+HOTE_CLOUDINARY = 'res.cloudinary.com'  # Seul hôte accepté pour les anciennes URL (compte CLOUDINARY_CLOUD_NAME)
+SUFFIXE_ATTENTE = '.attente'            # Marqueur « copie distante à faire » posé à côté du fichier local
+TAILLE_BLOC = 1024 * 1024
+TAILLE_MORCEAU = 256 * 1024             # Blob en base : une requête substr() par morceau envoyé
+
+_CLOUDINARY_URL = re.compile(r'/raw/upload/(?:v\d+/)?(.+)$')
+
+
+class StorageServiceError(Exception):
+    """Fichier introuvable ou stockage impossible."""
+    pass
+
+
+# ============================================================
+# BACKENDS
+# ============================================================
+# Un backend ne dépend pas du contexte Flask : les envois s'exécutent dans des threads.
+
+class StockageLocal:
+    """Fichiers sous un dossier privé (hors static/) : servis par la vue après contrôle d'accès."""
+    nom = 'local'
+
+    def __init__(self, racine: str):
+        self.racine = os.path.abspath(racine)
+
+    def chemin(self, cle: str) -> str:
+        chemin = os.path.abspath(os.path.join(self.racine, cle))
+        if not chemin.startswith(self.racine + os.sep):
+            raise StorageServiceError(f"Clé de stockage invalide : {cle}")
+        return chemin
+
+    def ecrire(self, cle: str, source) -> None:
+        """Copie atomique depuis un chemin ou un flux : un lecteur ne voit jamais un fichier partiel."""
+        destination = self.chemin(cle)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        tmp = f"{destination}.{uuid.uuid4().hex}.tmp"
+        try:
+            if isinstance(source, str):
+                shutil.copyfile(source, tmp)
+            else:
+                source.seek(0)
+                with open(tmp, 'wb') as f:
+                    shutil.copyfileobj(source, f, TAILLE_BLOC)
+            os.replace(tmp, destination)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def supprimer(self, cle: str) -> None:
+        for chemin in (self.chemin(cle), self.chemin(cle) + SUFFIXE_ATTENTE):
+            try:
+                os.remove(chemin)
+            except FileNotFoundError:
+                pass
+
+    def url(self, cle: str) -> Optional[str]:
+        return None
+
+
+class StockageCloudinary:
+    """Copie durable sur Cloudinary (fichiers « raw »), alimentée en arrière-plan depuis le stockage local."""
+    nom = 'cloudinary'
+
+    def __init__(self, dossier: str = DOSSIER_CLOUDINARY):
+        self.dossier = dossier
+
+    def public_id(self, cle: str) -> str:
+        return f"{self.dossier}/{cle}"
+
+    def ecrire(self, cle: str, source) -> None:
+        import cloudinary.uploader
+        cloudinary.uploader.upload(source, public_id=self.public_id(cle), resource_type='raw',
+                                   access_mode='public', overwrite=True)
+
+    def supprimer(self, cle: str) -> None:
+        import cloudinary.uploader
+        cloudinary.uploader.destroy(self.public_id(cle), resource_type='raw')
+
+    def supprimer_url(self, url: str) -> None:
+        """Anciennes lignes (fichier_url = secure_url) : public_id relu dans l'URL."""
+        m = _CLOUDINARY_URL.search(url)
+        if not m:
+            raise StorageServiceError(f"URL Cloudinary non reconnue : {url}")
+        import cloudinary.uploader
+        cloudinary.uploader.destroy(m.group(1), resource_type='raw')
+
+    def url(self, cle: str) -> Optional[str]:
+        import cloudinary.utils
+        return cloudinary.utils.cloudinary_url(self.public_id(cle), resource_type='raw', secure=True)[0]
+
+
+def _local() -> StockageLocal:
+    racine = current_app.config.get('STORAGE_DIR') or os.path.join(current_app.instance_path, 'storage')
+    os.makedirs(racine, exist_ok=True)
+    return StockageLocal(racine)
+
+
+def _distant() -> Optional[StockageCloudinary]:
+    """Backend distant configuré (STORAGE_BACKEND), None en stockage purement local."""
+    if current_app.config.get('STORAGE_BACKEND', 'local') == 'cloudinary':
+        return StockageCloudinary(current_app.config.get('STORAGE_CLOUDINARY_FOLDER', DOSSIER_CLOUDINARY))
+    return None
+
+
+# ============================================================
+# CLÉS
+# ============================================================
+# fichier_url contient une clé relative ('12/docs/1700000000_duerp.pdf') ; les lignes plus
+# anciennes gardent leur URL Cloudinary complète et restent servies par redirection.
+
+def est_externe(valeur: Optional[str]) -> bool:
+    return bool(valeur) and valeur.startswith(('http://', 'https://'))
+
+
+def appartient(etablissement_id: int, valeur: Optional[str]) -> bool:
+    """
+    True si `valeur` désigne un fichier de l'établissement : clé '<etab>/...' sans remontée de
+    dossier, ou ancienne URL Cloudinary du compte configuré rangée sous scientral/<etab>/.
+    Une ligne restaurée ou modifiée ne doit ni lire, ni supprimer, ni rediriger ailleurs.
+    """
+    if not valeur:
+        return False
+    prefixe = f"{int(etablissement_id)}/"
+    if est_externe(valeur):
+        url = urlsplit(valeur)
+        compte = current_app.config.get('CLOUDINARY_CLOUD_NAME')
+        if not compte or url.scheme != 'https' or url.netloc != HOTE_CLOUDINARY \
+                or not url.path.startswith(f"/{compte}/raw/upload/"):
+            return False
+        m = _CLOUDINARY_URL.search(url.path)
+        # Anciennes lignes : dossier toujours 'scientral' (antérieur à STORAGE_CLOUDINARY_FOLDER)
+        return bool(m) and posixpath.normpath(m.group(1)).startswith(f"{DOSSIER_CLOUDINARY}/{prefixe}")
+    return valeur.startswith(prefixe) and posixpath.normpath(valeur) == valeur and '\\' not in valeur
+
+
+def cle_document(etablissement_id: int, nom_fichier: str) -> str:
+    return f"{int(etablissement_id)}/docs/{int(datetime.now().timestamp())}_{secure_filename(nom_fichier)}"
+
+
+def cle_archive(etablissement_id: int, titre: str) -> str:
+    return f"{int(etablissement_id)}/archives/{secure_filename(titre.replace(' ', '_'))}.pdf"
+
+
+# ============================================================
+# FILE D'ENVOI (THREADS : TRAVAIL RÉSEAU, PAS CPU)
+# ============================================================
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Pool réutilisé entre requêtes ; recréé après un fork."""
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            workers = current_app.config.get('STORAGE_WORKERS', DEFAULT_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stockage')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _repliquer(local: StockageLocal, distant: StockageCloudinary, cle: str) -> None:
+    """Envoie la copie locale ; le marqueur n'est retiré qu'après succès (sinon `flask stockage repliquer`)."""
+    chemin = local.chemin(cle)
+    if not os.path.exists(chemin + SUFFIXE_ATTENTE):
+        return      # Déjà envoyé, ou supprimé entre-temps
+    distant.ecrire(cle, chemin)
+    try:
+        os.remove(chemin + SUFFIXE_ATTENTE)
+    except FileNotFoundError:
+        pass
+
+
+def _supprimer_distant(distant: StockageCloudinary, valeur: str) -> None:
+    if est_externe(valeur):
+        distant.supprimer_url(valeur)
+    else:
+        distant.supprimer(valeur)
+
+
+def _executer(tache, *args) -> None:
+    if current_app.config.get('STORAGE_UPLOAD_INLINE'):
+        try:
+            tache(*args)
+        except Exception as e:
+            logger.error(f"Stockage distant en échec ({args[-1]}) : {e}")
+        return
+    try:
+        future = _get_executor().submit(tache, *args)
+    except RuntimeError as e:
+        logger.error(f"File d'envoi indisponible, envoi différé : {e}")
+        return
+
+    def callback(f):
+        if f.exception():
+            logger.error(f"Stockage distant en échec ({args[-1]}) : {f.exception()}")
+    future.add_done_callback(callback)
+
+
+# ============================================================
+# ÉCRITURE ET SUPPRESSION (LIÉES AU COMMIT)
+# ============================================================
+# Le fichier local est écrit tout de suite (disque, rapide) ; l'envoi distant et les
+# suppressions attendent le commit : une transaction annulée ne laisse aucun fichier.
+
+_EN_ATTENTE = 'stockage_en_attente'
+
+
+def enregistrer(cle: str, source) -> str:
+    """
+    Écrit `source` (chemin ou flux) sous `cle` dans le stockage local et renvoie la clé à mettre
+    en base. Avec un backend distant, la copie part en arrière-plan après le commit de la session.
+    """
+    local = _local()
+    try:
+        local.ecrire(cle, source)
+        if _distant() is not None:
+            open(local.chemin(cle) + SUFFIXE_ATTENTE, 'w').close()
+    except OSError as e:
+        logger.error(f"Stockage local impossible ({cle}) : {e}", exc_info=True)
+        raise StorageServiceError("Erreur technique lors de l'enregistrement du fichier.") from e
+    db.session.connection()     # Transaction ouverte : son rollback (ou sa fermeture) retire le fichier
+    db.session.info.setdefault(_EN_ATTENTE, []).append(('ecrire', cle))
+    return cle
+
+
+def supprimer(etablissement_id: int, valeur: Optional[str]) -> None:
+    """
+    Supprime le fichier (clé ou ancienne URL) une fois la suppression de la ligne validée.
+    Valeur hors de l'établissement : rien n'est supprimé.
+    """
+    if not valeur:
+        return
+    if not appartient(etablissement_id, valeur):
+        logger.warning(f"SECURITY: suppression refusée, fichier hors établissement {etablissement_id} : {valeur}")
+        return
+    db.session.info.setdefault(_EN_ATTENTE, []).append(('supprimer', valeur))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apres_commit(session):
+    operations = session.info.pop(_EN_ATTENTE, [])
+    if not operations:
+        return
+    local, distant = _local(), _distant()
+    for operation, valeur in operations:
+        try:
+            if operation == 'ecrire':
+                if distant is not None:
+                    _executer(_repliquer, local, distant, valeur)
+            else:
+                if not est_externe(valeur):
+                    local.supprimer(valeur)
+                if distant is not None:
+                    _executer(_supprimer_distant, distant, valeur)
+        except Exception as e:
+            logger.error(f"Stockage : {operation} {valeur} impossible : {e}", exc_info=True)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _abandonner_sans_commit(session, transaction):
+    # Après un commit la liste est déjà vide ; sinon les fichiers écrits pour la transaction sont retirés
+    if transaction.nested or transaction.parent is not None:
+        return
+    operations = session.info.pop(_EN_ATTENTE, [])
+    ecrits = [valeur for operation, valeur in operations if operation == 'ecrire']
+    if not ecrits:
+        return
+    try:
+        local = _local()
+        for cle in ecrits:
+            local.supprimer(cle)
+    except Exception as e:
+        logger.warning(f"Nettoyage stockage après annulation impossible : {e}")
+
+
+# ============================================================
+# TÉLÉCHARGEMENT
+# ============================================================
+
+def envoyer(etablissement_id: int, valeur: str, nom_fichier: Optional[str] = None) -> Response:
+    """
+    Réponse de téléchargement : fichier local servi avec Range / If-None-Match (ou délégué au
+    serveur frontal via X-Sendfile / X-Accel-Redirect), redirection vers la copie distante si le
+    disque local ne l'a pas (autre instance, disque éphémère), ancienne URL redirigée telle quelle.
+    NotFound (404) si la valeur n'appartient pas à l'établissement (voir `appartient`).
+    """
+    if not appartient(etablissement_id, valeur):
+        logger.warning(f"SECURITY: téléchargement refusé, fichier hors établissement {etablissement_id} : {valeur}")
+        raise NotFound()
+    if est_externe(valeur):
+        return redirect(valeur)
+
+    local = _local()
+    chemin = local.chemin(valeur)
+    nom_fichier = nom_fichier or os.path.basename(valeur)
+    if os.path.isfile(chemin):
+        prefixe = current_app.config.get('STORAGE_X_ACCEL_PREFIX')
+        if prefixe:
+            # nginx : `location /protected-storage/ { internal; alias <STORAGE_DIR>/; }`
+            response = Response(mimetype=mimetypes.guess_type(nom_fichier)[0] or 'application/octet-stream')
+            response.headers.set('Content-Disposition', 'inline', filename=nom_fichier)
+            response.headers['X-Accel-Redirect'] = f"{prefixe.rstrip('/')}/{valeur}"
+            return response
+        # USE_X_SENDFILE (Apache, lighttpd) est appliqué par send_file lui-même
+        return send_file(chemin, download_name=nom_fichier, conditional=True, max_age=0)
+
+    distant = _distant()
+    if distant is not None:
+        return redirect(distant.url(valeur))
+    raise StorageServiceError("Fichier introuvable.")
+
+
+# ============================================================
+# BLOBS EN BASE (ANCIEN STOCKAGE fichier_pdf)
+# ============================================================
+# La colonne est différée : ni la liste ni le chargement d'une ligne ne lisent le PDF. Le
+# téléchargement le lit par morceaux (substr côté base), seulement sur la plage demandée.
+
+def _taille_blob(colonne, ligne_id: int) -> Optional[int]:
+    model = colonne.class_
+    return db.session.execute(select(func.length(colonne)).where(model.id == ligne_id)).scalar()
+
+
+def _lire_blob(colonne, ligne_id: int, debut: int, fin: int) -> Iterator[bytes]:
+    """Octets [debut, fin) du blob, morceau par morceau : jamais le blob entier en mémoire."""
+    model = colonne.class_
+    position = debut
+    while position < fin:
+        n = min(TAILLE_MORCEAU, fin - position)
+        morceau = db.session.execute(
+            select(func.substr(colonne, position + 1, n)).where(model.id == ligne_id)
+        ).scalar()
+        if not morceau:
+            break
+        yield bytes(morceau)
+        position += len(morceau)
+
+
+def envoyer_blob(colonne, ligne_id: int, nom_fichier: str,
+                 modifie_le: Optional[datetime] = None) -> Optional[Response]:
+    """
+    `nom_fichier` sans extension. Réponse de téléchargement d'un blob en base (Range, If-Range, If-None-Match, If-Modified-Since),
+    ou None si la ligne n'a pas de blob (fichier dans le stockage : voir `envoyer`).
+    """
+    taille = _taille_blob(colonne, ligne_id)
+    if not taille:
+        return None
+    etag = f"{colonne.class_.__tablename__}-{ligne_id}-{taille}"
+    # Colonne « fichier_pdf » mais les documents acceptent aussi des images : type lu dans l'en-tête
+    nom_fichier = f"{nom_fichier}.{_extension_blob(next(_lire_blob(colonne, ligne_id, 0, 8), b''))}"
+    mimetype = mimetypes.guess_type(nom_fichier)[0] or 'application/octet-stream'
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=modifie_le):
+        response = Response(status=304)
+    else:
+        debut, fin, statut = 0, taille, 200
+        plage = request.range
+        # If-Range périmé : le fichier complet est renvoyé à la place de la plage
+        if plage is not None and (not request.headers.get('If-Range') or not is_resource_modified(
+                request.environ, etag=etag, last_modified=modifie_le, ignore_if_range=False)):
+            bornes = plage.range_for_length(taille)
+            if bornes is None:
+                response = Response(status=416)
+                response.headers['Content-Range'] = f"bytes */{taille}"
+                return response
+            (debut, fin), statut = bornes, 206
+        response = Response(stream_with_context(_lire_blob(colonne, ligne_id, debut, fin)),
+                            status=statut, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = fin - debut
+        if statut == 206:
+            response.headers['Content-Range'] = f"bytes {debut}-{fin - 1}/{taille}"
+        response.headers.set('Content-Disposition', 'inline', filename=nom_fichier)
+
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = modifie_le
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _extension_blob(entete: bytes) -> str:
+    if entete.startswith(b'\x89PNG'):
+        return 'png'
+    if entete.startswith(b'\xff\xd8'):
+        return 'jpg'
+    return 'pdf'
+
+
+def migrer_blob(model, ligne_id: int) -> str:
+    """
+    Copie le blob de la ligne dans le stockage (flux, par morceaux), pointe fichier_url sur la
+    nouvelle clé et vide fichier_pdf, dans une transaction. L'ancienne URL éventuelle est conservée
+    côté distant (aucune suppression). Renvoie la clé.
+    """
+    colonne = model.fichier_pdf
+    taille = _taille_blob(colonne, ligne_id) or 0
+    ligne = db.session.get(model, ligne_id)
+    local = _local()
+    tmp = os.path.join(local.racine, f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, 'wb') as f:
+            for morceau in _lire_blob(colonne, ligne_id, 0, taille):
+                f.write(morceau)
+        with open(tmp, 'rb') as f:
+            extension = _extension_blob(f.read(8))
+        if model is DocumentReglementaire:
+            cle = cle_document(ligne.etablissement_id, f"{ligne_id}_{ligne.nom}.{extension}")
+        else:
+            cle = cle_archive(ligne.etablissement_id, f"{ligne.titre or 'Inventaire'}_{ligne_id}")
+        enregistrer(cle, tmp)
+        db.session.execute(update(model).where(model.id == ligne_id).values(fichier_url=cle, fichier_pdf=None))
+        db.session.commit()
+        return cle
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# ============================================================
+# CLI : flask stockage ...
+# ============================================================
+stockage_cli = AppGroup('stockage', help="Stockage des documents et archives.")
+
+
+def _en_attente(local: StockageLocal) -> List[Tuple[str, str]]:
+    fichiers = []
+    for dossier, _, noms in os.walk(local.racine):
+        for nom in noms:
+            if nom.endswith(SUFFIXE_ATTENTE):
+                chemin = os.path.join(dossier, nom[:-len(SUFFIXE_ATTENTE)])
+                fichiers.append((os.path.relpath(chemin, local.racine).replace(os.sep, '/'), chemin))
+    return sorted(fichiers)
+
+
+@stockage_cli.command('repliquer')
+def repliquer_command():
+    """Envoie au stockage distant les fichiers restés en attente (worker arrêté, API indisponible)."""
+    distant = _distant()
+    if distant is None:
+        click.echo("Stockage local uniquement (STORAGE_BACKEND=local) : rien à répliquer.")
+        return
+    local = _local()
+    envoyes = 0
+    for cle, chemin in _en_attente(local):
+        if not os.path.isfile(chemin):
+            os.remove(chemin + SUFFIXE_ATTENTE)
+            continue
+        try:
+            _repliquer(local, distant, cle)
+            envoyes += 1
+        except Exception as e:
+            click.echo(f"{cle} : {e}")
+    click.echo(f"{envoyes} fichier(s) répliqué(s).")
+
+
+@stockage_cli.command('migrer-blobs')
+@click.option('--simulation', is_flag=True, help="Compte les blobs sans rien déplacer.")
+def migrer_blobs_command(simulation):
+    """Sort les fichiers stockés en base (fichier_pdf) vers le stockage de fichiers, une ligne par transaction."""
+    migres = octets = erreurs = 0
+    for model in (DocumentReglementaire, InventaireArchive):
+        ids = db.session.execute(
+            select(model.id).where(model.fichier_pdf.isnot(None)).order_by(model.id)
+        ).scalars().all()
+        for ligne_id in ids:
+            taille = _taille_blob(model.fichier_pdf, ligne_id) or 0
+            if simulation:
+                migres += 1
+                octets += taille
+                continue
+            try:
+                migrer_blob(model, ligne_id)
+                migres += 1
+                octets += taille
+            except Exception as e:
+                erreurs += 1
+                click.echo(f"{model.__tablename__} #{ligne_id} : {e}")
+    prefixe = "À migrer" if simulation else "Migrés"
+    click.echo(f"{prefixe} : {migres} fichier(s), {octets / 1024 / 1024:.1f} Mo ; {erreurs} erreur(s).")
@@ -0,0 +1,335 @@
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import click
+from flask import current_app, request
+from flask.cli import AppGroup
+from sqlalchemy import func, select, update
+
+from db import db, Objet, Armoire, Parametre
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION (surchargée par app.config) ---
+RACINE = 'uploads/cas'                  # Fichiers nommés par empreinte : uploads/cas/ab/cd/<sha256>.<ext>
+DEFAULT_GRACE_MINUTES = 60              # Un blob non référencé plus récent que ça n'est jamais supprimé
+CACHE_IMMUABLE = 365 * 24 * 3600        # Contenu d'une URL de blob : jamais modifié
+CHEMINS_PAR_REQUETE = 500
+TAILLE_BLOC = 1024 * 1024
+
+_BLOB = re.compile(r'^uploads/cas/([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(?:_[a-z]+)?\.[a-z0-9]+$')
+
+# Colonnes qui référencent des fichiers uploadés (compteur de références = lignes qui pointent le blob),
+# avec le filtre qui restreint la table aux lignes concernées. Toutes indexées.
+COLONNES_REFERENCES = (
+    (Objet.image_url, None),
+    (Objet.fds_url, None),
+    (Armoire.photo_url, None),
+    (Parametre.valeur, Parametre.cle == 'logo_url'),
+)
+
+
+class UploadServiceError(Exception):
+    """Fichier refusé ou stockage impossible."""
+    pass
+
+
+# ============================================================
+# NOMMAGE
+# ============================================================
+
+def chemin_blob(empreinte: str, extension: str) -> str:
+    """Répertoires à deux niveaux (65 536 feuilles) : aucun dossier ne grossit indéfiniment."""
+    return f"{RACINE}/{empreinte[:2]}/{empreinte[2:4]}/{empreinte}.{extension.lower()}"
+
+
+def est_blob(chemin: Optional[str]) -> bool:
+    """Blob ou variante d'un blob (miniatures : même empreinte, suffixe _taille)."""
+    return bool(chemin) and _BLOB.match(chemin) is not None
+
+
+def empreinte_de(chemin: str) -> Optional[str]:
+    m = _BLOB.match(chemin or '')
+    return m.group(3) if m else None
+
+
+def _static_path(relative_path: str) -> str:
+    return os.path.join(current_app.root_path, 'static', relative_path)
+
+
+def _grace() -> float:
+    return current_app.config.get('UPLOAD_GC_GRACE_MINUTES', DEFAULT_GRACE_MINUTES) * 60
+
+
+# ============================================================
+# ÉCRITURE
+# ============================================================
+
+def copier_en_hachant(file_obj, destination: str) -> Tuple[str, int]:
+    """Copie le flux dans `destination` en calculant son SHA-256 au passage (une seule lecture)."""
+    sha = hashlib.sha256()
+    taille = 0
+    file_obj.seek(0)
+    with open(destination, 'wb') as f:
+        while True:
+            bloc = file_obj.read(TAILLE_BLOC)
+            if not bloc:
+                break
+            sha.update(bloc)
+            f.write(bloc)
+            taille += len(bloc)
+    return sha.hexdigest(), taille
+
+
+def hacher(file_obj) -> str:
+    """SHA-256 du flux, lu par blocs, sans copie."""
+    sha = hashlib.sha256()
+    file_obj.seek(0)
+    for bloc in iter(lambda: file_obj.read(TAILLE_BLOC), b''):
+        sha.update(bloc)
+    return sha.hexdigest()
+
+
+def toucher(chemin: str) -> bool:
+    """Blob déjà présent : sa date est rafraîchie pour le protéger du GC jusqu'au commit. False s'il manque."""
+    try:
+        os.utime(_static_path(chemin))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def stocker(file_obj, extension: str) -> str:
+    """
+    Enregistre le fichier sous son empreinte et renvoie le chemin à mettre en base.
+    Contenu déjà stocké (même fichier envoyé pour 40 produits) : rien n'est réécrit.
+    """
+    tmp_dir = _static_path(f"{RACINE}/tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.tmp")
+    try:
+        empreinte, taille = copier_en_hachant(file_obj, tmp)
+        if not taille:
+            raise UploadServiceError("Fichier vide.")
+        chemin = chemin_blob(empreinte, extension)
+        if toucher(chemin):
+            os.remove(tmp)
+            return chemin
+        os.makedirs(os.path.dirname(_static_path(chemin)), exist_ok=True)
+        os.replace(tmp, _static_path(chemin))    # Atomique : deux envois simultanés écrivent le même contenu
+        return chemin
+    except OSError as e:
+        logger.error(f"Stockage upload impossible : {e}", exc_info=True)
+        raise UploadServiceError("Erreur technique lors de l'enregistrement du fichier.") from e
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# ============================================================
+# RÉFÉRENCES ET LIBÉRATION
+# ============================================================
+
+def references(chemins: Iterable[str]) -> Dict[str, int]:
+    """Nombre de lignes qui pointent chaque chemin (toutes tables et tous établissements confondus)."""
+    chemins = list(dict.fromkeys(c for c in chemins if c))
+    comptes: Dict[str, int] = {c: 0 for c in chemins}
+    for i in range(0, len(chemins), CHEMINS_PAR_REQUETE):
+        lot = chemins[i:i + CHEMINS_PAR_REQUETE]
+        for colonne, filtre in COLONNES_REFERENCES:
+            stmt = select(colonne, func.count()).where(colonne.in_(lot))
+            if filtre is not None:
+                stmt = stmt.where(filtre)
+            for chemin, n in db.session.execute(stmt.group_by(colonne)):
+                comptes[chemin] += n
+    return comptes
+
+
+def _fichiers_du_blob(empreinte: str) -> List[str]:
+    """Le blob et ses variantes : tous les fichiers de la feuille qui commencent par l'empreinte."""
+    dossier = _static_path(f"{RACINE}/{empreinte[:2]}/{empreinte[2:4]}")
+    try:
+        return [os.path.join(dossier, nom) for nom in os.listdir(dossier) if nom.startswith(empreinte)]
+    except FileNotFoundError:
+        return []
+
+
+def _supprimer_si_ancien(fichiers: List[str], limite: float) -> Tuple[int, int]:
+    """Supprime le groupe seulement si aucun fichier n'a été touché depuis `limite` (relu juste avant)."""
+    try:
+        if any(os.path.getmtime(f) > limite for f in fichiers):
+            return 0, 0
+    except FileNotFoundError:
+        pass
+    supprimes = octets = 0
+    for f in fichiers:
+        try:
+            taille = os.path.getsize(f)
+            os.remove(f)
+            supprimes += 1
+            octets += taille
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.warning(f"Echec suppression blob {f}: {e}")
+    return supprimes, octets
+
+
+def liberer(chemins: Iterable[str]) -> int:
+    """
+    Après le commit qui a retiré des références : supprime tout de suite les blobs (et variantes)
+    qui ne sont plus référencés nulle part. Un blob touché récemment (envoi identique en cours)
+    est laissé au GC. Renvoie le nombre de blobs supprimés.
+    """
+    blobs = {c for c in chemins if est_blob(c)}
+    if not blobs:
+        return 0
+    limite = time.time() - _grace()
+    supprimes = 0
+    for chemin, n in references(blobs).items():
+        if n:
+            continue
+        fichiers = _fichiers_du_blob(empreinte_de(chemin))
+        if fichiers and _supprimer_si_ancien(fichiers, limite)[0]:
+            supprimes += 1
+    return supprimes
+
+
+# ============================================================
+# GARBAGE COLLECTOR
+# ============================================================
+
+def _empreintes_referencees() -> Set[str]:
+    empreintes = set()
+    for colonne, filtre in COLONNES_REFERENCES:
+        stmt = select(colonne).where(colonne.like(f"{RACINE}/%"))
+        if filtre is not None:
+            stmt = stmt.where(filtre)
+        for chemin in db.session.execute(stmt.distinct()).scalars():
+            empreinte = empreinte_de(chemin)
+            if empreinte:
+                empreintes.add(empreinte)
+    return empreintes
+
+
+def collecter(grace_minutes: Optional[int] = None, simulation: bool = False) -> Dict[str, int]:
+    """
+    Marque (empreintes référencées en base) puis balaie uploads/cas : un blob non référencé et
+    dont aucun fichier n'a bougé depuis le délai de grâce est supprimé avec ses variantes.
+    Les temporaires abandonnés sont nettoyés au passage.
+    """
+    grace = _grace() if grace_minutes is None else grace_minutes * 60
+    limite = time.time() - grace
+    vivantes = _empreintes_referencees()
+    stats = {'blobs': 0, 'conserves': 0, 'fichiers': 0, 'octets': 0}
+
+    racine = _static_path(RACINE)
+    if not os.path.isdir(racine):
+        return stats
+
+    for dossier, _, noms in os.walk(racine):
+        groupes: Dict[str, List[str]] = {}
+        for nom in noms:
+            chemin = os.path.join(dossier, nom)
+            if nom.endswith('.tmp'):
+                if os.path.getmtime(chemin) < limite and not simulation:
+                    os.remove(chemin)
+                continue
+            groupes.setdefault(nom[:64], []).append(chemin)
+        for empreinte, fichiers in groupes.items():
+            if empreinte in vivantes:
+                stats['conserves'] += 1
+                continue
+            if simulation:
+                if all(os.path.getmtime(f) <= limite for f in fichiers):
+                    stats['blobs'] += 1
+                    stats['fichiers'] += len(fichiers)
+                    stats['octets'] += sum(os.path.getsize(f) for f in fichiers)
+                continue
+            n, octets = _supprimer_si_ancien(fichiers, limite)
+            if n:
+                stats['blobs'] += 1
+                stats['fichiers'] += n
+                stats['octets'] += octets
+
+    logger.info(f"GC uploads : {stats}")
+    return stats
+
+
+# ============================================================
+# EN-TÊTES DE CACHE
+# ============================================================
+
+def cache_immuable(response):
+    """after_request : une URL de blob désigne toujours le même contenu (empreinte dans le nom)."""
+    if request.path.startswith(f"/static/{RACINE}/") and response.status_code in (200, 206, 304):
+        response.cache_control.public = True
+        response.cache_control.max_age = CACHE_IMMUABLE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+# ============================================================
+# CLI : flask uploads ...
+# ============================================================
+uploads_cli = AppGroup('uploads', help="Stockage des fichiers uploadés (par empreinte).")
+
+
+@uploads_cli.command('gc')
+@click.option('--grace', type=int, default=None, help="Minutes de grâce (défaut : UPLOAD_GC_GRACE_MINUTES).")
+@click.option('--simulation', is_flag=True, help="Affiche ce qui serait supprimé.")
+def gc_command(grace, simulation):
+    """Supprime les blobs qui ne sont plus référencés (à planifier, ex. chaque nuit)."""
+    stats = collecter(grace, simulation)
+    prefixe = "À supprimer" if simulation else "Supprimés"
+    click.echo(f"{prefixe} : {stats['blobs']} blob(s), {stats['fichiers']} fichier(s), "
+               f"{stats['octets'] / 1024 / 1024:.1f} Mo ; conservés : {stats['conserves']}.")
+
+
+@uploads_cli.command('migrer')
+def migrer_command():
+    """
+    Déplace les anciens uploads (noms horodatés, ARM_<uuid>) vers le stockage par empreinte,
+    fusionne les doublons et réécrit les chemins en base. Lancer ensuite `flask images variantes`.
+    """
+    from services.image_service import variantes
+
+    migres = fusionnes = manquants = 0
+    deja: Dict[str, str] = {}
+    for colonne, filtre in COLONNES_REFERENCES:
+        lignes = select(colonne).distinct() if filtre is None else select(colonne).where(filtre).distinct()
+        anciens = [c for c in db.session.execute(lignes).scalars()
+                   if c and c.startswith('uploads/') and not est_blob(c)]
+        for ancien in anciens:
+            nouveau = deja.get(ancien)
+            if nouveau is None:
+                source = _static_path(ancien)
+                if not os.path.isfile(source):
+                    manquants += 1
+                    continue
+                extension = ancien.rsplit('.', 1)[-1].lower() if '.' in ancien else 'bin'
+                with open(source, 'rb') as f:
+                    nouveau = stocker(f, extension)
+                fusionnes += references([nouveau])[nouveau] > 0
+                deja[ancien] = nouveau
+                migres += 1
+            cible = update(colonne.class_).where(colonne == ancien)
+            if filtre is not None:
+                cible = cible.where(filtre)
+            db.session.execute(cible.values({colonne.key: nouveau}))
+            db.session.commit()
+
+    # Anciens fichiers (et leurs miniatures) supprimés une fois toutes les références réécrites
+    for ancien in deja:
+        for chemin in [ancien] + variantes(ancien):
+            try:
+                os.remove(_static_path(chemin))
+            except FileNotFoundError:
+                pass
+    click.echo(f"{migres} fichier(s) migré(s) dont {fusionnes} doublon(s) fusionné(s) ; {manquants} introuvable(s).")
@@ -0,0 +1,102 @@
+import logging
+import time
+from datetime import datetime
+from itertools import chain
+from typing import Dict, Optional
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from db import db, VersionDonnees, Objet, Armoire, Categorie, Parametre
+
+logger = logging.getLogger(__name__)
+
+DOMAINE_INVENTAIRE = 'inventaire'
+DOMAINE_THEME = 'theme'
+DOMAINE_PARAMETRES = 'parametres'
+
+# Modèles dont toute écriture (ORM) change le contenu d'un domaine (exports d'inventaire, paramètres)
+_TRACKED_MODELS = {Objet: DOMAINE_INVENTAIRE, Armoire: DOMAINE_INVENTAIRE, Categorie: DOMAINE_INVENTAIRE,
+                   Parametre: DOMAINE_PARAMETRES}
+
+
+def _nouvelle_version() -> int:
+    # Horodatage et non un compteur : une ligne recréée (base neuve, id d'établissement réutilisé)
+    # ne retombe jamais sur une version déjà vue par un cache qui a survécu (fichiers d'export)
+    return time.time_ns()
+
+
+def _upsert(connection, etablissement_id: int, domaine: str) -> None:
+    """Nouvelle version jamais réutilisée, ligne créée au besoin (atomique sous PostgreSQL et SQLite)."""
+    table = VersionDonnees.__table__
+    now = datetime.now()
+    version = _nouvelle_version()
+    values = {'etablissement_id': etablissement_id, 'domaine': domaine, 'version': version, 'date_maj': now}
+    dialect = connection.dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(**values).on_conflict_do_update(
+            index_elements=['etablissement_id', 'domaine'],
+            set_={'version': version, 'date_maj': now}
+        )
+        connection.execute(stmt)
+        return
+
+    result = connection.execute(
+        update(table)
+        .where(table.c.etablissement_id == etablissement_id, table.c.domaine == domaine)
+        .values(version=version, date_maj=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(**values))
+
+
+def bump_version(etablissement_id: int, domaine: str) -> None:
+    """
+    Change explicitement la version d'un domaine (écritures hors ORM : suppressions en masse,
+    SQL brut, thème). S'exécute dans la transaction courante : l'appelant commit.
+    """
+    if etablissement_id:
+        _upsert(db.session.connection(), etablissement_id, domaine)
+
+
+def get_versions(etablissement_id: int) -> Dict[str, int]:
+    """Toutes les versions d'un établissement en une requête (0 si jamais écrit)."""
+    rows = db.session.execute(
+        select(VersionDonnees.domaine, VersionDonnees.version)
+        .where(VersionDonnees.etablissement_id == etablissement_id)
+    ).all()
+    return {domaine: version for domaine, version in rows}
+
+
+def get_version(etablissement_id: int, domaine: str) -> int:
+    return get_versions(etablissement_id).get(domaine, 0)
+
+
+def _etablissement_of(obj) -> Optional[int]:
+    # Lecture sans chargement paresseux (interdit pendant un flush)
+    return obj.__dict__.get('etablissement_id')
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_flush(session, flush_context):
+    """Change la version des domaines touchés par le flush, dans la même transaction que l'écriture."""
+    touched = set()
+    for obj in chain(session.new, session.deleted, session.dirty):
+        domaine = _TRACKED_MODELS.get(type(obj))
+        if not domaine:
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        etablissement_id = _etablissement_of(obj)
+        if etablissement_id:
+            touched.add((etablissement_id, domaine))
+
+    if touched:
+        connection = session.connection()
+        for etablissement_id, domaine in touched:
+            _upsert(connection, etablissement_id, domaine)
@@ -0,0 +1,56 @@
+/**
+ * Exports en arrière-plan : mise en file, suivi de progression, téléchargement.
+ * Le serveur répond 202 avec l'URL de statut ; on interroge jusqu'à la fin
+ * puis on déclenche le téléchargement du fichier généré.
+ */
+const POLL_INTERVAL_MS = 1500;
+const POLL_TIMEOUT_MS = 15 * 60 * 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+/**
+ * @param {string} url Route d'export (ex: /admin/exporter_inventaire).
+ * @param {URLSearchParams} params Paramètres de l'export (mode=async ajouté ici).
+ * @param {function(number):void} onProgress Callback recevant la progression (0-100).
+ */
+export async function lancerExportAsync(url, params, onProgress = () => {}) {
+    params.set('mode', 'async');
+    const response = await fetch(`${url}?${params.toString()}`, {
+        headers: { 'Accept': 'application/json' }
+    });
+
+    const contentType = response.headers.get('content-type') || '';
+    if (!contentType.includes('application/json')) {
+        throw new Error("Session expirée ou réponse inattendue du serveur.");
+    }
+    const data = await response.json();
+    if (!data.success) {
+        throw new Error(data.error || "Export refusé.");
+    }
+
+    const started = Date.now();
+    let job = data.job;
+    while (job.statut === 'en_attente' || job.statut === 'en_cours') {
+        onProgress(job.progression || 0);
+        if (Date.now() - started > POLL_TIMEOUT_MS) {
+            throw new Error("La génération prend trop de temps, réessayez plus tard.");
+        }
+        await sleep(POLL_INTERVAL_MS);
+        const statusResponse = await fetch(data.status_url, { headers: { 'Accept': 'application/json' } });
+        if (statusResponse.status === 503) {
+            continue;   // Statut momentanément illisible (base verrouillée) : on réessaie
+        }
+        const status = await statusResponse.json();
+        if (!status.success) {
+            throw new Error(status.error || "Export introuvable.");
+        }
+        job = status.job;
+    }
+
+    if (job.statut !== 'termine') {
+        throw new Error(job.message || "Erreur lors de la génération.");
+    }
+    onProgress(100);
+    window.location.href = data.download_url;
+    return job;
+}
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+# Configuration de test (base SQLite en mémoire, traitements en ligne) avant l'import de l'application
+os.environ['FLASK_ENV'] = 'testing'
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('GMLCL_PRO_KEY', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from db import db, Etablissement, Utilisateur, Parametre  # noqa: E402
+from services.sql_profiler_service import budget  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Application neuve par test : chaque create_app ouvre sa propre base en mémoire."""
+    app = create_app()
+    app.config['RATELIMIT_ENABLED'] = False
+    app.config['STORAGE_DIR'] = str(tmp_path / 'storage')
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def static_tmp(app, tmp_path, monkeypatch):
+    """Racine d'application temporaire : les uploads (static/uploads/cas) ne touchent pas le dépôt."""
+    monkeypatch.setattr(app, 'root_path', str(tmp_path))
+    os.makedirs(tmp_path / 'static', exist_ok=True)
+    return tmp_path / 'static'
+
+
+@pytest.fixture
+def etablissement(app):
+    """Établissement PRO avec son administrateur."""
+    etab = Etablissement(nom='Lycée Test')
+    db.session.add(etab)
+    db.session.flush()
+    admin = Utilisateur(nom_utilisateur='admin', mot_de_passe='x', role='admin', etablissement_id=etab.id)
+    db.session.add(admin)
+    db.session.add(Parametre(cle='licence_statut', valeur='PRO', etablissement_id=etab.id))
+    db.session.commit()
+    return etab, admin
+
+
+@pytest.fixture
+def client(app, etablissement):
+    """Client de test connecté en administrateur."""
+    etab, admin = etablissement
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user_id'] = admin.id
+        s['etablissement_id'] = etab.id
+        s['user_role'] = 'admin'
+        s['nom_etablissement'] = etab.nom
+    return client
+
+
+@pytest.fixture
+def budget_sql():
+    """`with budget_sql(8): client.get(...)` : échec si la vue dépasse son budget d'instructions SQL."""
+    return budget
@@ -0,0 +1,23 @@
+from services import export_job_service as jobs
+
+
+def test_echec_de_l_inventaire_annuel_affiche(client, monkeypatch):
+    def _echec(ctx):
+        raise jobs.ExportJobError("Rendu PDF impossible : délai dépassé.")
+    monkeypatch.setitem(jobs._HANDLERS, 'inventaire_annuel', _echec)
+
+    client.post('/admin/documents/generer_inventaire')
+    page = client.get('/admin/documents').get_data(as_text=True)
+
+    assert 'Échec de la génération' in page
+    assert 'Rendu PDF impossible : délai dépassé.' in page
+
+
+def test_inventaire_annuel_en_attente_suivi(client, monkeypatch):
+    monkeypatch.setattr(jobs, '_dispatch', lambda: None)     # Aucun worker : le job reste en file
+
+    client.post('/admin/documents/generer_inventaire')
+    page = client.get('/admin/documents').get_data(as_text=True)
+
+    assert 'job-inventaire' in page
+    assert "l'archive apparaîtra ci-dessous" in page
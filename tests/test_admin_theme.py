@@ -0,0 +1,29 @@
+import io
+
+from db import db, Parametre
+
+
+SVG = (b'<svg xmlns="http://www.w3.org/2000/svg" onload="alert(document.cookie)">'
+       b'<script>fetch("/admin/")</script></svg>')
+
+
+def test_logo_svg_refuse(client, etablissement):
+    etab, _ = etablissement
+    r = client.post('/admin/theme', data={'action': 'logo', 'logo_file': (io.BytesIO(SVG), 'logo.svg')},
+                    content_type='multipart/form-data')
+
+    assert r.status_code == 302
+    with client.session_transaction() as s:
+        assert [cat for cat, _ in s['_flashes']] == ['error']
+    assert db.session.execute(db.select(Parametre.valeur).filter_by(
+        etablissement_id=etab.id, cle='logo_url')).scalar() is None
+
+
+def test_logo_svg_deguise_refuse(client, etablissement):
+    etab, _ = etablissement
+    r = client.post('/admin/theme', data={'action': 'logo', 'logo_file': (io.BytesIO(SVG), 'logo.png')},
+                    content_type='multipart/form-data')
+
+    assert r.status_code == 302
+    assert db.session.execute(db.select(Parametre.valeur).filter_by(
+        etablissement_id=etab.id, cle='logo_url')).scalar() is None
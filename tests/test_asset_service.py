@@ -0,0 +1,23 @@
+from flask import render_template_string
+
+from services.asset_service import asset_url, manifeste
+
+
+def test_asset_url_empreinte_et_url_for_inchange(app):
+    app.config['ASSETS_FINGERPRINT'] = True
+    empreinte = manifeste()['css/style.css']
+
+    with app.test_request_context():
+        assert asset_url('css/style.css') == f"/assets/{empreinte}"
+        assert asset_url('images/favicon.png') == '/static/images/favicon.png'
+        # url_for reste celui de Flask, y compris pour l'endpoint static
+        assert render_template_string("{{ url_for('static', filename='css/style.css') }}") == '/static/css/style.css'
+
+    html = app.test_client().get('/login').get_data(as_text=True)
+    assert f"/assets/{empreinte}" in html
+
+
+def test_asset_url_sans_empreinte(app):
+    app.config['ASSETS_FINGERPRINT'] = False
+    with app.test_request_context():
+        assert asset_url('css/style.css') == '/static/css/style.css'
@@ -0,0 +1,124 @@
+import gzip
+import io
+import json
+from datetime import date
+
+from db import db, Armoire, Categorie, Objet, Salle, Parametre, Budget, Depense, DocumentReglementaire
+from services import journal_service as journal
+from services.backup_service import generer_sauvegarde, restaurer_sauvegarde
+
+
+def _inventaire(etab_id):
+    armoire = Armoire(nom='Armoire A', etablissement_id=etab_id)
+    categorie = Categorie(nom='Verrerie', etablissement_id=etab_id)
+    db.session.add_all([armoire, categorie])
+    db.session.flush()
+    db.session.add(Objet(nom='Bécher 100 mL', quantite_physique=12, seuil=2, armoire_id=armoire.id,
+                         categorie_id=categorie.id, date_peremption=date(2030, 1, 1), etablissement_id=etab_id))
+    budget = Budget(annee=2025, montant_initial=1000, etablissement_id=etab_id)
+    db.session.add(budget)
+    db.session.flush()
+    db.session.add(Depense(budget_id=budget.id, contenu='Réactifs', montant=12.5,
+                           date_depense=date(2025, 3, 1), etablissement_id=etab_id))
+    db.session.add(Salle(nom='Labo 1', etablissement_id=etab_id))
+    db.session.add(Parametre(cle='couleur_principale', valeur='#123456', etablissement_id=etab_id))
+    db.session.commit()
+
+
+def _etat(etab_id):
+    objet = db.session.execute(db.select(Objet).filter_by(etablissement_id=etab_id)).scalar_one()
+    depense = db.session.execute(db.select(Depense).filter_by(etablissement_id=etab_id)).scalar_one()
+    return {
+        'objet': (objet.nom, objet.quantite_physique, objet.armoire.nom, objet.categorie.nom, objet.date_peremption),
+        'depense': (depense.contenu, depense.montant, depense.budget.annee),
+        'salles': [s.nom for s in db.session.execute(db.select(Salle).filter_by(etablissement_id=etab_id)).scalars()],
+        'couleur': db.session.execute(db.select(Parametre.valeur).filter_by(
+            etablissement_id=etab_id, cle='couleur_principale')).scalar(),
+    }
+
+
+def test_restauration_ndjson_aller_retour(etablissement):
+    etab, admin = etablissement
+    _inventaire(etab.id)
+    avant = _etat(etab.id)
+    sauvegarde = b''.join(generer_sauvegarde(etab.id, etab.nom))
+
+    stats = restaurer_sauvegarde(io.BytesIO(sauvegarde), etab.id, admin.id)
+
+    assert stats['ignorees'] == 0
+    assert stats['tables']['objets'] == 1
+    assert _etat(etab.id) == avant
+
+
+def test_restauration_v1_conserve_les_tables_hors_format(etablissement):
+    etab, admin = etablissement
+    _inventaire(etab.id)
+    v1 = {
+        'metadata': {},
+        'armoires': [{'id': 9, 'nom': 'Armoire B'}],
+        'categories': [{'id': 3, 'nom': 'Optique'}],
+        'fournisseurs': [],
+        'objets': [{'id': 1, 'nom': 'Lentille', 'quantite': 4, 'seuil': 1, 'armoire_id': 9, 'categorie_id': 3,
+                    'date_peremption': '2027-01-01', 'image_url': None, 'fds_url': None}],
+        'budget': [{'id': 5, 'annee': 2024, 'montant': 300, 'cloture': False}],
+        'depenses': [{'budget_id': 5, 'date': '2024-03-01', 'contenu': 'Lampes', 'montant': 3,
+                      'est_bon_achat': False, 'fournisseur_id': None}],
+        'echeances': [],
+    }
+
+    restaurer_sauvegarde(io.BytesIO(json.dumps(v1).encode()), etab.id, admin.id)
+
+    etat = _etat(etab.id)
+    assert etat['objet'] == ('Lentille', 4, 'Armoire B', 'Optique', date(2027, 1, 1))
+    assert etat['depense'] == ('Lampes', 3, 2024)
+    # Absents du format v1 : ni purgés, ni modifiés
+    assert etat['salles'] == ['Labo 1']
+    assert etat['couleur'] == '#123456'
+
+
+def test_restauration_ignore_les_fichiers_d_un_autre_etablissement(etablissement, caplog):
+    etab, admin = etablissement
+    _inventaire(etab.id)
+    autre = etab.id + 1
+    db.session.add_all([
+        DocumentReglementaire(etablissement_id=etab.id, nom='DUERP', fichier_url=f'{etab.id}/docs/1_duerp.pdf'),
+        DocumentReglementaire(etablissement_id=etab.id, nom='Volé', fichier_url=f'{autre}/docs/1_secret.pdf'),
+        DocumentReglementaire(etablissement_id=etab.id, nom='Lien', fichier_url='https://evil.example/a.pdf'),
+    ])
+    db.session.commit()
+    sauvegarde = b''.join(generer_sauvegarde(etab.id, etab.nom))
+
+    stats = restaurer_sauvegarde(io.BytesIO(sauvegarde), etab.id, admin.id)
+
+    noms = db.session.execute(db.select(DocumentReglementaire.nom).filter_by(etablissement_id=etab.id)).scalars().all()
+    assert noms == ['DUERP']
+    assert stats['ignorees'] == 2
+    assert 'fichier hors établissement' in caplog.text
+
+
+def test_differentielle_apres_suppressions_contient_les_tombstones(etablissement):
+    etab, admin = etablissement
+    _inventaire(etab.id)
+    db.session.add(Salle(nom='Labo 2', etablissement_id=etab.id))
+    db.session.commit()
+    complete = b''.join(generer_sauvegarde(etab.id, etab.nom))
+    depuis = journal.sequence_courante()
+
+    objet = db.session.execute(db.select(Objet).filter_by(etablissement_id=etab.id)).scalar_one()
+    objet_id = objet.id
+    db.session.delete(objet)
+    salle_id = db.session.execute(db.select(Salle.id).filter_by(nom='Labo 2')).scalar_one()
+    db.session.execute(db.delete(Salle).where(Salle.id == salle_id))  # suppression en masse
+    db.session.commit()
+
+    differentielle = b''.join(generer_sauvegarde(etab.id, etab.nom, depuis=depuis))
+    lignes = [json.loads(l) for l in gzip.decompress(differentielle).splitlines()]
+
+    assert lignes[0]['mode'] == 'differentiel'
+    assert {'t': 'objets', 'd': objet_id} in lignes
+    assert {'t': 'salles', 'd': salle_id} in lignes
+
+    restaurer_sauvegarde([io.BytesIO(complete), io.BytesIO(differentielle)], etab.id, admin.id)
+    assert db.session.execute(db.select(Objet).filter_by(etablissement_id=etab.id)).first() is None
+    assert [s.nom for s in db.session.execute(db.select(Salle).filter_by(etablissement_id=etab.id)).scalars()] \
+        == ['Labo 1']
@@ -0,0 +1,51 @@
+import os
+
+from db import db, Objet, VersionDonnees
+from services import export_cache_service as export_cache
+from services.version_service import DOMAINE_INVENTAIRE, DOMAINE_THEME, bump_version, get_version
+
+
+def _cle(etab_id, **filtres):
+    return export_cache.cache_key(etab_id, 'inventaire', 'pdf', filtres, 'Lycée Test')
+
+
+def test_cle_suit_les_versions_des_donnees(etablissement):
+    etab, _ = etablissement
+    cle = _cle(etab.id)
+    assert _cle(etab.id) == cle
+    assert _cle(etab.id, armoire=3) != cle
+    assert export_cache.cache_key(etab.id, 'inventaire', 'pdf', {}, 'Autre titre') != cle
+
+    db.session.add(Objet(nom='Bécher', etablissement_id=etab.id))
+    db.session.commit()
+    apres_objet = _cle(etab.id)
+    assert apres_objet != cle
+
+    bump_version(etab.id, DOMAINE_THEME)
+    db.session.commit()
+    assert _cle(etab.id) not in (cle, apres_objet)
+
+
+def test_version_jamais_reutilisee_apres_recreation(etablissement):
+    etab, _ = etablissement
+    bump_version(etab.id, DOMAINE_INVENTAIRE)
+    db.session.commit()
+    ancienne = get_version(etab.id, DOMAINE_INVENTAIRE)
+
+    # Base recréée : la ligne de version repart de zéro
+    db.session.execute(db.delete(VersionDonnees))
+    bump_version(etab.id, DOMAINE_INVENTAIRE)
+    db.session.commit()
+    assert get_version(etab.id, DOMAINE_INVENTAIRE) > ancienne
+
+
+def test_eviction_lru(app, tmp_path):
+    app.config['EXPORT_CACHE_DIR'] = str(tmp_path / 'exports')
+    for i, cle in enumerate(('a', 'b', 'c')):
+        chemin = export_cache.put_bytes(cle, 'pdf', b'x' * 100)
+        os.utime(chemin, (1000 + i, 1000 + i))
+    assert export_cache.get('a', 'pdf')          # Servi : redevient le plus récent
+
+    assert export_cache.evict(max_bytes=200) == 1
+    assert export_cache.get('b', 'pdf') is None
+    assert export_cache.get('a', 'pdf') and export_cache.get('c', 'pdf')
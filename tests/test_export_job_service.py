@@ -0,0 +1,56 @@
+from sqlalchemy.exc import OperationalError
+
+from services import export_job_service as jobs
+
+
+@jobs.export_job_handler('test_texte')
+def _job_texte(ctx):
+    with open(ctx.output_path, 'w') as f:
+        f.write('ok')
+    return {'nom_fichier': 'test.txt', 'mimetype': 'text/plain'}
+
+
+def _base_verrouillee(*args, **kwargs):
+    raise OperationalError('SELECT ...', {}, Exception('database is locked'))
+
+
+def test_statut_d_un_job_termine(client, etablissement):
+    etab, admin = etablissement
+    job = jobs.enqueue('test_texte', 'csv', etab.id, admin.id, {})
+
+    data = client.get(f'/admin/exports/{job.id}/statut').get_json()
+
+    assert data['job']['statut'] == 'termine'
+    assert data['job']['download_url'].endswith(f'/admin/exports/{job.id}/telecharger')
+    assert client.get(data['job']['download_url']).get_data() == b'ok'
+
+
+def test_base_verrouillee_dernier_statut_connu(client, etablissement, monkeypatch):
+    etab, admin = etablissement
+    job = jobs.enqueue('test_texte', 'csv', etab.id, admin.id, {})
+    client.get(f'/admin/exports/{job.id}/statut')
+    monkeypatch.setattr(jobs, 'get_job', _base_verrouillee)
+
+    r = client.get(f'/admin/exports/{job.id}/statut')
+
+    assert r.status_code == 200
+    assert r.get_json()['job']['statut'] == 'termine'
+    assert r.get_json()['job']['perime'] is True
+
+
+def test_base_verrouillee_statut_inconnu(client, etablissement, monkeypatch):
+    monkeypatch.setattr(jobs, 'get_job', _base_verrouillee)
+
+    r = client.get('/admin/exports/inconnu/statut')
+
+    assert r.status_code == 503
+    assert r.get_json()['retry'] is True
+    assert r.headers['Retry-After'] == '2'
+
+
+def test_statut_cloisonne_par_etablissement(app, client, etablissement, monkeypatch):
+    etab, admin = etablissement
+    job = jobs.enqueue('test_texte', 'csv', etab.id + 1, None, {})
+    monkeypatch.setattr(jobs, 'get_job', _base_verrouillee)
+
+    assert client.get(f'/admin/exports/{job.id}/statut').status_code == 503
@@ -0,0 +1,47 @@
+import io
+import os
+
+from PIL import Image
+
+from db import db
+from services import image_service
+from services.image_service import chemin_variante, enregistrer_image, image_src
+
+
+def _jpeg(couleur='blue') -> io.BytesIO:
+    out = io.BytesIO()
+    Image.new('RGB', (800, 600), couleur).save(out, format='JPEG')
+    out.seek(0)
+    return out
+
+
+def test_original_servi_avant_le_commit(app, static_tmp):
+    chemin = enregistrer_image(_jpeg())
+
+    assert (static_tmp / chemin).exists()
+    with app.test_request_context():
+        assert image_src(chemin, 'thumb') == f"/static/{chemin}"
+        assert image_src(chemin, 'thumb', 'webp') is None
+
+    db.session.commit()
+    assert (static_tmp / chemin_variante(chemin, 'thumb', 'webp')).exists()
+    assert (static_tmp / chemin_variante(chemin, 'original', 'webp')).exists()
+
+
+def test_envois_simultanes_du_meme_fichier(app, static_tmp, monkeypatch):
+    # Les deux requêtes passent le test d'existence avant que l'une d'elles n'ait écrit l'original
+    monkeypatch.setattr(image_service, 'toucher', lambda chemin: False)
+    premier, second = enregistrer_image(_jpeg('red')), enregistrer_image(_jpeg('red'))
+    assert premier == second
+
+    db.session.commit()
+    assert (static_tmp / chemin_variante(premier, 'medium', 'jpg')).exists()
+    assert not [f for f in os.listdir(static_tmp / os.path.dirname(premier)) if f.endswith('.tmp')]
+
+
+def test_original_supprime_avant_les_variantes(app, static_tmp):
+    chemin = enregistrer_image(_jpeg('green'))
+    os.remove(static_tmp / chemin)
+
+    db.session.commit()
+    assert not (static_tmp / chemin_variante(chemin, 'thumb', 'jpg')).exists()
@@ -0,0 +1,99 @@
+import io
+
+from openpyxl import Workbook
+from werkzeug.datastructures import FileStorage
+
+from db import db, Armoire, Categorie, Historique, ImportLigne, Objet
+from services import import_service
+from services.import_service import (ImportService, creer_session, iter_rapport, lancer_validation,
+                                     peut_reprendre, LIGNE_VALIDE, STATUT_EN_COURS, STATUT_PRET, STATUT_TERMINE)
+from services.sql_profiler_service import mesurer
+
+
+def _references(etab_id):
+    db.session.add_all([Armoire(nom='Armoire A', etablissement_id=etab_id),
+                        Categorie(nom='Verrerie', etablissement_id=etab_id)])
+    db.session.add(Objet(nom='Bécher existant', etablissement_id=etab_id))
+    db.session.commit()
+
+
+def _classeur(lignes) -> FileStorage:
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Nom', 'Quantité', 'Seuil', 'Armoire', 'Catégorie', 'Date Péremption'])
+    for ligne in lignes:
+        ws.append(ligne)
+    out = io.BytesIO()
+    wb.save(out)
+    out.seek(0)
+    return FileStorage(out, filename='import.xlsx')
+
+
+def test_insertion_par_lots(etablissement, budget_sql):
+    etab, admin = etablissement
+    _references(etab.id)
+    service = ImportService(etab.id, admin.id)
+    service.charger_references()
+    # Colonnes facultatives renseignées une ligne sur deux : le lot reste une seule instruction
+    lot = [service.valider_ligne({'Nom': f"Pipette {i}", 'Quantité': 3, 'Seuil': '1',
+                                  'Armoire': 'armoire a', 'Catégorie': 'VERRERIE',
+                                  'Date Péremption': '2030-01-01' if i % 2 else None,
+                                  'Image (URL)': None if i % 2 else f"https://exemple.fr/{i}.jpg"})[0]
+           for i in range(1500)]
+
+    # Un INSERT par table (objets, historique, journal) et la lecture des ids, quel que soit le nombre de lignes
+    with budget_sql(6):
+        ids = service.inserer_lot(lot)
+    db.session.commit()
+
+    noms = dict(db.session.execute(db.select(Objet.id, Objet.nom).where(Objet.id.in_(ids))).all())
+    assert [noms[i] for i in ids] == [p['nom'] for p in lot]
+    assert db.session.execute(db.select(db.func.count()).select_from(Historique)).scalar() == 1500
+    assert service.valider_ligne({'Nom': 'pipette 7', 'Quantité': 1, 'Seuil': 0,
+                                  'Armoire': 'Armoire A', 'Catégorie': 'Verrerie'}) == (None, None)
+
+
+def test_import_en_deux_phases_avec_reprise(etablissement, monkeypatch):
+    etab, admin = etablissement
+    _references(etab.id)
+    fichier = _classeur([[f"Fiole {i}", 2, 1, 'Armoire A', 'Verrerie', None] for i in range(5)] + [
+        ['Bécher existant', 1, 0, 'Armoire A', 'Verrerie', None],     # doublon
+        ['Éprouvette', 'beaucoup', 0, 'Armoire A', 'Verrerie', None],  # erreur
+        ['Burette', 1, 0, 'Armoire Z', 'Verrerie', None],              # erreur
+    ])
+
+    # Phase 1 : analyse vers la zone de transit, rien n'est encore créé
+    with mesurer() as mesure:
+        import_session = creer_session(etab.id, admin.id, fichier, 'import.xlsx')
+    assert sum(n for forme, n in mesure.formes.items() if forme.startswith('INSERT INTO import_lignes')) == 1
+    assert import_session.statut == STATUT_PRET
+    assert (import_session.nb_valides, import_session.nb_erreurs, import_session.nb_ignores) == (5, 2, 1)
+    assert db.session.execute(db.select(db.func.count()).select_from(Objet)).scalar() == 1
+    assert [r[1] for r in iter_rapport(import_session.id)] == [
+        "Doublon : objet déjà présent", "Quantité et seuil doivent être des entiers positifs",
+        "Armoire ou Catégorie inconnue"]
+
+    # Phase 2 interrompue après le premier lot
+    monkeypatch.setattr(import_service, 'IMPORT_CHUNK_SIZE', 2)
+    inserer_lot, appels = ImportService.inserer_lot, []
+
+    def interrompu(self, lot):
+        appels.append(len(lot))
+        if len(appels) == 2:
+            raise RuntimeError("worker arrêté")
+        return inserer_lot(self, lot)
+
+    monkeypatch.setattr(ImportService, 'inserer_lot', interrompu)
+    lancer_validation(import_session)
+    db.session.refresh(import_session)
+    assert import_session.statut == STATUT_EN_COURS and import_session.nb_importes == 2
+    assert peut_reprendre(import_session)
+
+    # Reprise : seules les lignes encore 'valide' sont importées
+    lancer_validation(import_session)
+    db.session.refresh(import_session)
+    assert import_session.statut == STATUT_TERMINE and import_session.nb_importes == 5
+    noms = db.session.execute(db.select(Objet.nom).filter(Objet.nom.like('Fiole %'))).scalars().all()
+    assert sorted(noms) == [f"Fiole {i}" for i in range(5)]
+    assert db.session.execute(db.select(db.func.count()).select_from(ImportLigne).filter_by(
+        session_id=import_session.id, statut=LIGNE_VALIDE)).scalar() == 0
@@ -0,0 +1,47 @@
+import pytest
+from limits.strategies import SlidingWindowCounterRateLimiter
+
+from db import db, Parametre
+from extensions import limiter
+from services.limiter_service import LIMITE_LICENCE, SqliteStorage
+from utils import reset_license_limit
+
+
+@pytest.fixture
+def limiter_actif(app, monkeypatch):
+    monkeypatch.setattr(limiter, 'enabled', True)
+    limiter.reset()
+    yield limiter
+    limiter.reset()
+
+
+def _tenter(client):
+    client.post('/admin/activer_licence', data={'licence_cle': 'MAUVAISE-CLE-0000'})
+    with client.session_transaction() as s:
+        return [message for _, message in s.pop('_flashes', [])]
+
+
+def test_sixieme_tentative_de_licence_refusee(client, etablissement, limiter_actif):
+    etab, _ = etablissement
+    db.session.add(Parametre(cle='instance_id', valeur='instance-test', etablissement_id=etab.id))
+    db.session.commit()
+
+    for _ in range(5):
+        assert _tenter(client) == ["Clé incorrecte."]
+    assert _tenter(client) == ["Trop de tentatives. Réessayez dans 15 min."]
+
+    reset_license_limit(etab.id)
+    assert _tenter(client) == ["Clé incorrecte."]
+
+
+def test_stockage_sqlite_partage_fenetre_glissante(tmp_path):
+    chemin = tmp_path / 'limiter.db'
+    premier = SlidingWindowCounterRateLimiter(SqliteStorage(f"sqlite:///{chemin}"))
+    second = SlidingWindowCounterRateLimiter(SqliteStorage(f"sqlite:///{chemin}"))   # autre worker
+
+    assert all((premier if i % 2 else second).hit(LIMITE_LICENCE, 'licence', 1) for i in range(5))
+    assert not premier.hit(LIMITE_LICENCE, 'licence', 1)
+    assert premier.hit(LIMITE_LICENCE, 'licence', 2)        # autre établissement
+
+    second.clear(LIMITE_LICENCE, 'licence', 1)
+    assert premier.hit(LIMITE_LICENCE, 'licence', 1)
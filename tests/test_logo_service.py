@@ -0,0 +1,74 @@
+import io
+import json
+import os
+import time
+
+from PIL import Image
+
+from db import db
+from services import logo_service
+from services import parametre_service as parametres
+
+
+def _png() -> bytes:
+    out = io.BytesIO()
+    Image.new('RGB', (10, 10), 'red').save(out, format='PNG')
+    return out.getvalue()
+
+
+class _Reponse:
+    status_code = 304
+    headers = {}
+    content = b''
+
+
+def test_copie_perimee_servie_sans_reseau_puis_revalidee(app, etablissement, tmp_path, monkeypatch):
+    etab, _ = etablissement
+    app.config['LOGO_CACHE_DIR'] = str(tmp_path / 'logos')
+    url = 'https://res.cloudinary.com/demo/image/upload/logo.png'
+    parametres.definir(etab.id, 'logo_url', url)
+    db.session.commit()
+
+    png_path, meta_path = logo_service._paths(etab.id)
+    with open(png_path, 'wb') as f:
+        f.write(b'ancien')
+    with open(meta_path, 'w') as f:
+        json.dump({'url': url, 'etag': '"v1"', 'last_modified': None}, f)
+    perime = time.time() - 2 * logo_service.LOGO_REVALIDATE_SECONDS
+    os.utime(meta_path, (perime, perime))
+
+    appels, threads = [], []
+    monkeypatch.setattr(logo_service.requests, 'get', lambda u, **kw: appels.append(kw) or _Reponse())
+
+    class _Thread:
+        def __init__(self, target, args, **kw):
+            threads.append((target, args))
+
+        def start(self):
+            pass
+
+    monkeypatch.setattr(logo_service.threading, 'Thread', _Thread)
+
+    assert logo_service.get_logo_bytes(etab.id) == b'ancien'
+    assert appels == [] and len(threads) == 1
+    # Une seule revalidation en vol par établissement
+    assert logo_service.get_logo_bytes(etab.id) == b'ancien'
+    assert len(threads) == 1
+
+    target, args = threads[0]
+    target(*args)
+    assert appels[0]['headers'] == {'If-None-Match': '"v1"'}
+    assert time.time() - os.stat(meta_path).st_mtime < 60
+    assert logo_service.get_logo_bytes(etab.id) == b'ancien'
+    assert len(threads) == 1
+
+
+def test_logo_local_hors_static_refuse(app, etablissement, tmp_path):
+    etab, _ = etablissement
+    app.config['LOGO_CACHE_DIR'] = str(tmp_path / 'logos')
+    secret = tmp_path / 'secret.png'
+    secret.write_bytes(_png())
+    parametres.definir(etab.id, 'logo_url', os.path.relpath(secret, os.path.join(app.root_path, 'static')))
+    db.session.commit()
+
+    assert logo_service.get_logo_bytes(etab.id) is None
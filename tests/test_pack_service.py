@@ -0,0 +1,30 @@
+from db import db, Armoire, Categorie, Objet
+from services.pack_service import PACKS, importer_pack
+from services.version_service import DOMAINE_INVENTAIRE, get_version
+
+
+def test_import_de_pack_ensembliste_et_idempotent(etablissement, budget_sql):
+    etab, _ = etablissement
+    pack = next(iter(PACKS.values()))
+    db.session.add(Armoire(nom=pack.armoires[0][0], etablissement_id=etab.id))   # déjà créée à la main
+    db.session.commit()
+
+    # Nombre d'instructions indépendant de la taille du pack
+    with budget_sql(13, repetitions_max=3):
+        stats = importer_pack(pack.id, etab.id)
+
+    assert stats == {'armoires': len(pack.armoires) - 1, 'categories': len(pack.categories),
+                     'objets': len(pack.objets), 'ignores': 0}
+    armoires = dict(db.session.execute(db.select(Armoire.nom, Armoire.id).filter_by(etablissement_id=etab.id)).all())
+    categories = dict(db.session.execute(
+        db.select(Categorie.nom, Categorie.id).filter_by(etablissement_id=etab.id)).all())
+    rattaches = {nom: (a, c) for nom, a, c in db.session.execute(
+        db.select(Objet.nom, Objet.armoire_id, Objet.categorie_id).filter_by(etablissement_id=etab.id))}
+    for armoire, categorie, colonnes in pack.objets:
+        assert rattaches[colonnes['nom']] == (armoires[armoire], categories[categorie])
+    version = get_version(etab.id, DOMAINE_INVENTAIRE)
+    assert version
+
+    assert importer_pack(pack.id, etab.id) == {'armoires': 0, 'categories': 0, 'objets': 0,
+                                               'ignores': len(pack.objets)}
+    assert get_version(etab.id, DOMAINE_INVENTAIRE) == version
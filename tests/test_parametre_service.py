@@ -0,0 +1,71 @@
+from sqlalchemy import insert
+
+from db import db, Armoire, Parametre
+from services import parametre_service as parametres
+from services.sql_profiler_service import mesurer
+
+
+def test_ecriture_d_un_autre_worker_vue_a_la_requete_suivante(app, etablissement, monkeypatch):
+    etab, _ = etablissement
+    parametres.definir(etab.id, 'couleur_principale', '#111111')
+    db.session.commit()
+
+    # Un contexte d'application par requête, comme en production (flask.g neuf)
+    with app.app_context():
+        assert parametres.texte(etab.id, 'couleur_principale') == '#111111'
+
+        # Écriture d'un autre worker : la mémoire de ce processus n'est pas prévenue
+        with monkeypatch.context() as m:
+            m.setattr(parametres, 'oublier', lambda etablissement_id=None: None)
+            parametres.definir(etab.id, 'couleur_principale', '#222222')
+            db.session.commit()
+        # Une requête ne relit la version qu'une fois par établissement
+        assert parametres.texte(etab.id, 'couleur_principale') == '#111111'
+
+    with app.app_context():
+        assert parametres.texte(etab.id, 'couleur_principale') == '#222222'
+
+
+def test_definir_concurrent_sans_integrity_error(app, etablissement, monkeypatch):
+    etab, _ = etablissement
+    db.session.add(Armoire(nom='Armoire A', etablissement_id=etab.id))
+    begin_nested = db.session.begin_nested
+
+    def creation_concurrente():
+        # L'autre requête insère la même clé entre la lecture et l'insertion de definir
+        monkeypatch.setattr(db.session, 'begin_nested', begin_nested)
+        db.session.execute(insert(Parametre).values(etablissement_id=etab.id, cle='planning_debut', valeur='08:00'))
+        return begin_nested()
+
+    monkeypatch.setattr(db.session, 'begin_nested', creation_concurrente)
+    parametres.definir(etab.id, 'planning_debut', '07:30')
+    db.session.commit()
+
+    lignes = db.session.execute(db.select(Parametre.valeur).filter_by(
+        etablissement_id=etab.id, cle='planning_debut')).scalars().all()
+    assert lignes == ['07:30']
+    assert db.session.execute(db.select(Armoire).filter_by(etablissement_id=etab.id)).scalar_one().nom == 'Armoire A'
+    assert parametres.texte(etab.id, 'planning_debut') == '07:30'
+
+
+def test_second_niveau_partage_entre_workers(app, etablissement, monkeypatch):
+    etab, _ = etablissement
+    parametres.definir(etab.id, 'couleur_principale', '#333333')
+    db.session.commit()
+    with app.app_context():
+        assert parametres.texte(etab.id, 'couleur_principale') == '#333333'
+
+    # Worker qui démarre : mémoire vide, la version chargée par un autre est lue dans le cache partagé
+    parametres.oublier()
+    with app.app_context(), mesurer() as mesure:
+        assert parametres.texte(etab.id, 'couleur_principale') == '#333333'
+    assert not [f for f in mesure.formes if 'FROM parametres' in f]
+
+    # Cache partagé indisponible : lecture directe en base
+    def panne(*args, **kwargs):
+        raise ConnectionError("redis arrêté")
+
+    parametres.oublier()
+    monkeypatch.setattr(parametres.cache, 'get', panne)
+    with app.app_context():
+        assert parametres.texte(etab.id, 'couleur_principale') == '#333333'
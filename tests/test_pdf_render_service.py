@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from services import pdf_render_service
+from services.pdf_render_service import PdfRenderError, render_pdf
+
+
+# Renderers de module : exécutés dans les processus de rendu (spawn)
+def _lent(secondes, output):
+    time.sleep(secondes)
+    output.write(b'%PDF lent')
+
+
+def _rapide(output):
+    output.write(b'%PDF rapide')
+
+
+@pytest.fixture
+def pool(app, monkeypatch):
+    """Vrai pool de rendu (2 workers), échéance courte."""
+    app.config.update(PDF_RENDER_INLINE=False, PDF_WORKERS=2, PDF_RENDER_TIMEOUT=3)
+    monkeypatch.setattr(pdf_render_service, '_libres', None)
+    monkeypatch.setattr(pdf_render_service, '_pool_pid', None)
+    yield
+    libres = pdf_render_service._libres
+    while libres is not None and not libres.empty():
+        libres.get().arreter()
+
+
+def test_rendu_bloque_arrete_seul(app, pool):
+    erreurs = []
+
+    def bloque():
+        with app.app_context():
+            try:
+                render_pdf(_lent, 60)
+            except PdfRenderError as e:
+                erreurs.append((e, time.monotonic() - debut))
+
+    debut = time.monotonic()
+    fil = threading.Thread(target=bloque)
+    fil.start()
+    # Rendu d'une autre requête pendant ce temps, sur l'autre worker
+    assert render_pdf(_lent, 0.5) == b'%PDF lent'
+    fil.join(10)
+
+    assert len(erreurs) == 1 and erreurs[0][1] < 5     # Une seule échéance, file comprise
+    time.sleep(1)                                      # Le worker bloqué est arrêté, puis rendu au pool
+    assert [render_pdf(_rapide) for _ in range(3)] == [b'%PDF rapide'] * 3
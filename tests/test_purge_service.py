@@ -0,0 +1,44 @@
+import io
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from db import db, Armoire, Kit, KitObjet, Objet, Reservation
+from services.purge_service import purger_etablissement
+from services.upload_service import stocker
+
+
+def _blob(static_tmp, contenu: bytes) -> str:
+    chemin = stocker(io.BytesIO(contenu), 'jpg')
+    # Hors délai de grâce du GC : supprimable dès qu'il n'est plus référencé
+    ancien = datetime.now().timestamp() - 86400
+    os.utime(static_tmp / chemin, (ancien, ancien))
+    return chemin
+
+
+def test_purge_inventaire_et_armoires(etablissement, static_tmp):
+    etab, admin = etablissement
+    photo, image = _blob(static_tmp, b'photo armoire'), _blob(static_tmp, b'image objet')
+    armoire = Armoire(nom='Armoire A', photo_url=photo, etablissement_id=etab.id)
+    kit = Kit(nom='Kit', etablissement_id=etab.id)
+    db.session.add_all([armoire, kit])
+    db.session.flush()
+    objets = [Objet(nom=f"Objet {i}", quantite_physique=1, seuil=0, armoire_id=armoire.id, image_url=image,
+                    etablissement_id=etab.id) for i in range(5)]
+    db.session.add_all(objets)
+    db.session.flush()
+    db.session.add(KitObjet(kit_id=kit.id, objet_id=objets[0].id, quantite=1, etablissement_id=etab.id))
+    db.session.add(Reservation(utilisateur_id=admin.id, objet_id=objets[1].id, quantite_reservee=1,
+                               debut_reservation=datetime.now(), fin_reservation=datetime.now() + timedelta(hours=1),
+                               groupe_id='g', etablissement_id=etab.id))
+    db.session.commit()
+
+    stats = purger_etablissement(etab.id, ['inventaire', 'armoires'], batch_size=2)
+
+    assert stats['inventaire'] == 5 and stats['armoires'] == 1 and stats['fichiers'] == 2
+    assert db.session.execute(text('PRAGMA foreign_key_check')).all() == []
+    for model in (Objet, Armoire, KitObjet, Reservation):
+        assert db.session.execute(db.select(model).filter_by(etablissement_id=etab.id)).first() is None
+    assert db.session.get(Kit, kit.id) is not None
+    assert not (static_tmp / photo).exists() and not (static_tmp / image).exists()
@@ -0,0 +1,37 @@
+import pytest
+
+from db import db, Armoire, Categorie, Objet
+from services.sql_profiler_service import BudgetSqlDepasse
+
+
+def _objets(etab_id, n):
+    armoire = Armoire(nom='Armoire A', etablissement_id=etab_id)
+    categorie = Categorie(nom='Verrerie', etablissement_id=etab_id)
+    db.session.add_all([armoire, categorie])
+    db.session.flush()
+    db.session.add_all([Objet(nom=f'Bécher {i}', quantite_physique=i, seuil=1, armoire_id=armoire.id,
+                              categorie_id=categorie.id, etablissement_id=etab_id) for i in range(n)])
+    db.session.commit()
+
+
+def test_recherche_dans_son_budget(client, etablissement, budget_sql):
+    etab, _ = etablissement
+    _objets(etab.id, 60)
+
+    # Nombre d'instructions indépendant du nombre d'objets trouvés
+    with budget_sql(3, repetitions_max=1):
+        r = client.get('/api/search?q=Bécher')
+
+    assert r.status_code == 200
+    assert r.get_json()['data']
+
+
+def test_budget_detecte_les_requetes_repetees(etablissement, budget_sql):
+    etab, _ = etablissement
+    _objets(etab.id, 5)
+    ids = db.session.execute(db.select(Objet.id)).scalars().all()
+
+    with pytest.raises(BudgetSqlDepasse, match='même forme'):
+        with budget_sql(50, repetitions_max=2):
+            for id_ in ids:
+                db.session.execute(db.select(Objet.nom).where(Objet.id == id_)).scalar()
@@ -0,0 +1,85 @@
+import io
+
+import pytest
+
+from db import db, DocumentReglementaire, Etablissement
+from services import storage_service as stockage
+
+
+@pytest.fixture
+def autre_etab(app):
+    etab = Etablissement(nom='Autre lycée')
+    db.session.add(etab)
+    db.session.commit()
+    return etab
+
+
+def _document(etab_id, fichier_url):
+    doc = DocumentReglementaire(etablissement_id=etab_id, nom='DUERP', type_doc='duerp', fichier_url=fichier_url)
+    db.session.add(doc)
+    db.session.commit()
+    return doc
+
+
+def _fichier(etab_id, contenu):
+    cle = stockage.enregistrer(stockage.cle_document(etab_id, 'duerp.pdf'), io.BytesIO(contenu))
+    db.session.commit()
+    return cle
+
+
+def test_telechargement_document_de_l_etablissement(client, etablissement):
+    etab, _ = etablissement
+    doc = _document(etab.id, _fichier(etab.id, b'%PDF-MIEN'))
+
+    r = client.get(f'/admin/documents/telecharger/{doc.id}')
+
+    assert r.status_code == 200
+    assert r.get_data() == b'%PDF-MIEN'
+
+
+def test_cle_d_un_autre_etablissement_refusee(client, etablissement, autre_etab):
+    etab, _ = etablissement
+    cle = _fichier(autre_etab.id, b'%PDF-SECRET')
+    doc = _document(etab.id, cle)
+
+    r = client.get(f'/admin/documents/telecharger/{doc.id}')
+    assert r.status_code == 404
+
+    client.post(f'/admin/documents/supprimer/{doc.id}')
+    assert db.session.get(DocumentReglementaire, doc.id) is None
+    with open(stockage._local().chemin(cle), 'rb') as f:
+        assert f.read() == b'%PDF-SECRET'
+
+
+def test_remontee_de_dossier_refusee(client, etablissement, autre_etab):
+    etab, _ = etablissement
+    cle = _fichier(autre_etab.id, b'%PDF-SECRET')
+    doc = _document(etab.id, f"{etab.id}/../{cle}")
+
+    assert client.get(f'/admin/documents/telecharger/{doc.id}').status_code == 404
+
+
+@pytest.mark.parametrize('url', [
+    'https://evil.example/phishing.pdf',
+    'https://res.cloudinary.com@evil.example/demo/raw/upload/v1/scientral/{etab}/docs/a.pdf',
+    'https://res.cloudinary.com/autre-compte/raw/upload/v1/scientral/{etab}/docs/a.pdf',
+    'https://res.cloudinary.com/demo/raw/upload/v1/scientral/{autre}/docs/a.pdf',
+])
+def test_url_externe_sans_redirection_ouverte(app, client, etablissement, autre_etab, url):
+    etab, _ = etablissement
+    app.config['CLOUDINARY_CLOUD_NAME'] = 'demo'
+    doc = _document(etab.id, url.format(etab=etab.id, autre=autre_etab.id))
+
+    assert client.get(f'/admin/documents/telecharger/{doc.id}').status_code == 404
+
+
+def test_ancienne_url_cloudinary_redirigee(app, client, etablissement):
+    etab, _ = etablissement
+    app.config['CLOUDINARY_CLOUD_NAME'] = 'demo'
+    url = f'https://res.cloudinary.com/demo/raw/upload/v1/scientral/{etab.id}/docs/a.pdf'
+    doc = _document(etab.id, url)
+
+    r = client.get(f'/admin/documents/telecharger/{doc.id}')
+
+    assert r.status_code == 302
+    assert r.headers['Location'] == url
@@ -0,0 +1,46 @@
+import io
+import os
+import time
+
+from db import db, Objet, Parametre
+from services.upload_service import collecter, liberer, references, stocker
+
+
+def _vieillir(chemin):
+    ancien = time.time() - 86400
+    os.utime(chemin, (ancien, ancien))
+
+
+def test_blob_partage_libere_apres_la_derniere_reference(etablissement, static_tmp):
+    etab, _ = etablissement
+    chemin = stocker(io.BytesIO(b'%PDF-1.4 fiche de securite'), 'pdf')
+    _vieillir(static_tmp / chemin)
+    premier, second = (Objet(nom=nom, fds_url=chemin, etablissement_id=etab.id) for nom in ('Acide', 'Base'))
+    db.session.add_all([premier, second])
+    db.session.commit()
+    assert references([chemin]) == {chemin: 2}
+
+    db.session.delete(premier)
+    db.session.commit()
+    assert liberer([chemin]) == 0
+    assert collecter(grace_minutes=0)['blobs'] == 0
+    assert (static_tmp / chemin).exists()
+
+    db.session.delete(second)
+    db.session.commit()
+    assert collecter(grace_minutes=0)['blobs'] == 1
+    assert not (static_tmp / chemin).exists()
+
+
+def test_seul_le_parametre_logo_reference_un_blob(etablissement, static_tmp):
+    etab, _ = etablissement
+    chemin = stocker(io.BytesIO(b'logo'), 'png')
+    _vieillir(static_tmp / chemin)
+    db.session.add(Parametre(cle='message_accueil', valeur=chemin, etablissement_id=etab.id))
+    db.session.commit()
+    assert references([chemin]) == {chemin: 0}
+
+    db.session.add(Parametre(cle='logo_url', valeur=chemin, etablissement_id=etab.id))
+    db.session.commit()
+    assert references([chemin]) == {chemin: 1}
+    assert liberer([chemin]) == 0 and (static_tmp / chemin).exists()
@@ -12,12 +12,11 @@ from datetime import datetime, timedelta
 from flask import session, flash, redirect, url_for, request, current_app
 
 # Imports SQLAlchemy
-from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import func
 
 # Imports Locaux
-from db import db, Utilisateur, Parametre, Objet, Reservation, AuditLog, MaintenanceLog, EquipementSecurite, Suggestion
-from extensions import cache
+from db import db, Utilisateur, Objet, Reservation, AuditLog, MaintenanceLog, EquipementSecurite, Suggestion
+from services import limiter_service, parametre_service
 
 # -----------------------------------------------------------------------------
 # 1. VALIDATION & SANITIZATION (C'est ce qu'il manquait !)
@@ -116,21 +115,12 @@ def log_action(action, details=None):
 # -----------------------------------------------------------------------------
 # 5. GESTION DU CACHE
 # -----------------------------------------------------------------------------
-@cache.memoize(timeout=300)
 def get_etablissement_params(etablissement_id):
-    """Récupère les paramètres critiques (Licence) avec mise en cache."""
-    if not etablissement_id:
-        return {}
-
-    try:
-        params = db.session.execute(
-            db.select(Parametre)
-            .filter_by(etablissement_id=etablissement_id)
-        ).scalars().all()
-        
-        return {p.cle: p.valeur for p in params}
-    except SQLAlchemyError:
-        return {}
+    """
+    Paramètres de l'établissement (lecture seule), servis par le store versionné :
+    voir services/parametre_service (accesseurs typés texte/entier/booleen/est_pro).
+    """
+    return parametre_service.tous(etablissement_id)
 
 # -----------------------------------------------------------------------------
 # 6. DÉCORATEURS DE SÉCURITÉ
@@ -161,10 +151,7 @@ def limit_objets_required(f):
             flash("Session invalide. Veuillez vous reconnecter.", "error")
             return redirect(url_for('auth.login'))
 
-        params = get_etablissement_params(etablissement_id)
-        is_pro = params.get('licence_statut') == 'PRO'
-        
-        if not is_pro:
+        if not parametre_service.est_pro(etablissement_id):
             count = db.session.query(Objet).filter_by(etablissement_id=etablissement_id).count()
             if count >= 50:
                 flash("La version gratuite est limitée à 50 objets. Passez à la version Pro.", "warning")
@@ -173,6 +160,22 @@ def limit_objets_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def rate_limit_license(f):
+    """5 tentatives d'activation par établissement et par 15 min (stockage partagé du limiter)."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        eid = session.get('etablissement_id')
+        if not eid: return redirect(url_for('main.index'))
+        if not limiter_service.tenter(limiter_service.LIMITE_LICENCE, 'licence', eid):
+            flash("Trop de tentatives. Réessayez dans 15 min.", "error")
+            return redirect(url_for('main.a_propos'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def reset_license_limit(etablissement_id):
+    """Licence activée : les tentatives de l'établissement repartent de zéro."""
+    limiter_service.reinitialiser(limiter_service.LIMITE_LICENCE, 'licence', etablissement_id)
+
 # -----------------------------------------------------------------------------
 # 7. LOGIQUE MÉTIER (ALERTES)
 # -----------------------------------------------------------------------------
@@ -1,28 +1,25 @@
 # ============================================================
 # FICHIER : views/admin.py (VERSION FINALE & COMPLÈTE)
 # ============================================================
-import json
 import hashlib
 import secrets
 import re
 import logging
-import io
 import os
+import shutil
 import filetype
-import uuid
 from io import BytesIO
 from urllib.parse import urlparse
 from html import escape
 from datetime import date, datetime, timedelta
-from collections import defaultdict
-from functools import wraps
 
 from flask import (Blueprint, render_template, request, redirect, url_for,
-                   flash, session, jsonify, send_file, current_app, abort, make_response)
+                   flash, session, jsonify, send_file, current_app, abort, make_response,
+                   Response, stream_with_context)
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy import func
 from sqlalchemy.orm import joinedload
 
 # --- IMPORTS POUR EXPORT PDF (ReportLab) ---
@@ -36,23 +33,39 @@ from reportlab.graphics.shapes import Drawing, Rect, Line
 from reportlab.graphics import renderPDF
 
 # --- IMPORTS POUR EXPORT EXCEL (OpenPyXL) ---
-import openpyxl
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl import Workbook
 from openpyxl.drawing.image import Image as OpenPyXLImage
 from openpyxl.worksheet.datavalidation import DataValidation
 
 # Imports Locaux
 from extensions import limiter, cache
-from db import db, Utilisateur, Parametre, Objet, Armoire, Categorie, Fournisseur, Kit, KitObjet, Budget, Depense, Echeance, Historique, Etablissement, Reservation, Suggestion, Salle
-from utils import calculate_license_key, admin_required, login_required, log_action, get_etablissement_params, allowed_file
+from db import db, Utilisateur, Parametre, Objet, Armoire, Categorie, Fournisseur, Kit, KitObjet, Budget, Depense, Echeance, Historique, Etablissement, Reservation, Salle, ImportSession, ImportLigne
+from utils import calculate_license_key, admin_required, login_required, log_action, allowed_file, rate_limit_license, reset_license_limit
 
 from services.security_service import SecurityService
+from services.export_service import (StreamingWorkbook, iter_rows, count_rows, csv_response, stream_csv,
+                                     XLSX_MIMETYPE, CSV_MIMETYPE)
+from services.pdf_render_service import render_pdf, PdfRenderError
+from services.logo_service import get_logo_bytes, invalidate_logo
+from services import export_cache_service as export_cache
+from services.export_cache_service import ExportCacheError
+from services.version_service import bump_version, DOMAINE_THEME
+from services.import_service import (ImportServiceError, creer_session, get_session as get_import_session,
+                                     job_actif, peut_reprendre, lancer_validation, annuler_session,
+                                     iter_rapport as iter_rapport_import, RAPPORT_HEADERS as RAPPORT_IMPORT_HEADERS,
+                                     LIGNE_ERREUR)
+from services.backup_service import (generer_sauvegarde, restaurer_sauvegarde, lire_entete, verifier_differentielle,
+                                     BackupServiceError)
+from services.journal_service import sequence_courante as sequence_journal
+from services.image_service import enregistrer_image, variantes as variantes_image, supprimer_upload, ImageServiceError
+from services.upload_service import est_blob, liberer
+from services import parametre_service as parametres
+from services.purge_service import lancer_purge, plan_purge, PurgeServiceError
+from services.pack_service import get_pack, importer_pack as importer_pack_onboarding, PackServiceError
+from static.data.packs_onboarding import PACKS_ONBOARDING
+from services.export_job_service import (enqueue as enqueue_export, export_job_handler, get_job, job_to_dict,
+                                         is_downloadable, job_file_path, lire_statut)
 
-from PIL import Image, UnidentifiedImageError
-import pillow_heif
-
-pillow_heif.register_heif_opener()
 
 # ============================================================
 # CONFIGURATION
@@ -63,13 +76,10 @@ MAX_EXPORT_LIMIT = 3000
 MAX_FILE_SIZE = 10 * 1024 * 1024 # 10 Mo
 PASSWORD_MIN_LENGTH = 12
 EMAIL_REGEX = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-MAX_IMPORT_ROWS = 5000
-MAX_JSON_SIZE = 5 * 1024 * 1024
+BACKUP_EXTENSIONS = ('.ndjson.gz', '.json.gz', '.ndjson', '.json', '.gz')
 
 MAX_ARMOIRES_PER_ETAB = 50
 MAX_DESC_LENGTH = 500
-MAX_IMAGE_PIXELS = 1920
-JPEG_QUALITY = 80
 UPLOAD_SUBDIR = 'armoires'
 
 # ============================================================
@@ -124,139 +134,26 @@ def sanitize_filename(name):
     cleaned = secure_filename(safe)
     return cleaned[:100] if cleaned else "Export"
 
-def sanitize_filename_report(text):
-    if not text: return "Rapport"
-    return re.sub(r'[^\w\s-]', '', str(text)).strip().replace(' ', '_')
-
-def sanitize_for_excel_report(text):
-    if not text: return ""
-    text = str(text)
-    if text.startswith(('=', '+', '-', '@')): text = "'" + text
-    return text
-
 def _handle_armoire_image(file_obj):
     """
-    Helper dédié admin : Traite, sécurise et convertit (HEIC->JPG) l'image.
+    Helper dédié admin : valide l'image (HEIC compris) et la confie au pipeline commun.
+    Les variantes (JPEG/WebP, sans métadonnées) sont générées après le commit.
     """
     try:
-        img = Image.open(file_obj)
-        img.load() # Force le chargement pour valider l'intégrité
-    except (UnidentifiedImageError, Exception):
-        raise ValueError("Fichier image invalide ou corrompu.")
-
-    # Validation Format (Liste blanche incluant HEIC/HEIF)
-    valid_formats = ['JPEG', 'JPG', 'PNG', 'WEBP', 'HEIF', 'HEIC']
-    if img.format is None or img.format.upper() not in valid_formats:
-        raise ValueError("Format non supporté. Utilisez JPG, PNG ou HEIC (iPhone).")
-
-    # Nettoyage (Sécurité) & Conversion RGB
-    if img.mode in ("RGBA", "P"):
-        img = img.convert("RGB")
-    
-    img_clean = img.copy()
-
-    # Redimensionnement (Optimisation stockage)
-    if img_clean.width > MAX_IMAGE_PIXELS or img_clean.height > MAX_IMAGE_PIXELS:
-        img_clean.thumbnail((MAX_IMAGE_PIXELS, MAX_IMAGE_PIXELS), Image.Resampling.LANCZOS)
-
-    # Génération nom sécurisé (UUID) + Extension forcée .jpg
-    filename = f"ARM_{uuid.uuid4().hex}.jpg"
-    
-    # Chemins
-    base_upload_dir = os.path.join(current_app.root_path, 'static', 'uploads', UPLOAD_SUBDIR)
-    full_path = os.path.abspath(os.path.join(base_upload_dir, filename))
-    
-    # Sécurité Path Traversal
-    if not full_path.startswith(os.path.abspath(base_upload_dir)):
-        raise ValueError("Erreur de sécurité (Path Traversal).")
-
-    os.makedirs(base_upload_dir, exist_ok=True)
-    
-    # Sauvegarde en JPEG (Universel pour le web)
-    img_clean.save(full_path, "JPEG", quality=JPEG_QUALITY, optimize=True)
-
-    return f"uploads/{UPLOAD_SUBDIR}/{filename}", full_path
-
-def _rollback_file(path):
-    """Supprime le fichier si l'enregistrement DB échoue"""
-    if path and os.path.exists(path):
-        try: os.remove(path)
-        except OSError: pass
+        return enregistrer_image(file_obj)
+    except ImageServiceError as e:
+        raise ValueError(str(e))
             
  
 # ============================================================
 # GÉNÉRATEURS PDF / EXCEL
 # ============================================================
 
-class LogoGraphique(Flowable):
-    def __init__(self, width=40, height=40, etablissement_id=None, logo_url_override=None):
-        Flowable.__init__(self)
-        self.width = width
-        self.height = height
-        self.logo_path = None
-        self.logo_data = None
-        try:
-            from io import BytesIO
-            import requests as req
-            logo_url = logo_url_override
-            if not logo_url and etablissement_id:
-                _P = Parametre
-                _p = db.session.execute(db.select(_P).filter_by(etablissement_id=etablissement_id, cle='logo_url')).scalar_one_or_none()
-                logo_url = _p.valeur if _p else None
-            if logo_url:
-                if logo_url.startswith('http'):
-                    r = req.get(logo_url, timeout=5)
-                    if r.status_code == 200:
-                        self.logo_data = BytesIO(r.content)
-                else:
-                    path = os.path.join(current_app.root_path, 'static', logo_url)
-                    if os.path.exists(path):
-                        self.logo_path = path
-        except Exception as e:
-            import traceback
-            print(f"LOGO ERROR: {e}")
-            traceback.print_exc()
-    def draw(self):
-        if self.logo_data or self.logo_path:
-            try:
-                from reportlab.lib.utils import ImageReader
-                source = self.logo_data if self.logo_data else self.logo_path
-                img = ImageReader(source)
-                self.canv.drawImage(img, 0, 0, width=self.width, height=self.height, preserveAspectRatio=True, mask='auto')
-                return
-            except Exception:
-                pass
-        self.canv.setFillColor(colors.HexColor('#1F3B73'))
-        self.canv.rect(0, 0, 8, 15, fill=1, stroke=0)
-        self.canv.rect(12, 0, 8, 25, fill=1, stroke=0)
-        self.canv.setFillColor(colors.HexColor('#4facfe'))
-        self.canv.rect(24, 0, 8, 35, fill=1, stroke=0)
-        self.canv.setStrokeColor(colors.HexColor('#FFD700'))
-        self.canv.setLineWidth(2)
-        self.canv.line(-5, 5, 35, 40)
-
 def ajouter_logo_excel(ws, etablissement_id=None):
     """Ajoute le logo de l etablissement dans le fichier Excel si disponible."""
     from io import BytesIO
-    import requests as req
-    logo_data = None
-    if etablissement_id:
-        try:
-            from db import Parametre as _Parametre
-            _p = db.session.execute(db.select(_Parametre).filter_by(etablissement_id=etablissement_id, cle='logo_url')).scalar_one_or_none()
-            logo_url = _p.valeur if _p else None
-            if logo_url:
-                if logo_url.startswith('http'):
-                    r = req.get(logo_url, timeout=5)
-                    if r.status_code == 200:
-                        logo_data = BytesIO(r.content)
-                else:
-                    logo_path = os.path.join(current_app.root_path, 'static', logo_url)
-                    if os.path.exists(logo_path):
-                        with open(logo_path, 'rb') as f:
-                            logo_data = BytesIO(f.read())
-        except Exception:
-            pass
+    logo_bytes = get_logo_bytes(etablissement_id)  # Cache local : pas d'appel réseau
+    logo_data = BytesIO(logo_bytes) if logo_bytes else None
     if not logo_data:
         logo_path = os.path.join(current_app.root_path, 'static', 'logo.png')
         if os.path.exists(logo_path):
@@ -273,35 +170,17 @@ def ajouter_logo_excel(ws, etablissement_id=None):
             return False
     return False
 
-def generer_budget_pdf_pro(data_export, metadata):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=1.5*cm, leftMargin=1.5*cm, topMargin=1.5*cm, bottomMargin=1.5*cm, title=f"Budget {metadata['etablissement']}")
+def _construire_budget_pdf(data_export, metadata, output):
+    """Rendu ReportLab pur (données sérialisables) : exécuté dans le pool de rendu."""
+    doc = SimpleDocTemplate(output, pagesize=A4, rightMargin=1.5*cm, leftMargin=1.5*cm, topMargin=1.5*cm, bottomMargin=1.5*cm, title=f"Budget {metadata['etablissement']}")
     elements = []
     styles = getSampleStyleSheet()
     SCIENTRAL_BLUE = colors.HexColor('#1F3B73')
     style_titre = ParagraphStyle('Titre', parent=styles['Heading1'], fontSize=22, textColor=SCIENTRAL_BLUE, alignment=TA_CENTER)
     style_normal = ParagraphStyle('Normal', parent=styles['Normal'], fontSize=10)
     style_cell = ParagraphStyle('Cell', parent=styles['Normal'], fontSize=9)
-    # Logo etablissement - téléchargé avant doc.build()
-    logo_image_data = None
-    etablissement_id = metadata.get('etablissement_id')
-    if etablissement_id:
-        try:
-            from db import Parametre as _P
-            import requests as _req
-            _p = db.session.execute(db.select(_P).filter_by(etablissement_id=etablissement_id, cle='logo_url')).scalar_one_or_none()
-            if _p and _p.valeur:
-                if _p.valeur.startswith('http'):
-                    r = _req.get(_p.valeur, timeout=5)
-                    if r.status_code == 200:
-                        logo_image_data = BytesIO(r.content)
-                else:
-                    logo_path = os.path.join(current_app.root_path, 'static', _p.valeur)
-                    if os.path.exists(logo_path):
-                        with open(logo_path, 'rb') as f:
-                            logo_image_data = BytesIO(f.read())
-        except Exception:
-            pass
+    # Logo etablissement - résolu par l'appelant (octets) avant le rendu
+    logo_image_data = BytesIO(metadata['logo_bytes']) if metadata.get('logo_bytes') else None
     from reportlab.platypus import Image as RLImage, HRFlowable
     style_etab = ParagraphStyle('Etab', parent=styles['Normal'], fontSize=18, textColor=SCIENTRAL_BLUE, fontName='Helvetica-Bold', alignment=2)
     style_sous = ParagraphStyle('Sous', parent=styles['Normal'], fontSize=8, textColor=colors.grey, fontName='Helvetica-Oblique', alignment=2)
@@ -339,348 +218,49 @@ def generer_budget_pdf_pro(data_export, metadata):
     t.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), SCIENTRAL_BLUE), ('TEXTCOLOR', (0, 0), (-1, 0), colors.white), ('ALIGN', (0, 0), (-1, -1), 'CENTER'), ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'), ('GRID', (0, 0), (-1, -1), 0.5, colors.grey), ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'), ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.whitesmoke])]))
     elements.append(t)
     doc.build(elements)
-    buffer.seek(0)
+
+def generer_budget_pdf_pro(data_export, metadata):
+    metadata = {**metadata, 'logo_bytes': get_logo_bytes(metadata.get('etablissement_id'))}
+    pdf = render_pdf(_construire_budget_pdf, data_export, metadata)
     filename = f"Budget_{sanitize_filename(metadata['etablissement'])}.pdf"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
+    return send_file(BytesIO(pdf), as_attachment=True, download_name=filename, mimetype='application/pdf')
 
 def generer_budget_excel_pro(data_export, metadata):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Budget"
-    
-    COLOR_PRIMARY = "1F3B73"
-    fill_header = PatternFill(start_color=COLOR_PRIMARY, end_color=COLOR_PRIMARY, fill_type="solid")
-    font_header = Font(name='Segoe UI', size=11, bold=True, color="FFFFFF")
-    
-    font_titre = Font(name='Segoe UI', size=16, bold=True, color=COLOR_PRIMARY)
-    align_center = Alignment(horizontal="center", vertical="center")
-    align_left = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    align_right = Alignment(horizontal="right", vertical="center")
-    font_data = Font(name='Segoe UI', size=10)
-    border_thin = Border(left=Side(style='thin', color='D9D9D9'), right=Side(style='thin', color='D9D9D9'), bottom=Side(style='thin', color='D9D9D9'))
-
-    ws.merge_cells('B1:E1')
-    ws['B1'] = f"Rapport Budgétaire - {metadata['etablissement']}"
-    ws['B1'].font = font_titre
-    ws['B1'].alignment = align_left
-    ws.row_dimensions[1].height = 40
-    
-    ajouter_logo_excel(ws, metadata.get('etablissement_id'))
+    """Excel budgétaire en write_only : les dépenses sont écrites au fil de l'eau."""
+    book = StreamingWorkbook("Budget")
+    ws = book.ws
+    headers = ['Date', 'Fournisseur', 'Libellé', 'Montant']
 
-    ws.merge_cells('A2:D2')
-    ws['A2'] = f"Période : {metadata['date_debut']} au {metadata['date_fin']}"
-    ws['A2'].alignment = align_left
-    ws.merge_cells('A3:D3')
-    ws['A3'] = f"Généré le {metadata['date_generation']} | {metadata['nombre_depenses']} écritures"
-    ws['A3'].alignment = align_left
+    # Mise en page (avant toute ligne en write_only)
+    book.set_widths({'A': 15, 'B': 30, 'C': 50, 'D': 15})
+    ws.row_dimensions[1].height = 40
     ws.row_dimensions[3].height = 20
-
-    headers = ['Date', 'Fournisseur', 'Libellé', 'Montant']
-    ws.append([]) 
-    ws.append(headers) 
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=5, column=col_num)
-        cell.fill = fill_header
-        cell.font = font_header
-        cell.alignment = align_center
-        cell.border = border_thin
-    
     ws.row_dimensions[5].height = 25
+    ws.merged_cells.add('B1:E1')
+    ws.merged_cells.add('A2:D2')
+    ws.merged_cells.add('A3:D3')
 
-    current_row = 6
-    for item in data_export:
-        ws.cell(row=current_row, column=1, value=item['date']).alignment = align_center
-        ws.cell(row=current_row, column=2, value=item['fournisseur'])
-        ws.cell(row=current_row, column=3, value=item['contenu'])
-        c4 = ws.cell(row=current_row, column=4, value=item['montant'])
-        c4.number_format = '#,##0.00 €'
-        c4.alignment = align_right
-        
-        for col in range(1, 5):
-            ws.cell(row=current_row, column=col).border = border_thin
-            ws.cell(row=current_row, column=col).font = font_data
-        current_row += 1
-
-    ws.cell(row=current_row, column=3, value="TOTAL").font = Font(bold=True)
-    ws.cell(row=current_row, column=3).alignment = align_right
-    c_total = ws.cell(row=current_row, column=4, value=metadata['total'])
-    c_total.font = Font(bold=True, color=COLOR_PRIMARY, size=12)
-    c_total.number_format = '#,##0.00 €'
-
-    ws.column_dimensions['A'].width = 15
-    ws.column_dimensions['B'].width = 30
-    ws.column_dimensions['C'].width = 50
-    ws.column_dimensions['D'].width = 15
-
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    filename = f"Budget_{sanitize_filename(metadata['etablissement'])}.xlsx"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-
-def generer_rapport_pdf(data, metadata):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), rightMargin=1.0*cm, leftMargin=1.0*cm, topMargin=1.0*cm, bottomMargin=1.0*cm, title=f"Rapport - {metadata['etablissement']}")
-    elements = []
-    styles = getSampleStyleSheet()
-    logo = LogoGraphique(width=40, height=40, etablissement_id=metadata.get('etablissement_id'))
-    titre_style = ParagraphStyle('Titre', parent=styles['Heading1'], fontSize=22, textColor=colors.HexColor('#1F3B73'), alignment=TA_LEFT)
-    sous_titre_style = ParagraphStyle('SousTitre', parent=styles['Normal'], fontSize=12, textColor=colors.gray, alignment=TA_LEFT)
-    titre_bloc = [Paragraph(f"RAPPORT D'ACTIVITÉ", titre_style), Paragraph(f"{escape(metadata['etablissement'])}", sous_titre_style)]
-    header_table = Table([[logo, titre_bloc]], colWidths=[1.5*cm, 20*cm])
-    header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE'), ('LEFTPADDING', (0,0), (-1,-1), 0)]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 0.5*cm))
-    meta_style = ParagraphStyle('Meta', parent=styles['Normal'], fontSize=10, textColor=colors.black)
-    meta_label = ParagraphStyle('MetaLabel', parent=styles['Normal'], fontSize=10, textColor=colors.HexColor('#1F3B73'), fontName='Helvetica-Bold')
-    meta_data = [[Paragraph('Période :', meta_label), Paragraph(metadata['periode'], meta_style), Paragraph('Généré le :', meta_label), Paragraph(metadata['date_generation'], meta_style)], [Paragraph('Total :', meta_label), Paragraph(f"{metadata['total']} entrées", meta_style), '', '']]
-    meta_table = Table(meta_data, colWidths=[2.5*cm, 8*cm, 2.5*cm, 8*cm])
-    meta_table.setStyle(TableStyle([('BACKGROUND', (0,0), (-1,-1), colors.HexColor('#F8F9FA')), ('BOX', (0,0), (-1,-1), 0.5, colors.HexColor('#CCCCCC')), ('PADDING', (0,0), (-1,-1), 6), ('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
-    elements.append(meta_table)
-    elements.append(Spacer(1, 0.8*cm))
-    header_style = ParagraphStyle('Header', parent=styles['Normal'], fontSize=10, textColor=colors.white, fontName='Helvetica-Bold', alignment=TA_CENTER)
-    cell_style = ParagraphStyle('Cell', parent=styles['Normal'], fontSize=9, textColor=colors.black)
-    headers = [Paragraph('Date', header_style), Paragraph('Heure', header_style), Paragraph('Utilisateur', header_style), Paragraph('Action', header_style), Paragraph('Objet', header_style), Paragraph('Détails', header_style)]
-    table_data = [headers]
-    for row in data:
-        table_data.append([Paragraph(row['date'], cell_style), Paragraph(row['heure'], cell_style), Paragraph(escape(row['utilisateur']), cell_style), Paragraph(escape(row['action']), cell_style), Paragraph(escape(row['objet']), cell_style), Paragraph(escape(row['details']) if row['details'] else '-', cell_style)])
-    col_widths = [2.5*cm, 1.5*cm, 4.0*cm, 3.0*cm, 6.5*cm, 10.0*cm]
-    t = Table(table_data, colWidths=col_widths, repeatRows=1)
-    t.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1F3B73')), ('VALIGN', (0, 0), (-1, 0), 'MIDDLE'), ('TOPPADDING', (0, 0), (-1, 0), 10), ('BOTTOMPADDING', (0, 0), (-1, 0), 10), ('VALIGN', (0, 1), (-1, -1), 'TOP'), ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F4F6F9')]), ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E0E0E0')), ('LINEBELOW', (0, 0), (-1, 0), 2, colors.HexColor('#1F3B73'))]))
-    elements.append(t)
-    doc.build(elements)
-    buffer.seek(0)
-    filename = f"Rapport_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.pdf"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
-
-def generer_rapport_excel(data, metadata):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Activité"
-    
-    COLOR_PRIMARY = "1F3B73"
-    fill_header = PatternFill(start_color="1F3B73", end_color="1F3B73", fill_type="solid")
-    font_header = Font(name='Segoe UI', size=11, bold=True, color="FFFFFF")
-    
-    font_titre = Font(name='Segoe UI', size=18, bold=True, color=COLOR_PRIMARY)
-    align_center = Alignment(horizontal="center", vertical="center")
-    font_data = Font(name='Segoe UI', size=10)
-    align_top = Alignment(vertical="top", wrap_text=True)
-    border_thin = Border(left=Side(style='thin', color='D9D9D9'), right=Side(style='thin', color='D9D9D9'), bottom=Side(style='thin', color='D9D9D9'))
-
-    ws.merge_cells('B1:F1')
-    ws['B1'] = f"RAPPORT D'ACTIVITÉ - {metadata['etablissement']}"
-    ws['B1'].font = font_titre
-    ws['B1'].alignment = Alignment(horizontal="left", vertical="center")
-    ws.row_dimensions[1].height = 45
-    
     ajouter_logo_excel(ws, metadata.get('etablissement_id'))
-    
-    ws.merge_cells('A2:F4')
-    ws['A2'] = f"Période : {metadata['periode']}\nGénéré le : {metadata['date_generation']}\nTotal : {metadata['total']} enregistrements"
-    ws['A2'].alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    
-    headers = ["Date", "Heure", "Utilisateur", "Action", "Objet", "Détails"]
-    ws.append([])
-    ws.append(headers)
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=6, column=col_num)
-        cell.fill = fill_header
-        cell.font = font_header
-        cell.alignment = align_center
-    
-    ws.row_dimensions[6].height = 30
-    
-    for row in data:
-        ws.append([
-            row['date'], row['heure'], 
-            sanitize_for_excel_report(row['utilisateur']), 
-            sanitize_for_excel_report(row['action']), 
-            sanitize_for_excel_report(row['objet']), 
-            sanitize_for_excel_report(row['details'])
-        ])
-    
-    ws.column_dimensions['A'].width = 12
-    ws.column_dimensions['B'].width = 10
-    ws.column_dimensions['C'].width = 20
-    ws.column_dimensions['D'].width = 15
-    ws.column_dimensions['E'].width = 30
-    ws.column_dimensions['F'].width = 50
-    
-    for row in ws.iter_rows(min_row=7, max_row=ws.max_row):
-        for cell in row:
-            cell.font = font_data
-            cell.alignment = align_top
-            cell.border = border_thin
-
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    filename = f"Rapport_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.xlsx"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-
-def generer_inventaire_pdf(data, metadata):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), rightMargin=1.0*cm, leftMargin=1.0*cm, topMargin=1.0*cm, bottomMargin=1.0*cm, title=f"Inventaire - {metadata['etablissement']}")
-    elements = []
-    styles = getSampleStyleSheet()
-    logo = LogoGraphique(width=40, height=40, etablissement_id=metadata.get('etablissement_id'))
-    titre_style = ParagraphStyle('Titre', parent=styles['Heading1'], fontSize=22, textColor=colors.HexColor('#1F3B73'), alignment=TA_LEFT)
-    sous_titre_style = ParagraphStyle('SousTitre', parent=styles['Normal'], fontSize=12, textColor=colors.gray, alignment=TA_LEFT)
-    titre_bloc = [Paragraph(f"ÉTAT DE L'INVENTAIRE", titre_style), Paragraph(f"{escape(metadata['etablissement'])}", sous_titre_style)]
-    header_table = Table([[logo, titre_bloc]], colWidths=[1.5*cm, 20*cm])
-    header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 0.5*cm))
-    info_text = f"<b>Généré le :</b> {metadata['date_generation']}  |  <b>Total références :</b> {metadata['total']}"
-    elements.append(Paragraph(info_text, ParagraphStyle('Info', parent=styles['Normal'], fontSize=10, alignment=TA_RIGHT, textColor=colors.HexColor('#1F3B73'))))
-    elements.append(Spacer(1, 0.3*cm))
-    header_style = ParagraphStyle('Header', parent=styles['Normal'], fontSize=10, textColor=colors.white, fontName='Helvetica-Bold', alignment=TA_CENTER)
-    cell_style = ParagraphStyle('Cell', parent=styles['Normal'], fontSize=9, textColor=colors.black)
-    cell_center = ParagraphStyle('CellCenter', parent=cell_style, alignment=TA_CENTER)
-    headers = [Paragraph('Catégorie', header_style), Paragraph('Désignation', header_style), Paragraph('Qté', header_style), Paragraph('Seuil', header_style), Paragraph('Emplacement', header_style), Paragraph('Péremption', header_style)]
-    table_data = [headers]
-    for row in data:
-        qty_style = cell_center
-        if row['quantite'] <= row['seuil']: qty_style = ParagraphStyle('Alert', parent=cell_center, textColor=colors.red, fontName='Helvetica-Bold')
-        table_data.append([Paragraph(escape(row['categorie']), cell_style), Paragraph(escape(row['nom']), cell_style), Paragraph(str(row['quantite']), qty_style), Paragraph(str(row['seuil']), cell_center), Paragraph(escape(row['armoire']), cell_style), Paragraph(row['peremption'], cell_center)])
-    col_widths = [5.0*cm, 9.5*cm, 2.0*cm, 2.0*cm, 5.0*cm, 4.0*cm]
-    t = Table(table_data, colWidths=col_widths, repeatRows=1)
-    t.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1F3B73')), ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'), ('TOPPADDING', (0, 0), (-1, 0), 8), ('BOTTOMPADDING', (0, 0), (-1, 0), 8), ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F4F6F9')]), ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#E0E0E0')), ('LINEBELOW', (0, 0), (-1, 0), 2, colors.HexColor('#1F3B73'))]))
-    elements.append(t)
-    doc.build(elements)
-    buffer.seek(0)
-    filename = f"Inventaire_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.pdf"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
-
-def generer_inventaire_excel(data, metadata):
-    """Génère un Excel propre (Style Premium sans image)."""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Inventaire"
-    
-    # --- 1. DÉFINITION DES STYLES ---
-    COLOR_PRIMARY = "1F3B73"      # Bleu Nuit
-    COLOR_HEADER_TEXT = "FFFFFF"  # Blanc
-    COLOR_ZEBRA = "F4F6F9"        # Gris très clair
-    COLOR_BORDER = "D0D0D0"       # Gris bordure
-    COLOR_ALERT = "DC3545"        # Rouge Alerte
-
-    # Polices
-    font_titre = Font(name='Segoe UI', size=18, bold=True, color=COLOR_PRIMARY)
-    # Sous-titre en gris et italique
-    font_meta = Font(name='Segoe UI', size=11, italic=True, color="666666")
-    
-    font_header = Font(name='Segoe UI', size=11, bold=True, color=COLOR_HEADER_TEXT)
-    font_data = Font(name='Segoe UI', size=10, color="333333")
-    font_alert = Font(name='Segoe UI', size=10, bold=True, color=COLOR_ALERT)
-    
-    # Remplissages
-    fill_header = PatternFill(start_color=COLOR_PRIMARY, end_color=COLOR_PRIMARY, fill_type="solid")
-    fill_zebra = PatternFill(start_color=COLOR_ZEBRA, end_color=COLOR_ZEBRA, fill_type="solid")
-    
-    # Alignements
-    align_center = Alignment(horizontal="center", vertical="center")
-    align_left = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    
-    # Bordures
-    border_thin = Border(
-        left=Side(style='thin', color=COLOR_BORDER),
-        right=Side(style='thin', color=COLOR_BORDER),
-        top=Side(style='thin', color=COLOR_BORDER),
-        bottom=Side(style='thin', color=COLOR_BORDER)
-    )
 
-    # --- 2. EN-TÊTE (TEXTE SEULEMENT) ---
-    
-    # Ligne 1 : TITRE PRINCIPAL
-    ws.merge_cells('A1:F1')
-    ws['A1'] = f"ÉTAT DE L'INVENTAIRE - {metadata['etablissement']}"
-    ws['A1'].font = font_titre
-    ws['A1'].alignment = align_left
-    ws.row_dimensions[1].height = 35
-    
-    # Ligne 2 : SOUS-TITRE (Date | Total)
-    ws.merge_cells('A2:F2')
-    ws['A2'] = f"Généré le : {metadata['date_generation']} | Total références : {metadata['total']}"
-    ws['A2'].font = font_meta
-    ws['A2'].alignment = align_left
-    ws.row_dimensions[2].height = 25
-    
-    # Ligne 3 : Espace vide pour aérer
-    ws.row_dimensions[3].height = 15
+    book.append([None, f"Rapport Budgétaire - {metadata['etablissement']}"], [None, 'lf_titre'])
+    book.append([f"Période : {metadata['date_debut']} au {metadata['date_fin']}"], ['lf_meta'])
+    book.append([f"Généré le {metadata['date_generation']} | {metadata['nombre_depenses']} écritures"], ['lf_meta'])
+    book.append([])
+    book.append(headers, ['lf_header'] * len(headers))
 
-    # --- 3. TABLEAU : HEADERS (Ligne 4) ---
-    headers = ["Catégorie", "Désignation", "Quantité", "Seuil", "Emplacement", "Péremption"]
-    
-    header_row = 4
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=header_row, column=col_num, value=header)
-        cell.fill = fill_header
-        cell.font = font_header
-        cell.alignment = align_center
-        cell.border = border_thin
-    
-    ws.row_dimensions[header_row].height = 30
-
-    # --- 4. TABLEAU : DONNÉES ---
-    start_row = 5
-    
-    for i, row in enumerate(data):
-        current_row = start_row + i
-        
-        # Insertion des valeurs
-        ws.cell(row=current_row, column=1, value=row['categorie'])
-        ws.cell(row=current_row, column=2, value=row['nom'])
-        ws.cell(row=current_row, column=3, value=row['quantite'])
-        ws.cell(row=current_row, column=4, value=row['seuil'])
-        ws.cell(row=current_row, column=5, value=row['armoire'])
-        ws.cell(row=current_row, column=6, value=row['peremption'])
-        
-        # Application du style
-        ws.row_dimensions[current_row].height = 25
-        
-        for col in range(1, 7):
-            cell = ws.cell(row=current_row, column=col)
-            cell.border = border_thin
-            cell.font = font_data
-            
-            # Alignement : Centre pour les chiffres/dates, Gauche pour le texte
-            if col in [3, 4, 6]: 
-                cell.alignment = align_center
-            else:
-                cell.alignment = align_left
-            
-            # Zebra Striping
-            if current_row % 2 == 0:
-                cell.fill = fill_zebra
-        
-        # Alerte Stock Bas (Rouge sur la quantité)
-        if row['quantite'] <= row['seuil']:
-            ws.cell(row=current_row, column=3).font = font_alert
+    data_styles = ['lf_cell_center', 'lf_cell', 'lf_cell', 'lf_money']
+    for item in data_export:
+        book.append([
+            item['date'],
+            sanitize_for_excel(item['fournisseur']),
+            sanitize_for_excel(item['contenu']),
+            item['montant']
+        ], data_styles)
 
-    # --- 5. FINITIONS ---
-    ws.column_dimensions['A'].width = 25
-    ws.column_dimensions['B'].width = 45
-    ws.column_dimensions['C'].width = 12
-    ws.column_dimensions['D'].width = 12
-    ws.column_dimensions['E'].width = 25
-    ws.column_dimensions['F'].width = 18
-    
-    # Filtres automatiques
-    ws.auto_filter.ref = f"A{header_row}:F{start_row + len(data) - 1}"
-    
-    # Figer les volets sous les titres
-    ws.freeze_panes = f"A{start_row}"
+    book.append([None, None, "TOTAL", metadata['total']], [None, None, 'lf_total_label', 'lf_total_money'])
 
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    filename = f"Inventaire_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.xlsx"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    filename = f"Budget_{sanitize_filename(metadata['etablissement'])}.xlsx"
+    return book.response(filename)
 
 
 # ============================================================
@@ -697,6 +277,11 @@ def _safe_delete_old_image(relative_path: str | None, context_info: str = "") ->
     if not relative_path or not relative_path.strip(): 
         return
 
+    # Photo partagée (stockage par empreinte) : supprimée seulement si plus aucune ligne ne la référence
+    if est_blob(relative_path):
+        liberer([relative_path])
+        return
+
     try:
         base_dir = os.path.join(current_app.root_path, 'static', 'uploads', UPLOAD_SUBDIR)
         full_path = os.path.abspath(os.path.join(current_app.root_path, 'static', relative_path))
@@ -711,6 +296,10 @@ def _safe_delete_old_image(relative_path: str | None, context_info: str = "") ->
             os.remove(full_path)
             current_app.logger.info(f"Nettoyage image : {relative_path} ({context_info})")
 
+        # Miniatures et variantes WebP
+        for variante in variantes_image(relative_path):
+            supprimer_upload(variante)
+
     # Point 3 : Exception spécifique
     except (OSError, IOError) as e:
         current_app.logger.error(f"Erreur suppression fichier {relative_path}: {e}")
@@ -740,7 +329,7 @@ def admin():
             db.session.rollback()
             current_app.logger.error("Erreur génération code invitation", exc_info=True)
 
-    params = get_etablissement_params(etablissement_id)
+    params = parametres.tous(etablissement_id)
     
     licence_info = {
         'is_pro': params.get('licence_statut') == 'PRO',
@@ -829,15 +418,14 @@ def ajouter_armoire_specifique():
         flash("Description trop longue.", "warning")
         return redirect(url_for('main.gestion_armoires'))
 
-    # 3. Gestion Image (HEIC -> JPG)
+    # 3. Gestion Image (HEIC -> JPG/WebP, traitée après le commit)
     photo_db_path = None
-    uploaded_file_path = None
 
     if 'photo' in request.files:
         file = request.files['photo']
         if file and file.filename != '':
             try:
-                photo_db_path, uploaded_file_path = _handle_armoire_image(file)
+                photo_db_path = _handle_armoire_image(file)
             except ValueError as ve:
                 flash(str(ve), "warning")
                 return redirect(url_for('main.gestion_armoires'))
@@ -862,11 +450,9 @@ def ajouter_armoire_specifique():
 
     except IntegrityError:
         db.session.rollback()
-        _rollback_file(uploaded_file_path)
         flash(f"Une armoire nommée '{nom}' existe déjà.", "warning")
     except Exception as e:
         db.session.rollback()
-        _rollback_file(uploaded_file_path)
         current_app.logger.error(f"DB Error: {str(e)}", exc_info=True)
         flash("Erreur technique base de données.", "error")
 
@@ -1015,18 +601,14 @@ def modifier_armoire_specifique():
     # --- Logique Image ---
     old_photo_path = armoire.photo_url
     new_photo_path = old_photo_path
-    uploaded_file_physical_path = None
     file_to_delete_later = None
 
     # Cas A : Nouvel Upload
     if 'photo' in request.files and request.files['photo'].filename != '':
         try:
             # Point 7 : Nom uniformisé (_handle_armoire_image)
-            rel_path, abs_path = _handle_armoire_image(request.files['photo'])
-            
-            new_photo_path = rel_path
-            uploaded_file_physical_path = abs_path
-            
+            new_photo_path = _handle_armoire_image(request.files['photo'])
+
             if old_photo_path:
                 file_to_delete_later = old_photo_path
 
@@ -1064,12 +646,10 @@ def modifier_armoire_specifique():
     # Point 9 : Distinction des erreurs
     except IntegrityError:
         db.session.rollback()
-        if uploaded_file_physical_path: _rollback_file(uploaded_file_physical_path)
         flash("Erreur d'intégrité (doublon probable).", "error")
 
     except Exception as e:
         db.session.rollback()
-        if uploaded_file_physical_path: _rollback_file(uploaded_file_physical_path)
         current_app.logger.error(f"DB Error update armoire: {e}", exc_info=True)
         flash("Erreur technique lors de l'enregistrement.", "error")
 
@@ -1088,7 +668,6 @@ def modifier_categorie():
 @admin_required
 def packs_onboarding():
     """Page de sélection des packs de matériel."""
-    from static.data.packs_onboarding import PACKS_ONBOARDING
     breadcrumbs = [
         {'text': 'Tableau de Bord', 'url': url_for('inventaire.index')},
         {'text': 'Administration', 'url': url_for('admin.admin')},
@@ -1101,114 +680,26 @@ def packs_onboarding():
 @admin_required
 def importer_pack(pack_id):
     """Importe un pack : crée armoires, catégories et objets."""
-    from static.data.packs_onboarding import PACKS_ONBOARDING
     etablissement_id = session.get('etablissement_id')
 
-    pack = next((p for p in PACKS_ONBOARDING if p["id"] == pack_id), None)
+    pack = get_pack(pack_id)
     if not pack:
         return jsonify({"success": False, "error": "Pack introuvable"}), 404
 
     try:
-        stats = {"armoires": 0, "categories": 0, "objets": 0, "ignores": 0}
-
-        # 1. Créer les armoires (si elles n'existent pas déjà)
-        armoires_map = {}
-        for arm_data in pack["armoires"]:
-            existing = db.session.execute(
-                db.select(Armoire).filter_by(
-                    nom=arm_data["nom"],
-                    etablissement_id=etablissement_id
-                )
-            ).scalar_one_or_none()
-            if existing:
-                armoires_map[arm_data["nom"]] = existing
-            else:
-                new_arm = Armoire(
-                    nom=arm_data["nom"],
-                    description=arm_data["description"],
-                    etablissement_id=etablissement_id
-                )
-                db.session.add(new_arm)
-                db.session.flush()
-                armoires_map[arm_data["nom"]] = new_arm
-                stats["armoires"] += 1
-
-        # 2. Créer les catégories (si elles n'existent pas déjà)
-        categories_map = {}
-        for cat_nom in pack["categories"]:
-            existing = db.session.execute(
-                db.select(Categorie).filter_by(
-                    nom=cat_nom,
-                    etablissement_id=etablissement_id
-                )
-            ).scalar_one_or_none()
-            if existing:
-                categories_map[cat_nom] = existing
-            else:
-                new_cat = Categorie(
-                    nom=cat_nom,
-                    etablissement_id=etablissement_id
-                )
-                db.session.add(new_cat)
-                db.session.flush()
-                categories_map[cat_nom] = new_cat
-                stats["categories"] += 1
-
-        # 3. Créer les objets (si ils n'existent pas déjà)
-        for obj_data in pack["objets"]:
-            existing = db.session.execute(
-                db.select(Objet).filter_by(
-                    nom=obj_data["nom"],
-                    etablissement_id=etablissement_id
-                )
-            ).scalar_one_or_none()
-            if existing:
-                stats["ignores"] += 1
-                continue
-
-            armoire = armoires_map.get(obj_data["armoire"])
-            categorie = categories_map.get(obj_data["categorie"])
-
-            new_obj = Objet(
-                nom=obj_data["nom"],
-                type_objet=obj_data["type_objet"],
-                etablissement_id=etablissement_id,
-                armoire_id=armoire.id if armoire else None,
-                categorie_id=categorie.id if categorie else None,
-                quantite_physique=obj_data["quantite_physique"],
-                seuil=obj_data["seuil"],
-                unite=obj_data.get("unite", "unité"),
-                is_cmr=obj_data.get("is_cmr", False),
-                image_url=obj_data.get("image_url"),
-                fds_url=obj_data.get("fds_url"),
-                en_commande=False,
-                traite=False,
-            )
-
-            # Champs spécifiques aux produits chimiques
-            if obj_data["type_objet"] == "produit":
-                new_obj.capacite_initiale = obj_data.get("capacite_initiale")
-                new_obj.niveau_actuel = obj_data.get("niveau_actuel")
-                new_obj.seuil_pourcentage = obj_data.get("seuil_pourcentage", 50)
-
-            db.session.add(new_obj)
-            stats["objets"] += 1
-
-        db.session.commit()
-        log_action('import_pack', f"Pack '{pack['nom']}' importé : {stats}")
-        cache.delete(f"armoires_{etablissement_id}")
-        cache.delete(f"categories_{etablissement_id}")
-        return jsonify({
-            "success": True,
-            "message": f"Pack importé avec succès ! {stats['armoires']} armoires, {stats['categories']} catégories et {stats['objets']} objets créés. {stats['ignores']} éléments ignorés (déjà existants).",
-            "stats": stats
-        })
-
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Erreur import pack: {e}", exc_info=True)
+        stats = importer_pack_onboarding(pack_id, etablissement_id)
+    except PackServiceError as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+    log_action('import_pack', f"Pack '{pack.nom}' importé : {stats}")
+    cache.delete(f"armoires_{etablissement_id}")
+    cache.delete(f"categories_{etablissement_id}")
+    return jsonify({
+        "success": True,
+        "message": f"Pack importé avec succès ! {stats['armoires']} armoires, {stats['categories']} catégories et {stats['objets']} objets créés. {stats['ignores']} éléments ignorés (déjà existants).",
+        "stats": stats
+    })
+
 @admin_bp.route("/personnalisation", methods=["GET"])
 @admin_required
 def personnalisation_page():
@@ -1218,12 +709,8 @@ def personnalisation_page():
         {'text': 'Personnalisation', 'url': None}
     ]
     etablissement_id = session.get('etablissement_id')
-    # Bypass cache pour toujours avoir les donnees fraiches
-    from db import Parametre
-    params_list = db.session.execute(
-        db.select(Parametre).filter_by(etablissement_id=etablissement_id)
-    ).scalars().all()
-    params = {p.cle: p.valeur for p in params_list}
+    # Store versionné : une écriture validée est visible dès la requête suivante, dans tous les workers
+    params = parametres.tous(etablissement_id)
     return render_template("admin_personnalisation.html", breadcrumbs=breadcrumbs, params=params)
 
 @admin_bp.route("/theme", methods=["POST"])
@@ -1232,27 +719,14 @@ def sauvegarder_theme():
     etablissement_id = session.get('etablissement_id')
     action = request.form.get('action', '')
 
-    def _save_param(cle, valeur):
-        param = db.session.execute(
-            db.select(Parametre).filter_by(etablissement_id=etablissement_id, cle=cle)
-        ).scalar_one_or_none()
-        if param:
-            param.valeur = valeur
-        else:
-            db.session.add(Parametre(etablissement_id=etablissement_id, cle=cle, valeur=valeur))
-
-    def _invalidate_cache():
-        from extensions import cache
-        cache.clear()
-
     if action == 'couleur':
         try:
             couleur = request.form.get('couleur_principale', '').strip()
             if couleur and couleur.startswith('#') and len(couleur) in [4, 7]:
-                _save_param('couleur_principale', couleur)
-                _save_param('couleur_secondaire', couleur)
+                parametres.definir(etablissement_id, 'couleur_principale', couleur)
+                parametres.definir(etablissement_id, 'couleur_secondaire', couleur)
+                bump_version(etablissement_id, DOMAINE_THEME)
                 db.session.commit()
-                _invalidate_cache()
                 flash('Couleur mise a jour avec succes.', 'success')
             else:
                 flash('Couleur invalide.', 'error')
@@ -1266,48 +740,25 @@ def sauvegarder_theme():
         if not logo_file or not logo_file.filename:
             flash('Aucun fichier selectionne.', 'error')
         else:
-            ext = logo_file.filename.rsplit('.', 1)[-1].lower()
-            if ext not in ['png', 'jpg', 'jpeg', 'svg', 'webp']:
-                flash('Format non supporte. Utilisez PNG, JPG, SVG ou WebP.', 'error')
-            else:
-                try:
-                    import cloudinary
-                    import cloudinary.uploader
-                    cloudinary.config(
-                        cloud_name=current_app.config.get('CLOUDINARY_CLOUD_NAME'),
-                        api_key=current_app.config.get('CLOUDINARY_API_KEY'),
-                        api_secret=current_app.config.get('CLOUDINARY_API_SECRET')
-                    )
-                    result = cloudinary.uploader.upload(
-                        logo_file,
-                        public_id=f'scientral/logos/logo_{etablissement_id}',
-                        overwrite=True,
-                        resource_type='image'
-                    )
-                    logo_url = result['secure_url']
-                    flash(f'DEBUG: etab_id={etablissement_id} logo_url={logo_url}', 'info')
-                    import os
-                    import psycopg2
-                    db_url = os.environ.get('DATABASE_URL', '')
-                    if '?' in db_url:
-                        db_url += '&sslmode=require'
-                    conn = psycopg2.connect(db_url, sslmode='require')
-                    conn.autocommit = True
-                    cur = conn.cursor()
-                    cur.execute("SELECT COUNT(*) FROM parametres WHERE cle = 'logo_url' AND etablissement_id = %s", (etablissement_id,))
-                    if cur.fetchone()[0] > 0:
-                        cur.execute("UPDATE parametres SET valeur = %s WHERE cle = 'logo_url' AND etablissement_id = %s", (logo_url, etablissement_id))
-                    else:
-                        cur.execute("INSERT INTO parametres (cle, valeur, etablissement_id) VALUES ('logo_url', %s, %s)", (logo_url, etablissement_id))
-                    cur.close()
-                    conn.close()
-                    flash(f'DEBUG: commit OK', 'info')
-                    _invalidate_cache()
-                    flash('Logo mis a jour avec succes.', 'success')
-                except Exception as e:
-                    db.session.rollback()
-                    current_app.logger.error(f'Erreur Cloudinary: {e}', exc_info=True)
-                    flash(f'Erreur upload logo: {str(e)}', 'error')
+            try:
+                # Pipeline image commun : contenu matriciel vérifié (pas de SVG, servi tel quel depuis
+                # /static il exécuterait ses scripts), ré-encodé en JPEG, stocké par empreinte
+                ancien_logo = parametres.texte(etablissement_id, 'logo_url')
+                logo_url = enregistrer_image(logo_file)
+                # Même transaction que la version du thème : tout ou rien
+                parametres.definir(etablissement_id, 'logo_url', logo_url)
+                bump_version(etablissement_id, DOMAINE_THEME)
+                db.session.commit()
+                invalidate_logo(etablissement_id)
+                if ancien_logo != logo_url:
+                    liberer([ancien_logo])
+                flash('Logo mis a jour avec succes.', 'success')
+            except ImageServiceError as e:
+                flash(str(e), 'error')
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f'Erreur logo: {e}', exc_info=True)
+                flash(f'Erreur upload logo: {str(e)}', 'error')
     else:
         flash('Action inconnue.', 'error')
 
@@ -1324,16 +775,18 @@ def supprimer_logo():
             )
         ).scalar_one_or_none()
         if param:
-            # Supprimer le fichier
-            logo_path = os.path.join(current_app.root_path, 'static', param.valeur)
-            if os.path.exists(logo_path):
-                os.remove(logo_path)
+            ancien_logo = param.valeur
             db.session.delete(param)
+            bump_version(etablissement_id, DOMAINE_THEME)
             db.session.commit()
-            # Invalider cache
-            from extensions import cache
-            from utils import get_etablissement_params
-            cache.delete_memoized(get_etablissement_params, etablissement_id)
+            # Fichier supprimé après le commit (un blob partagé reste tant qu'il est référencé)
+            if est_blob(ancien_logo):
+                liberer([ancien_logo])
+            elif not ancien_logo.startswith('http'):
+                logo_path = os.path.join(current_app.root_path, 'static', ancien_logo)
+                if os.path.exists(logo_path):
+                    os.remove(logo_path)
+            invalidate_logo(etablissement_id)
             flash("Logo supprimé avec succès.", "success")
         else:
             flash("Aucun logo à supprimer.", "warning")
@@ -1403,99 +856,27 @@ def reset_etablissement():
         return jsonify({'success': False, 'error': 'Confirmation incorrecte'}), 400
 
     try:
-        from db import KitObjet, ReservationRecurrence, Salle
-        stats = {}
-
-        if 'reservations' in elements:
-            count = db.session.execute(
-                db.select(db.func.count(Reservation.id))
-                .where(Reservation.etablissement_id == etablissement_id)
-            ).scalar()
-            db.session.execute(
-                db.delete(Reservation).where(Reservation.etablissement_id == etablissement_id)
-            )
-            db.session.execute(
-                db.delete(ReservationRecurrence).where(ReservationRecurrence.etablissement_id == etablissement_id)
-            )
-            stats['reservations'] = count
-
-        if 'kits' in elements:
-            kits = db.session.execute(
-                db.select(Kit).filter_by(etablissement_id=etablissement_id)
-            ).scalars().all()
-            for kit in kits:
-                db.session.execute(db.delete(KitObjet).where(KitObjet.kit_id == kit.id))
-                db.session.delete(kit)
-            stats['kits'] = len(kits)
-
-        if 'inventaire' in elements:
-            objets = db.session.execute(
-                db.select(Objet).filter_by(etablissement_id=etablissement_id)
-            ).scalars().all()
-            for obj in objets:
-                db.session.execute(db.delete(KitObjet).where(KitObjet.objet_id == obj.id))
-                db.session.execute(db.delete(Reservation).where(Reservation.objet_id == obj.id))
-                db.session.delete(obj)
-            stats['inventaire'] = len(objets)
-
-        if 'armoires' in elements:
-            count = db.session.execute(
-                db.select(db.func.count(Armoire.id))
-                .where(Armoire.etablissement_id == etablissement_id)
-            ).scalar()
-            db.session.execute(
-                db.delete(Armoire).where(Armoire.etablissement_id == etablissement_id)
-            )
-            stats['armoires'] = count
-
-        if 'categories' in elements:
-            count = db.session.execute(
-                db.select(db.func.count(Categorie.id))
-                .where(Categorie.etablissement_id == etablissement_id)
-            ).scalar()
-            db.session.execute(
-                db.delete(Categorie).where(Categorie.etablissement_id == etablissement_id)
-            )
-            stats['categories'] = count
-
-        if 'salles' in elements:
-            count = db.session.execute(
-                db.select(db.func.count(Salle.id))
-                .where(Salle.etablissement_id == etablissement_id)
-            ).scalar()
-            db.session.execute(
-                db.delete(Salle).where(Salle.etablissement_id == etablissement_id)
-            )
-            stats['salles'] = count
-
-        if 'fournisseurs' in elements:
-            count = db.session.execute(
-                db.select(db.func.count(Fournisseur.id))
-                .where(Fournisseur.etablissement_id == etablissement_id)
-            ).scalar()
-            db.session.execute(
-                db.delete(Fournisseur).where(Fournisseur.etablissement_id == etablissement_id)
-            )
-            stats['fournisseurs'] = count
-
-        if 'budget' in elements:
-            budgets = db.session.execute(
-                db.select(Budget).filter_by(etablissement_id=etablissement_id)
-            ).scalars().all()
-            for budget in budgets:
-                db.session.execute(db.delete(Depense).where(Depense.budget_id == budget.id))
-                db.session.delete(budget)
-            stats['budget'] = len(budgets)
-
-        db.session.commit()
-        log_action('reset_etablissement', f"Reset: {list(elements)}")
-        return jsonify({'success': True, 'stats': stats})
+        plan_purge(elements)
+    except PurgeServiceError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
+    try:
+        job = lancer_purge(etablissement_id, session.get('user_id'), elements)
+    except PurgeServiceError as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Erreur reset: {e}", exc_info=True)
         return jsonify({'success': False, 'error': 'Erreur technique'}), 500
 
+    log_action('reset_etablissement', f"Reset: {list(elements)}")
+    return jsonify({
+        'success': True,
+        'job': job_to_dict(job),
+        'status_url': url_for('admin.statut_export', job_id=job.id),
+        'resultat_url': url_for('admin.telecharger_export', job_id=job.id),
+    }), 202
+
 # GESTION DES SALLES
 # ============================================================
 @admin_bp.route("/salles")
@@ -2365,28 +1746,38 @@ def exporter_budget():
         date_debut = datetime.strptime(date_debut_str, '%Y-%m-%d').date()
         date_fin = datetime.strptime(date_fin_str, '%Y-%m-%d').date()
         
-        depenses = db.session.execute(
-            db.select(Depense).options(joinedload(Depense.fournisseur))
-            .filter_by(etablissement_id=etablissement_id)
-            .filter(Depense.date_depense >= date_debut, Depense.date_depense <= date_fin)
-            .order_by(Depense.date_depense.asc())
-        ).scalars().all()
+        periode_filter = (
+            Depense.etablissement_id == etablissement_id,
+            Depense.date_depense >= date_debut,
+            Depense.date_depense <= date_fin
+        )
+
+        # Agrégats calculés en base : l'en-tête et le total sont connus avant le streaming
+        nombre_depenses, total = db.session.execute(
+            db.select(func.count(Depense.id), func.coalesce(func.sum(Depense.montant), 0.0))
+            .filter(*periode_filter)
+        ).one()
         
-        if not depenses:
+        if not nombre_depenses:
             flash("Aucune dépense sur cette période.", "warning")
             return redirect(redirect_url)
-        
-        data_export = []
-        total = 0.0
-        for d in depenses:
-            nom_fournisseur = "Petit matériel" if d.est_bon_achat else (d.fournisseur.nom if d.fournisseur else "Inconnu")
-            data_export.append({
-                'date': d.date_depense.strftime('%d/%m/%Y'),
-                'fournisseur': nom_fournisseur,
-                'contenu': d.contenu or "-",
-                'montant': d.montant
-            })
-            total += d.montant
+
+        query = (
+            db.select(Depense.date_depense, Depense.contenu, Depense.montant,
+                      Depense.est_bon_achat, Fournisseur.nom)
+            .outerjoin(Fournisseur, Depense.fournisseur_id == Fournisseur.id)
+            .filter(*periode_filter)
+            .order_by(Depense.date_depense.asc(), Depense.id.asc())
+        )
+
+        def _iter_depenses():
+            for date_depense, contenu, montant, est_bon_achat, nom_fournisseur in iter_rows(query):
+                yield {
+                    'date': date_depense.strftime('%d/%m/%Y'),
+                    'fournisseur': "Petit matériel" if est_bon_achat else (nom_fournisseur or "Inconnu"),
+                    'contenu': contenu or "-",
+                    'montant': montant
+                }
         
         metadata = {
             'etablissement': session.get('nom_etablissement', 'Mon Établissement'),
@@ -2394,15 +1785,18 @@ def exporter_budget():
             'date_debut': date_debut.strftime('%d/%m/%Y'),
             'date_fin': date_fin.strftime('%d/%m/%Y'),
             'date_generation': datetime.now().strftime('%d/%m/%Y à %H:%M'),
-            'nombre_depenses': len(data_export),
-            'total': total
+            'nombre_depenses': nombre_depenses,
+            'total': float(total)
         }
         
         if format_type == 'excel': 
-            return generer_budget_excel_pro(data_export, metadata)
+            return generer_budget_excel_pro(_iter_depenses(), metadata)
         else: 
-            return generer_budget_pdf_pro(data_export, metadata)
+            return generer_budget_pdf_pro(list(_iter_depenses()), metadata)
     
+    except PdfRenderError as e:
+        flash(str(e), "warning")
+        return redirect(redirect_url)
     except Exception as e:
         current_app.logger.error(f"Erreur export budget: {e}", exc_info=True)
         flash("Erreur technique lors de l'export.", "error")
@@ -2583,8 +1977,7 @@ def supprimer_fournisseur(id):
 @admin_required
 def gestion_sauvegardes():
     etablissement_id = session['etablissement_id']
-    params = get_etablissement_params(etablissement_id)
-    if params.get('licence_statut') != 'PRO':
+    if not parametres.est_pro(etablissement_id):
         flash("Réservé à la version PRO.", "warning")
         return redirect(url_for('admin.admin'))
     return render_template("admin_backup.html", now=datetime.now(), breadcrumbs=[
@@ -2597,53 +1990,37 @@ def gestion_sauvegardes():
 @admin_required
 def telecharger_db():
     etablissement_id = session['etablissement_id']
-    params = get_etablissement_params(etablissement_id)
-    if params.get('licence_statut') != 'PRO':
+    if not parametres.est_pro(etablissement_id):
         flash("Réservé PRO.", "warning")
         return redirect(url_for('admin.gestion_sauvegardes'))
 
-    try:
-        data = {
-            'metadata': {'version': '1.0', 'date': datetime.now().isoformat(), 'etablissement': session.get('nom_etablissement')},
-            'armoires': [], 'categories': [], 'fournisseurs': [], 'objets': [], 'budget': [], 'depenses': [], 'echeances': []
+    # Différentielle : ?depuis=<séquence> (indiquée dans le nom du fichier précédent)
+    depuis = request.args.get('depuis', type=int)
+    if depuis is not None:
+        try:
+            verifier_differentielle(etablissement_id, depuis)
+        except BackupServiceError as e:
+            flash(str(e), "warning")
+            return redirect(url_for('admin.gestion_sauvegardes'))
+
+    nom_etab = session.get('nom_etablissement', 'Backup')
+    sequence = sequence_journal()
+    if depuis is None:
+        log_action('backup_download', "Export NDJSON.gz")
+        suffixe = f"complet_{sequence}"
+    else:
+        log_action('backup_download', f"Export différentiel depuis {depuis}")
+        suffixe = f"diff_{depuis}_{sequence}"
+    safe_etab = sanitize_filename(nom_etab)
+    # Réponse chunked : chaque table est lue par lots et compressée pendant l'envoi
+    return Response(
+        stream_with_context(generer_sauvegarde(etablissement_id, nom_etab, depuis=depuis, sequence=sequence)),
+        mimetype='application/gzip',
+        headers={
+            'Content-Disposition': f'attachment; filename="Sauvegarde_{safe_etab}_{date.today()}_{suffixe}.ndjson.gz"',
+            'Cache-Control': 'no-store',
         }
-        
-        # Extraction des données (simplifiée pour la lisibilité)
-        for a in db.session.execute(db.select(Armoire).filter_by(etablissement_id=etablissement_id)).scalars():
-            data['armoires'].append({'id': a.id, 'nom': a.nom})
-        for c in db.session.execute(db.select(Categorie).filter_by(etablissement_id=etablissement_id)).scalars():
-            data['categories'].append({'id': c.id, 'nom': c.nom})
-        for f in db.session.execute(db.select(Fournisseur).filter_by(etablissement_id=etablissement_id)).scalars():
-            data['fournisseurs'].append({'id': f.id, 'nom': f.nom, 'site_web': f.site_web, 'logo': f.logo})
-        for o in db.session.execute(db.select(Objet).filter_by(etablissement_id=etablissement_id)).scalars():
-            data['objets'].append({
-                'id': o.id, 'nom': o.nom, 'quantite': o.quantite_physique, 'seuil': o.seuil,
-                'armoire_id': o.armoire_id, 'categorie_id': o.categorie_id, 'date_peremption': o.date_peremption,
-                'image_url': o.image_url, 'fds_url': o.fds_url
-            })
-        for b in db.session.execute(db.select(Budget).filter_by(etablissement_id=etablissement_id)).scalars():
-            b_data = {'id': b.id, 'annee': b.annee, 'montant': b.montant_initial, 'cloture': b.cloture}
-            data['budget'].append(b_data)
-            for d in b.depenses:
-                data['depenses'].append({
-                    'budget_id': b.id, 'date': d.date_depense, 'contenu': d.contenu,
-                    'montant': d.montant, 'est_bon_achat': d.est_bon_achat, 'fournisseur_id': d.fournisseur_id
-                })
-        for e in db.session.execute(db.select(Echeance).filter_by(etablissement_id=etablissement_id)).scalars():
-            data['echeances'].append({'intitule': e.intitule, 'date': e.date_echeance, 'details': e.details, 'traite': e.traite})
-
-        json_str = json.dumps(data, default=json_serial, indent=4)
-        buffer = BytesIO()
-        buffer.write(json_str.encode('utf-8'))
-        buffer.seek(0)
-        log_action('backup_download', "Export JSON")
-        safe_etab = sanitize_filename(session.get('nom_etablissement', 'Backup'))
-        return send_file(buffer, as_attachment=True, download_name=f"Sauvegarde_{safe_etab}_{date.today()}.json", mimetype='application/json')
-
-    except Exception:
-        current_app.logger.error("Erreur backup", exc_info=True)
-        flash("Erreur technique.", "error")
-        return redirect(url_for('admin.gestion_sauvegardes'))
+    )
 
 @admin_bp.route("/importer_db", methods=["POST"])
 @admin_required
@@ -2652,101 +2029,29 @@ def importer_db():
     if 'fichier' not in request.files:
         flash("Aucun fichier.", "error")
         return redirect(url_for('admin.gestion_sauvegardes'))
-        
-    fichier = request.files['fichier']
-    
-    # CORRECTION : Vérification taille fichier avant lecture
-    fichier.seek(0, 2)
-    if fichier.tell() > MAX_JSON_SIZE:
-        flash("Fichier JSON trop volumineux (Max 5Mo).", "error")
-        return redirect(url_for('admin.gestion_sauvegardes'))
-    fichier.seek(0)
 
-    if fichier.filename == '' or not allowed_file(fichier.filename) or not fichier.filename.endswith('.json'):
-        flash("Fichier invalide (.json requis).", "error")
+    fichiers = [f for f in request.files.getlist('fichier') if f.filename]
+    if not fichiers or not all(f.filename.lower().endswith(BACKUP_EXTENSIONS) for f in fichiers):
+        flash("Fichier invalide (.ndjson.gz ou .json requis).", "error")
         return redirect(url_for('admin.gestion_sauvegardes'))
 
     try:
-        data = json.load(fichier)
-        
-        # CORRECTION : Transaction atomique (Tout ou rien)
-        with db.session.begin_nested():
-            map_armoires = {}
-            map_categories = {}
-            map_fournisseurs = {}
-            map_budgets = {}
-
-            # Nettoyage
-            for model in [KitObjet, Historique, Reservation, Suggestion, Depense, Objet, Kit, Budget, Echeance, Armoire, Categorie, Fournisseur]:
-                db.session.query(model).filter_by(etablissement_id=etablissement_id).delete()
-            db.session.flush()
-
-            # Reconstruction
-            for a in data.get('armoires', []):
-                new_a = Armoire(nom=a['nom'], etablissement_id=etablissement_id)
-                db.session.add(new_a)
-                db.session.flush()
-                map_armoires[a['id']] = new_a.id
-
-            for c in data.get('categories', []):
-                new_c = Categorie(nom=c['nom'], etablissement_id=etablissement_id)
-                db.session.add(new_c)
-                db.session.flush()
-                map_categories[c['id']] = new_c.id
-
-            for f in data.get('fournisseurs', []):
-                new_f = Fournisseur(nom=f['nom'], site_web=f.get('site_web'), logo=f.get('logo'), etablissement_id=etablissement_id)
-                db.session.add(new_f)
-                db.session.flush()
-                map_fournisseurs[f['id']] = new_f.id
-
-            for o in data.get('objets', []):
-                new_armoire_id = map_armoires.get(o['armoire_id'])
-                new_cat_id = map_categories.get(o['categorie_id'])
-                if not new_armoire_id or not new_cat_id: continue 
-                
-                date_perim = None
-                if o.get('date_peremption'):
-                    try: date_perim = datetime.fromisoformat(o['date_peremption']).date()
-                    except: pass
-
-                db.session.add(Objet(
-                    nom=o['nom'], quantite_physique=o['quantite'], seuil=o['seuil'],
-                    armoire_id=new_armoire_id, categorie_id=new_cat_id, date_peremption=date_perim,
-                    image_url=o.get('image_url'), fds_url=o.get('fds_url'), etablissement_id=etablissement_id
-                ))
-
-            for b in data.get('budget', []):
-                new_b = Budget(annee=b['annee'], montant_initial=b['montant'], cloture=b['cloture'], etablissement_id=etablissement_id)
-                db.session.add(new_b)
-                db.session.flush()
-                map_budgets[b['id']] = new_b.id
-
-            for d in data.get('depenses', []):
-                new_budget_id = map_budgets.get(d['budget_id'])
-                if not new_budget_id: continue
-                new_fournisseur_id = map_fournisseurs.get(d['fournisseur_id']) if d.get('fournisseur_id') else None
-                try: date_dep = datetime.fromisoformat(d['date']).date()
-                except: date_dep = date.today()
-                db.session.add(Depense(
-                    budget_id=new_budget_id, fournisseur_id=new_fournisseur_id, contenu=d['contenu'],
-                    montant=d['montant'], date_depense=date_dep, est_bon_achat=d.get('est_bon_achat', False),
-                    etablissement_id=etablissement_id
-                ))
-
-            for e in data.get('echeances', []):
-                try: date_ech = datetime.fromisoformat(e['date']).date()
-                except: continue
-                db.session.add(Echeance(intitule=e['intitule'], date_echeance=date_ech, details=e.get('details'), traite=e.get('traite', 0), etablissement_id=etablissement_id))
-
-        db.session.commit()
-        log_action('backup_restore', "Import JSON")
-        flash("Restauration réussie !", "success")
+        # Complète d'abord, puis différentielles dans l'ordre de la chaîne
+        entetes = {id(f): lire_entete(f.stream) for f in fichiers}
+        fichiers.sort(key=lambda f: (entetes[id(f)]['mode'] != 'complet', entetes[id(f)].get('depuis') or 0))
+        # Lecture en flux (décompression à la volée), écritures par lots, une seule transaction
+        stats = restaurer_sauvegarde([f.stream for f in fichiers], etablissement_id, session['user_id'])
+    except BackupServiceError as e:
+        current_app.logger.warning(f"Restauration refusée (etab {etablissement_id}): {e}")
+        flash(str(e), "error")
+        return redirect(url_for('admin.gestion_sauvegardes'))
 
-    except Exception:
-        db.session.rollback()
-        current_app.logger.error("Erreur import DB", exc_info=True)
-        flash("Erreur critique lors de l'importation.", "error")
+    invalidate_logo(etablissement_id)
+    log_action('backup_restore', f"Import sauvegarde ({stats['total']} lignes)")
+    message = f"Restauration réussie ! {stats['total']} élément(s) restauré(s)."
+    if stats['ignorees']:
+        message += f" {stats['ignorees']} ligne(s) orpheline(s) ignorée(s)."
+    flash(message, "success")
 
     return redirect(url_for('admin.gestion_sauvegardes'))
 
@@ -2759,11 +2064,15 @@ def importer_page():
     etablissement_id = session['etablissement_id']
     armoires = db.session.execute(db.select(Armoire).filter_by(etablissement_id=etablissement_id)).scalars().all()
     categories = db.session.execute(db.select(Categorie).filter_by(etablissement_id=etablissement_id)).scalars().all()
+    sessions_import = db.session.execute(
+        db.select(ImportSession).filter_by(etablissement_id=etablissement_id)
+        .order_by(ImportSession.date_creation.desc()).limit(5)
+    ).scalars().all()
     return render_template("admin_import.html", breadcrumbs=[
         {'text': 'Tableau de Bord', 'url': url_for('inventaire.index')},
         {'text': 'Administration', 'url': url_for('admin.admin')},
         {'text': 'Import', 'url': None}
-    ], armoires=armoires, categories=categories, now=datetime.now())
+    ], armoires=armoires, categories=categories, now=datetime.now(), sessions_import=sessions_import)
 
 @admin_bp.route("/telecharger_modele")
 @admin_required
@@ -2818,92 +2127,141 @@ def importer_fichier():
         return redirect(url_for('admin.importer_page'))
     fichier.seek(0)
 
+    # Phase 1 : analyse en arrière-plan, rien n'est écrit dans l'inventaire
     try:
-        wb = load_workbook(fichier)
-        ws = wb.active
-        
-        # 1. Validation des en-têtes
-        headers = {cell.value: idx for idx, cell in enumerate(ws[1], 0) if cell.value}
-        required_cols = {'Nom', 'Quantité', 'Seuil', 'Armoire', 'Catégorie'}
-        
-        if not required_cols.issubset(headers.keys()):
-            flash(f"Colonnes manquantes. Requis : {', '.join(required_cols)}", "error")
-            return redirect(url_for('admin.importer_page'))
-
-        existing_objets = {o.nom.lower() for o in db.session.execute(db.select(Objet).filter_by(etablissement_id=etablissement_id)).scalars().all()}
-        armoires_map = {a.nom.lower(): a.id for a in db.session.execute(db.select(Armoire).filter_by(etablissement_id=etablissement_id)).scalars().all()}
-        categories_map = {c.nom.lower(): c.id for c in db.session.execute(db.select(Categorie).filter_by(etablissement_id=etablissement_id)).scalars().all()}
-        
-        success_count = 0
-        errors = []
-        
-        # 2. Lecture avec limite de lignes
-        for i, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
-            if i > MAX_IMPORT_ROWS:
-                errors.append(f"Limite de {MAX_IMPORT_ROWS} lignes atteinte. Le reste a été ignoré.")
-                break
-                
-            if not row: continue
-            
-            # Récupération via le mapping des colonnes
-            try:
-                nom = row[headers['Nom']]
-                qte = row[headers['Quantité']]
-                seuil = row[headers['Seuil']]
-                arm_nom = row[headers['Armoire']]
-                cat_nom = row[headers['Catégorie']]
-                
-                # Colonnes optionnelles
-                date_val = row[headers['Date Péremption']] if 'Date Péremption' in headers else None
-                img_val = row[headers['Image (URL)']] if 'Image (URL)' in headers else None
-            except IndexError:
-                continue # Ligne malformée
-
-            if not all([nom, qte is not None, seuil is not None]):
-                errors.append(f"Ligne {i}: Données obligatoires manquantes")
-                continue
-                
-            if str(nom).lower() in existing_objets: continue
-            
-            arm_id = armoires_map.get(str(arm_nom).lower().strip()) if arm_nom else None
-            cat_id = categories_map.get(str(cat_nom).lower().strip()) if cat_nom else None
-            
-            if not arm_id or not cat_id:
-                errors.append(f"Ligne {i}: Armoire ou Catégorie inconnue")
-                continue
-                
-            date_perim = None
-            if date_val:
-                if isinstance(date_val, datetime): date_perim = date_val.date()
-                elif isinstance(date_val, str):
-                    try: date_perim = datetime.strptime(date_val.split(' ')[0], '%Y-%m-%d').date()
-                    except: pass
-
-            db.session.add(Objet(
-                nom=str(nom), quantite_physique=int(qte), seuil=int(seuil),
-                armoire_id=arm_id, categorie_id=cat_id, date_peremption=date_perim,
-                image_url=str(img_val) if img_val else None,
-                etablissement_id=etablissement_id
-            ))
-            success_count += 1
-            
-        if errors:
-            db.session.rollback()
-            for e in errors[:5]: flash(e, "error")
-            if len(errors) > 5: flash(f"... et {len(errors)-5} autres erreurs.", "error")
-        else:
-            db.session.commit()
-            log_action('import_excel', f"{success_count} objets importés")
-            flash(f"{success_count} objets importés.", "success")
-
+        import_session = creer_session(etablissement_id, session.get('user_id'), fichier, fichier.filename)
+    except ImportServiceError as e:
+        flash(str(e), "error")
+        return redirect(url_for('admin.importer_page'))
     except Exception as e:
         db.session.rollback()
         current_app.logger.error("Erreur import Excel", exc_info=True)
         flash("Erreur technique.", "error")
+        return redirect(url_for('admin.importer_page'))
+
+    return redirect(url_for('admin.import_session_page', session_id=import_session.id))
+
+
+def _get_import_session_or_redirect(session_id):
+    import_session = get_import_session(session_id, session['etablissement_id'])
+    if not import_session:
+        flash("Import introuvable ou expiré.", "warning")
+    return import_session
+
+
+@admin_bp.route("/import/<session_id>")
+@admin_required
+def import_session_page(session_id):
+    import_session = _get_import_session_or_redirect(session_id)
+    if not import_session:
+        return redirect(url_for('admin.importer_page'))
+
+    erreurs = import_session.lignes.filter(ImportLigne.statut == LIGNE_ERREUR) \
+        .order_by(ImportLigne.ligne).limit(50).all()
+    return render_template("admin_import_session.html", breadcrumbs=[
+        {'text': 'Tableau de Bord', 'url': url_for('inventaire.index')},
+        {'text': 'Administration', 'url': url_for('admin.admin')},
+        {'text': 'Import', 'url': url_for('admin.importer_page')},
+        {'text': import_session.nom_fichier or 'Session', 'url': None}
+    ], import_session=import_session, job=job_actif(import_session), erreurs=erreurs,
+       peut_reprendre=peut_reprendre(import_session))
+
+
+@admin_bp.route("/import/<session_id>/valider", methods=['POST'])
+@admin_required
+@limiter.limit("10 per minute")
+def valider_import(session_id):
+    import_session = _get_import_session_or_redirect(session_id)
+    if not import_session:
+        return redirect(url_for('admin.importer_page'))
+    try:
+        lancer_validation(import_session)
+        log_action('import_excel', f"Validation de l'import {import_session.nom_fichier} "
+                                   f"({import_session.nb_valides - import_session.nb_importes} lignes)")
+    except ImportServiceError as e:
+        flash(str(e), "warning")
+    return redirect(url_for('admin.import_session_page', session_id=session_id))
+
 
+@admin_bp.route("/import/<session_id>/annuler", methods=['POST'])
+@admin_required
+def annuler_import(session_id):
+    import_session = _get_import_session_or_redirect(session_id)
+    if not import_session:
+        return redirect(url_for('admin.importer_page'))
+    try:
+        annuler_session(import_session)
+        flash("Import abandonné.", "info")
+    except ImportServiceError as e:
+        flash(str(e), "warning")
+        return redirect(url_for('admin.import_session_page', session_id=session_id))
     return redirect(url_for('admin.importer_page'))
 
 
+@admin_bp.route("/import/<session_id>/rapport")
+@admin_required
+def rapport_import(session_id):
+    import_session = _get_import_session_or_redirect(session_id)
+    if not import_session:
+        return redirect(url_for('admin.importer_page'))
+    nom = os.path.splitext(secure_filename(import_session.nom_fichier or 'import'))[0] or 'import'
+    return csv_response(RAPPORT_IMPORT_HEADERS, iter_rapport_import(import_session.id), f"Erreurs_{nom}.csv")
+
+
+
+def _inventaire_export_query(etablissement_id, armoire_id=None, categorie_id=None):
+    """Requête d'export inventaire (colonnes utiles uniquement, pas d'entités ORM)."""
+    query = (
+        db.select(Categorie.nom, Objet.nom, Objet.quantite_physique, Objet.seuil,
+                  Armoire.nom, Objet.date_peremption)
+        .select_from(Objet)
+        .outerjoin(Categorie, Objet.categorie_id == Categorie.id)
+        .outerjoin(Armoire, Objet.armoire_id == Armoire.id)
+        .filter(Objet.etablissement_id == etablissement_id)
+    )
+    if armoire_id:
+        query = query.filter(Objet.armoire_id == armoire_id)
+    elif categorie_id:
+        query = query.filter(Objet.categorie_id == categorie_id)
+    return query.order_by(Objet.categorie_id, Objet.nom)
+
+
+def _iter_inventaire_rows(query):
+    """Formate les lignes d'inventaire à la volée (curseur serveur)."""
+    for cat_nom, nom, quantite, seuil, arm_nom, peremption in iter_rows(query):
+        yield {
+            'categorie': cat_nom or "Sans catégorie",
+            'nom': nom,
+            'quantite': quantite,
+            'seuil': seuil,
+            'armoire': arm_nom or "Non rangé",
+            'peremption': peremption.strftime('%d/%m/%Y') if peremption else "-"
+        }
+
+
+def _export_refuse(message, category, endpoint, is_async):
+    """Erreur d'export : JSON pour le mode arrière-plan, flash + redirection sinon."""
+    if is_async:
+        return jsonify({'success': False, 'error': message}), 400
+    flash(message, category)
+    return redirect(url_for(endpoint))
+
+
+def _export_job_response(job):
+    return jsonify({
+        'success': True,
+        'job': job_to_dict(job),
+        'status_url': url_for('admin.statut_export', job_id=job.id),
+        'download_url': url_for('admin.telecharger_export', job_id=job.id)
+    }), 202
+
+
+def _envoyer_inventaire_cache(chemin, titre_doc, ext):
+    """Sert un export d'inventaire depuis le cache disque (nom de fichier daté du jour)."""
+    mimetype = XLSX_MIMETYPE if ext == 'xlsx' else 'application/pdf'
+    return send_file(chemin, as_attachment=True, mimetype=mimetype,
+                     download_name=_nom_export("Inventaire", {'etablissement': titre_doc}, ext))
+
 
 @admin_bp.route("/exporter_inventaire")
 @admin_required
@@ -2915,25 +2273,18 @@ def exporter_inventaire():
     format_type = request.args.get('format')
     armoire_id = request.args.get('armoire_id', type=int)
     categorie_id = request.args.get('categorie_id', type=int)
+    is_async = request.args.get('mode') == 'async'
     
     # 2. Sécurité : Validation du format
     if format_type not in ['excel', 'pdf']:
-        flash("Format d'export non supporté.", "error")
-        return redirect(url_for('admin.admin'))
+        return _export_refuse("Format d'export non supporté.", "error", 'admin.admin', is_async)
     
     # 3. Sécurité : Exclusion mutuelle
     if armoire_id and categorie_id:
-        flash("Veuillez choisir soit une armoire, soit une catégorie, mais pas les deux.", "warning")
-        return redirect(url_for('admin.admin'))
+        return _export_refuse("Veuillez choisir soit une armoire, soit une catégorie, mais pas les deux.", "warning", 'admin.admin', is_async)
 
     try:
-        # 4. Construction de la requête de base (Optimisée)
-        query = db.select(Objet).options(
-            joinedload(Objet.categorie), 
-            joinedload(Objet.armoire)
-        ).filter_by(etablissement_id=etablissement_id)
-
-        # 5. Application des filtres avec SÉCURITÉ IDOR
+        # 4. Application des filtres avec SÉCURITÉ IDOR
         titre_doc = f"Inventaire - {session.get('nom_etablissement', 'Global')}"
         
         if armoire_id:
@@ -2941,10 +2292,7 @@ def exporter_inventaire():
             armoire = db.session.get(Armoire, armoire_id)
             if not armoire or armoire.etablissement_id != etablissement_id:
                 current_app.logger.warning(f"IDOR SUSPECT: User {session.get('user_id')} tried accessing Armoire {armoire_id}")
-                flash("Armoire introuvable ou accès refusé.", "error")
-                return redirect(url_for('admin.admin'))
-            
-            query = query.filter(Objet.armoire_id == armoire_id)
+                return _export_refuse("Armoire introuvable ou accès refusé.", "error", 'admin.admin', is_async)
             titre_doc = f"Inventaire - {armoire.nom}"
         
         elif categorie_id:
@@ -2952,52 +2300,69 @@ def exporter_inventaire():
             categorie = db.session.get(Categorie, categorie_id)
             if not categorie or categorie.etablissement_id != etablissement_id:
                 current_app.logger.warning(f"IDOR SUSPECT: User {session.get('user_id')} tried accessing Categorie {categorie_id}")
-                flash("Catégorie introuvable ou accès refusé.", "error")
-                return redirect(url_for('admin.admin'))
-            
-            query = query.filter(Objet.categorie_id == categorie_id)
+                return _export_refuse("Catégorie introuvable ou accès refusé.", "error", 'admin.admin', is_async)
             titre_doc = f"Inventaire - {categorie.nom}"
 
-        # 6. Exécution
-        objets = db.session.execute(query.order_by(Objet.categorie_id, Objet.nom)).scalars().all()
+        # 5. Cache : même sélection, mêmes versions de l'inventaire et du thème => même fichier
+        ext = 'xlsx' if format_type == 'excel' else 'pdf'
+        cle_cache = None
+        if not is_async and export_cache.is_enabled():
+            cle_cache = export_cache.cache_key(etablissement_id, 'inventaire', format_type,
+                                               {'armoire_id': armoire_id, 'categorie_id': categorie_id}, titre_doc)
+            chemin = export_cache.get(cle_cache, ext)
+            if chemin:
+                log_action('export_inventaire',
+                           f"Format: {format_type}, Armoire: {armoire_id}, Cat: {categorie_id}, Cache")
+                return _envoyer_inventaire_cache(chemin, titre_doc, ext)
+
+        # 6. Comptage (sans charger les lignes)
+        query = _inventaire_export_query(etablissement_id, armoire_id, categorie_id)
+        total = count_rows(query)
         
-        if not objets:
-            flash("Aucun objet trouvé pour cette sélection.", "warning")
-            return redirect(url_for('admin.admin'))
-        
-        # 7. Formatage des données (La boucle complète)
-        data_export = []
-        for obj in objets:
-            data_export.append({
-                'categorie': obj.categorie.nom if obj.categorie else "Sans catégorie",
-                'nom': obj.nom,
-                'quantite': obj.quantite_physique,
-                'seuil': obj.seuil,
-                'armoire': obj.armoire.nom if obj.armoire else "Non rangé",
-                'peremption': obj.date_peremption.strftime('%d/%m/%Y') if obj.date_peremption else "-"
-            })
-            
-        # 8. Métadonnées
+        if not total:
+            return _export_refuse("Aucun objet trouvé pour cette sélection.", "warning", 'admin.admin', is_async)
+
+        # 7. Audit Log (Obligatoire)
+        log_action('export_inventaire', 
+                  f"Format: {format_type}, Armoire: {armoire_id}, Cat: {categorie_id}, Items: {total}")
+
+        # 8. Mode arrière-plan : seuls les paramètres sont mis en file, le worker relance la requête
+        if is_async:
+            job = enqueue_export('inventaire', format_type, etablissement_id, session.get('user_id'), {
+                'armoire_id': armoire_id,
+                'categorie_id': categorie_id,
+                'titre': titre_doc
+            }, total=total)
+            return _export_job_response(job)
+
+        # 9. Métadonnées
         metadata = {
             'etablissement': titre_doc, 
+            'etablissement_id': etablissement_id,
             'date_generation': datetime.now().strftime('%d/%m/%Y à %H:%M'),
-            'total': len(data_export)
+            'total': total
         }
 
-        # 9. Audit Log (Obligatoire)
-        log_action('export_inventaire', 
-                  f"Format: {format_type}, Armoire: {armoire_id}, Cat: {categorie_id}, Items: {len(data_export)}")
+        # 10. Génération du fichier (lignes lues par lots au fil de l'écriture)
+        if cle_cache:
+            if format_type == 'excel':
+                chemin = export_cache.store(cle_cache, ext, _construire_inventaire_excel(_iter_inventaire_rows(query), metadata).save)
+            else:
+                metadata['logo_bytes'] = get_logo_bytes(etablissement_id)
+                pdf = render_pdf(_construire_inventaire_pdf, list(_iter_inventaire_rows(query)), metadata)
+                chemin = export_cache.put_bytes(cle_cache, ext, pdf)
+            return _envoyer_inventaire_cache(chemin, titre_doc, ext)
 
-        # 10. Génération du fichier
         if format_type == 'excel':
-            return generer_inventaire_excel(data_export, metadata)
+            return generer_inventaire_excel(_iter_inventaire_rows(query), metadata)
         else:
-            return generer_inventaire_pdf(data_export, metadata)
+            return generer_inventaire_pdf(list(_iter_inventaire_rows(query)), metadata)
 
+    except PdfRenderError as e:
+        return _export_refuse(str(e), "warning", 'admin.admin', is_async)
     except Exception as e:
         current_app.logger.error(f"Erreur critique export inventaire: {e}", exc_info=True)
-        flash("Une erreur technique est survenue lors de l'export.", "error")
-        return redirect(url_for('admin.admin'))
+        return _export_refuse("Une erreur technique est survenue lors de l'export.", "error", 'admin.admin', is_async)
 
 # ============================================================
 # MODULE RAPPORTS & ACTIVITÉ (Version Durcie)
@@ -3005,8 +2370,9 @@ def exporter_inventaire():
 
 # Constantes de sécurité pour les rapports
 MAX_EXPORT_DAYS = 366      # Limite la plage à 1 an
-MAX_EXPORT_ROWS = 5000     # Limite le nombre de lignes pour éviter le crash RAM (ReportLab/OpenPyXL)
-ALLOWED_FORMATS = {'excel', 'pdf'}
+MAX_PDF_EXPORT_ROWS = 5000 # ReportLab construit tout le document en RAM : Excel/CSV sont streamés, sans plafond
+ALLOWED_FORMATS = {'excel', 'pdf', 'csv'}
+RAPPORT_HEADERS = ["Date", "Heure", "Utilisateur", "Action", "Objet", "Détails"]
 
 @admin_bp.route("/rapports")
 @admin_required
@@ -3104,6 +2470,54 @@ def rapports():
                            breadcrumbs=breadcrumbs)
 
 
+def _rapport_export_query(etablissement_id, date_debut, date_fin, group_by='date', selected_actions=None):
+    """Requête d'export de l'historique (tri selon le mode de regroupement)."""
+    query = db.select(
+        Historique,
+        Utilisateur.nom_utilisateur,
+        Objet.nom.label('objet_nom')
+    ).outerjoin(Utilisateur, Historique.utilisateur_id == Utilisateur.id)\
+     .outerjoin(Objet, Historique.objet_id == Objet.id)\
+     .filter(Historique.etablissement_id == etablissement_id)\
+     .filter(Historique.timestamp >= date_debut)\
+     .filter(Historique.timestamp <= date_fin)
+
+    # --- LOGIQUE DE FILTRE ET TRI ---
+    if group_by == 'action':
+        # Si des actions spécifiques sont cochées, on filtre
+        if selected_actions:
+            query = query.filter(Historique.action.in_(selected_actions))
+        
+        # On trie par Action puis par Date
+        return query.order_by(Historique.action.asc(), Historique.timestamp.desc())
+    # Tri chronologique standard
+    return query.order_by(Historique.timestamp.desc())
+
+
+def _iter_rapport_rows(query):
+    """Formate les lignes d'historique à la volée (aucune liste intermédiaire)."""
+    for h, user_name, obj_name in iter_rows(query):
+        yield {
+            'date': h.timestamp.strftime('%d/%m/%Y'),
+            'heure': h.timestamp.strftime('%H:%M'),
+            'utilisateur': user_name or "Inconnu",
+            'action': h.action,
+            'objet': obj_name or "-",
+            'details': h.details or ""
+        }
+
+
+def _rapport_csv_rows(data_export):
+    for row in data_export:
+        yield [
+            row['date'], row['heure'],
+            sanitize_for_excel_report(row['utilisateur']),
+            sanitize_for_excel_report(row['action']),
+            sanitize_for_excel_report(row['objet']),
+            sanitize_for_excel_report(row['details'])
+        ]
+
+
 @admin_bp.route("/exporter_rapports", methods=['GET'])
 @admin_required
 @limiter.limit("5 per minute")
@@ -3115,18 +2529,17 @@ def exporter_rapports():
     date_fin_str = request.args.get('date_fin')
     format_type = request.args.get('format')
     group_by = request.args.get('group_by', 'date')
+    is_async = request.args.get('mode') == 'async'
     
     # NOUVEAU : Récupération des actions cochées (liste)
     # Flask récupère les checkbox multiples avec getlist
     selected_actions = request.args.getlist('actions') 
 
     if not all([date_debut_str, date_fin_str, format_type]):
-        flash("Paramètres manquants.", "warning")
-        return redirect(url_for('admin.rapports'))
+        return _export_refuse("Paramètres manquants.", "warning", 'admin.rapports', is_async)
 
     if format_type not in ALLOWED_FORMATS:
-        flash("Format non supporté.", "error")
-        return redirect(url_for('admin.rapports'))
+        return _export_refuse("Format non supporté.", "error", 'admin.rapports', is_async)
 
     try:
         # 2. Parsing Dates
@@ -3135,55 +2548,23 @@ def exporter_rapports():
         date_fin = date_fin.replace(hour=23, minute=59, second=59)
 
         if date_debut > date_fin:
-            flash("Dates incohérentes.", "warning")
-            return redirect(url_for('admin.rapports'))
+            return _export_refuse("Dates incohérentes.", "warning", 'admin.rapports', is_async)
             
         if (date_fin - date_debut).days > MAX_EXPORT_DAYS:
-            flash(f"Période limitée à {MAX_EXPORT_DAYS} jours.", "warning")
-            return redirect(url_for('admin.rapports'))
+            return _export_refuse(f"Période limitée à {MAX_EXPORT_DAYS} jours.", "warning", 'admin.rapports', is_async)
 
         # 3. Construction Requête
-        query = db.select(
-            Historique,
-            Utilisateur.nom_utilisateur,
-            Objet.nom.label('objet_nom')
-        ).outerjoin(Utilisateur, Historique.utilisateur_id == Utilisateur.id)\
-         .outerjoin(Objet, Historique.objet_id == Objet.id)\
-         .filter(Historique.etablissement_id == etablissement_id)\
-         .filter(Historique.timestamp >= date_debut)\
-         .filter(Historique.timestamp <= date_fin)
-
-        # --- LOGIQUE DE FILTRE ET TRI ---
-        if group_by == 'action':
-            # Si des actions spécifiques sont cochées, on filtre
-            if selected_actions:
-                query = query.filter(Historique.action.in_(selected_actions))
-            
-            # On trie par Action puis par Date
-            query = query.order_by(Historique.action.asc(), Historique.timestamp.desc())
-        else:
-            # Tri chronologique standard
-            query = query.order_by(Historique.timestamp.desc())
-
-        # Protection RAM
-        query = query.limit(MAX_EXPORT_ROWS)
-        resultats = db.session.execute(query).all()
-
-        if not resultats:
-            flash("Aucune donnée trouvée pour ces critères.", "info")
-            return redirect(url_for('admin.rapports'))
-
-        # 4. Préparation Données
-        data_export = []
-        for h, user_name, obj_name in resultats:
-            data_export.append({
-                'date': h.timestamp.strftime('%d/%m/%Y'),
-                'heure': h.timestamp.strftime('%H:%M'),
-                'utilisateur': user_name or "Inconnu",
-                'action': h.action,
-                'objet': obj_name or "-",
-                'details': h.details or ""
-            })
+        query = _rapport_export_query(etablissement_id, date_debut, date_fin, group_by, selected_actions)
+
+        # Comptage préalable (en-têtes et contrôle PDF) sans charger les lignes
+        total = count_rows(query)
+
+        if not total:
+            return _export_refuse("Aucune donnée trouvée pour ces critères.", "info", 'admin.rapports', is_async)
+
+        if format_type == 'pdf' and total > MAX_PDF_EXPORT_ROWS:
+            return _export_refuse(f"{total} lignes : le PDF est limité à {MAX_PDF_EXPORT_ROWS}. Utilisez l'export Excel ou CSV.",
+                                  "warning", 'admin.rapports', is_async)
 
         # Métadonnées enrichies
         filtre_info = "Tous types"
@@ -3194,79 +2575,75 @@ def exporter_rapports():
             'etablissement': session.get('nom_etablissement', 'Scientral'),
             'etablissement_id': session.get('etablissement_id'),
             'periode': f"Du {date_debut.strftime('%d/%m/%Y')} au {date_fin.strftime('%d/%m/%Y')}",
-            'total': len(data_export),
+            'total': total,
             'date_generation': datetime.now().strftime('%d/%m/%Y à %H:%M'),
             'filtre': filtre_info # On pourra l'afficher dans le PDF si on veut
         }
 
-        log_action('export_rapport', f"Format: {format_type}, Rows: {len(data_export)}")
-
-        if format_type == 'excel':
+        log_action('export_rapport', f"Format: {format_type}, Rows: {total}")
+
+        # Mode arrière-plan : paramètres sérialisés, le worker relance la requête
+        if is_async:
+            job = enqueue_export('rapport', format_type, etablissement_id, session.get('user_id'), {
+                'date_debut': date_debut.isoformat(),
+                'date_fin': date_fin.isoformat(),
+                'group_by': group_by,
+                'actions': selected_actions,
+                'etablissement': metadata['etablissement'],
+                'periode': metadata['periode'],
+                'filtre': filtre_info
+            }, total=total)
+            return _export_job_response(job)
+
+        # 4. Génération : les lignes sont lues par lots (curseur serveur) au fil de l'écriture
+        data_export = _iter_rapport_rows(query)
+
+        if format_type == 'csv':
+            return csv_response(RAPPORT_HEADERS, _rapport_csv_rows(data_export), _nom_export("Rapport", metadata, "csv"))
+        elif format_type == 'excel':
             return generer_rapport_excel(data_export, metadata)
         else:
-            return generer_rapport_pdf(data_export, metadata)
+            return generer_rapport_pdf(list(data_export), metadata)
 
+    except PdfRenderError as e:
+        return _export_refuse(str(e), "warning", 'admin.rapports', is_async)
     except Exception as e:
         current_app.logger.error(f"Erreur export: {e}", exc_info=True)
-        flash("Erreur technique lors de la génération.", "error")
-        return redirect(url_for('admin.rapports'))
+        return _export_refuse("Erreur technique lors de la génération.", "error", 'admin.rapports', is_async)
 
 # ============================================================
-# LICENCE (Rate Limit Custom)
+# EXPORTS EN ARRIÈRE-PLAN (suivi & téléchargement)
 # ============================================================
-class RateLimiter:
-    def __init__(self):
-        self.attempts = defaultdict(list)
-        self.last_cleanup = datetime.now()
-
-    def _cleanup_all(self):
-        """Supprime les clés vides et obsolètes."""
-        now = datetime.now()
-        cutoff = now - timedelta(minutes=15)
-        
-        # On itère sur une copie des clés pour pouvoir supprimer
-        for key in list(self.attempts.keys()):
-            # On ne garde que les tentatives récentes
-            self.attempts[key] = [t for t in self.attempts[key] if t > cutoff]
-            # Si la liste est vide, on supprime la clé pour libérer la mémoire
-            if not self.attempts[key]:
-                del self.attempts[key]
-        
-        self.last_cleanup = now
-
-    def is_allowed(self, key):
-        now = datetime.now()
-        
-        # Nettoyage opportuniste global (toutes les heures)
-        if (now - self.last_cleanup) > timedelta(hours=1):
-            self._cleanup_all()
-        
-        # Nettoyage spécifique à la clé courante
-        cutoff = now - timedelta(minutes=15)
-        self.attempts[key] = [t for t in self.attempts[key] if t > cutoff]
-        
-        if len(self.attempts[key]) >= 5: 
-            return False
-            
-        self.attempts[key].append(now)
-        return True
-    
-    def reset(self, key):
-        if key in self.attempts: del self.attempts[key]
-
-license_limiter = RateLimiter()
 
-def rate_limit_license(f):
-    @wraps(f)
-    def wrapped(*args, **kwargs):
-        eid = session.get('etablissement_id')
-        if not eid: return redirect(url_for('main.index'))
-        if not license_limiter.is_allowed(eid):
-            flash("Trop de tentatives. Réessayez dans 15 min.", "error")
-            return redirect(url_for('main.a_propos'))
-        return f(*args, **kwargs)
-    return wrapped
+@admin_bp.route("/exports/<job_id>/statut", methods=['GET'])
+@admin_required
+def statut_export(job_id):
+    try:
+        data = lire_statut(job_id, session['etablissement_id'])
+    except OperationalError:
+        # Base verrouillée (SQLite) et statut jamais lu ici : le client réessaie
+        response = jsonify({'success': False, 'retry': True, 'error': 'Statut momentanément indisponible'})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    if not data:
+        return jsonify({'success': False, 'error': 'Export introuvable'}), 404
+    data['download_url'] = url_for('admin.telecharger_export', job_id=job_id) if data.pop('telechargeable') else None
+    return jsonify({'success': True, 'job': data})
+
+
+@admin_bp.route("/exports/<job_id>/telecharger", methods=['GET'])
+@admin_required
+def telecharger_export(job_id):
+    job = get_job(job_id, session['etablissement_id'])
+    if not job or not is_downloadable(job):
+        flash("Export introuvable ou expiré.", "warning")
+        return redirect(url_for('admin.admin'))
+    return send_file(job_file_path(job), as_attachment=True,
+                     download_name=job.nom_fichier, mimetype=job.mimetype)
 
+# ============================================================
+# LICENCE (tentatives limitées : utils.rate_limit_license)
+# ============================================================
 @admin_bp.route("/activer_licence", methods=["POST"])
 @admin_required
 @rate_limit_license
@@ -3290,14 +2667,9 @@ def activer_licence():
             return redirect(url_for('main.a_propos'))
         
         # Activation
-        param_statut = db.session.execute(db.select(Parametre).filter_by(etablissement_id=etablissement_id, cle='licence_statut')).scalar_one_or_none()
-        if not param_statut: db.session.add(Parametre(etablissement_id=etablissement_id, cle='licence_statut', valeur='PRO'))
-        else: param_statut.valeur = 'PRO'
-        
+        parametres.definir(etablissement_id, 'licence_statut', 'PRO')
         db.session.commit()
-        try: cache.delete_memoized(get_etablissement_params, etablissement_id)
-        except: pass
-        license_limiter.reset(etablissement_id)
+        reset_license_limit(etablissement_id)
         flash("Licence PRO activée !", "success")
         
     except Exception as e:
@@ -3312,21 +2684,6 @@ def activer_licence():
 # GÉNÉRATEURS RAPPORTS PROFESSIONNELS (PDF/EXCEL) - VERSION FINALE
 # ============================================================
 
-# Imports spécifiques aux rapports (à laisser ici pour ne pas polluer le haut du fichier)
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-from html import escape
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from io import BytesIO
-from datetime import date
-import re
-
-
 # ============================================================
 # UTILITAIRES INTERNES AUX RAPPORTS
 # ============================================================
@@ -3338,6 +2695,11 @@ def sanitize_filename_report(text):
     return re.sub(r'[^\w\s-]', '', str(text)).strip().replace(' ', '_')
 
 
+def _nom_export(prefix, metadata, ext):
+    """Nom de fichier de téléchargement : Prefix_Etablissement_AAAAMMJJ.ext"""
+    return f"{prefix}_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.{ext}"
+
+
 def sanitize_for_excel_report(text):
     """Prépare le texte pour Excel (évite les formules injection)."""
     if not text:
@@ -3355,36 +2717,19 @@ def sanitize_for_excel_report(text):
 
 class LogoGraphique(Flowable):
     """Dessine un petit graphique vectoriel ou logo etablissement en PDF."""
-    def __init__(self, width=40, height=40, etablissement_id=None):
+    def __init__(self, width=40, height=40, etablissement_id=None, logo_bytes=None):
         Flowable.__init__(self)
         self.width = width
         self.height = height
-        self.logo_path = None
-        self.logo_data = None
-        if etablissement_id:
-            try:
-                from utils import get_etablissement_params
-                from io import BytesIO
-                import requests as req
-                params = get_etablissement_params(etablissement_id)
-                logo_url = params.get('logo_url')
-                if logo_url:
-                    if logo_url.startswith('http'):
-                        r = req.get(logo_url, timeout=5)
-                        if r.status_code == 200:
-                            self.logo_data = BytesIO(r.content)
-                    else:
-                        path = os.path.join(current_app.root_path, 'static', logo_url)
-                        if os.path.exists(path):
-                            self.logo_path = path
-            except Exception:
-                pass
+        if etablissement_id and not logo_bytes:
+            logo_bytes = get_logo_bytes(etablissement_id)  # Cache local (disque + mémoire)
+        self.logo_data = BytesIO(logo_bytes) if logo_bytes else None
 
     def draw(self):
-        if self.logo_path:
+        if self.logo_data:
             try:
                 from reportlab.lib.utils import ImageReader
-                img = ImageReader(self.logo_path)
+                img = ImageReader(self.logo_data)
                 self.canv.drawImage(img, 0, 0, width=self.width, height=self.height, preserveAspectRatio=True, mask="auto")
                 return
             except Exception:
@@ -3406,10 +2751,10 @@ class LogoGraphique(Flowable):
         self.canv.setLineWidth(2)
         self.canv.line(-5, 5, 35, 40) # Ligne montante
 
-def generer_rapport_pdf(data, metadata):
-    buffer = BytesIO()
+def _construire_rapport_pdf(data, metadata, output):
+    """Rend le rapport PDF dans `output` (chemin ou fichier)."""
     doc = SimpleDocTemplate(
-        buffer,
+        output,
         pagesize=landscape(A4),
         rightMargin=1.0*cm, leftMargin=1.0*cm, topMargin=1.0*cm, bottomMargin=1.0*cm,
         title=f"Rapport - {metadata['etablissement']}"
@@ -3420,7 +2765,7 @@ def generer_rapport_pdf(data, metadata):
     
     # --- EN-TÊTE AVEC LOGO ---
     # On crée un tableau invisible pour mettre le Logo à gauche et le Titre au centre
-    logo = LogoGraphique(width=40, height=40, etablissement_id=metadata.get('etablissement_id'))
+    logo = LogoGraphique(width=40, height=40, logo_bytes=metadata.get('logo_bytes'))
     
     titre_style = ParagraphStyle('Titre', parent=styles['Heading1'], fontSize=22, textColor=colors.HexColor('#1F3B73'), alignment=TA_LEFT)
     sous_titre_style = ParagraphStyle('SousTitre', parent=styles['Normal'], fontSize=12, textColor=colors.gray, alignment=TA_LEFT)
@@ -3501,122 +2846,80 @@ def generer_rapport_pdf(data, metadata):
     
     elements.append(t)
     doc.build(elements)
-    buffer.seek(0)
-    
-    filename = f"Rapport_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.pdf"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
+
+
+def generer_rapport_pdf(data, metadata):
+    """Le rendu ReportLab (CPU, GIL) part dans le pool : la requête n'attend que les octets."""
+    metadata = {**metadata, 'logo_bytes': get_logo_bytes(metadata.get('etablissement_id'))}
+    pdf = render_pdf(_construire_rapport_pdf, data, metadata)
+    return send_file(BytesIO(pdf), as_attachment=True, download_name=_nom_export("Rapport", metadata, "pdf"), mimetype='application/pdf')
 
 
 # ============================================================
 # GÉNÉRATEUR EXCEL (DESIGN TABLEAU DE BORD)
 # ============================================================
 
-def generer_rapport_excel(data, metadata):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Activité"
-    
-    # --- STYLES ---
-    # Titre
-    font_titre = Font(name='Segoe UI', size=18, bold=True, color="1F3B73")
-    
-    # En-têtes Tableau
-    fill_header = PatternFill(start_color="1F3B73", end_color="1F3B73", fill_type="solid")
-    font_header = Font(name='Segoe UI', size=11, bold=True, color="FFFFFF")
-    align_center = Alignment(horizontal="center", vertical="center")
-    
-    # Données
-    font_data = Font(name='Segoe UI', size=10)
-    align_top = Alignment(vertical="top", wrap_text=True)
-    border_thin = Border(left=Side(style='thin', color='D9D9D9'), 
-                         right=Side(style='thin', color='D9D9D9'), 
-                         bottom=Side(style='thin', color='D9D9D9'))
+def _construire_rapport_excel(data, metadata):
+    """
+    Excel en mode write_only : chaque ligne est écrite dès qu'elle arrive
+    (`data` peut être un générateur), la mémoire reste constante.
+    """
+    book = StreamingWorkbook("Activité")
+    ws = book.ws
 
-    # --- MISE EN PAGE ---
+    # --- MISE EN PAGE (doit précéder l'écriture des lignes en write_only) ---
+    book.set_widths({'A': 12, 'B': 10, 'C': 20, 'D': 18, 'E': 35, 'F': 60})
+    ws.row_dimensions[1].height = 40
+    ws.row_dimensions[2].height = 60 # Hauteur pour les 3 lignes
+    ws.row_dimensions[6].height = 30
+    ws.merged_cells.add('A1:F1')
+    ws.merged_cells.add('A2:F4')
+    ws.freeze_panes = "A7"
     
     # 1. Titre et Logo (Simulé par emoji pour Excel)
-    ws.merge_cells('A1:F1')
-    ws['A1'] = f"📊 RAPPORT D'ACTIVITÉ - {metadata['etablissement']}"
-    ws['A1'].font = font_titre
-    ws['A1'].alignment = Alignment(horizontal="left", vertical="center")
-    ws.row_dimensions[1].height = 40
+    book.append([f"📊 RAPPORT D'ACTIVITÉ - {metadata['etablissement']}"], ['lf_titre'])
     
-    # 2. Métadonnées (Cadre gris clair)
-    ws.merge_cells('A2:F4')
+    # 2. Métadonnées
     meta_text = (f"Période : {metadata['periode']}\n"
                  f"Généré le : {metadata['date_generation']}\n"
                  f"Total : {metadata['total']} enregistrements")
-    
-    ws['A2'] = meta_text
-    ws['A2'].font = Font(name='Segoe UI', size=10, italic=True, color="555555")
-    ws['A2'].alignment = Alignment(horizontal="left", vertical="center", wrap_text=True)
-    ws['A2'].fill = PatternFill(start_color="F8F9FA", fill_type="solid")
-    ws.row_dimensions[2].height = 60 # Hauteur pour les 3 lignes
+    book.append([meta_text], ['lf_meta'])
+    book.append([])
+    book.append([])
     
     # 3. En-têtes du tableau (Ligne 6)
-    headers = ["Date", "Heure", "Utilisateur", "Action", "Objet", "Détails"]
-    ws.append([]) # Ligne 5 vide
-    ws.append(headers) # Ligne 6
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=6, column=col_num)
-        cell.fill = fill_header
-        cell.font = font_header
-        cell.alignment = align_center
-    
-    ws.row_dimensions[6].height = 30
+    book.append([]) # Ligne 5 vide
+    book.append(RAPPORT_HEADERS, ['lf_header'] * len(RAPPORT_HEADERS))
     
-    # 4. Données
+    # 4. Données (streamées)
+    data_styles = ['lf_cell_wrap'] * len(RAPPORT_HEADERS)
     for row in data:
-        ws.append([
+        book.append([
             row['date'],
             row['heure'],
             sanitize_for_excel_report(row['utilisateur']),
             sanitize_for_excel_report(row['action']),
             sanitize_for_excel_report(row['objet']),
             sanitize_for_excel_report(row['details']) if row['details'] else '-'
-        ])
-        
-    # 5. Finitions (Bordures et Largeurs)
-    # Largeurs optimisées
-    ws.column_dimensions['A'].width = 12
-    ws.column_dimensions['B'].width = 10
-    ws.column_dimensions['C'].width = 20
-    ws.column_dimensions['D'].width = 18
-    ws.column_dimensions['E'].width = 35
-    ws.column_dimensions['F'].width = 60
-    
-    # Appliquer styles aux données
-    for row in ws.iter_rows(min_row=7, max_row=ws.max_row):
-        for cell in row:
-            cell.font = font_data
-            cell.alignment = align_top
-            cell.border = border_thin
+        ], data_styles)
             
     # Filtres automatiques
-    ws.auto_filter.ref = f"A6:F{ws.max_row}"
-    
-    # Figer les volets
-    ws.freeze_panes = "A7"
+    ws.auto_filter.ref = f"A6:F{book.rows_written}"
+    return book
 
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    filename = f"Rapport_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.xlsx"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+def generer_rapport_excel(data, metadata):
+    return _construire_rapport_excel(data, metadata).response(_nom_export("Rapport", metadata, "xlsx"))
 
 
 # ============================================================
 # GÉNÉRATEURS INVENTAIRE (PDF/EXCEL)
 # ============================================================
 
-def generer_inventaire_pdf(data, metadata):
-    """Génère un PDF propre de l'inventaire complet (Paysage)."""
-    buffer = BytesIO()
-    
+def _construire_inventaire_pdf(data, metadata, output):
+    """Génère un PDF propre de l'inventaire complet (Paysage) dans `output`."""
     doc = SimpleDocTemplate(
-        buffer,
+        output,
         pagesize=landscape(A4),
         rightMargin=1.0*cm, leftMargin=1.0*cm, topMargin=1.0*cm, bottomMargin=1.0*cm,
         title=f"Inventaire - {metadata['etablissement']}"
@@ -3626,7 +2929,7 @@ def generer_inventaire_pdf(data, metadata):
     styles = getSampleStyleSheet()
     
     # --- EN-TÊTE (Réutilisation du style Rapport) ---
-    logo = LogoGraphique(width=40, height=40, etablissement_id=metadata.get('etablissement_id')) # Utilise la classe existante
+    logo = LogoGraphique(width=40, height=40, logo_bytes=metadata.get('logo_bytes')) # Utilise la classe existante
     
     titre_style = ParagraphStyle('Titre', parent=styles['Heading1'], fontSize=22, textColor=colors.HexColor('#1F3B73'), alignment=TA_LEFT)
     sous_titre_style = ParagraphStyle('SousTitre', parent=styles['Normal'], fontSize=12, textColor=colors.gray, alignment=TA_LEFT)
@@ -3702,93 +3005,133 @@ def generer_inventaire_pdf(data, metadata):
     
     elements.append(t)
     doc.build(elements)
-    buffer.seek(0)
-    
-    filename = f"Inventaire_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.pdf"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
 
 
-def generer_inventaire_excel(data, metadata):
-    """Génère un Excel propre de l'inventaire."""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Inventaire"
-    
-    # Styles
-    font_titre = Font(name='Segoe UI', size=16, bold=True, color="1F3B73")
-    fill_header = PatternFill(start_color="1F3B73", end_color="1F3B73", fill_type="solid")
-    font_header = Font(name='Segoe UI', size=11, bold=True, color="FFFFFF")
-    align_center = Alignment(horizontal="center", vertical="center")
-    border_thin = Border(left=Side(style='thin', color='D9D9D9'), right=Side(style='thin', color='D9D9D9'), bottom=Side(style='thin', color='D9D9D9'))
-    font_alert = Font(color="DC3545", bold=True) # Rouge pour stock bas
+def generer_inventaire_pdf(data, metadata):
+    metadata = {**metadata, 'logo_bytes': get_logo_bytes(metadata.get('etablissement_id'))}
+    pdf = render_pdf(_construire_inventaire_pdf, data, metadata)
+    return send_file(BytesIO(pdf), as_attachment=True, download_name=_nom_export("Inventaire", metadata, "pdf"), mimetype='application/pdf')
 
-    # 1. En-tête
-    ws.merge_cells('A1:F1')
-    ws['A1'] = f"📦 ÉTAT DE L'INVENTAIRE - {metadata['etablissement']}"
-    ws['A1'].font = font_titre
-    ws['A1'].alignment = Alignment(horizontal="left", vertical="center")
+
+def _construire_inventaire_excel(data, metadata):
+    """
+    Génère un Excel propre de l'inventaire (write_only, mémoire constante).
+    `data` peut être un générateur alimenté par une requête yield_per.
+    """
+    book = StreamingWorkbook("Inventaire")
+    ws = book.ws
+    headers = ["Catégorie", "Désignation", "Quantité", "Seuil", "Emplacement", "Péremption"]
+
+    # Mise en page (avant toute ligne en write_only)
+    book.set_widths({'A': 25, 'B': 40, 'C': 12, 'D': 12, 'E': 25, 'F': 15})
     ws.row_dimensions[1].height = 35
-    
-    ws['A2'] = f"Généré le : {metadata['date_generation']}"
-    ws['A2'].font = Font(italic=True, color="666666")
+    ws.row_dimensions[4].height = 30
+    ws.merged_cells.add('A1:F1')
+    ws.freeze_panes = "A5"
+
+    # 1. En-tête
+    book.append([f"📦 ÉTAT DE L'INVENTAIRE - {metadata['etablissement']}"], ['lf_titre'])
+    book.append([f"Généré le : {metadata['date_generation']}"], ['lf_meta'])
     
     # 2. Tableau
-    headers = ["Catégorie", "Désignation", "Quantité", "Seuil", "Emplacement", "Péremption"]
-    ws.append([])
-    ws.append(headers) # Ligne 4
-    
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=4, column=col_num)
-        cell.value = header
-        cell.fill = fill_header
-        cell.font = font_header
-        cell.alignment = align_center
+    book.append([])
+    book.append(headers, ['lf_header'] * len(headers)) # Ligne 4
     
-    ws.row_dimensions[4].height = 30
-    
-    # 3. Données
+    # 3. Données (Qté, Seuil, Date centrés ; Qté en rouge si stock bas)
+    styles_normal = ['lf_cell', 'lf_cell', 'lf_cell_center', 'lf_cell_center', 'lf_cell', 'lf_cell_center']
+    styles_alert = ['lf_cell', 'lf_cell', 'lf_cell_alert', 'lf_cell_center', 'lf_cell', 'lf_cell_center']
     for row in data:
-        ws.append([
-            row['categorie'],
-            row['nom'],
+        book.append([
+            sanitize_for_excel_report(row['categorie']),
+            sanitize_for_excel_report(row['nom']),
             row['quantite'],
             row['seuil'],
-            row['armoire'],
+            sanitize_for_excel_report(row['armoire']),
             row['peremption']
-        ])
-        
-        current_row = ws.max_row
-        
-        # Style des cellules
-        for col in range(1, 7):
-            cell = ws.cell(row=current_row, column=col)
-            cell.border = border_thin
-            cell.alignment = Alignment(vertical="center")
-            
-            # Centrer Qté, Seuil, Date
-            if col in [3, 4, 6]:
-                cell.alignment = align_center
-                
-        # Alerte Stock Bas (Rouge)
-        if row['quantite'] <= row['seuil']:
-            ws.cell(row=current_row, column=3).font = font_alert
+        ], styles_alert if row['quantite'] <= row['seuil'] else styles_normal)
 
-    # 4. Largeurs
-    ws.column_dimensions['A'].width = 25 # Cat
-    ws.column_dimensions['B'].width = 40 # Nom
-    ws.column_dimensions['C'].width = 12 # Qté
-    ws.column_dimensions['D'].width = 12 # Seuil
-    ws.column_dimensions['E'].width = 25 # Armoire
-    ws.column_dimensions['F'].width = 15 # Date
-    
     # Filtres
-    ws.auto_filter.ref = f"A4:F{ws.max_row}"
-    ws.freeze_panes = "A5"
+    ws.auto_filter.ref = f"A4:F{book.rows_written}"
+    return book
 
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
-    filename = f"Inventaire_{sanitize_filename_report(metadata['etablissement'])}_{date.today().strftime('%Y%m%d')}.xlsx"
-    return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+def generer_inventaire_excel(data, metadata):
+    return _construire_inventaire_excel(data, metadata).response(_nom_export("Inventaire", metadata, "xlsx"))
+
+
+# ============================================================
+# HANDLERS DES EXPORTS EN ARRIÈRE-PLAN (exécutés dans le pool)
+# ============================================================
+
+@export_job_handler('inventaire')
+def _job_export_inventaire(ctx):
+    p = ctx.parametres
+    metadata = {
+        'etablissement': p['titre'],
+        'etablissement_id': ctx.etablissement_id,
+        'date_generation': datetime.now().strftime('%d/%m/%Y à %H:%M'),
+        'total': ctx.total
+    }
+    ext = 'xlsx' if ctx.format == 'excel' else 'pdf'
+    resultat = {'nom_fichier': _nom_export("Inventaire", metadata, ext),
+                'mimetype': XLSX_MIMETYPE if ext == 'xlsx' else 'application/pdf'}
+
+    # Versions lues avant les lignes : une écriture concurrente ne peut que rendre l'entrée obsolète
+    cle_cache = None
+    if export_cache.is_enabled():
+        cle_cache = export_cache.cache_key(ctx.etablissement_id, 'inventaire', ctx.format,
+                                           {'armoire_id': p.get('armoire_id'), 'categorie_id': p.get('categorie_id')},
+                                           p['titre'])
+        chemin = export_cache.get(cle_cache, ext)
+        if chemin:
+            shutil.copyfile(chemin, ctx.output_path)
+            ctx.progress(ctx.total or 0)
+            return resultat
+
+    query = _inventaire_export_query(ctx.etablissement_id, p.get('armoire_id'), p.get('categorie_id'))
+    rows = ctx.track(_iter_inventaire_rows(query))
+
+    if ctx.format == 'excel':
+        _construire_inventaire_excel(rows, metadata).save(ctx.output_path)
+    else:
+        metadata['logo_bytes'] = get_logo_bytes(ctx.etablissement_id)
+        _construire_inventaire_pdf(list(rows), metadata, ctx.output_path)
+
+    if cle_cache:
+        try:
+            export_cache.put_file(cle_cache, ext, ctx.output_path)
+        except ExportCacheError as e:
+            current_app.logger.warning(f"Export inventaire non mis en cache : {e}")
+    return resultat
+
+
+@export_job_handler('rapport')
+def _job_export_rapport(ctx):
+    p = ctx.parametres
+    query = _rapport_export_query(ctx.etablissement_id,
+                                  datetime.fromisoformat(p['date_debut']), datetime.fromisoformat(p['date_fin']),
+                                  p.get('group_by', 'date'), p.get('actions'))
+    metadata = {
+        'etablissement': p['etablissement'],
+        'etablissement_id': ctx.etablissement_id,
+        'logo_bytes': get_logo_bytes(ctx.etablissement_id),
+        'periode': p['periode'],
+        'total': ctx.total,
+        'date_generation': datetime.now().strftime('%d/%m/%Y à %H:%M'),
+        'filtre': p.get('filtre')
+    }
+    rows = ctx.track(_iter_rapport_rows(query))
+
+    if ctx.format == 'csv':
+        with open(ctx.output_path, 'wb') as f:
+            for chunk in stream_csv(RAPPORT_HEADERS, _rapport_csv_rows(rows)):
+                f.write(chunk)
+        return {'nom_fichier': _nom_export("Rapport", metadata, "csv"), 'mimetype': CSV_MIMETYPE}
+
+    if ctx.format == 'excel':
+        _construire_rapport_excel(rows, metadata).save(ctx.output_path)
+        return {'nom_fichier': _nom_export("Rapport", metadata, "xlsx"), 'mimetype': XLSX_MIMETYPE}
+
+    _construire_rapport_pdf(list(rows), metadata, ctx.output_path)
+    return {'nom_fichier': _nom_export("Rapport", metadata, "pdf"), 'mimetype': 'application/pdf'}
 
@@ -4,22 +4,20 @@
 # ============================================================
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import select
 from sqlalchemy.orm import joinedload
-from datetime import datetime
 from werkzeug.utils import secure_filename
 import os
+import shutil
 
 from markupsafe import Markup
-from extensions import limiter, cache
 from db import db, DocumentReglementaire, InventaireArchive, Parametre, Objet, Armoire, Categorie
-from utils import admin_required, login_required, log_action, calculate_license_key, get_etablissement_params, build_breadcrumbs
+from utils import admin_required, login_required, log_action, calculate_license_key, build_breadcrumbs, rate_limit_license, reset_license_limit
 from services.document_service import DocumentService, DocumentServiceError
-from collections import defaultdict
-from functools import wraps
-
-import cloudinary
-import cloudinary.uploader
+from services.export_job_service import (enqueue as enqueue_export, export_job_handler, jobs_non_aboutis,
+                                         ExportJobError)
+from services import storage_service as stockage
+from services.storage_service import StorageServiceError
+from services import parametre_service as parametres
 
 admin_documents_bp = Blueprint('admin_documents', __name__, url_prefix='/admin')
 
@@ -29,9 +27,11 @@ def gestion_documents():
     etablissement_id = session['etablissement_id']
     docs = db.session.execute(db.select(DocumentReglementaire).filter_by(etablissement_id=etablissement_id).order_by(DocumentReglementaire.date_upload.desc())).scalars().all()
     archives = db.session.execute(db.select(InventaireArchive).filter_by(etablissement_id=etablissement_id).order_by(InventaireArchive.date_archive.desc())).scalars().all()
+    # Générations d'inventaire en file ou en échec : suivies ici tant que l'archive n'existe pas
+    jobs_inventaire = jobs_non_aboutis(etablissement_id, 'inventaire_annuel')
     is_admin = session.get('user_role') == 'admin'
     breadcrumbs = build_breadcrumbs('Documents & Conformité')
-    return render_template("admin_documents.html", docs=docs, archives=archives,
+    return render_template("admin_documents.html", docs=docs, archives=archives, jobs_inventaire=jobs_inventaire,
                            breadcrumbs=breadcrumbs, is_admin=is_admin)
 
 @admin_documents_bp.route("/documents/upload", methods=['POST'])
@@ -53,23 +53,25 @@ def upload_document():
             flash(f"Format non autorisé. Formats acceptés : {', '.join(EXTENSIONS_AUTORISEES_DOCS)}", "error")
             return redirect(url_for('admin_documents.gestion_documents'))
         
-        # Sécurisation du nom de fichier
-        result = cloudinary.uploader.upload(
-            f,
-            folder=f"scientral/{etablissement_id}/docs",
-            resource_type="raw",
-            access_mode="public",
-            public_id=f"{int(datetime.now().timestamp())}_{secure_filename(f.filename)}"
-        )
-        doc = DocumentReglementaire(
-            etablissement_id=etablissement_id,
-            nom=nom,
-            type_doc=type_doc,
-            fichier_url=result['secure_url']
-        )
-        db.session.add(doc)
-        db.session.commit()
-        flash("Document ajouté avec succès.", "success")
+        # Disque local dans la requête ; la copie distante part après le commit
+        try:
+            cle = stockage.enregistrer(stockage.cle_document(etablissement_id, f.filename), f.stream)
+            doc = DocumentReglementaire(
+                etablissement_id=etablissement_id,
+                nom=nom,
+                type_doc=type_doc,
+                fichier_url=cle
+            )
+            db.session.add(doc)
+            db.session.commit()
+            flash("Document ajouté avec succès.", "success")
+        except StorageServiceError as e:
+            db.session.rollback()
+            flash(str(e), "error")
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f"Erreur DB ajout document: {e}")
+            flash("Erreur lors de l'enregistrement en base de données.", "error")
     return redirect(url_for('admin_documents.gestion_documents'))
 
 @admin_documents_bp.route("/documents/telecharger/<int:doc_id>")
@@ -80,7 +82,13 @@ def telecharger_doc(doc_id):
     if not doc or doc.etablissement_id != etablissement_id:
         flash("Document introuvable ou accès interdit.", "error")
         return redirect(url_for('admin_documents.gestion_documents'))
-    return redirect(doc.fichier_url)
+    try:
+        return (stockage.envoyer_blob(DocumentReglementaire.fichier_pdf, doc.id, secure_filename(doc.nom) or 'document',
+                                      doc.date_upload)
+                or stockage.envoyer(etablissement_id, doc.fichier_url))
+    except StorageServiceError as e:
+        flash(str(e), "error")
+        return redirect(url_for('admin_documents.gestion_documents'))
 
 @admin_documents_bp.route("/documents/telecharger_archive/<int:archive_id>")
 @login_required
@@ -90,7 +98,13 @@ def telecharger_archive(archive_id):
     if not archive or archive.etablissement_id != etablissement_id:
         flash("Archive introuvable ou accès interdit.", "error")
         return redirect(url_for('admin_documents.gestion_documents'))
-    return redirect(archive.fichier_url)
+    try:
+        return (stockage.envoyer_blob(InventaireArchive.fichier_pdf, archive.id,
+                                      secure_filename(archive.titre or '') or 'inventaire', archive.date_archive)
+                or stockage.envoyer(etablissement_id, archive.fichier_url))
+    except StorageServiceError as e:
+        flash(str(e), "error")
+        return redirect(url_for('admin_documents.gestion_documents'))
 
 @admin_documents_bp.route("/documents/supprimer/<int:doc_id>", methods=['POST'])
 @admin_required
@@ -101,8 +115,8 @@ def supprimer_doc(doc_id):
         flash("Document introuvable ou accès interdit.", "error")
         return redirect(url_for('admin_documents.gestion_documents'))
     try:
-        public_id = f"scientral/{etablissement_id}/docs/" + doc.fichier_url.split('/')[-1].rsplit('.', 1)[0]
-        cloudinary.uploader.destroy(public_id, resource_type="raw")
+        # Fichier (local et distant) retiré après le commit
+        stockage.supprimer(etablissement_id, doc.fichier_url)
         db.session.delete(doc)
         db.session.commit()
         flash("Document supprimé avec succès.", "success")
@@ -119,129 +133,87 @@ def generer_inventaire_annuel():
     etablissement_id = session['etablissement_id']
     nom_etablissement = session.get('nom_etablissement', 'Mon Etablissement')
     try:
-        # 1. Récupération optimisée (Eager Loading)
-        stmt = (
-            db.select(Objet)
-            .options(
-                joinedload(Objet.categorie),
-                joinedload(Objet.armoire)
-            )
-            .filter_by(etablissement_id=etablissement_id)
-            .order_by(Objet.nom)
+        # Rendu + stockage hors requête : l'archive apparaît dans la liste une fois prête
+        job = enqueue_export('inventaire_annuel', 'pdf', etablissement_id, session.get('user_id'),
+                             {'nom_etablissement': nom_etablissement})
+        if job.statut == 'erreur':
+            flash(job.message or "Erreur lors de la génération de l'inventaire.", "warning")
+        elif job.statut == 'termine':
+            flash("Inventaire généré avec succès.", "success")
+        else:
+            flash("Génération de l'inventaire lancée : son avancement est suivi dans la liste des archives.", "info")
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erreur DB lors de la mise en file de l'inventaire: {e}")
+        flash("Erreur lors de l'enregistrement en base de données.", "error")
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Erreur critique génération inventaire: {e}", exc_info=True)
+        flash("Une erreur technique inattendue est survenue.", "error")
+
+    return redirect(url_for('admin_documents.gestion_documents'))
+
+
+@export_job_handler('inventaire_annuel')
+def _job_inventaire_annuel(ctx):
+    """Génère l'inventaire réglementaire, l'archive dans le stockage et garde une copie téléchargeable."""
+    etablissement_id = ctx.etablissement_id
+
+    # 1. Récupération optimisée (Eager Loading)
+    stmt = (
+        db.select(Objet)
+        .options(
+            joinedload(Objet.categorie),
+            joinedload(Objet.armoire)
         )
-        objets = db.session.execute(stmt).scalars().all()
+        .filter_by(etablissement_id=etablissement_id)
+        .order_by(Objet.nom)
+    )
+    objets = db.session.execute(stmt).scalars().all()
 
-        # 2. Appel du Service — génération PDF sur disque temporairement
-        upload_root = os.path.join(current_app.root_path, 'static', 'uploads')
-        doc_service = DocumentService(upload_root)
+    # 2. Appel du Service — rendu dans le dossier privé des exports (jamais sous static/)
+    doc_service = DocumentService(os.path.dirname(ctx.output_path))
+    try:
         result = doc_service.generate_inventory_pdf(
-            etablissement_name=nom_etablissement,
+            etablissement_name=ctx.parametres['nom_etablissement'],
             etablissement_id=etablissement_id,
             objets=objets
         )
+    except DocumentServiceError as e:
+        raise ExportJobError(str(e))
 
-        # 3. Upload sur Cloudinary
-        full_path = os.path.join(current_app.root_path, 'static', result['relative_path'])
-        with open(full_path, 'rb') as pdf_file:
-            cloud_result = cloudinary.uploader.upload(
-                pdf_file,
-                folder=f"scientral/{etablissement_id}/archives",
-                resource_type="raw",
-                public_id=f"{result['titre'].replace(' ', '_')}",
-                access_mode="public"
-            )
-        cloudinary_url = cloud_result['secure_url']
-
-        # Nettoyage du fichier temporaire local
-        if os.path.exists(full_path):
-            os.remove(full_path)
+    full_path = os.path.join(doc_service.archive_folder, result['filename'])
+    try:
+        # 3. Copie dans le stockage (envoi distant en arrière-plan après le commit)
+        cle = stockage.enregistrer(stockage.cle_archive(etablissement_id, result['titre']), full_path)
 
         # 4. Enregistrement en Base
         archive = InventaireArchive(
             etablissement_id=etablissement_id,
             titre=result['titre'],
-            fichier_url=cloudinary_url,
+            fichier_url=cle,
             nb_objets=result['nb_objets']
         )
         db.session.add(archive)
         db.session.commit()
-
-        flash("Inventaire généré avec succès.", "success")
-
-    except DocumentServiceError as e:
-        flash(str(e), "warning")
-    except OSError as e:
-        current_app.logger.critical(f"Erreur Disque: {e}")
-        flash("Erreur système : Impossible d'écrire le fichier.", "error")
-    except SQLAlchemyError as e:
-        db.session.rollback()
-        current_app.logger.error(f"Erreur DB lors de l'archivage: {e}")
-        flash("Erreur lors de l'enregistrement en base de données.", "error")
     except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Erreur critique génération inventaire: {e}", exc_info=True)
-        flash("Une erreur technique inattendue est survenue.", "error")
+        # Aucun PDF orphelin, quelle que soit l'étape en échec
+        if os.path.exists(full_path):
+            os.remove(full_path)
+        if isinstance(e, StorageServiceError):
+            raise ExportJobError(str(e))
+        raise
 
-    return redirect(url_for('admin_documents.gestion_documents'))
+    # Le fichier local devient le résultat téléchargeable du job (purgé à expiration)
+    shutil.move(full_path, ctx.output_path)
+    return {'nom_fichier': f"{result['titre'].replace(' ', '_')}.pdf", 'mimetype': 'application/pdf'}
 
 
 
 # ============================================================
-# LICENCE (Rate Limit Custom)
+# LICENCE (tentatives limitées : utils.rate_limit_license)
 # ============================================================
-class RateLimiter:
-    def __init__(self):
-        self.attempts = defaultdict(list)
-        self.last_cleanup = datetime.now()
-
-    def _cleanup_all(self):
-        """Supprime les clés vides et obsolètes."""
-        now = datetime.now()
-        cutoff = now - timedelta(minutes=15)
-        
-        # On itère sur une copie des clés pour pouvoir supprimer
-        for key in list(self.attempts.keys()):
-            # On ne garde que les tentatives récentes
-            self.attempts[key] = [t for t in self.attempts[key] if t > cutoff]
-            # Si la liste est vide, on supprime la clé pour libérer la mémoire
-            if not self.attempts[key]:
-                del self.attempts[key]
-        
-        self.last_cleanup = now
-
-    def is_allowed(self, key):
-        now = datetime.now()
-        
-        # Nettoyage opportuniste global (toutes les heures)
-        if (now - self.last_cleanup) > timedelta(hours=1):
-            self._cleanup_all()
-        
-        # Nettoyage spécifique à la clé courante
-        cutoff = now - timedelta(minutes=15)
-        self.attempts[key] = [t for t in self.attempts[key] if t > cutoff]
-        
-        if len(self.attempts[key]) >= 5: 
-            return False
-            
-        self.attempts[key].append(now)
-        return True
-    
-    def reset(self, key):
-        if key in self.attempts: del self.attempts[key]
-
-license_limiter = RateLimiter()
-
-def rate_limit_license(f):
-    @wraps(f)
-    def wrapped(*args, **kwargs):
-        eid = session.get('etablissement_id')
-        if not eid: return redirect(url_for('main.index'))
-        if not license_limiter.is_allowed(eid):
-            flash("Trop de tentatives. Réessayez dans 15 min.", "error")
-            return redirect(url_for('main.a_propos'))
-        return f(*args, **kwargs)
-    return wrapped
-
 @admin_documents_bp.route("/activer_licence", methods=["POST"])
 @admin_required
 @rate_limit_license
@@ -265,14 +237,9 @@ def activer_licence():
             return redirect(url_for('main.a_propos'))
         
         # Activation
-        param_statut = db.session.execute(db.select(Parametre).filter_by(etablissement_id=etablissement_id, cle='licence_statut')).scalar_one_or_none()
-        if not param_statut: db.session.add(Parametre(etablissement_id=etablissement_id, cle='licence_statut', valeur='PRO'))
-        else: param_statut.valeur = 'PRO'
-        
+        parametres.definir(etablissement_id, 'licence_statut', 'PRO')
         db.session.commit()
-        try: cache.delete_memoized(get_etablissement_params, etablissement_id)
-        except: pass
-        license_limiter.reset(etablissement_id)
+        reset_license_limit(etablissement_id)
         flash("Licence PRO activée !", "success")
         
     except Exception as e:
@@ -296,14 +263,9 @@ def supprimer_archive(archive_id):
         return redirect(url_for('admin_documents.gestion_documents'))
         
     try:
-        # 1. Suppression du fichier physique sur le disque
-        # On reconstruit le chemin absolu : root/static/uploads/...
-        try:
-            public_id = f"scientral/{etablissement_id}/archives/" + archive.fichier_url.split('/')[-1].rsplit('.', 1)[0]
-            cloudinary.uploader.destroy(public_id, resource_type="raw")
-        except Exception as ce:
-            current_app.logger.warning(f"Impossible de supprimer sur Cloudinary: {ce}")
-            
+        # 1. Fichier (local et distant) retiré après le commit
+        stockage.supprimer(etablissement_id, archive.fichier_url)
+
         # 2. Suppression de l'entrée en base de données
         db.session.delete(archive)
         db.session.commit()
@@ -336,36 +298,12 @@ def config_planning():
             flash("L'heure de début doit être strictement antérieure à l'heure de fin.", "error")
             return redirect(url_for('admin.admin'))
 
-        # 3. Fonction de sauvegarde "Upsert" (Update or Insert) pour chaque paramètre
-        def upsert_param(cle, valeur):
-            # On cherche si le paramètre existe déjà pour cet établissement
-            param = db.session.execute(
-                select(Parametre).filter_by(etablissement_id=etablissement_id, cle=cle)
-            ).scalar_one_or_none()
-            
-            if param:
-                # Si oui, on met à jour sa valeur
-                param.valeur = str(valeur)
-                current_app.logger.info(f"Paramètre '{cle}' mis à jour à '{valeur}' pour Etab {etablissement_id}.")
-            else:
-                # Sinon, on le crée
-                db.session.add(Parametre(etablissement_id=etablissement_id, cle=cle, valeur=str(valeur)))
-                current_app.logger.info(f"Paramètre '{cle}' créé avec la valeur '{valeur}' pour Etab {etablissement_id}.")
-
-        # 4. Application des sauvegardes
-        upsert_param('planning_debut', heure_debut)
-        upsert_param('planning_fin', heure_fin)
-        
+        # 3. Sauvegarde (upsert sur l'index unique etablissement/clé)
+        parametres.definir(etablissement_id, 'planning_debut', heure_debut)
+        parametres.definir(etablissement_id, 'planning_fin', heure_fin)
         db.session.commit()
-        
-        # 5. POINT CRUCIAL : Invalidation explicite du cache
-        # C'est cette ligne qui force la fonction `get_etablissement_params` à relire
-        # la base de données la prochaine fois qu'elle sera appelée.
-        try:
-            cache.delete_memoized(get_etablissement_params, etablissement_id)
-            current_app.logger.info(f"✅ Cache pour 'get_etablissement_params' (Etab {etablissement_id}) invalidé avec succès.")
-        except Exception as e:
-            current_app.logger.warning(f"⚠️ Erreur non bloquante lors de l'invalidation du cache : {e}")
+        # La version du domaine 'parametres' a changé : tous les workers relisent à leur prochaine requête
+        current_app.logger.info(f"[CONFIG_PLANNING] Etab {etablissement_id} : planning {heure_debut}-{heure_fin} enregistré.")
         
         flash("La configuration du planning de réservation a été mise à jour.", "success")
         
@@ -7,7 +7,6 @@ from urllib.parse import urlparse
 from datetime import datetime, timedelta
 from flask import (Blueprint, render_template, request, redirect, url_for,
                    flash, session, jsonify, current_app)
-from werkzeug.utils import secure_filename
 from sqlalchemy import func, desc, or_
 from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
@@ -16,11 +15,13 @@ from sqlalchemy.exc import IntegrityError
 from db import db, Objet, Armoire, Categorie, Reservation, Utilisateur, Historique, Echeance, Budget, Depense, Fournisseur, Suggestion
 
 # IMPORTS UTILS
-from utils import login_required, admin_required, limit_objets_required, allowed_file
+from utils import login_required, admin_required, limit_objets_required
 
 # --- CORRECTION ICI : On importe le Service au lieu de la fonction API ---
 from services.inventory_service import InventoryService, InventoryServiceError
 from services.security_service import SecurityService
+from services.image_service import enregistrer_image, variantes, supprimer_upload, ImageServiceError
+from services.upload_service import stocker as stocker_upload, est_blob, liberer
 
 inventaire_bp = Blueprint(
     'inventaire', 
@@ -48,7 +49,12 @@ def cleanup_old_file(relative_path):
     """
     if not relative_path or not relative_path.startswith('uploads/'):
         return
-    
+
+    # Fichier partagé (stockage par empreinte) : supprimé seulement s'il n'est plus référencé
+    if est_blob(relative_path):
+        liberer([relative_path])
+        return
+
     try:
         # 1. Normalisation du chemin
         safe_path = os.path.normpath(relative_path)
@@ -65,6 +71,10 @@ def cleanup_old_file(relative_path):
         if os.path.exists(full_path):
             os.remove(full_path)
             current_app.logger.info(f"Fichier orphelin supprimé : {full_path}")
+
+        # Miniatures et variantes WebP d'une image
+        for variante in variantes(safe_path):
+            supprimer_upload(variante)
             
     except Exception as e:
         current_app.logger.warning(f"Echec suppression fichier {relative_path}: {e}")
@@ -378,15 +388,11 @@ def ajouter_objet():
                 if file.tell() > 5 * 1024 * 1024:
                     flash("Image trop volumineuse (Max 5 Mo).", "warning")
                 else:
-                    file.seek(0)
-                    if allowed_file(file.filename):
-                        filename = secure_filename(file.filename)
-                        ts = datetime.now().strftime("%Y%m%d%H%M%S")
-                        unique_filename = f"{ts}_{filename}"
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                        if not os.path.exists(upload_folder): os.makedirs(upload_folder)
-                        file.save(os.path.join(upload_folder, unique_filename))
-                        image_path_db = f"uploads/{unique_filename}"
+                    try:
+                        # Variantes (miniature, moyenne, WebP) générées après le commit
+                        image_path_db = enregistrer_image(file)
+                    except ImageServiceError as e:
+                        flash(str(e), "warning")
         
         if not image_path_db:
             url_input = request.form.get("image_url", "").strip()
@@ -404,13 +410,8 @@ def ajouter_objet():
                 else:
                     file.seek(0)
                     if file.filename.lower().endswith('.pdf'):
-                        filename = secure_filename(file.filename)
-                        ts = datetime.now().strftime("%Y%m%d%H%M%S")
-                        unique_filename = f"FDS_{ts}_{filename}"
-                        fds_folder = os.path.join(current_app.root_path, 'static', 'uploads', 'fds')
-                        if not os.path.exists(fds_folder): os.makedirs(fds_folder)
-                        file.save(os.path.join(fds_folder, unique_filename))
-                        fds_path_db = f"uploads/fds/{unique_filename}"
+                        # Stockage par empreinte : une FDS partagée par 40 produits n'est stockée qu'une fois
+                        fds_path_db = stocker_upload(file, 'pdf')
 
         if not fds_path_db:
             url_input = request.form.get("fds_url", "").strip()
@@ -517,21 +518,15 @@ def modifier_objet(id_objet):
                 if file.tell() > 5 * 1024 * 1024:
                     flash("Image trop volumineuse (Max 5 Mo).", "warning")
                 else:
-                    file.seek(0)
-                    if allowed_file(file.filename):
+                    try:
+                        nouvelle_image = enregistrer_image(file)
                         # On marque l'ancien fichier pour suppression future
                         if objet.image_url and objet.image_url.startswith('uploads/'):
                             files_to_cleanup.append(objet.image_url)
-                        
-                        filename = secure_filename(file.filename)
-                        ts = datetime.now().strftime("%Y%m%d%H%M%S")
-                        unique_filename = f"{ts}_{filename}"
-                        upload_folder = os.path.join(current_app.root_path, 'static', 'uploads')
-                        if not os.path.exists(upload_folder): os.makedirs(upload_folder)
-                        file.save(os.path.join(upload_folder, unique_filename))
-                        
-                        objet.image_url = f"uploads/{unique_filename}"
+                        objet.image_url = nouvelle_image
                         is_image_updated = True
+                    except ImageServiceError as e:
+                        flash(str(e), "warning")
 
         if not is_image_updated:
             url_input = request.form.get("image_url")
@@ -563,15 +558,8 @@ def modifier_objet(id_objet):
                     if file.filename.lower().endswith('.pdf'):
                         if objet.fds_url and objet.fds_url.startswith('uploads/'):
                             files_to_cleanup.append(objet.fds_url)
-                        
-                        filename = secure_filename(file.filename)
-                        ts = datetime.now().strftime("%Y%m%d%H%M%S")
-                        unique_filename = f"FDS_{ts}_{filename}"
-                        fds_folder = os.path.join(current_app.root_path, 'static', 'uploads', 'fds')
-                        if not os.path.exists(fds_folder): os.makedirs(fds_folder)
-                        file.save(os.path.join(fds_folder, unique_filename))
-                        
-                        objet.fds_url = f"uploads/fds/{unique_filename}"
+
+                        objet.fds_url = stocker_upload(file, 'pdf')
                         is_fds_updated = True
 
         if not is_fds_updated:
@@ -661,9 +649,14 @@ def supprimer_objet(id_objet):
         )
         db.session.add(hist)
         
+        fichiers = [objet.image_url, objet.fds_url]
+
         # Suppression
         db.session.delete(objet)
         db.session.commit()
+
+        for chemin in fichiers:
+            cleanup_old_file(chemin)
         flash(f"L'objet '{nom_objet}' a été supprimé.", "success")
         
     except Exception as e:
@@ -6,6 +6,7 @@ from sqlalchemy import func, desc
 from sqlalchemy.orm import joinedload
 from db import db, Armoire, Categorie, Fournisseur, Objet, Reservation, Utilisateur, Echeance, Depense, Budget, Parametre, Suggestion, MaintenanceLog, EquipementSecurite
 from utils import login_required
+from services import parametre_service as parametres
 
 main_bp = Blueprint(
     'main', 
@@ -195,10 +196,8 @@ def vue_jour(date_str):
             'user_id': session.get('user_id')
         })
 
-    from utils import get_etablissement_params
-    params = get_etablissement_params(etablissement_id)
-    planning_debut = params.get('planning_debut', '08:00')
-    planning_fin = params.get('planning_fin', '18:00')
+    planning_debut = parametres.texte(etablissement_id, 'planning_debut', '08:00')
+    planning_fin = parametres.texte(etablissement_id, 'planning_fin', '18:00')
 
     return render_template("vue_jour.html",
                            date_concernee=date_obj,